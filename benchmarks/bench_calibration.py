@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""Noise removal and calibration: vectorized against ALCF, calibration tables cold and warm
+
+Usage: ``python benchmarks/bench_calibration.py [--hours H] [--window S] [--gates N]``
+
+Synthetic files of every instrument are read with the in-process engine, their noise
+removed and calibrated by ALCF's default algorithms and by :mod:`app.calibration`. The
+script fails unless both agree exactly, and checks the noise estimated over a sliding
+window covering every profile against the estimate of the whole file. The sliding window
+estimate (``--window``, ``--gates``) is timed too.
+
+The calibration table of a station is then read from an in-memory S3 (moto) by
+:func:`app.calibration.periods`, cold and warm, and the coefficients per profile checked
+against a loop over the profiles.
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aquarius_time as aq
+import boto3
+import numpy as np
+from alcf.algorithms.calibration import default as alcf_calibration
+from alcf.algorithms.noise_removal import default as alcf_noise_removal
+from moto import mock_aws
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import calibration, engine  # pylint: disable=import-error,wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+
+#: Synthetic instruments: file suffix, writer and time between profiles (s).
+INSTRUMENTS = {
+    "cl51": (".dat", synthetic.write_cl51, 16.0),
+    "chm15k": (".nc", synthetic.write_chm15k, 15.0),
+    "minimpl": (".nc", synthetic.write_minimpl, 30.0),
+}
+
+BUCKET = "benchmark"
+
+
+def table(d: dict) -> dict:
+    """Returns a calibration table of two periods, starting a quarter and a half of the way
+    through the profiles of a dataset"""
+    start, end = d["time"][0], d["time"][-1]
+    return {
+        "periods": [
+            {"start": aq.to_iso(start + (end - start) * fraction), "calibration_coeff": coeff}
+            for fraction, coeff in ((0.25, 2.0), (0.5, 3.0))
+        ]
+    }
+
+
+def timed(function, d: dict, **options) -> tuple:
+    """Runs a step on a copy of a dataset, returning it and the time taken (s)"""
+    d = copy.deepcopy(d)
+    start = time.perf_counter()
+    function(d, **options)
+    return d, time.perf_counter() - start
+
+
+def compare(d: dict, args) -> tuple:
+    """Compares the noise removal and calibration of ALCF and app.calibration on a dataset,
+    returning the times (s)"""
+    reference, alcf_time = timed(alcf_noise_removal.noise_removal, d)
+    result, app_time = timed(calibration.noise_removal, d)
+    for name in ("backscatter", "backscatter_sd"):
+        np.testing.assert_array_equal(result[name], reference[name])
+
+    # A window covering all the profiles estimates the noise of the whole file
+    whole, _ = timed(calibration.noise_removal, d, noise_removal_window=10 * 86400)
+    scale = np.max(np.abs(reference["backscatter_sd"]))
+    np.testing.assert_allclose(
+        whole["backscatter_sd"], reference["backscatter_sd"], rtol=1e-6, atol=1e-9 * scale
+    )
+    _, window_time = timed(
+        calibration.noise_removal,
+        d,
+        noise_removal_window=args.window,
+        noise_removal_gates=args.gates,
+    )
+
+    coeff = 1.7
+    reference, _ = timed(alcf_calibration.calibration, reference, calibration_coeff=coeff)
+    result, _ = timed(calibration.calibration, result, calibration_coeff=coeff)
+    for name in ("backscatter", "backscatter_sd"):
+        np.testing.assert_array_equal(result[name], reference[name])
+    return alcf_time, app_time, window_time
+
+
+def tables(d: dict, repeat: int) -> tuple:
+    """Reads the calibration table of a station cold and warm, returning the times (s)"""
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        key = calibration.table_key("calibration/", "station")
+        client.put_object(Bucket=BUCKET, Key=key, Body=json.dumps(table(d)).encode())
+
+        start = time.perf_counter()
+        periods = calibration.periods(BUCKET, "calibration/", "station", client=client)
+        cold = time.perf_counter() - start
+
+        # Warm reads do not reach the object store
+        client.delete_object(Bucket=BUCKET, Key=key)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            assert calibration.periods(BUCKET, "calibration/", "station", client=client) == periods
+        warm = (time.perf_counter() - start) / repeat
+
+    coeff = calibration.coefficients(d["time"], 1.0, periods)
+    for t, c in zip(d["time"], coeff):
+        expected = 1.0
+        for period_start, period_coeff in periods:
+            if t >= period_start:
+                expected = period_coeff
+        assert c == expected, "wrong calibration coefficient"
+    assert len(set(coeff)) == 3, "the synthetic files do not cover the periods"
+    return cold, warm
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=24.0, help="duration of the files")
+    parser.add_argument("--window", type=float, default=300.0, help="sliding window (s)")
+    parser.add_argument("--gates", type=int, default=10, help="far-range gates")
+    parser.add_argument("--repeat", type=int, default=1000, help="warm table reads")
+    args = parser.parse_args()
+
+    print(
+        f"{'':>8} {'profiles':>8} {'ALCF s':>8} {'app s':>8} {'speedup':>8} {'window s':>9}"
+    )
+    with tempfile.TemporaryDirectory() as work_dir:
+        for instrument, (suffix, writer, period) in INSTRUMENTS.items():
+            path = os.path.join(work_dir, instrument + suffix)
+            writer(path, int(args.hours * 3600 / period), period=period)
+            d = engine.read(instrument, path)
+            alcf_time, app_time, window_time = compare(d, args)
+            print(
+                f"{instrument:>8} {len(d['time']):8d} {alcf_time:8.3f} {app_time:8.3f} "
+                f"{alcf_time / app_time:7.0f}x {window_time:9.3f}"
+            )
+    print("same noise removal and calibration as ALCF")
+
+    cold, warm = tables(d, args.repeat)
+    print(f"calibration table: cold {cold * 1000:.2f} ms, warm {warm * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
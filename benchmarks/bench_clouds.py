@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""Cloud detection and cloud base detection: vectorized against ALCF
+
+Usage: ``python benchmarks/bench_clouds.py [--hours H] [--zres M] [lidar_type:path ...]``
+
+Synthetic files of every instrument, and any recorded files given as ``lidar_type:path``,
+are read with the in-process engine, their noise removed and resampled in height, at full
+time resolution. The cloud mask and cloud base height are then computed by ALCF's default
+algorithms and by :mod:`app.clouds`. The script fails unless both agree exactly, and
+checks the cloud layers against the cloud mask.
+"""
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from alcf.algorithms.cloud_detection import default as alcf_cloud_detection
+from alcf.algorithms.cloud_base_detection import default as alcf_cloud_base_detection
+from alcf.algorithms.noise_removal import default as noise_removal
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import clouds, engine, resample  # pylint: disable=import-error,wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+
+#: Synthetic instruments: file suffix, writer and time between profiles (s).
+INSTRUMENTS = {
+    "cl51": (".dat", synthetic.write_cl51, 16.0),
+    "chm15k": (".nc", synthetic.write_chm15k, 15.0),
+    "minimpl": (".nc", synthetic.write_minimpl, 30.0),
+}
+
+
+def prepare(lidar_type: str, path: str, zres: float) -> dict:
+    """Reads a file, then removes its noise and resamples it in height, as the chain does"""
+    d = engine.read(lidar_type, path)
+    noise_removal.noise_removal(d)
+    resample.zsample(d, zres=zres, zlim=[0.0, 15000.0])
+    return d
+
+
+def timed(functions: list, d: dict) -> tuple:
+    """Runs detection steps on a copy of a dataset, returning it and the time taken (s)"""
+    d = copy.deepcopy(d)
+    start = time.perf_counter()
+    for function in functions:
+        function(d)
+    return d, time.perf_counter() - start
+
+
+def check_layers(d: dict):
+    """Checks that the cloud layers are runs of the cloud mask, the lowest first"""
+    mask = d["cloud_mask"]
+    zfull = d["zfull"]
+    base, top = d["cloud_layer_base"], d["cloud_layer_top"]
+    for i in np.flatnonzero(np.isfinite(base[:, 0]))[:200]:
+        profile = np.asarray(mask[i], bool)
+        for b, t in zip(base[i], top[i]):
+            if not np.isfinite(b):
+                break
+            j, k = np.searchsorted(zfull, [b, t])
+            assert profile[j : k + 1].all(), "layer not cloudy"
+            assert j == 0 or not profile[j - 1], "layer not starting at its base"
+            assert k == len(profile) - 1 or not profile[k + 1], "layer not ending at its top"
+    upper = np.isfinite(base[..., 1:])
+    assert np.all(base[..., 1:][upper] > top[..., :-1][upper]), "unsorted layers"
+
+
+def compare(name: str, d: dict):
+    """Compares the detection of ALCF and app.clouds on a dataset, printing the times"""
+    reference, alcf_time = timed(
+        [alcf_cloud_detection.cloud_detection, alcf_cloud_base_detection.cloud_base_detection],
+        d,
+    )
+    result, app_time = timed([clouds.cloud_detection, clouds.cloud_base_detection], d)
+
+    np.testing.assert_array_equal(result["cloud_mask"], reference["cloud_mask"])
+    assert result["cloud_mask"].dtype == reference["cloud_mask"].dtype
+    np.testing.assert_array_equal(result["cbh"], reference["cbh"])
+    assert list(result["."]["cbh"][".dims"]) == list(reference["."]["cbh"][".dims"])
+    check_layers(result)
+
+    # Removing runs shorter than 2 gates keeps the runs of 2 gates or more
+    filtered = clouds.filter_noise(result["cloud_mask"], 2)
+    _, starts, ends = clouds.runs(np.moveaxis(filtered, 1, -1).reshape(-1, filtered.shape[1]))
+    assert np.all(ends - starts >= 2), "noise left in the cloud mask"
+    assert np.all(filtered <= result["cloud_mask"]), "cloudy gates added"
+
+    cloudy = np.mean(np.isfinite(result["cbh"]))
+    print(
+        f"{name:>24} {len(d['time']):8d} {cloudy:8.0%} {alcf_time:8.3f} {app_time:8.3f} "
+        f"{alcf_time / app_time:7.0f}x"
+    )
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=24.0, help="duration of the files")
+    parser.add_argument("--zres", type=float, default=50.0)
+    parser.add_argument("files", nargs="*", help="recorded files, as lidar_type:path")
+    args = parser.parse_args()
+
+    print(f"{'':>24} {'profiles':>8} {'cloudy':>8} {'ALCF s':>8} {'app s':>8} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for instrument, (suffix, writer, period) in INSTRUMENTS.items():
+            path = os.path.join(work_dir, instrument + suffix)
+            writer(path, int(args.hours * 3600 / period), period=period)
+            compare(instrument, prepare(instrument, path, args.zres))
+    for argument in args.files:
+        lidar_type, path = argument.split(":", 1)
+        compare(os.path.basename(path)[-24:], prepare(lidar_type, path, args.zres))
+    print("same cloud mask and cloud base height as ALCF")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""Amortized per-file cost of coalescing small files into windows
+
+Usage: ``python benchmarks/bench_coalesce.py [--files N] [--minutes M] [--windows 1 5 ...]``
+
+A station pushing a CL51 file every ``--minutes`` is simulated with ``--files`` synthetic
+files, uploaded to an in-memory S3 (moto). They are processed as the function does: one by
+one (``app.ingest.process_objects``), then in windows of each size
+(``app.coalesce.process_windows``), downloads and uploads included. The script fails if a
+window loses profiles.
+"""
+
+import argparse
+import datetime as dt
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import boto3
+from moto import mock_aws
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+# pylint: disable=import-error,wrong-import-position
+from app import coalesce, storage
+from app.config import Settings
+from app.ingest import S3Object, process_objects
+
+import synthetic  # pylint: disable=wrong-import-position
+
+BUCKET = "benchmark"
+
+
+def upload_files(client, files: int, minutes: float, work_dir: str) -> list:
+    """Uploads the synthetic files of a station, returning their objects"""
+    period = 16.0
+    n = int(minutes * 60 / period)
+    sources = []
+    for i in range(files):
+        start = synthetic.START + dt.timedelta(minutes=minutes * i)
+        path = os.path.join(work_dir, f"{start:%Y%m%d%H%M}.dat")
+        synthetic.write_cl51(path, n, period=period, seed=i, start=start)
+        key = f"station/{os.path.basename(path)}"
+        client.upload_file(path, BUCKET, key)
+        sources.append(S3Object(BUCKET, key, os.path.getsize(path)))
+        os.remove(path)
+    return sources
+
+
+def measure(process, sources: list, window: int, settings: Settings, client) -> tuple:
+    """Processes the files in windows, returning the time (s), outputs and profiles"""
+    start = time.perf_counter()
+    results = []
+    for i in range(0, len(sources), window):
+        results += process(sources[i : i + window], settings, client=client)
+    seconds = time.perf_counter() - start
+
+    errors = [result.error for result in results if result.error is not None]
+    if errors:
+        sys.exit(f"{len(errors)} file(s) failed: {errors[0]}")
+    outputs = {key for result in results for key in result.outputs}
+    return seconds, len(outputs), sum(result.profiles for result in results)
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=60)
+    parser.add_argument("--minutes", type=float, default=2.0, help="duration of a file")
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 2, 5, 10, 30, 60])
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws(), tempfile.TemporaryDirectory() as work_dir:
+        storage._CLIENT = None  # pylint: disable=protected-access
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        sources = upload_files(client, args.files, args.minutes, work_dir)
+        settings = Settings(work_dir=work_dir)
+
+        # Warm up the chain, as in a warm container
+        process_objects(sources[:1], settings, client=client)
+
+        seconds, outputs, profiles = measure(process_objects, sources, 1, settings, client)
+        print(f"{args.files} files of {args.minutes:g} min, {profiles} profiles")
+        print(f"{'window':>10} {'total s':>9} {'ms/file':>9} {'outputs':>8} {'speedup':>8}")
+        print(f"{'off':>10} {seconds:9.2f} {seconds / args.files * 1000:9.1f} {outputs:8d}")
+        reference = seconds
+
+        for window in args.windows:
+            seconds, outputs, window_profiles = measure(
+                coalesce.process_windows, sources, window, settings, client
+            )
+            if window_profiles != profiles:
+                sys.exit(f"Window of {window} read {window_profiles} profiles, not {profiles}")
+            print(
+                f"{window:>10} {seconds:9.2f} {seconds / args.files * 1000:9.1f} "
+                f"{outputs:8d} {reference / seconds:7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""Memory and scratch space of compressed raw files streamed through the engine
+
+Usage: ``python benchmarks/bench_compressed.py [--tmp-mb 512] [--endpoint-url URL]``
+
+A gzip-compressed CL51 file larger than ``--tmp-mb`` MB once uncompressed, the default
+ephemeral storage of a function, is generated and uploaded to a moto server started by the
+script, or to the S3 stand-in at ``--endpoint-url``. It is then processed by
+:func:`app.compressed.run` in a child process, which reports the time taken, the peak RSS
+of the process, the peak memory allocated while processing (traced by ``tracemalloc``,
+NumPy arrays included, so not inflated by the allocator keeping freed memory) and the peak
+size of its work directory. The script fails unless the allocated memory and the work
+directory stay below the size of the uncompressed file, and the work directory below
+``--tmp-mb``.
+
+Beforehand, the script checks that small gzip, bzip2 and zip files, read in small blocks,
+are processed by :func:`app.ingest.process_object` into the same files as their
+uncompressed copy.
+"""
+
+import argparse
+import bz2
+import contextlib
+import datetime as dt
+import gzip
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import boto3
+import ds_format as ds
+from moto.server import ThreadedMotoServer
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+# pylint: disable=import-error,wrong-import-position
+from app import compressed, storage
+from app.config import Settings
+from app.ingest import S3Object, process_object
+
+import synthetic  # pylint: disable=wrong-import-position
+
+BUCKET = "benchmark"
+
+#: Time between the synthetic profiles (s) and profiles generated at a time.
+PERIOD, BATCH = 16.0, 1000
+
+
+def write_archive(path: str, n: int, level: int = 1) -> int:
+    """Writes a gzip-compressed CL51 file of ``n`` profiles, returning its uncompressed size"""
+    size = 0
+    with gzip.open(path, "wb", compresslevel=level) as handler:
+        for first in range(0, n, BATCH):
+            samples = synthetic.cl51_profiles(min(BATCH, n - first), 1540, seed=first)
+            for i, profile in enumerate(samples):
+                time_ = synthetic.START + dt.timedelta(seconds=PERIOD * (first + i))
+                message = synthetic.cl51_message(time_, profile)
+                handler.write(message)
+                size += len(message)
+    return size
+
+
+def directory_size(path: str) -> int:
+    """Returns the size of the files under a directory (bytes)"""
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def child(key: str, args):
+    """Processes a compressed file, printing the time taken (s), the profiles read, the peak
+    RSS of the process (MB), the peak memory allocated (MB) and the peak size of the work
+    directory (MB)"""
+    peak = [0]
+    done = threading.Event()
+    with tempfile.TemporaryDirectory() as work_dir:
+
+        def watch():
+            while not done.wait(0.05):
+                peak[0] = max(peak[0], directory_size(work_dir))
+
+        watcher = threading.Thread(target=watch)
+        watcher.start()
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            output = compressed.run("cl51", BUCKET, key, work_dir, {})
+        finally:
+            done.set()
+            watcher.join()
+        elapsed = time.perf_counter() - start
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        peak[0] = max(peak[0], directory_size(work_dir))
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(elapsed, output.profiles, rss, allocated / 2**20, peak[0] / 2**20)
+
+
+def run(key: str, args) -> tuple:
+    """Runs :func:`child` in a new process, returning what it prints"""
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", key, "--endpoint-url", args.endpoint_url],
+        check=True,
+        stdout=subprocess.PIPE,
+        env={**os.environ, "S3_ENDPOINT_URL": args.endpoint_url},
+    ).stdout
+    elapsed, profiles, rss, allocated, work_mb = output.decode().split()[-5:]
+    return float(elapsed), int(profiles), float(rss), float(allocated), float(work_mb)
+
+
+def outputs(keys: list, client, work_dir: str) -> dict:
+    """Reads processed files, by name"""
+    d = {}
+    for key in keys:
+        path = os.path.join(work_dir, "output.nc")
+        storage.download(BUCKET, key, path, client=client)
+        d[key.split("/", 2)[-1]] = ds.read(path, ["time_bnds", "backscatter", "cloud_mask"])
+    return d
+
+
+def check(client, work_dir: str):
+    """Checks that compressed files, read in small blocks, are processed as their copy"""
+    path = os.path.join(work_dir, "20200101.dat")
+    synthetic.write_cl51(path, 1500, period=PERIOD)
+    with open(path, "rb") as handler:
+        data = handler.read()
+    archive = os.path.join(work_dir, "archive.zip")
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as handler:
+        handler.writestr("20200101.dat", data)
+    with open(archive, "rb") as handler:
+        bodies = {
+            "": data,
+            ".gz": gzip.compress(data),
+            ".bz2": bz2.compress(data),
+            ".zip": handler.read(),
+        }
+
+    settings = Settings(output_bucket=BUCKET, work_dir=work_dir)
+    block_size, compressed.BLOCK_SIZE = compressed.BLOCK_SIZE, 1024 * 1024
+    try:
+        results = {}
+        for suffix, body in bodies.items():
+            key = f"check{suffix}/20200101.dat{suffix}"
+            client.put_object(Bucket=BUCKET, Key=key, Body=body)
+            result = process_object(S3Object(BUCKET, key), settings, client=client)
+            results[suffix] = outputs(result.outputs, client, work_dir)
+    finally:
+        compressed.BLOCK_SIZE = block_size
+
+    reference = results.pop("")
+    for suffix, result in results.items():
+        assert result.keys() == reference.keys(), f"{suffix}: wrong outputs {list(result)}"
+        for name, d in result.items():
+            for var in ("time_bnds", "backscatter", "cloud_mask"):
+                np.testing.assert_allclose(
+                    np.asarray(d[var], np.float64),
+                    np.asarray(reference[name][var], np.float64),
+                    err_msg=f"{suffix}: {name} {var}",
+                )
+
+
+def free_port() -> int:
+    """Returns a free local port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tmp-mb", type=float, default=512, help="ephemeral storage (MB)")
+    parser.add_argument("--endpoint-url", help="S3 stand-in, a local moto server by default")
+    parser.add_argument("--child")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    if args.child:
+        child(args.child, args)
+        return
+
+    server = None
+    if not args.endpoint_url:
+        # A server, so that the object is not held in the memory of the child
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = ThreadedMotoServer(port=free_port())
+        server.start()
+        args.endpoint_url = f"http://127.0.0.1:{server._port}"  # pylint: disable=protected-access
+
+    with contextlib.ExitStack() as stack:
+        if server is not None:
+            stack.callback(server.stop)
+        work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        client = boto3.client("s3", endpoint_url=args.endpoint_url)
+        client.create_bucket(Bucket=BUCKET)
+
+        check(client, work_dir)
+        print("compressed files are processed as their uncompressed copy")
+
+        message_size = len(
+            synthetic.cl51_message(synthetic.START, synthetic.cl51_profiles(1, 1540)[0])
+        )
+        n = int(args.tmp_mb * 2**20 / message_size) + BATCH
+        path = os.path.join(work_dir, "20200101.dat.gz")
+        size = write_archive(path, n)
+        key = f"station/{os.path.basename(path)}"
+        storage.upload(path, BUCKET, key, client=client)
+        print(
+            f"{n} profiles, {size / 2**20:.0f} MB uncompressed, "
+            f"{os.path.getsize(path) / 2**20:.0f} MB compressed"
+        )
+        os.remove(path)
+
+        elapsed, profiles, rss, allocated, work_mb = run(key, args)
+        print(
+            f"{elapsed:.1f} s, {profiles / elapsed:.0f} profiles/s, "
+            f"{size / 2**20 / elapsed:.1f} MB/s uncompressed"
+        )
+        print(
+            f"peak RSS {rss:.0f} MB, peak allocated {allocated:.0f} MB, "
+            f"peak work directory {work_mb:.1f} MB"
+        )
+
+    assert profiles == n, f"{profiles} profiles read, not {n}"
+    assert allocated < size / 2**20, "the file was held in memory"
+    assert work_mb < min(size / 2**20, args.tmp_mb), "the file was staged"
+    print(f"a {size / 2**20:.0f} MB file was processed within {args.tmp_mb:g} MB of /tmp")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""Vectorized Vaisala decoder against cl2nc, the decoder of ``alcf convert cl51``
+
+Usage: ``python benchmarks/bench_decoder.py [--profiles N] [--gates M]``
+
+A synthetic CL51 file is decoded by both. The script fails if the profiles differ.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import vaisala  # pylint: disable=import-error,wrong-import-position
+
+import cl2nc  # pylint: disable=wrong-import-position
+import synthetic  # pylint: disable=wrong-import-position
+
+
+def read_cl2nc(path: str) -> tuple:
+    """Decodes a file with cl2nc, returning the time and backscatter arrays"""
+    messages = cl2nc.read(
+        os.fsencode(path), {"check": False, "time": None, "sampling_rate": None}
+    )
+    return (
+        np.array([message["time"] for message in messages]),
+        np.array([message["backscatter"] for message in messages]),
+    )
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", type=int, default=5400, help="a day of 16 s profiles")
+    parser.add_argument("--gates", type=int, default=1540)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "synthetic.dat")
+        samples = synthetic.write_cl51(path, args.profiles, args.gates)
+
+        start = time.perf_counter()
+        profiles = vaisala.read(path)
+        vectorized = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reference_time, reference_backscatter = read_cl2nc(path)
+        reference = time.perf_counter() - start
+
+    np.testing.assert_array_equal(profiles.time, reference_time)
+    np.testing.assert_array_equal(profiles.backscatter, reference_backscatter)
+    np.testing.assert_array_equal(profiles.backscatter, samples / 100000)
+
+    print(f"{args.profiles} profiles of {args.gates} gates, identical output")
+    print(f"  vectorized: {vectorized * 1000:8.1f} ms")
+    print(f"      cl2nc: {reference * 1000:8.1f} ms ({reference / vectorized:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
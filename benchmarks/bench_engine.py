@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""Per-file latency of the in-process ALCF engine against the ``alcf`` command line tool
+
+Usage: ``python benchmarks/bench_engine.py cl51 <file> [<file>...] [--repeat N]``
+
+Both engines are run on every file, the in-process one after a first warm-up call, as in a
+warm Lambda container.
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import processing  # pylint: disable=import-error,wrong-import-position
+
+
+def measure(engine_name: str, lidar_type: str, paths: list, repeat: int) -> list:
+    """Returns the latencies (s) of processing every file ``repeat`` times"""
+    latencies = []
+    for _ in range(repeat):
+        for path in paths:
+            with tempfile.TemporaryDirectory() as work_dir:
+                start = time.perf_counter()
+                processing.run(lidar_type, path, work_dir, {}, engine_name=engine_name)
+                latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("lidar_type")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Warm up the in-process engine, as the first invocation of a container would
+    measure("inprocess", args.lidar_type, args.paths[:1], 1)
+
+    for engine_name in ("inprocess", "cli"):
+        latencies = measure(engine_name, args.lidar_type, args.paths, args.repeat)
+        print(
+            f"{engine_name:>9}: mean {statistics.mean(latencies) * 1000:8.1f} ms, "
+            f"median {statistics.median(latencies) * 1000:8.1f} ms "
+            f"over {len(latencies)} file(s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""Cold initialisation time of the function against a budget
+
+Usage: ``python benchmarks/bench_import.py [--budget-ms 500] [--repeat 5]``
+
+``app.index`` is imported in fresh interpreters, as a new Lambda container does before its
+first event, and the handler is called on an SQS message carrying the S3 test event, which
+references no file. The script fails if the median import time exceeds the budget, or if
+the heavy modules only needed to process files (ALCF, NumPy, SciPy, netCDF4, Zarr...) were
+loaded on the way. The modules slowest to import are listed, from ``python -X importtime``.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+FUNCTION_DIR = REPOSITORY_ROOT / "lambdas" / "alcf_ceilometer" / "function"
+
+#: Modules that must not be imported before a file is processed.
+HEAVY_MODULES = (
+    "alcf",
+    "astropy",
+    "ds_format",
+    "matplotlib",
+    "netCDF4",
+    "numpy",
+    "scipy",
+    "zarr",
+)
+
+# Run in the child interpreter: times the import, then the handler on a test event
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app.index
+seconds = time.perf_counter() - start
+
+class LambdaContext:
+    function_name = "alcf_ceilometer-benchmark"
+    memory_limit_in_mb = 3008
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:benchmark"
+    aws_request_id = "benchmark"
+
+body = json.dumps({"Event": "s3:TestEvent"})
+message = {"messageId": "1", "eventSource": "aws:sqs", "body": body}
+app.index.main({"Records": [message]}, LambdaContext())
+print(json.dumps({
+    "seconds": seconds,
+    "heavy": sorted(name for name in HEAVY if name in sys.modules),
+}))
+"""
+
+
+def cold_start(env: dict) -> dict:
+    """Imports the function in a fresh interpreter, returning the time and heavy modules"""
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-W",
+            "ignore::UserWarning",
+            "-c",
+            f"HEAVY = {HEAVY_MODULES!r}\n{_CHILD}",
+        ],
+        cwd=FUNCTION_DIR,
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout.decode()
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: dict, count: int) -> list:
+    """Returns the modules of ``import app.index`` taking the longest, with their own time (ms)"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.index"],
+        cwd=FUNCTION_DIR,
+        env=env,
+        check=True,
+        stderr=subprocess.PIPE,
+    ).stderr.decode()
+
+    imports = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            own, _, name = line[len("import time:") :].split("|")
+            imports.append((name.strip(), int(own) / 1000))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=500.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports listed")
+    args = parser.parse_args()
+
+    env = {
+        **os.environ,
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+        "LOG_LEVEL": "WARNING",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    }
+    runs = [cold_start(env) for _ in range(args.repeat)]
+    median = statistics.median(run["seconds"] for run in runs) * 1000
+
+    print(f"{'import':>40} {'ms':>8}")
+    for name, milliseconds in slowest_imports(env, args.top):
+        print(f"{name:>40} {milliseconds:8.1f}")
+    print(
+        f"import app.index: median {median:.1f} ms over {args.repeat} cold start(s), "
+        f"budget {args.budget_ms:.0f} ms"
+    )
+
+    heavy = sorted({name for run in runs for name in run["heavy"]})
+    if heavy:
+        sys.exit(f"Heavy modules loaded before processing a file: {', '.join(heavy)}")
+    if median > args.budget_ms:
+        sys.exit(f"Cold initialisation over budget: {median:.1f} ms > {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""Processing lanes of a station registry: synthesized template and isolation of a noisy station
+
+Usage: ``python benchmarks/bench_lanes.py [--stations 40] [--backlog-days 30]
+[--environment Dev]``
+
+A registry of ``--stations`` synthetic stations, CL51 and CHM15k of various cadences and
+rates, is added to the configuration of ``--environment`` and the stack is synthesized
+offline. The script fails unless the template has, for every lane planned by
+:func:`stacks.lanes.plan_lanes`:
+
+- a queue and its own dead letter queue, the visibility timeout six times the timeout of
+  the function;
+- a function of the lidar type, memory, timeout and reserved concurrency of the lane, fed
+  by the queue of the lane only, in batches of the lane;
+- the S3 notifications of the files of its stations, and of no other station, sent to its
+  queue.
+
+The files of six hours are then simulated, one station uploading ``--backlog-days`` of
+files at once after the first hour. Each file takes one execution for its size over the
+``throughput`` of the configuration, first in first out, either in the lanes or in a single
+queue and function of the same total concurrency. The delays of the files of the other
+stations are printed: in the lanes, only the stations sharing the lane of the noisy station
+wait for its backlog, longer than in the single queue as their lane has fewer executions.
+"""
+
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+from aws_cdk import core as cdk
+
+# Inject required path to gain access to the stacks package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# pylint: disable=import-error,wrong-import-position
+from stacks import alcf_ceilometer, utils
+from stacks.alcf_ceilometer import Alcf_ceilometerStack
+from stacks.lanes import load_stations
+
+#: Bucket of the raw files, routed to the lanes.
+INPUT_BUCKET = "raw-ceilometer"
+
+#: Duration simulated (s) and overhead of a file (s).
+DURATION, OVERHEAD = 6 * 3600, 0.5
+
+
+def registry(n: int, seed: int = 0) -> dict:
+    """Returns a registry of ``n`` stations of various types, cadences and rates"""
+    rng = random.Random(seed)
+    stations = {}
+    for i in range(n):
+        if rng.random() < 0.7:
+            entry = dict(
+                lidar_type="cl51",
+                cadence=rng.choice([60, 300, 3600]),
+                bytes_per_day=rng.randrange(20, 80) * 10**6,
+            )
+        else:
+            entry = dict(
+                lidar_type="chm15k",
+                cadence=rng.choice([300, 3600]),
+                bytes_per_day=rng.randrange(50, 1500) * 10**6,
+            )
+        stations[f"station{i:03d}"] = entry
+    return stations
+
+
+def synth(stations: dict, environment: str) -> tuple:
+    """Synthesizes the stack with a registry, returning it, its template and the time (s)"""
+
+    def consolidate_config(*args, **kwargs):
+        config = utils.consolidate_config(*args, **kwargs)
+        config["stations"] = stations
+        config["input_buckets"] = [INPUT_BUCKET]
+        # Synthesis rejects the underscore of the configured name, the template's own
+        config["stack_name"] = config["stack_name"].replace("_", "-")
+        return config
+
+    alcf_ceilometer.consolidate_config = consolidate_config
+    try:
+        start = time.perf_counter()
+        app = cdk.App()
+        stack = Alcf_ceilometerStack(app, "Lanes", environment)
+        template = app.synth().get_stack_by_name(stack.stack_name).template
+    finally:
+        alcf_ceilometer.consolidate_config = utils.consolidate_config
+    return stack, template, time.perf_counter() - start
+
+
+def resolve(value: dict) -> str:
+    """Returns the logical ID referenced by ``Ref`` or ``Fn::GetAtt``"""
+    if "Ref" in value:
+        return value["Ref"]
+    return value["Fn::GetAtt"][0]
+
+
+def check(stack, template: dict):
+    """Checks the resources of every lane in the synthesized template"""
+    resources = template["Resources"]
+
+    def logical_id(construct) -> str:
+        return stack.get_logical_id(construct.node.default_child)
+
+    by_type = {}
+    for name, resource in resources.items():
+        by_type.setdefault(resource["Type"], []).append(name)
+    mappings = [
+        resources[name]["Properties"] for name in by_type["AWS::Lambda::EventSourceMapping"]
+    ]
+    (notifications,) = [
+        resources[name]["Properties"]["NotificationConfiguration"]["QueueConfigurations"]
+        for name in by_type["Custom::S3BucketNotifications"]
+    ]
+    routes = {}
+    for route in notifications:
+        (rule,) = route["Filter"]["Key"]["FilterRules"]
+        assert rule["Name"] == "prefix", rule
+        assert rule["Value"] not in routes, f"{rule['Value']} routed twice"
+        routes[rule["Value"]] = resolve(route["QueueArn"])
+
+    lane_queues = set()
+    for lane in stack.lanes:
+        queue, function = stack.lane_resources[lane.name]
+        queue_id, function_id = logical_id(queue), logical_id(function)
+        lane_queues.add(queue_id)
+
+        properties = resources[queue_id]["Properties"]
+        assert properties["VisibilityTimeout"] == 6 * lane.timeout, lane.name
+        dead_letter_queue = resolve(properties["RedrivePolicy"]["deadLetterTargetArn"])
+        assert dead_letter_queue == logical_id(queue.dead_letter_queue.queue), lane.name
+
+        properties = resources[function_id]["Properties"]
+        assert properties["MemorySize"] == lane.memory_size, lane.name
+        assert properties["Timeout"] == lane.timeout, lane.name
+        assert properties["ReservedConcurrentExecutions"] == lane.reserved_concurrency
+        assert properties["Environment"]["Variables"]["LIDAR_TYPE"] == lane.lidar_type
+
+        sources = [
+            (resolve(mapping["EventSourceArn"]), mapping["BatchSize"])
+            for mapping in mappings
+            if resolve(mapping["FunctionName"]) == function_id
+        ]
+        assert sources == [(queue_id, lane.batch_size)], f"{lane.name}: fed by {sources}"
+
+        for station in lane.stations:
+            assert routes.pop(station.prefix) == queue_id, f"{station.name} misrouted"
+
+    assert not routes, f"unknown stations routed: {sorted(routes)}"
+    assert len(lane_queues) == len(stack.lanes), "lanes share a queue"
+    dead_letter_queues = {
+        resolve(resources[name]["Properties"]["RedrivePolicy"]["deadLetterTargetArn"])
+        for name in lane_queues
+    }
+    assert len(dead_letter_queues) == len(stack.lanes), "lanes share a dead letter queue"
+
+
+def files(stations: list, noisy: str, backlog_days: float, seed: int = 0) -> list:
+    """Returns the files of the stations as (arrival time, station, size in MB)"""
+    rng = random.Random(seed)
+    arrivals = []
+    for station in stations:
+        size = station.file_bytes / 2**20
+        t = rng.uniform(0, station.cadence)
+        while t < DURATION:
+            arrivals.append((t, station.name, size))
+            t += station.cadence
+        if station.name == noisy:
+            count = int(backlog_days * 86400 / station.cadence)
+            arrivals += [(3600.0, station.name, size)] * count
+    return sorted(arrivals)
+
+
+def delays(arrivals: list, slots: int, throughput: float) -> dict:
+    """Processes files first in first out on ``slots`` executions, returning the delays of
+    the files (s) by station"""
+    free = [0.0] * slots
+    result = {}
+    for arrival, station, size in arrivals:
+        start = max(arrival, heapq.heappop(free))
+        heapq.heappush(free, start + OVERHEAD + size / throughput)
+        result.setdefault(station, []).append(start - arrival)
+    return result
+
+
+def summary(result: dict, names: set) -> str:
+    """Returns the mean and largest delays (s) of the files of stations"""
+    values = [delay for name in names for delay in result[name]]
+    return f"{sum(values) / len(values):8.1f} {max(values):8.1f}"
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=40)
+    parser.add_argument("--backlog-days", type=float, default=30)
+    parser.add_argument("--environment", default="Dev")
+    args = parser.parse_args()
+
+    stack, template, seconds = synth(registry(args.stations), args.environment)
+    print(f"{args.stations} stations, {len(stack.lanes)} lanes, synthesized in {seconds:.1f} s")
+    print(
+        f"{'lane':>10} {'stations':>8} {'MB/day':>7} {'memory':>6} {'timeout':>7} "
+        f"{'reserved':>8} {'batch':>5}"
+    )
+    for lane in stack.lanes:
+        print(
+            f"{lane.name:>10} {len(lane.stations):8d} {lane.bytes_per_day / 10**6:7.0f} "
+            f"{lane.memory_size:6d} {lane.timeout:7d} {lane.reserved_concurrency:8d} "
+            f"{lane.batch_size:5d}"
+        )
+    check(stack, template)
+    print("every lane has its queue, function and stations in the template")
+
+    stations = load_stations(registry(args.stations))
+    lanes = {station.name: lane for lane in stack.lanes for station in lane.stations}
+    # The largest station of a shared lane, so that its lane-mates show what the lanes cost
+    noisy = max(
+        (station for station in stations if len(lanes[station.name].stations) > 1),
+        key=lambda x: x.bytes_per_day,
+    ).name
+    arrivals = files(stations, noisy, args.backlog_days)
+    throughput = stack.config["lanes"]["throughput"]
+
+    shared = delays(arrivals, sum(lane.reserved_concurrency for lane in stack.lanes), throughput)
+    laned = {}
+    for lane in stack.lanes:
+        names = {station.name for station in lane.stations}
+        laned.update(
+            delays(
+                [x for x in arrivals if x[1] in names], lane.reserved_concurrency, throughput
+            )
+        )
+
+    mates = {station.name for station in lanes[noisy].stations} - {noisy}
+    others = {station.name for station in stations} - mates - {noisy}
+    print(
+        f"{noisy} uploads {args.backlog_days:g} days of files after an hour, "
+        f"in lane {lanes[noisy].name}"
+    )
+    print(f"{'delay (s)':>12} {'shared':>17} {'lanes':>17}")
+    print(f"{'':>12} {'mean':>8} {'max':>8} {'mean':>8} {'max':>8}")
+    for label, names in (("other lanes", others), ("same lane", mates)):
+        print(f"{label:>12} {summary(shared, names)} {summary(laned, names)}")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("CDK_DEFAULT_REGION", "us-west-2")
+    main()
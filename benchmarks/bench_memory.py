@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Peak memory of CHM15k processing against the size of the input file
+
+Usage: ``python benchmarks/bench_memory.py [--hours 6 12 24 48] [--chunk-size N]``
+
+Synthetic CHM15k files of growing duration are processed, whole and in time chunks, each
+run in its own process so that its peak resident set size can be measured. With chunks,
+peak memory should stay flat as the files grow.
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+
+import synthetic  # pylint: disable=wrong-import-position
+
+#: Time between synthetic profiles (s).
+PERIOD = 15.0
+
+
+def child(path: str, chunk_size: int):
+    """Processes a file and prints the peak RSS of the process (MB)"""
+    from app import processing  # pylint: disable=import-error,import-outside-toplevel
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        processing.run("chm15k", path, work_dir, {}, chunk_size=chunk_size)
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def peak_rss(path: str, chunk_size: int) -> float:
+    """Runs :func:`child` in a new process, returning its peak RSS (MB)"""
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", path, str(chunk_size)],
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    return float(output.decode().split()[-1])
+
+
+def main():
+    """Runs the benchmark"""
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], int(sys.argv[3]))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, nargs="+", default=[6, 12, 24, 48])
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'hours':>6} {'profiles':>9} {'file MB':>8} {'whole MB':>9} {'chunked MB':>11}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for hours in args.hours:
+            n = int(hours * 3600 / PERIOD)
+            path = os.path.join(work_dir, f"chm15k_{n}.nc")
+            synthetic.write_chm15k(path, n, period=PERIOD)
+            print(
+                f"{hours:6g} {n:9d} {os.path.getsize(path) / 2**20:8.1f} "
+                f"{peak_rss(path, 0):9.1f} {peak_rss(path, args.chunk_size):11.1f}"
+            )
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""Latency of time and height window queries against the size of the archive
+
+Usage: ``python benchmarks/bench_query.py [--days 7 30 60] [--repeat N] [--endpoint-url URL]``
+
+Archives of a station of growing duration are written by :func:`app.archive.write` to an
+in-memory S3 (moto), or to the S3 stand-in at ``--endpoint-url`` (moto server, minio...),
+from synthetic processed days. Windows of an hour to a day are then queried at the end of
+each archive; the latency, GET requests and bytes read should depend on the window, not
+on the archive.
+
+The script fails unless every query returns the profiles of the synthetic days in the
+window, and the query handler answers a function URL request with them.
+"""
+
+import argparse
+import contextlib
+import datetime as dt
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import boto3
+import numpy as np
+import aquarius_time as aq
+from moto import mock_aws
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import archive, query, storage  # pylint: disable=import-error,wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+from suite import LambdaContext  # pylint: disable=wrong-import-position
+
+BUCKET = "benchmark"
+PREFIX = "archive/"
+
+#: Windows queried: name, hours before the end of the archive, duration (h), zmax (m).
+WINDOWS = [
+    ("1 h", 1, 1, np.inf),
+    ("6 h < 3 km", 9, 6, 3000.0),
+    ("6 h", 9, 6, np.inf),
+    ("24 h", 24, 24, np.inf),
+]
+
+#: Time between synthetic profiles (s), levels and level spacing (m).
+PERIOD, LEVELS, RESOLUTION = 30.0, 300, 50.0
+
+
+class Counter:
+    """Counts the GET requests of a client and the bytes they read"""
+
+    def __init__(self, client):
+        self.requests = 0
+        self.bytes = 0
+        client.meta.events.register("after-call.s3.GetObject", self)
+
+    def __call__(self, parsed=None, **kwargs):
+        self.requests += 1
+        self.bytes += parsed.get("ContentLength", 0)
+
+
+def day(index: int) -> dict:
+    """Returns the synthetic processed day of an index"""
+    return synthetic.processed(
+        synthetic.START + dt.timedelta(days=index),
+        int(86400 / PERIOD),
+        m=LEVELS,
+        step=PERIOD,
+        resolution=RESOLUTION,
+        seed=index,
+    )
+
+
+def expected(days: list, start: float, end: float, zmax: float) -> dict:
+    """Returns the profiles of a window from the synthetic days"""
+    d = {
+        name: np.concatenate([x[name] for x in days])
+        for name in ("time", "backscatter", "cloud_mask", "cbh")
+    }
+    rows = (d["time"] >= start) & (d["time"] < end)
+    levels = days[0]["zfull"] <= zmax
+    return {
+        "time": d["time"][rows],
+        "zfull": days[0]["zfull"][levels],
+        "backscatter": d["backscatter"][rows][:, levels].astype(np.float32),
+        "cloud_mask": d["cloud_mask"][rows][:, levels].astype(bool),
+        "cbh": d["cbh"][rows],
+    }
+
+
+def check(result: dict, reference: dict):
+    """Checks the result of a query against the expected profiles"""
+    for name, x in reference.items():
+        np.testing.assert_array_equal(result[name], x, err_msg=name)
+
+
+def check_handler(days: list, station: str):
+    """Checks the query handler on a function URL request of the last hour"""
+    end = days[-1]["time_bnds"][-1, 1]
+    event = {
+        "queryStringParameters": {
+            "station": station,
+            "start": aq.to_iso(end - 1 / 24),
+            "end": aq.to_iso(end),
+            "zmax": "3000",
+        }
+    }
+    response = query.main(event, LambdaContext())
+    assert response["statusCode"] == 200, response
+    result = json.loads(response["body"])
+    reference = expected(days[-1:], end - 1 / 24, end, 3000.0)
+    assert len(result["time"]) == len(reference["time"]), "wrong profiles"
+    np.testing.assert_array_equal(
+        np.array(result["backscatter"], np.float32), reference["backscatter"]
+    )
+
+    event["queryStringParameters"] = {"station": station, "start": "yesterday"}
+    assert query.main(event, LambdaContext())["statusCode"] == 400
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[7, 30, 60])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--endpoint-url", help="S3 stand-in, in-memory moto by default")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.update(OUTPUT_BUCKET=BUCKET, QUERY_PREFIX=PREFIX)
+    if args.endpoint_url:
+        os.environ["S3_ENDPOINT_URL"] = args.endpoint_url
+    mock = contextlib.nullcontext() if args.endpoint_url else mock_aws()
+
+    print(f"{'days':>5} {'window':>11} {'profiles':>9} {'ms':>8} {'GETs':>5} {'kB read':>8}")
+    with mock:
+        client = boto3.client("s3", endpoint_url=args.endpoint_url)
+        client.create_bucket(Bucket=BUCKET)
+        # The handler uses the shared client of the container
+        storage._CLIENT = client  # pylint: disable=protected-access
+        counter = Counter(client)
+
+        days = []
+        for size in args.days:
+            station = f"station{size}"
+            days = [day(i) for i in range(size)]
+            for i, d in enumerate(days):
+                archive.write(d, BUCKET, PREFIX, station, f"{PREFIX}{station}/{i}.pack", client)
+
+            end = days[-1]["time_bnds"][-1, 1]
+            for name, before, hours, zmax in WINDOWS:
+                start = end - before / 24
+                window = (start, start + hours / 24)
+                counter.requests = counter.bytes = 0
+                times = []
+                for _ in range(args.repeat):
+                    begin = time.perf_counter()
+                    result = archive.read(
+                        BUCKET, PREFIX, station, *window, zmax=zmax, client=client
+                    )
+                    times.append(time.perf_counter() - begin)
+                check(result, expected(days[-2:], *window, zmax))
+                print(
+                    f"{size:5d} {name:>11} {len(result['time']):9d} "
+                    f"{statistics.median(times) * 1000:8.1f} "
+                    f"{counter.requests // args.repeat:5d} "
+                    f"{counter.bytes / args.repeat / 1024:8.0f}"
+                )
+        check_handler(days, station)
+        storage._CLIENT = None  # pylint: disable=protected-access
+    print("queries return the profiles of their window")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""Render time and peak memory of decimated quicklooks against a full-resolution plot
+
+Usage: ``python benchmarks/bench_quicklook.py [--period S] [--levels N] [--resolution M]``
+
+A synthetic processed day of ``--period`` seconds between profiles and ``--levels`` levels
+is plotted by ALCF's ``plot_profile`` at full resolution, by :func:`app.quicklook.render`
+and as the tile pyramid of :func:`app.quicklook.tiles`. Each run is made in its own
+process, so that its peak resident set size can be measured; ``data`` is the peak of a
+process only generating the day.
+
+The script fails unless the decimated image keeps the maximum of the data and a cloud
+layer in every pixel column holding cloudy profiles.
+"""
+
+import argparse
+import io
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+
+import synthetic  # pylint: disable=wrong-import-position
+
+#: Plots compared, each run by :func:`child`.
+MODES = ("data", "full", "decimated", "tiles")
+
+
+def day(args) -> dict:
+    """Generates the synthetic processed day"""
+    return synthetic.processed(
+        synthetic.START,
+        int(86400 / args.period),
+        m=args.levels,
+        step=args.period,
+        resolution=args.resolution,
+    )
+
+
+def child(mode: str, args):
+    """Plots the day and prints the time taken (s) and the peak RSS of the process (MB)"""
+    # pylint: disable=import-error,import-outside-toplevel
+    from app import quicklook
+
+    d = day(args)
+    start = time.perf_counter()
+    size = 0
+    if mode == "full":
+        import matplotlib.pyplot as plt
+        from alcf.cmds.plot import plot_profile
+
+        plt.figure(figsize=(10, 4))
+        plot_profile("backscatter", d)
+        buffer = io.BytesIO()
+        plt.savefig(buffer, bbox_inches="tight", dpi=150)
+        size = len(buffer.getvalue())
+    elif mode == "decimated":
+        buffer = io.BytesIO()
+        quicklook.render(d, buffer)
+        size = len(buffer.getvalue())
+    elif mode == "tiles":
+        size = sum(len(quicklook.png(rgba)) for *_, rgba in quicklook.tiles(d))
+    elapsed = time.perf_counter() - start
+    print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, size)
+
+
+def run(mode: str, args) -> tuple:
+    """Runs :func:`child` in a new process, returning the time (s), peak RSS (MB) and size of
+    the images (bytes)"""
+    output = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--child",
+            mode,
+            "--period",
+            str(args.period),
+            "--levels",
+            str(args.levels),
+            "--resolution",
+            str(args.resolution),
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    elapsed, rss, size = output.decode().split()[-3:]
+    return float(elapsed), float(rss), int(size)
+
+
+def check(args):
+    """Checks that decimation keeps the maximum and the cloud layers of the day"""
+    from app import quicklook  # pylint: disable=import-error,import-outside-toplevel
+
+    d = day(args)
+    x = quicklook.values(d)
+    bounds = quicklook.cells(d)
+    t1, t2, z1, z2 = quicklook.extent(d)
+    t_edges = np.linspace(t1, t2, 1200 + 1)
+    pixels = quicklook.decimate(x, bounds, t_edges, np.linspace(z1, z2, 480 + 1))
+    assert np.nanmax(pixels) == np.nanmax(x), "maximum lost"
+
+    # Columns of pixels holding cloudy profiles show a cloud
+    cloudy = np.any(d["cloud_mask"], axis=1)
+    column = np.searchsorted(t_edges, d["time"], side="right") - 1
+    peak = np.nanmax(pixels, axis=1)
+    threshold = 0.5 * np.min(np.max(x[cloudy], axis=1))
+    assert np.all(peak[np.unique(column[cloudy])] >= threshold), "cloud layer lost"
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--child", choices=MODES)
+    parser.add_argument("--period", type=float, default=16.0, help="time between profiles (s)")
+    parser.add_argument("--levels", type=int, default=1500, help="number of levels")
+    parser.add_argument("--resolution", type=float, default=10.0, help="level spacing (m)")
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args)
+        return
+
+    check(args)
+    print(f"{'':>10} {'s':>8} {'peak MB':>8} {'image kB':>9}")
+    for mode in MODES:
+        elapsed, rss, size = run(mode, args)
+        print(f"{mode:>10} {elapsed:8.2f} {rss:8.1f} {size / 1024:9.0f}")
+    print("decimation keeps the maximum and the cloud layers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""Height resampling: cached sparse weights against ALCF's ``zsample``
+
+Usage: ``python benchmarks/bench_resample.py [--hours H] [--missing X] [--zres M]``
+
+Synthetic files of every instrument are read with the in-process engine, a fraction
+``--missing`` of their samples set missing, and resampled onto the output levels by ALCF's
+``zsample`` and by :mod:`app.resample`, the latter with the weights of the geometry not
+cached yet (cold) and cached (warm). The script fails if the results differ by more than
+rounding.
+"""
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from alcf.algorithms import zsample
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import engine, resample  # pylint: disable=import-error,wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+
+#: Synthetic instruments: file suffix, writer and time between profiles (s).
+INSTRUMENTS = {
+    "cl51": (".dat", synthetic.write_cl51, 16.0),
+    "chm15k": (".nc", synthetic.write_chm15k, 15.0),
+    "minimpl": (".nc", synthetic.write_minimpl, 30.0),
+}
+
+
+def timed(function, d: dict, **options) -> tuple:
+    """Runs a resampling on a copy of a dataset, returning it and the time taken (s)"""
+    d = copy.deepcopy(d)
+    start = time.perf_counter()
+    function(d, **options)
+    return d, time.perf_counter() - start
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=6.0, help="duration of the files")
+    parser.add_argument("--missing", type=float, default=0.01, help="fraction of samples")
+    parser.add_argument("--zres", type=float, default=50.0)
+    parser.add_argument("--zlim", type=float, nargs=2, default=[0.0, 15000.0])
+    args = parser.parse_args()
+
+    options = {"zres": args.zres, "zlim": args.zlim}
+    rng = np.random.default_rng(0)
+    print(f"{'':>8} {'profiles':>8} {'ALCF s':>8} {'cold s':>8} {'warm s':>8} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for instrument, (suffix, writer, period) in INSTRUMENTS.items():
+            path = os.path.join(work_dir, instrument + suffix)
+            writer(path, int(args.hours * 3600 / period), period=period)
+            d = engine.read(instrument, path)
+            d["backscatter"][rng.random(d["backscatter"].shape) < args.missing] = np.nan
+
+            reference, alcf_time = timed(zsample.zsample, d, **options)
+            result, cold_time = timed(resample.zsample, d, **options)
+            result, warm_time = timed(resample.zsample, d, **options)
+
+            np.testing.assert_array_equal(result["zfull"], reference["zfull"])
+            # Sums of opposite samples cancel to about 0: compare to the scale of the data
+            scale = np.nanmax(np.abs(reference["backscatter"]))
+            np.testing.assert_allclose(
+                result["backscatter"], reference["backscatter"], rtol=1e-9, atol=1e-12 * scale
+            )
+            print(
+                f"{instrument:>8} {len(d['time']):8d} {alcf_time:8.3f} {cold_time:8.3f} "
+                f"{warm_time:8.3f} {alcf_time / warm_time:7.0f}x"
+            )
+    print("same backscatter and missing values as ALCF (within 1e-9, relative)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Scaling of the parallel lidar simulation across local cores
+
+Usage: ``python benchmarks/bench_simulate.py [--days D] [--stations S] [--workers 1 2 4 ...]``
+
+Synthetic ERA5 output of ``--days`` days is simulated at ``--stations`` stations by
+:func:`app.simulate.run`, in chunks of a day, with every number of worker processes in
+turn. Each run starts from an empty output directory. The times, throughput, speedup and
+parallel efficiency are printed. The script fails if the runs do not produce the same
+profiles.
+
+The COSP simulator of ALCF (``cosp_alcf``) must be built, as in the Docker image of the
+function.
+"""
+
+import argparse
+import datetime as dt
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import alcf
+import aquarius_time as aq
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import simulate  # pylint: disable=import-error,wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--stations", type=int, default=8)
+    parser.add_argument("--lidar-type", default="cl51")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, 2, 4, os.cpu_count()} & set(range(1, os.cpu_count() + 1))),
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(os.path.dirname(alcf.__file__), "cosp_alcf")):
+        sys.exit("The COSP simulator of ALCF is not built: run the benchmark in the image")
+
+    start = aq.from_iso(synthetic.START.isoformat())
+    end = aq.from_iso((synthetic.START + dt.timedelta(days=args.days)).isoformat())
+    print(f"{'workers':>8} {'chunks':>8} {'s':>8} {'chunks/s':>9} {'speedup':>8} {'eff.':>6}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_dir = os.path.join(work_dir, "era5")
+        synthetic.write_era5(input_dir, args.days + 1)
+        stations = [
+            simulate.Station(f"station{i}", 0.25 * (i % 10), 0.25 * (i // 10))
+            for i in range(args.stations)
+        ]
+
+        reference = None
+        for workers in args.workers:
+            summary = simulate.run(
+                stations,
+                "era5",
+                input_dir,
+                args.lidar_type,
+                os.path.join(work_dir, f"output{workers}"),
+                start,
+                end,
+                workers=workers,
+            )
+            if summary["failed"]:
+                sys.exit(f"{summary['failed']} chunk(s) failed with {workers} worker(s)")
+            if reference is None:
+                reference = summary
+            elif summary["profiles"] != reference["profiles"]:
+                sys.exit(f"Different profiles with {workers} worker(s)")
+
+            # Speedup against a single worker, extrapolated if the first run has more
+            speedup = reference["elapsed"] / summary["elapsed"] * args.workers[0]
+            print(
+                f"{workers:8d} {summary['chunks']:8d} {summary['elapsed']:8.1f} "
+                f"{summary['chunks_per_second']:9.2f} {speedup:7.1f}x "
+                f"{speedup / workers:6.0%}"
+            )
+    print(f"{reference['profiles']} profiles in {len(reference['outputs'])} station file(s)")
+
+
+if __name__ == "__main__":
+    main()
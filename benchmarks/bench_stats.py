@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""Incremental statistics against a full ``alcf stats`` recompute
+
+Usage: ``python benchmarks/bench_stats.py [--files N] [--profiles N]``
+
+Synthetic hourly CL51 files are processed in-process, then the statistics of the day are
+computed twice: by merging the state of every processed file into a daily aggregate, as
+the function does, and by ``alcf stats`` over all the processed files. The script fails if
+they differ, and reports the time of a merge against the time of a recompute.
+"""
+
+import argparse
+import datetime as dt
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from alcf.algorithms import stats as alcf_stats
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import engine, stats  # pylint: disable=import-error,wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+
+
+def alcf_options(config: stats.StatsConfig) -> dict:
+    """Returns the options of ``alcf.algorithms.stats`` for the grids of ``config``"""
+    return {
+        "tlim": None,
+        "blim": np.array(config.blim),
+        "bres": config.bres,
+        "bsd_lim": np.array(config.bsd_lim),
+        "bsd_log": config.bsd_log,
+        "bsd_res": config.bsd_res,
+        "bsd_z": config.bsd_z,
+        "filter": [None],
+        "zlim": config.zlim,
+        "zres": config.zres,
+    }
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=12, help="hourly files")
+    parser.add_argument("--profiles", type=int, default=225, help="profiles per file")
+    args = parser.parse_args()
+
+    config = stats.StatsConfig()
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = []
+        for i in range(args.files):
+            input_path = os.path.join(work_dir, f"{i}.dat")
+            synthetic.write_cl51(
+                input_path,
+                args.profiles,
+                seed=i,
+                start=synthetic.START + dt.timedelta(hours=i),
+            )
+            paths += engine.run("cl51", input_path, os.path.join(work_dir, str(i)), {}).paths
+        datasets = [stats.read(path) for path in paths]
+
+        aggregate = stats.StatsState.empty(config)
+        merge_times = []
+        for i, d in enumerate(datasets):
+            start = time.perf_counter()
+            state = stats.StatsState.from_dataset(d, config)
+            aggregate = stats.StatsState.from_bytes(aggregate.to_bytes()).merge(state)
+            merge_times.append(time.perf_counter() - start)
+        incremental = stats.reduce(aggregate, config)
+
+        start = time.perf_counter()
+        state = {}
+        options = alcf_options(config)
+        for d in datasets:
+            alcf_stats.stream([d], state, **options)
+        reference = alcf_stats.stream([None], state, **options)[0]
+        recompute = time.perf_counter() - start
+
+    assert incremental["n"] == reference["n"], (incremental["n"], reference["n"])
+    for name in ("cl", "clt", "backscatter_avg", "backscatter_hist", "backscatter_sd_hist"):
+        np.testing.assert_allclose(incremental[name], reference[name], rtol=1e-9, atol=1e-15)
+    np.testing.assert_array_equal(incremental["zfull"], reference["zfull"])
+
+    print(f"{args.files} file(s), {incremental['n']} profiles, identical statistics")
+    print(f"  merge of one file: {np.mean(merge_times) * 1000:8.1f} ms")
+    print(f"  full recompute:    {recompute * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""Read time of a window of profiles: station store against per-file NetCDF
+
+Usage: ``python benchmarks/bench_store.py [--days N] [--files-per-day N]``
+
+Synthetic processed profiles are written as one NetCDF per input file, as the function
+uploads them, and to a station store (:mod:`app.store`). The whole window is then read from
+both. The script fails if they differ.
+"""
+
+import argparse
+import datetime as dt
+import glob
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import ds_format as ds
+import zarr
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import store  # pylint: disable=import-error,wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+
+
+def read_files(paths: list) -> dict:
+    """Reads and concatenates processed files, as a user of the per-file layout would"""
+    dd = [ds.read(path, store.VARIABLES) for path in paths]
+    return {
+        name: np.concatenate([d[name] for d in dd])
+        for name in ("time", "backscatter", "cloud_mask", "cbh")
+    }
+
+
+def size(path: str) -> int:
+    """Returns the size of the files under a directory (bytes)"""
+    return sum(
+        os.path.getsize(name)
+        for name in glob.glob(os.path.join(path, "**"), recursive=True)
+        if os.path.isfile(name)
+    )
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--files-per-day", type=int, default=24, help="hourly files")
+    parser.add_argument("--levels", type=int, default=300)
+    args = parser.parse_args()
+
+    profiles = 288 // args.files_per_day
+    with tempfile.TemporaryDirectory() as work_dir:
+        files_dir = os.path.join(work_dir, "files")
+        os.makedirs(files_dir)
+        station = zarr.DirectoryStore(os.path.join(work_dir, "station.zarr"))
+
+        paths = []
+        write_time = 0.0
+        for i in range(args.days * args.files_per_day):
+            start = synthetic.START + dt.timedelta(seconds=300 * profiles * i)
+            d = synthetic.processed(start, profiles, args.levels, seed=i)
+            paths.append(os.path.join(files_dir, f"{i:06d}.nc"))
+            ds.write(paths[-1], d)
+
+            begin = time.perf_counter()
+            store.write(d, station)
+            write_time += time.perf_counter() - begin
+
+        window = (d["time_bnds"][0, 0] - args.days, d["time_bnds"][-1, 1])
+
+        begin = time.perf_counter()
+        reference = read_files(paths)
+        files_time = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        result = store.read(station, *window)
+        store_time = time.perf_counter() - begin
+
+        files_size, store_size = size(files_dir), size(station.path)
+
+    np.testing.assert_array_equal(result["time"], reference["time"])
+    np.testing.assert_allclose(result["backscatter"], reference["backscatter"], rtol=1e-6)
+    np.testing.assert_array_equal(result["cloud_mask"], reference["cloud_mask"])
+    np.testing.assert_array_equal(result["cbh"], reference["cbh"])
+
+    print(f"{args.days} days, {len(paths)} files, {len(result['time'])} profiles, same data")
+    print(f"  NetCDF files: read {files_time * 1000:8.1f} ms, {files_size / 1e6:7.1f} MB")
+    print(
+        f"  store:        read {store_time * 1000:8.1f} ms, {store_size / 1e6:7.1f} MB "
+        f"({files_time / store_time:.0f}x faster), "
+        f"write {write_time / len(paths) * 1000:.1f} ms per file"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""CDK synth time of many station stacks and stages, with and without the config cache
+
+Usage: ``python benchmarks/bench_synth.py [--stacks 1 10 50] [--environment Dev]``
+
+An app of ``--stacks`` stages, each deploying an ``Alcf_ceilometerStack`` for one station
+(``allow_multiple`` on, the station as suffix, git information on), is built and
+synthesized, as the pipeline does for its stages:
+
+- ``uncached``: the configuration caches are cleared before every stack loads its
+  configuration, which parses the YAML files and runs ``git`` again, as before the cache;
+- ``cached``: the files are parsed once and ``git`` is run once per process.
+
+The time spent loading configurations, building the stacks and synthesizing them is
+printed. The script fails unless both modes synthesize the same templates.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aws_cdk import core as cdk
+
+# Inject required path to gain access to the stacks package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# pylint: disable=import-error,wrong-import-position
+from stacks import alcf_ceilometer, utils
+from stacks.alcf_ceilometer import Alcf_ceilometerStack
+
+#: Configuration loads compared.
+MODES = ("uncached", "cached")
+
+
+class StationStage(cdk.Stage):
+    """A stage deploying the stack of one station"""
+
+    def __init__(
+        self, scope, id, target_env, station, **kwargs
+    ):  # pylint: disable=redefined-builtin
+        super().__init__(scope, id, **kwargs)
+        Alcf_ceilometerStack(
+            self,
+            f"Alcf_ceilometerStack{target_env}",
+            target_env,
+            stack_name_suffix=station,
+            use_git_info=True,
+        )
+
+
+class TimedLoads:
+    """Times the configuration loads of the stacks, clearing the caches first if asked"""
+
+    def __init__(self, uncached: bool):
+        self.uncached = uncached
+        self.seconds = 0.0
+        self.loads = 0
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        if self.uncached:
+            utils.clear_config_cache()
+        config = utils.consolidate_config(*args, **kwargs)
+        # Stations need their own stack names
+        config["allow_multiple"] = True
+        # Synthesis rejects the underscore of the configured name, the template's own
+        config["stack_name"] = config["stack_name"].replace("_", "-")
+        self.seconds += time.perf_counter() - start
+        self.loads += 1
+        return config
+
+
+def synth(mode: str, stacks: int, environment: str, outdir: str) -> tuple:
+    """Builds and synthesizes the app, returning the times (s) and the templates"""
+    utils.clear_config_cache()
+    loads = TimedLoads(mode == "uncached")
+    alcf_ceilometer.consolidate_config = loads
+    try:
+        start = time.perf_counter()
+        app = cdk.App(outdir=outdir)
+        for i in range(stacks):
+            StationStage(app, f"Station{i}", environment, f"station{i}")
+        built = time.perf_counter()
+        assembly = app.synth()
+        done = time.perf_counter()
+    finally:
+        alcf_ceilometer.consolidate_config = utils.consolidate_config
+
+    templates = {
+        stack.stack_name: stack.template
+        for stage in assembly.nested_assemblies
+        for stack in stage.nested_assembly.stacks
+    }
+    return loads.seconds, built - start - loads.seconds, done - built, loads.loads, templates
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stacks", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--environment", default="Dev")
+    args = parser.parse_args()
+
+    print(f"{'stacks':>6} {'mode':>9} {'loads':>6} {'config s':>9} {'build s':>8} {'synth s':>8}")
+    for stacks in args.stacks:
+        templates = {}
+        for mode in MODES:
+            with tempfile.TemporaryDirectory() as outdir:
+                config, build, synthesis, loads, templates[mode] = synth(
+                    mode, stacks, args.environment, outdir
+                )
+            print(
+                f"{stacks:6d} {mode:>9} {loads:6d} {config:9.3f} {build:8.3f} "
+                f"{synthesis:8.3f}"
+            )
+        assert len(templates["cached"]) == stacks, "missing stacks"
+        assert json.dumps(templates["cached"], sort_keys=True) == json.dumps(
+            templates["uncached"], sort_keys=True
+        ), "the templates differ"
+    print("both modes synthesize the same templates")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("CDK_DEFAULT_REGION", "us-west-2")
+    main()
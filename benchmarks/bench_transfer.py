@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""Throughput of the pooled, parallel transfers of app.storage against single-stream calls
+
+Usage: ``python benchmarks/bench_transfer.py [--sizes 4 32 128] [--repeat N] [--endpoint-url URL]``
+
+Objects of ``--sizes`` MB are written and read against an in-memory S3 (moto), or the S3
+stand-in at ``--endpoint-url`` (moto server, minio...):
+
+- ``new client``: a client created for every call, single-stream ``get_object`` and
+  ``put_object``;
+- ``single``: the pooled client of :func:`app.storage.get_client`, single-stream calls;
+- ``memory``: :func:`app.storage.read` and :func:`app.storage.write`, parallel ranged GETs
+  and multipart uploads from and to memory;
+- ``file``: :func:`app.storage.download` and :func:`app.storage.upload`, the same from and
+  to local files.
+
+The median throughput (MB/s) of each is printed. The script fails unless every read
+returns the content written.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import boto3
+from moto import mock_aws
+
+# Inject required path to gain access to the app package
+sys.path.insert(
+    0,
+    str(Path(__file__).resolve().parent.parent / "lambdas" / "alcf_ceilometer" / "function"),
+)
+from app import storage  # pylint: disable=import-error,wrong-import-position
+
+BUCKET = "benchmark"
+
+#: Transfers compared.
+MODES = ("new client", "single", "memory", "file")
+
+
+def new_client(endpoint_url):
+    """Creates a client, as done per call before pooling"""
+    return boto3.client("s3", endpoint_url=endpoint_url)
+
+
+def transfers(mode: str, args, work_dir: str):
+    """Returns the write and read functions of a mode, taking and returning the content"""
+    path = os.path.join(work_dir, "object")
+
+    if mode == "new client":
+
+        def write(key, body):
+            new_client(args.endpoint_url).put_object(Bucket=BUCKET, Key=key, Body=body)
+
+        def read(key):
+            client = new_client(args.endpoint_url)
+            return client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+    elif mode == "single":
+
+        def write(key, body):
+            storage.get_client().put_object(Bucket=BUCKET, Key=key, Body=body)
+
+        def read(key):
+            return storage.get_client().get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+    elif mode == "memory":
+
+        def write(key, body):
+            storage.write(body, BUCKET, key)
+
+        def read(key):
+            return storage.read(BUCKET, key)
+
+    else:
+
+        def write(key, body):
+            with open(path, "wb") as handler:
+                handler.write(body)
+            storage.upload(path, BUCKET, key)
+
+        def read(key):
+            storage.download(BUCKET, key, path)
+            with open(path, "rb") as handler:
+                return handler.read()
+
+    return write, read
+
+
+def median_rate(function, size: int, repeat: int) -> float:
+    """Runs a transfer ``repeat`` times, returning the median throughput (MB/s)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return size / 2**20 / statistics.median(times)
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[4, 32, 128])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--endpoint-url", help="S3 stand-in, in-memory moto by default")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    if args.endpoint_url:
+        os.environ["S3_ENDPOINT_URL"] = args.endpoint_url
+    mock = contextlib.nullcontext() if args.endpoint_url else mock_aws()
+
+    print(f"{'MB':>6} {'mode':>11} {'write MB/s':>11} {'read MB/s':>10}")
+    with mock, tempfile.TemporaryDirectory() as work_dir:
+        storage._CLIENT = None  # pylint: disable=protected-access
+        storage.get_client().create_bucket(Bucket=BUCKET)
+        for size_mb in args.sizes:
+            body = os.urandom(int(size_mb * 2**20))
+            digest = hashlib.sha256(body).digest()
+            for mode in MODES:
+                write, read = transfers(mode, args, work_dir)
+                key = f"{mode}/{size_mb}"
+                write_rate = median_rate(lambda: write(key, body), len(body), args.repeat)
+                read_rate = median_rate(lambda: read(key), len(body), args.repeat)
+                assert hashlib.sha256(read(key)).digest() == digest, f"{mode}: wrong content"
+                print(f"{size_mb:6g} {mode:>11} {write_rate:11.1f} {read_rate:10.1f}")
+                storage.get_client().delete_object(Bucket=BUCKET, Key=key)
+        storage._CLIENT = None  # pylint: disable=protected-access
+    print("every read returned the content written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+"""End-to-end and per-stage benchmark suite of the processing chain
+
+Usage: ``python benchmarks/suite.py [--instruments cl51 chm15k minimpl] [--hours H]
+[--gates M] [--noise X] [--output results.json] [--baseline baseline.json]``
+
+A synthetic file of every instrument is generated, then processed in its own process:
+each stage separately (read, ALCF processing, write, statistics, station store), then the
+whole function, ``app.index.main``, on an S3 event against an in-memory S3 (moto). Every
+stage records its wall time (best of ``--repeat``), profiles per second and peak memory
+allocated (tracemalloc); the case records the peak RSS of its process.
+
+The results are written as JSON. With ``--baseline``, the stages slower than the baseline by
+more than ``--tolerance`` are reported and the script fails.
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+
+# Inject required path to gain access to the app package
+sys.path.insert(0, str(REPOSITORY_ROOT / "lambdas" / "alcf_ceilometer" / "function"))
+
+import synthetic  # pylint: disable=wrong-import-position
+
+#: Synthetic instruments: file suffix, writer, time between profiles (s) and range gates.
+INSTRUMENTS = {
+    "cl51": (".dat", synthetic.write_cl51, 16.0, 1540),
+    "chm15k": (".nc", synthetic.write_chm15k, 15.0, 1024),
+    "minimpl": (".nc", synthetic.write_minimpl, 30.0, 2000),
+}
+
+# Slowdowns under this many seconds are timing noise, not regressions
+_MIN_SLOWDOWN = 0.01
+
+# Default noise of the writers, scaled by --noise
+_NOISE = {"cl51": 50.0, "chm15k": 2e4, "minimpl": 0.05}
+
+
+class LambdaContext:
+    """Context of a local invocation of the function"""
+
+    function_name = "alcf_ceilometer-benchmark"
+    memory_limit_in_mb = 3008
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:benchmark"
+    aws_request_id = "benchmark"
+
+
+def generate(instrument: str, path: str, hours: float, gates: int, noise: float) -> int:
+    """Writes a synthetic file of an instrument.
+
+    Args:
+        instrument (str): One of :data:`INSTRUMENTS`.
+        path (str): The file to write.
+        hours (float): Duration of the file (h).
+        gates (int): Number of range gates, 0 for the instrument's default.
+        noise (float): Noise, relative to the instrument's default.
+
+    Returns:
+        int: The number of profiles written.
+    """
+    _, writer, period, default_gates = INSTRUMENTS[instrument]
+    n = int(hours * 3600 / period)
+    writer(path, n, gates or default_gates, period=period, noise=noise * _NOISE[instrument])
+    return n
+
+
+def measure(function, setup, profiles: int, repeat: int) -> dict:
+    """Measures a stage.
+
+    Args:
+        function (callable): The stage, called with the arguments returned by ``setup``.
+        setup (callable): Prepares the arguments of a run, outside of the measurement.
+        profiles (int): Number of profiles handled by a run.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        dict: The best wall time (s), the profiles per second and the peak memory allocated
+        during an extra run (MB).
+    """
+    seconds = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = min(seconds)
+    return {
+        "seconds": best,
+        "profiles_per_second": profiles / best if best > 0 else None,
+        "peak_mb": peak / 2**20,
+    }
+
+
+def invoke_main(instrument: str, path: str):
+    """Runs ``app.index.main`` on an S3 event of a file, against an in-memory S3"""
+    # pylint: disable=import-outside-toplevel
+    import boto3
+    from moto import mock_aws
+    from app import index, storage
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        storage._CLIENT = None  # pylint: disable=protected-access
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="benchmark")
+        key = f"{instrument}/{os.path.basename(path)}"
+        client.upload_file(path, "benchmark", key)
+        event = {
+            "Records": [
+                {"s3": {"bucket": {"name": "benchmark"}, "object": {"key": key}}},
+            ]
+        }
+        index.main(event, LambdaContext())
+    storage._CLIENT = None  # pylint: disable=protected-access
+
+
+def child(instrument: str, path: str, profiles: int, repeat: int) -> dict:
+    """Measures every stage on a file, in the current process"""
+    # pylint: disable=import-outside-toplevel,import-error
+    import zarr
+    from app import engine, stats, store
+
+    stages = {}
+    stages["read"] = measure(lambda: engine.read(instrument, path), tuple, profiles, repeat)
+
+    d = engine.read(instrument, path)
+    stages["process"] = measure(
+        lambda x: engine.process(x, instrument), lambda: (copy.deepcopy(d),), profiles, repeat
+    )
+
+    outputs = engine.process(copy.deepcopy(d), instrument)
+    with tempfile.TemporaryDirectory() as work_dir:
+        stages["write"] = measure(
+            lambda: [engine.write(x, work_dir) for x in outputs], tuple, profiles, repeat
+        )
+
+    config = stats.StatsConfig()
+    stages["stats"] = measure(
+        lambda: [stats.StatsState.from_dataset(x, config) for x in outputs],
+        tuple,
+        profiles,
+        repeat,
+    )
+    stages["store"] = measure(
+        lambda station: [store.write(x, station) for x in outputs],
+        lambda: (zarr.MemoryStore(),),
+        profiles,
+        repeat,
+    )
+
+    os.environ["LIDAR_TYPE"] = instrument
+    try:
+        stages["main"] = measure(lambda: invoke_main(instrument, path), tuple, profiles, repeat)
+    except ImportError as error:
+        stages["main"] = {"skipped": f"{error}"}
+
+    return {
+        "stages": stages,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_case(instrument: str, path: str, profiles: int, repeat: int) -> dict:
+    """Runs :func:`child` in a new process, returning its results"""
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--child",
+                instrument,
+                path,
+                str(profiles),
+                str(repeat),
+                output.name,
+            ],
+            check=True,
+            env={**os.environ, "LOG_LEVEL": "WARNING"},
+        )
+        return json.load(output)
+
+
+def metadata(args: argparse.Namespace) -> dict:
+    """Describes the code, the platform and the parameters of a run"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPOSITORY_ROOT,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "hours": args.hours,
+        "gates": args.gates,
+        "noise": args.noise,
+        "repeat": args.repeat,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Compares the wall times of a run against a baseline.
+
+    Args:
+        results (dict): The results of the run.
+        baseline (dict): The results of the baseline run.
+        tolerance (float): The accepted slowdown, e.g. 0.2 for 20 %.
+
+    Returns:
+        list: The regressions, as ``(instrument, stage, ratio)`` tuples.
+    """
+    regressions = []
+    print(f"{'case':>8} {'stage':>8} {'baseline s':>11} {'s':>9} {'ratio':>6}")
+    for instrument, case in results["cases"].items():
+        for stage, result in case["stages"].items():
+            reference = baseline.get("cases", {}).get(instrument, {}).get("stages", {})
+            reference = reference.get(stage, {})
+            if "seconds" not in result or "seconds" not in reference:
+                continue
+            ratio = result["seconds"] / reference["seconds"]
+            slower = result["seconds"] - reference["seconds"] > _MIN_SLOWDOWN
+            flag = " slower" if slower and ratio > 1 + tolerance else ""
+            print(
+                f"{instrument:>8} {stage:>8} {reference['seconds']:11.3f} "
+                f"{result['seconds']:9.3f} {ratio:6.2f}{flag}"
+            )
+            if flag:
+                regressions.append((instrument, stage, ratio))
+    return regressions
+
+
+def main():
+    """Runs the suite"""
+    if sys.argv[1:2] == ["--child"]:
+        instrument, path, profiles, repeat, output = sys.argv[2:7]
+        result = child(instrument, path, int(profiles), int(repeat))
+        with open(output, "w") as handler:
+            json.dump(result, handler)
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instruments", nargs="+", default=list(INSTRUMENTS))
+    parser.add_argument("--hours", type=float, default=6.0, help="duration of the files")
+    parser.add_argument("--gates", type=int, default=0, help="range gates, 0 for defaults")
+    parser.add_argument("--noise", type=float, default=1.0, help="relative to the defaults")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON file of the results, defaults to stdout")
+    parser.add_argument("--baseline", help="JSON file of the results of a baseline run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="accepted slowdown")
+    args = parser.parse_args()
+
+    results = {"metadata": metadata(args), "cases": {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for instrument in args.instruments:
+            path = os.path.join(work_dir, f"{instrument}{INSTRUMENTS[instrument][0]}")
+            profiles = generate(instrument, path, args.hours, args.gates, args.noise)
+            case = run_case(instrument, path, profiles, args.repeat)
+            case.update(profiles=profiles, file_bytes=os.path.getsize(path))
+            results["cases"][instrument] = case
+            os.remove(path)
+
+    if args.output:
+        with open(args.output, "w") as handler:
+            json.dump(results, handler, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as handler:
+            regressions = compare(results, json.load(handler), args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} stage(s) slower than the baseline")
+
+
+if __name__ == "__main__":
+    main()
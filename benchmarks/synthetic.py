@@ -0,0 +1,306 @@
+"""Synthetic ceilometer data for the benchmarks"""
+
+import datetime as dt
+
+import numpy as np
+
+#: Start of the synthetic time series.
+START = dt.datetime(2020, 1, 1)
+
+
+def cl51_profiles(
+    n: int, m: int = 1540, noise: float = 50.0, seed: int = 0
+) -> np.ndarray:
+    """Generates raw CL51 backscatter samples: noise, a boundary layer and a cloud layer.
+
+    Args:
+        n (int): Number of profiles.
+        m (int, optional): Number of range gates.
+        noise (float, optional): Standard deviation of the noise (raw units).
+        seed (int, optional): Seed of the random generator.
+
+    Returns:
+        np.ndarray: The samples, 20-bit signed integers, shape (n, m).
+    """
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0.0, noise, (n, m))
+    gates = np.arange(m)
+    samples += 400.0 * np.exp(-gates / (0.05 * m))
+    # A cloud layer slowly going up and down, absent from one profile in three
+    base = (0.2 * m * (1 + 0.5 * np.sin(np.arange(n) / 50.0))).astype(int)
+    cloudy = np.arange(n) % 3 != 0
+    layer = (gates >= base[:, np.newaxis]) & (gates < base[:, np.newaxis] + 20)
+    samples[layer & cloudy[:, np.newaxis]] += 5000.0
+    return np.clip(np.round(samples), -(1 << 19), (1 << 19) - 1).astype(np.int64)
+
+
+def cl51_message(time: dt.datetime, samples: np.ndarray, scale: int = 100) -> bytes:
+    """Formats a CL51 data message (number 1), preceded by its time line.
+
+    Args:
+        time (dt.datetime): Time of the profile.
+        samples (np.ndarray): The raw backscatter samples of the profile.
+        scale (int, optional): Scale parameter (%).
+
+    Returns:
+        bytes: The message.
+    """
+    encoded = np.where(samples < 0, samples + (1 << 20), samples)
+    return b"".join(
+        [
+            b"-" + time.strftime("%Y-%m-%d %H:%M:%S").encode("ascii") + b"\r\n",
+            b"\x01CL010212\x02\r\n",
+            b"10 01230 ///// ///// 000000000000\r\n",
+            b"%05d 10 %04d 098 +34 099 12 0621 L0016HN15 191\r\n" % (scale, len(samples)),
+            b"".join(b"%05x" % value for value in encoded) + b"\r\n",
+            b"\x03abcd\x04\r\n",
+        ]
+    )
+
+
+def write_cl51(
+    path: str,
+    n: int,
+    m: int = 1540,
+    period: float = 16.0,
+    noise: float = 50.0,
+    seed: int = 0,
+    start: dt.datetime = START,
+) -> np.ndarray:
+    """Writes a CL51 ``.dat`` file of ``n`` profiles.
+
+    Args:
+        path (str): The file to write.
+        n (int): Number of profiles.
+        m (int, optional): Number of range gates.
+        period (float, optional): Time between profiles (s).
+        noise (float, optional): Standard deviation of the noise (raw units).
+        seed (int, optional): Seed of the random generator.
+        start (dt.datetime, optional): Time of the first profile.
+
+    Returns:
+        np.ndarray: The raw samples written, shape (n, m).
+    """
+    samples = cl51_profiles(n, m, noise=noise, seed=seed)
+    with open(path, "wb") as handler:
+        for i in range(n):
+            handler.write(cl51_message(start + dt.timedelta(seconds=period * i), samples[i]))
+    return samples
+
+
+def write_chm15k(
+    path: str,
+    n: int,
+    m: int = 1024,
+    period: float = 15.0,
+    resolution: float = 15.0,
+    noise: float = 2e4,
+    seed: int = 0,
+    block: int = 1000,
+):
+    """Writes a Lufft CHM15k NetCDF file of ``n`` profiles, ``block`` profiles at a time.
+
+    Args:
+        path (str): The file to write.
+        n (int): Number of profiles.
+        m (int, optional): Number of range gates.
+        period (float, optional): Time between profiles (s).
+        resolution (float, optional): Range resolution (m).
+        noise (float, optional): Standard deviation of the noise of ``beta_raw``.
+        seed (int, optional): Seed of the random generator.
+        block (int, optional): Number of profiles generated at a time.
+    """
+    from netCDF4 import Dataset  # pylint: disable=import-outside-toplevel
+
+    start = (START - dt.datetime(1904, 1, 1)).total_seconds()
+    with Dataset(path, "w") as handler:
+        handler.createDimension("time", None)
+        handler.createDimension("range", m)
+        handler.createVariable("time", "f8", ("time",))
+        handler.createVariable("range", "f4", ("range",))[:] = resolution * (np.arange(m) + 0.5)
+        handler.createVariable("altitude", "f4", ())[:] = 100.0
+        beta_raw = handler.createVariable(
+            "beta_raw", "f4", ("time", "range"), zlib=True, chunksizes=(min(block, n), m)
+        )
+        for i in range(0, n, block):
+            j = min(i + block, n)
+            handler.variables["time"][i:j] = start + period * np.arange(i, j)
+            # Same shapes as the CL51 profiles, in CHM15k units
+            beta_raw[i:j] = 1e3 * cl51_profiles(j - i, m, noise=noise / 1e3, seed=seed + i)
+
+
+def processed(
+    start: dt.datetime,
+    n: int,
+    m: int = 300,
+    step: float = 300.0,
+    resolution: float = 50.0,
+    seed: int = 0,
+) -> dict:
+    """Generates a dataset in the format of the processed files of ``alcf lidar``.
+
+    Args:
+        start (dt.datetime): Start of the first profile.
+        n (int): Number of profiles.
+        m (int, optional): Number of levels.
+        step (float, optional): Time step (s).
+        resolution (float, optional): Height resolution (m).
+        seed (int, optional): Seed of the random generator.
+
+    Returns:
+        dict: The dataset, with ``time``, ``time_bnds``, ``zfull``, ``backscatter``,
+        ``cloud_mask`` and ``cbh``.
+    """
+    rng = np.random.default_rng(seed)
+    lower = (start - dt.datetime(1970, 1, 1)).total_seconds() + step * np.arange(n)
+    time_bnds = np.stack([lower, lower + step], axis=1) / 86400.0 + 2440587.5
+    zfull = resolution * (np.arange(m) + 0.5)
+
+    backscatter = np.abs(rng.normal(0.0, 1e-7, (n, m)))
+    base = (0.2 * m * (1 + 0.5 * np.sin(np.arange(n) / 50.0 + seed))).astype(int)
+    cloud_mask = (np.arange(m) >= base[:, np.newaxis]) & (np.arange(m) < base[:, np.newaxis] + 8)
+    cloud_mask[np.arange(n) % 3 == 0] = False
+    backscatter[cloud_mask] += 50e-6
+    cbh = np.where(np.any(cloud_mask, axis=1), zfull[base], np.inf)
+
+    return {
+        "time": time_bnds.mean(axis=1),
+        "time_bnds": time_bnds,
+        "zfull": zfull,
+        "backscatter": backscatter,
+        "cloud_mask": cloud_mask.astype(np.int8),
+        "cbh": cbh,
+        ".": {
+            "time": {".dims": ["time"]},
+            "time_bnds": {".dims": ["time", "bnds"]},
+            "zfull": {".dims": ["level"]},
+            "backscatter": {".dims": ["time", "level"]},
+            "cloud_mask": {".dims": ["time", "level"]},
+            "cbh": {".dims": ["time"]},
+        },
+    }
+
+
+def write_minimpl(
+    path: str,
+    n: int,
+    m: int = 2000,
+    period: float = 30.0,
+    resolution: float = 15.0,
+    noise: float = 0.05,
+    seed: int = 0,
+):
+    """Writes a MiniMPL NetCDF file of ``n`` profiles, as converted by SigmaMPL.
+
+    Args:
+        path (str): The file to write.
+        n (int): Number of profiles.
+        m (int, optional): Number of range gates.
+        period (float, optional): Time between profiles (s).
+        resolution (float, optional): Range resolution (m).
+        noise (float, optional): Standard deviation of the noise of the NRB.
+        seed (int, optional): Seed of the random generator.
+    """
+    from netCDF4 import Dataset  # pylint: disable=import-outside-toplevel
+
+    times = [START + dt.timedelta(seconds=period * i) for i in range(n)]
+    # Same shapes as the CL51 profiles, in normalized relative backscatter units
+    nrb = cl51_profiles(n, m, noise=noise * 1e3, seed=seed) / 1e3
+    with Dataset(path, "w") as handler:
+        handler.temporal_resolution = "%d s" % period
+        handler.createDimension("profile", n)
+        handler.createDimension("range_nrb", m)
+        handler.createVariable("range_nrb", "f8", ("range_nrb",))[:] = (
+            resolution * (np.arange(m) + 0.5) / 1e3
+        )
+        handler.createVariable("elevation_angle", "f8", ())[:] = 90.0
+        for name in ("year", "month", "day", "hour", "minute", "second"):
+            handler.createVariable(name, "i4", ("profile",))[:] = [
+                getattr(time, name) for time in times
+            ]
+        for name, value in (("altitude", 100.0), ("latitude", 0.0), ("longitude", 0.0)):
+            handler.createVariable(name, "f8", ("profile",))[:] = value
+        handler.createVariable("copol_nrb", "f4", ("profile", "range_nrb"), zlib=True)[:] = (
+            0.8 * nrb
+        )
+        handler.createVariable("crosspol_nrb", "f4", ("profile", "range_nrb"), zlib=True)[:] = (
+            0.1 * nrb
+        )
+
+
+def write_era5(
+    directory: str,
+    days: int,
+    grid: int = 11,
+    levels: int = 37,
+    seed: int = 0,
+):
+    """Writes hourly ERA5 pressure level and surface files, one per day, as ``alcf model``
+    reads them: ``<directory>/plev/<day>.nc`` and ``<directory>/surf/<day>.nc``.
+
+    The grid covers ``grid`` × ``grid`` points of 0.25° from 0°N 0°E, with a cloud layer
+    slowly going up and down.
+
+    Args:
+        directory (str): The directory to write.
+        days (int): Number of days.
+        grid (int, optional): Number of latitudes and longitudes.
+        levels (int, optional): Number of pressure levels.
+        seed (int, optional): Seed of the random generator.
+    """
+    import os  # pylint: disable=import-outside-toplevel
+
+    from netCDF4 import Dataset  # pylint: disable=import-outside-toplevel
+
+    rng = np.random.default_rng(seed)
+    pressure = np.linspace(100.0, 1000.0, levels)
+    # Geopotential of a standard atmosphere of scale height 8 km (m2 s-2)
+    geopotential = 9.80665 * 8000.0 * np.log(1013.25 / pressure)
+    shape = (24, levels, grid, grid)
+    for name in ("plev", "surf"):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    for day in range(days):
+        date = START + dt.timedelta(days=day)
+        hours = (date - dt.datetime(1900, 1, 1)).total_seconds() / 3600 + np.arange(24)
+        phase = 2 * np.pi * (day * 24 + np.arange(24)) / 48.0
+        level = (levels // 2 + (levels // 4 * np.sin(phase))).astype(int)
+        cloud = np.zeros(shape, np.float32)
+        cloud[np.arange(24), level] = 1.0
+        cloud[np.arange(24), np.minimum(level + 1, levels - 1)] = 0.5
+
+        for name in ("plev", "surf"):
+            path = os.path.join(directory, name, f"{date:%Y-%m-%d}.nc")
+            with Dataset(path, "w") as handler:
+                handler.createDimension("time", 24)
+                handler.createDimension("latitude", grid)
+                handler.createDimension("longitude", grid)
+                time = handler.createVariable("time", "i4", ("time",))
+                time.units = "hours since 1900-01-01 00:00:00.0"
+                time.calendar = "gregorian"
+                time[:] = hours
+                handler.createVariable("latitude", "f4", ("latitude",))[:] = (
+                    0.25 * np.arange(grid)
+                )
+                handler.createVariable("longitude", "f4", ("longitude",))[:] = (
+                    0.25 * np.arange(grid)
+                )
+                dims = ("time", "latitude", "longitude")
+                if name == "surf":
+                    handler.createVariable("sp", "f4", dims)[:] = 101325.0 + rng.normal(
+                        0.0, 100.0, (24, grid, grid)
+                    )
+                    handler.createVariable("z", "f4", dims)[:] = 0.0
+                    continue
+                handler.createDimension("level", levels)
+                handler.createVariable("level", "i4", ("level",))[:] = pressure
+                dims = ("time", "level", "latitude", "longitude")
+                handler.createVariable("cc", "f4", dims, zlib=True)[:] = cloud
+                handler.createVariable("clwc", "f4", dims, zlib=True)[:] = 1e-4 * cloud
+                handler.createVariable("ciwc", "f4", dims, zlib=True)[:] = 1e-5 * cloud
+                handler.createVariable("t", "f4", dims, zlib=True)[:] = (
+                    288.0 - 6.5e-3 * geopotential[:, None, None] / 9.80665
+                ) * np.ones(shape, np.float32)
+                handler.createVariable("z", "f4", dims, zlib=True)[:] = geopotential[
+                    :, None, None
+                ] * np.ones(shape, np.float32)
@@ -1,4 +1,11 @@
-"""alcf_ceilometer"""
+"""alcf_ceilometer
+
+Importing the handler, ``app.index``, loads the Powertools and boto3 only. The modules
+processing files, with ALCF, NumPy, SciPy, netCDF4 and Zarr, are imported by the code paths
+using them (:func:`app.processing.run`, :func:`app.ingest.upload_outputs`, coalescing), so
+that a new container handles its first event sooner and invocations processing no file, or
+only cache hits, never load them. ``benchmarks/bench_import.py`` checks this.
+"""
 
 from aws_lambda_powertools import Logger
 
@@ -0,0 +1,448 @@
+"""Archive of the processed profiles of the stations, indexed for time and range queries
+
+Every processed file is also written as a pack, one object of compressed blocks of
+profiles: a block holds the profiles of an hour (:data:`BLOCK_SECONDS`) and a band of
+:data:`BLOCK_LEVELS` range gates. The blocks of a station are listed by its index, one
+object per month, ``<prefix><station>.index/<YYYY-MM>.npz``, giving the time and height
+span of every block, its pack and its byte range in the pack.
+
+A query of a time and height window (:func:`read`) reads the months of the index it
+covers, then only the blocks overlapping the window, by ranged reads of their packs run in
+parallel. Its cost depends on the size of the window, not of the archive.
+
+Index updates are read-modify-write, with a conditional write retried when another
+invocation updated the index in the meantime, as the aggregates of :mod:`app.stats`.
+"""
+
+import datetime as dt
+import io
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import aquarius_time as aq
+import ds_format as ds
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
+from numcodecs import Blosc
+
+from . import storage
+from .processing import LOCK
+
+LOGGER = Logger(child=True)
+
+#: Variables of the processed files written to the archive.
+VARIABLES = ["time", "time_bnds", "zfull", "backscatter", "cloud_mask", "cbh"]
+
+#: Duration of the blocks (s), aligned on the hours.
+BLOCK_SECONDS = 3600
+
+#: Number of range gates per block.
+BLOCK_LEVELS = 64
+
+#: Entries of the index: time and height span of the block, first level, shape, pack and
+#: byte range in the pack.
+INDEX_DTYPE = np.dtype(
+    [
+        ("time_min", "f8"),
+        ("time_max", "f8"),
+        ("zfull_min", "f8"),
+        ("zfull_max", "f8"),
+        ("level", "i4"),
+        ("rows", "i4"),
+        ("levels", "i4"),
+        ("pack", "i4"),
+        ("offset", "i8"),
+        ("length", "i8"),
+    ]
+)
+
+# Blocks closer than this in a pack are read in one request (bytes)
+_MERGE_GAP = 64 * 1024
+
+# Ranged reads run in parallel by a query
+_READ_WORKERS = 8
+
+# Attempts of an index update racing other updates
+_UPDATE_ATTEMPTS = 10
+
+_COMPRESSOR = Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE)
+
+
+def index_key(prefix: str, station: str, month: str) -> str:
+    """Returns the key of the index of a station for a month (``YYYY-MM``)"""
+    return f"{prefix}{station.strip('/')}.index/{month}.npz"
+
+
+def _month(t: float) -> str:
+    """Returns the month (``YYYY-MM``) of a Julian date"""
+    return aq.to_datetime(t).strftime("%Y-%m")
+
+
+def _months(start: float, end: float) -> List[str]:
+    """Returns the months of the blocks that can overlap a time window"""
+    # Blocks start at most BLOCK_SECONDS before the profiles they hold
+    first = aq.to_datetime(start - BLOCK_SECONDS / 86400.0).replace(day=1)
+    last = aq.to_datetime(end)
+    months = []
+    while first <= last:
+        months.append(first.strftime("%Y-%m"))
+        first = (first + dt.timedelta(days=32)).replace(day=1)
+    return months
+
+
+def _get(client, bucket: str, key: str, byte_range: Optional[Tuple[int, int]] = None):
+    """Reads an object or a byte range of it, None if the object does not exist"""
+    options = {} if byte_range is None else {"Range": "bytes=%d-%d" % byte_range}
+    try:
+        return client.get_object(Bucket=bucket, Key=key, **options)["Body"].read()
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+
+
+def read_index(
+    bucket: str, prefix: str, station: str, month: str, client=None
+) -> Tuple[np.ndarray, List[str]]:
+    """Reads the index of a station for a month.
+
+    Args:
+        bucket (str): The bucket of the archive.
+        prefix (str): The key prefix of the archive.
+        station (str): The station, the first directory of the keys of its input files.
+        month (str): The month, ``YYYY-MM``.
+        client (optional): The S3 client to use.
+
+    Returns:
+        tuple: The blocks, of :data:`INDEX_DTYPE`, and the keys of the packs they refer
+        to; empty if the station has no block this month.
+    """
+    content = _get(client or storage.get_client(), bucket, index_key(prefix, station, month))
+    if content is None:
+        return np.zeros(0, INDEX_DTYPE), []
+    with np.load(io.BytesIO(content), allow_pickle=False) as index:
+        return index["blocks"], index["packs"].tolist()
+
+
+def _write_index(
+    bucket: str,
+    prefix: str,
+    station: str,
+    month: str,
+    blocks: np.ndarray,
+    packs: List[str],
+    client,
+    **condition,
+) -> int:
+    """Writes the index of a station for a month, dropping the packs without blocks, and
+    returns its size (bytes)"""
+    used = np.unique(blocks["pack"])
+    blocks = blocks.copy()
+    blocks["pack"] = np.searchsorted(used, blocks["pack"])
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, blocks=blocks, packs=np.array([packs[i] for i in used], dtype=str))
+    client.put_object(
+        Bucket=bucket, Key=index_key(prefix, station, month), Body=buffer.getvalue(), **condition
+    )
+    return len(buffer.getvalue())
+
+
+def _update_index(
+    bucket: str,
+    prefix: str,
+    station: str,
+    month: str,
+    pack_key: str,
+    new: np.ndarray,
+    client,
+) -> int:
+    """Adds the blocks of a pack to the index of a station for a month, replacing the
+    earlier blocks of the pack, and returns the size of the index (bytes).
+
+    The index is updated with a conditional write, retried when another invocation updated
+    it in the meantime.
+    """
+    key = index_key(prefix, station, month)
+    for attempt in range(_UPDATE_ATTEMPTS):
+        try:
+            response = client.get_object(Bucket=bucket, Key=key)
+            with np.load(io.BytesIO(response["Body"].read()), allow_pickle=False) as index:
+                blocks, packs = index["blocks"], index["packs"].tolist()
+            condition = dict(IfMatch=response["ETag"])
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            blocks, packs = np.zeros(0, INDEX_DTYPE), []
+            condition = dict(IfNoneMatch="*")
+
+        if pack_key in packs:
+            blocks = blocks[blocks["pack"] != packs.index(pack_key)]
+        else:
+            packs.append(pack_key)
+        new = new.copy()
+        new["pack"] = packs.index(pack_key)
+        blocks = np.concatenate([blocks, new])
+        blocks = blocks[np.argsort(blocks["time_min"], kind="stable")]
+
+        try:
+            return _write_index(bucket, prefix, station, month, blocks, packs, client, **condition)
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in (
+                "PreconditionFailed",
+                "ConditionalRequestConflict",
+            ):
+                raise
+            LOGGER.debug("Concurrent update of %s, retrying", key)
+            sleep(0.05 * 2**attempt)
+
+    raise RuntimeError(f"Could not update {key} after {_UPDATE_ATTEMPTS} attempts")
+
+
+def _encode(time: np.ndarray, cbh: np.ndarray, zfull: np.ndarray, b: np.ndarray, mask):
+    """Encodes a block: time, cloud base height and levels, then backscatter and cloud mask"""
+    return _COMPRESSOR.encode(
+        b"".join(
+            [
+                np.ascontiguousarray(time, "<f8").tobytes(),
+                np.ascontiguousarray(cbh, "<f8").tobytes(),
+                np.ascontiguousarray(zfull, "<f8").tobytes(),
+                np.ascontiguousarray(b, "<f4").tobytes(),
+                np.ascontiguousarray(mask, "i1").tobytes(),
+            ]
+        )
+    )
+
+
+def _decode(content: bytes, rows: int, levels: int) -> dict:
+    """Decodes a block encoded by :func:`_encode`"""
+    buffer = _COMPRESSOR.decode(content)
+    sizes = [("time", "<f8", rows), ("cbh", "<f8", rows), ("zfull", "<f8", levels)]
+    sizes += [("backscatter", "<f4", rows * levels), ("cloud_mask", "i1", rows * levels)]
+    block = {}
+    offset = 0
+    for name, dtype, count in sizes:
+        block[name] = np.frombuffer(buffer, dtype, count, offset)
+        offset += block[name].nbytes
+    block["backscatter"] = block["backscatter"].reshape(rows, levels)
+    block["cloud_mask"] = block["cloud_mask"].reshape(rows, levels)
+    return block
+
+
+def write(d: dict, bucket: str, prefix: str, station: str, pack_key: str, client=None) -> int:
+    """Writes the profiles of a processed dataset to the archive of a station.
+
+    The pack replaces an earlier pack of the same key, e.g. of a reprocessed file, in the
+    index.
+
+    Args:
+        d (dict): The processed dataset, with the variables of :data:`VARIABLES`.
+        bucket (str): The bucket of the archive.
+        prefix (str): The key prefix of the archive.
+        station (str): The station, the first directory of the keys of its input files.
+        pack_key (str): The key of the pack of the dataset.
+        client (optional): The S3 client to use.
+
+    Returns:
+        int: The number of bytes written, pack and index.
+    """
+    client = client or storage.get_client()
+    time = np.asarray(d["time"], np.float64)
+    backscatter = np.ma.filled(d["backscatter"], np.nan).astype(np.float32)
+    valid = ~np.all(np.isnan(backscatter), axis=1)
+    time, backscatter = time[valid], backscatter[valid]
+    cloud_mask = np.ma.filled(d["cloud_mask"], 0)[valid]
+    cbh = np.ma.filled(np.asarray(d["cbh"], np.float64), np.nan)[valid]
+    zfull = np.asarray(d["zfull"], np.float64)
+    if zfull.ndim == 2:
+        zfull = zfull[0]
+    order = np.argsort(time, kind="stable")
+    time, cbh = time[order], cbh[order]
+    backscatter, cloud_mask = backscatter[order], cloud_mask[order]
+
+    # Blocks of the hours, then of the bands of levels, in the order of the pack
+    hours = np.floor(time * 86400.0 / BLOCK_SECONDS)
+    bounds = np.flatnonzero(np.diff(hours)) + 1
+    parts, entries = [], []
+    offset = 0
+    for rows in np.split(np.arange(len(time)), bounds):
+        if len(rows) == 0:
+            continue
+        first, last = rows[0], rows[-1] + 1
+        for level in range(0, len(zfull), BLOCK_LEVELS):
+            levels = slice(level, min(level + BLOCK_LEVELS, len(zfull)))
+            content = _encode(
+                time[first:last],
+                cbh[first:last],
+                zfull[levels],
+                backscatter[first:last, levels],
+                cloud_mask[first:last, levels],
+            )
+            parts.append(content)
+            entries.append(
+                (
+                    time[first],
+                    time[last - 1],
+                    zfull[levels][0],
+                    zfull[levels][-1],
+                    level,
+                    last - first,
+                    len(zfull[levels]),
+                    0,
+                    offset,
+                    len(content),
+                )
+            )
+            offset += len(content)
+    if not entries:
+        return 0
+    written = storage.write(b"".join(parts), bucket, pack_key, client=client)
+
+    blocks = np.array(entries, INDEX_DTYPE)
+    months = np.array([_month(t) for t in blocks["time_min"]])
+    for month in np.unique(months):
+        written += _update_index(
+            bucket, prefix, station, month, pack_key, blocks[months == month], client
+        )
+    return written
+
+
+def write_file(path: str, bucket: str, prefix: str, station: str, pack_key: str, client=None):
+    """Writes the profiles of a processed file to the archive of a station, see :func:`write`"""
+    with LOCK:
+        d = ds.read(path, VARIABLES)
+    return write(d, bucket, prefix, station, pack_key, client=client)
+
+
+def _ranges(blocks: np.ndarray) -> List[Tuple[int, int, np.ndarray]]:
+    """Groups the blocks of a pack, sorted by offset, into byte ranges to read.
+
+    Returns:
+        list: The first and last byte of every range and the blocks it holds.
+    """
+    ends = blocks["offset"] + blocks["length"]
+    breaks = np.flatnonzero(blocks["offset"][1:] - ends[:-1] > _MERGE_GAP) + 1
+    return [
+        (int(group["offset"][0]), int(group["offset"][-1] + group["length"][-1] - 1), group)
+        for group in np.split(blocks, breaks)
+    ]
+
+
+def read(
+    bucket: str,
+    prefix: str,
+    station: str,
+    start: float,
+    end: float,
+    zmin: float = -np.inf,
+    zmax: float = np.inf,
+    client=None,
+) -> dict:
+    """Reads the profiles of a time and height window from the archive of a station.
+
+    Args:
+        bucket (str): The bucket of the archive.
+        prefix (str): The key prefix of the archive.
+        station (str): The station, the first directory of the keys of its input files.
+        start (float): Start of the window (Julian date), included.
+        end (float): End of the window (Julian date), excluded.
+        zmin (float, optional): Lowest level of the window (m), included.
+        zmax (float, optional): Highest level of the window (m), included.
+        client (optional): The S3 client to use.
+
+    Returns:
+        dict: ``time``, ``zfull``, ``backscatter``, ``cloud_mask`` and ``cbh`` of the
+        profiles of the window, sorted in time, and ``bytes_read``, the bytes read from the
+        object store.
+
+    Raises:
+        ValueError: If the profiles of the window do not share their levels.
+    """
+    client = client or storage.get_client()
+    bytes_read = 0
+
+    # Blocks of the window, per pack
+    wanted: Dict[str, List[np.ndarray]] = {}
+    for month in _months(start, end):
+        index, packs = read_index(bucket, prefix, station, month, client=client)
+        index = index[
+            (index["time_min"] < end)
+            & (index["time_max"] >= start)
+            & (index["zfull_min"] <= zmax)
+            & (index["zfull_max"] >= zmin)
+        ]
+        for pack in np.unique(index["pack"]):
+            wanted.setdefault(packs[pack], []).append(index[index["pack"] == pack])
+
+    requests = []
+    for pack_key, blocks in wanted.items():
+        blocks = np.concatenate(blocks)
+        blocks = blocks[np.argsort(blocks["offset"])]
+        requests.extend((pack_key,) + byte_range for byte_range in _ranges(blocks))
+
+    def fetch(request):
+        pack_key, first, last, group = request
+        content = _get(client, bucket, pack_key, (first, last))
+        if content is None:
+            raise ValueError(f"Pack {pack_key} of the index does not exist")
+        decoded = []
+        for block in group:
+            offset = block["offset"] - first
+            data = _decode(
+                content[offset : offset + block["length"]], block["rows"], block["levels"]
+            )
+            decoded.append(((block["time_min"], pack_key), block["level"], data))
+        return len(content), decoded
+
+    with ThreadPoolExecutor(max_workers=_READ_WORKERS) as executor:
+        results = list(executor.map(fetch, requests))
+
+    # Bands of levels side by side, then the hours of the packs one after the other
+    hours: Dict[Tuple[float, str], List[Tuple[int, dict]]] = {}
+    for size, decoded in results:
+        bytes_read += size
+        for hour, level, data in decoded:
+            hours.setdefault(hour, []).append((level, data))
+
+    columns = None
+    parts = []
+    for hour in sorted(hours):
+        bands = [data for _, data in sorted(hours[hour], key=lambda item: item[0])]
+        zfull = np.concatenate([band["zfull"] for band in bands])
+        levels = (zfull >= zmin) & (zfull <= zmax)
+        if columns is None:
+            columns = zfull[levels]
+        elif not np.array_equal(zfull[levels], columns):
+            raise ValueError("Levels of the window differ between blocks")
+        time = bands[0]["time"]
+        rows = (time >= start) & (time < end)
+        parts.append(
+            (
+                time[rows],
+                bands[0]["cbh"][rows],
+                np.hstack([band["backscatter"] for band in bands])[rows][:, levels],
+                np.hstack([band["cloud_mask"] for band in bands])[rows][:, levels],
+            )
+        )
+
+    if not parts:
+        return {
+            "time": np.zeros(0),
+            "zfull": np.zeros(0),
+            "backscatter": np.zeros((0, 0), np.float32),
+            "cloud_mask": np.zeros((0, 0), bool),
+            "cbh": np.zeros(0),
+            "bytes_read": bytes_read,
+        }
+    time, cbh, backscatter, cloud_mask = (np.concatenate(x) for x in zip(*parts))
+    # Overlapping packs, e.g. of coalescing windows, hold the same profiles once
+    time, rows = np.unique(time, return_index=True)
+    return {
+        "time": time,
+        "zfull": columns,
+        "backscatter": backscatter[rows],
+        "cloud_mask": cloud_mask[rows].astype(bool),
+        "cbh": cbh[rows],
+        "bytes_read": bytes_read,
+    }
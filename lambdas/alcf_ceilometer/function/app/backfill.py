@@ -0,0 +1,256 @@
+"""Parallel, resumable reprocessing of archived ceilometer files
+
+Usage::
+
+    python -m app.backfill <bucket> <station> [<station>...] --start 2020-01-01 \\
+        --end 2020-12-31 [--workers N] [--manifest backfill.jsonl]
+
+The raw files of every station are listed day by day, under keys formatted with
+``--key-format`` (``{station}/%Y/%m/%d/`` by default). Each file is a task processed by
+:func:`app.ingest.process_objects`, the code of ``app.index.main``, on a pool of processes
+using all the local cores. The settings are read from the environment as in the function.
+
+Every finished task is appended to a JSON lines manifest. A run started again with the
+same manifest and settings skips the files already processed, so a killed backfill resumes
+where it stopped. Changing the settings (e.g. ``ALCF_OPTIONS``) processes everything again.
+"""
+
+import argparse
+import datetime as dt
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from typing import Iterator, List, Set
+
+from aws_lambda_powertools import Logger
+
+from . import instrumentation, storage
+from .config import Settings
+from .ingest import Result, S3Object, process_objects
+
+LOGGER = Logger(child=True)
+
+#: Default format of the key prefix of the files of a station and a day.
+KEY_FORMAT = "{station}/%Y/%m/%d/"
+
+# Seconds between two progress reports
+_REPORT_INTERVAL = 30.0
+
+
+def settings_fingerprint(settings: Settings) -> str:
+    """Returns an identifier of the settings that change the processed files.
+
+    Args:
+        settings (Settings): The settings of the engine.
+
+    Returns:
+        str: A hash of the settings.
+    """
+    relevant = asdict(settings)
+    for name in (
+        "max_workers",
+        "work_dir",
+        "cache_entries",
+        "event_sample_rate",
+        "query_buckets",
+        "coalesce",
+    ):
+        relevant.pop(name)
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def day_prefixes(
+    stations: List[str], start: dt.date, end: dt.date, key_format: str = KEY_FORMAT
+) -> List[str]:
+    """Lists the key prefixes of the files of stations over a range of days.
+
+    Args:
+        stations (list): The stations, i.e. the paths of their files.
+        start (dt.date): The first day.
+        end (dt.date): The last day, included.
+        key_format (str, optional): The format of the prefixes, a :meth:`str.format`
+            template with a ``station`` field and :meth:`dt.date.strftime` directives.
+
+    Returns:
+        list: The distinct prefixes, in order of station then day.
+    """
+    prefixes = []
+    for station in stations:
+        day = start
+        while day <= end:
+            prefixes.append(day.strftime(key_format.format(station=station.strip("/"))))
+            day += dt.timedelta(days=1)
+    return list(dict.fromkeys(prefixes))
+
+
+def list_objects(bucket: str, prefixes: List[str], client=None) -> Iterator[S3Object]:
+    """Lists the objects under key prefixes.
+
+    Args:
+        bucket (str): The bucket.
+        prefixes (list): The key prefixes.
+        client (optional): The S3 client to use.
+
+    Yields:
+        S3Object: The objects, in order of prefix and key.
+    """
+    paginator = (client or storage.get_client()).get_paginator("list_objects_v2")
+    for prefix in prefixes:
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                if not item["Key"].endswith("/"):
+                    yield S3Object(bucket, item["Key"], item["Size"])
+
+
+def read_manifest(path: str, fingerprint: str) -> Set[str]:
+    """Reads the files already processed with the same settings from a manifest.
+
+    Args:
+        path (str): The manifest, which may not exist yet.
+        fingerprint (str): The fingerprint of the settings, see :func:`settings_fingerprint`.
+
+    Returns:
+        set: The ``s3://bucket/key`` URLs of the files processed successfully.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as handler:
+        for line in handler:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of a killed run may be truncated
+                continue
+            if entry.get("settings") == fingerprint and entry.get("error") is None:
+                done.add(entry["source"])
+    return done
+
+
+def _url(source: S3Object) -> str:
+    """Returns the URL of an object, as recorded in the manifest"""
+    return f"s3://{source.bucket}/{source.key}"
+
+
+def _process(source: S3Object, settings: Settings) -> Result:
+    """Task of a worker process: processes one file as ``app.index.main`` does"""
+    try:
+        return process_objects([source], settings)[0]
+    finally:
+        # No invocation flushes the metrics of a backfill, the manifest records the run
+        instrumentation.METRICS.clear_metrics()
+
+
+def backfill(
+    sources: List[S3Object], settings: Settings, manifest: str, workers: int
+) -> dict:
+    """Processes files on a pool of processes, recording them in a manifest.
+
+    Args:
+        sources (list): The files to process.
+        settings (Settings): The settings of the engine.
+        manifest (str): The manifest of the run. The files it records as processed with
+            the same settings are skipped.
+        workers (int): The number of worker processes.
+
+    Returns:
+        dict: Counts of files (processed, failed, skipped) and profiles, elapsed time and
+        throughput.
+    """
+    fingerprint = settings_fingerprint(settings)
+    done = read_manifest(manifest, fingerprint)
+    pending = [source for source in sources if _url(source) not in done]
+    LOGGER.info(
+        "Backfilling %d file(s), %d already processed", len(pending), len(sources) - len(pending)
+    )
+
+    summary = dict(processed=0, failed=0, skipped=len(sources) - len(pending), profiles=0)
+    start = last_report = time.perf_counter()
+
+    # Spawned workers do not inherit the S3 client of the parent, which is not fork safe
+    context = multiprocessing.get_context("spawn")
+    with open(manifest, "a") as handler, ProcessPoolExecutor(
+        max_workers=workers, mp_context=context
+    ) as executor:
+        futures = [executor.submit(_process, source, settings) for source in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            handler.write(
+                json.dumps(
+                    dict(
+                        source=_url(result.source),
+                        settings=fingerprint,
+                        outputs=result.outputs,
+                        profiles=result.profiles,
+                        error=result.error,
+                    )
+                )
+                + "\n"
+            )
+            handler.flush()
+
+            summary["failed" if result.error is not None else "processed"] += 1
+            summary["profiles"] += result.profiles
+
+            now = time.perf_counter()
+            if now - last_report >= _REPORT_INTERVAL:
+                last_report = now
+                LOGGER.info("Progress", extra=_throughput(summary, now - start))
+
+    summary.update(_throughput(summary, time.perf_counter() - start))
+    return summary
+
+
+def _throughput(summary: dict, elapsed: float) -> dict:
+    """Returns the number of files and the throughput of a run"""
+    files = summary["processed"] + summary["failed"]
+    return dict(
+        files=files,
+        elapsed=round(elapsed, 3),
+        files_per_second=files / elapsed if elapsed > 0 else 0.0,
+        profiles_per_second=summary["profiles"] / elapsed if elapsed > 0 else 0.0,
+    )
+
+
+def main(argv: List[str] = None) -> int:
+    """Runs a backfill from the command line.
+
+    Args:
+        argv (list, optional): The arguments. Defaults to the command line.
+
+    Returns:
+        int: The exit status, 1 if any file failed.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("bucket", help="bucket of the raw files")
+    parser.add_argument("stations", nargs="+", help="stations, i.e. paths of their files")
+    parser.add_argument("--start", type=dt.date.fromisoformat, required=True, help="first day")
+    parser.add_argument("--end", type=dt.date.fromisoformat, required=True, help="last day")
+    parser.add_argument("--key-format", default=KEY_FORMAT, help="prefix of a station's day")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes")
+    parser.add_argument("--manifest", default="backfill.jsonl", help="checkpoint manifest")
+    args = parser.parse_args(argv)
+
+    # Processes run side by side: each handles one file at a time
+    settings = Settings.from_env()
+    settings.max_workers = 1
+
+    prefixes = day_prefixes(args.stations, args.start, args.end, args.key_format)
+    sources = list(list_objects(args.bucket, prefixes))
+    summary = backfill(sources, settings, args.manifest, args.workers)
+
+    print(
+        f"{summary['processed']} file(s) processed, {summary['failed']} failed, "
+        f"{summary['skipped']} skipped in {summary['elapsed']:.1f} s: "
+        f"{summary['files_per_second']:.2f} files/s, "
+        f"{summary['profiles_per_second']:.0f} profiles/s"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+"""SQS batch mode with partial failure reporting"""
+
+import json
+from typing import List
+
+from aws_lambda_powertools import Logger
+
+from .config import Settings
+from .ingest import S3Object, process_objects, s3_objects
+
+LOGGER = Logger(child=True)
+
+
+def is_sqs_event(event: dict) -> bool:
+    """Tells if an event is a batch of SQS messages.
+
+    Args:
+        event (dict): The event received by the handler.
+
+    Returns:
+        bool: True if the records of the event come from SQS.
+    """
+    records = event.get("Records") or [{}]
+    return records[0].get("eventSource") == "aws:sqs"
+
+
+def message_objects(message: dict) -> List[S3Object]:
+    """Lists the objects referenced by the S3 notification carried by an SQS message.
+
+    Notifications forwarded through SNS are unwrapped. The test event sent by S3 when
+    notifications are configured references no object.
+
+    Args:
+        message (dict): The SQS message.
+
+    Returns:
+        list: The referenced objects.
+
+    Raises:
+        ValueError: If the body of the message is not an S3 notification.
+    """
+    body = json.loads(message["body"])
+    if body.get("Type") == "Notification" and "Message" in body:
+        body = json.loads(body["Message"])
+    if body.get("Event") == "s3:TestEvent":
+        return []
+    if "Records" not in body:
+        raise ValueError("Message is not an S3 event notification")
+    return s3_objects(body)
+
+
+def process_sqs_batch(event: dict, settings: Settings, client=None) -> dict:
+    """Processes all the files of a batch of SQS messages concurrently.
+
+    The files of every message are processed together by the worker pool, limited to
+    ``settings.max_workers`` files at a time, or, with ``settings.coalesce``, as one window
+    per station. A message is reported as failed when any of its files failed, so only
+    those messages are redelivered.
+
+    Args:
+        event (dict): The SQS event.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use.
+
+    Returns:
+        dict: The partial batch response, listing the failed messages in ``batchItemFailures``.
+    """
+    messages = event.get("Records", [])
+
+    sources = []
+    owners = []
+    failures = set()
+    for message in messages:
+        try:
+            objects = message_objects(message)
+        except (KeyError, TypeError, ValueError):
+            LOGGER.exception("Invalid message %s", message.get("messageId"))
+            failures.add(message.get("messageId"))
+            continue
+        sources += objects
+        owners += [message["messageId"]] * len(objects)
+
+    process = process_objects
+    if settings.coalesce:
+        from .coalesce import process_windows  # pylint: disable=import-outside-toplevel
+
+        process = process_windows
+    for owner, result in zip(owners, process(sources, settings, client=client)):
+        if result.error is not None:
+            failures.add(owner)
+
+    if failures:
+        LOGGER.warning("%d of %d message(s) failed", len(failures), len(messages))
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message.get("messageId")}
+            for message in messages
+            if message.get("messageId") in failures
+        ]
+    }
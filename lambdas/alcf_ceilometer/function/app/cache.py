@@ -0,0 +1,259 @@
+"""Content-addressed cache of processed files
+
+Re-uploads and duplicate notifications deliver files already processed. Before running
+ALCF, the input is identified by the SHA-256 of its content, the ALCF version and the
+settings changing the output (:func:`cache_key`). When the same input was processed before,
+the earlier processed files are copied to the keys of the new input, server side, instead
+of being computed again.
+
+Each entry is a small JSON manifest referencing the earlier processed files by key and
+ETag. The copies are conditional on the ETag: a processed file overwritten since, e.g. by
+the processing of its input with other options, makes the entry stale. Entries are
+kept in two tiers: a bounded least recently used directory in the scratch space of the
+container, then the object store, under the cache prefix of the output bucket.
+"""
+
+import functools
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import threading
+from typing import List, Optional
+
+from botocore.exceptions import ClientError
+
+from . import LOGGER, storage
+from .config import Settings
+
+# Size of the blocks read to hash the input files
+_BLOCK_SIZE = 1 << 20
+
+_COUNTS = {"hits": 0, "misses": 0}
+_COUNTS_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def alcf_version() -> str:
+    """Returns the installed ALCF version.
+
+    ``setup.py install`` may leave no metadata that :mod:`importlib.metadata` finds. The
+    version is then the SHA-256 of the sources of the installed package.
+
+    Raises:
+        RuntimeError: If ALCF is not installed.
+    """
+    try:
+        return importlib.metadata.version("alcf")
+    except importlib.metadata.PackageNotFoundError:
+        pass
+
+    spec = importlib.util.find_spec("alcf")
+    if spec is None or not spec.submodule_search_locations:
+        raise RuntimeError("ALCF is not installed, the result cache cannot key its entries")
+    sources = hashlib.sha256()
+    for location in spec.submodule_search_locations:
+        for directory, directories, names in os.walk(location):
+            directories.sort()
+            for name in sorted(names):
+                if name.endswith(".py"):
+                    path = os.path.join(directory, name)
+                    sources.update(os.path.relpath(path, location).encode())
+                    with open(path, "rb") as handler:
+                        sources.update(handler.read())
+    return f"sha256:{sources.hexdigest()}"
+
+
+def cache_key(path: str, settings: Settings, options: Optional[dict] = None) -> str:
+    """Computes the cache key of an input file.
+
+    Args:
+        path (str): The input file.
+        settings (Settings): The settings of the engine.
+        options (dict, optional): The ALCF options of the file, see
+            :func:`app.ingest.alcf_options`. Defaults to those of the settings.
+
+    Returns:
+        str: The key, a SHA-256 of the content of the file, the ALCF version, the engine, the
+        lidar type and the ALCF options.
+    """
+    content = hashlib.sha256()
+    with open(path, "rb") as handler:
+        for block in iter(lambda: handler.read(_BLOCK_SIZE), b""):
+            content.update(block)
+
+    key = hashlib.sha256()
+    key.update(
+        json.dumps(
+            [
+                content.hexdigest(),
+                alcf_version(),
+                settings.engine,
+                settings.lidar_type,
+                settings.alcf_options if options is None else options,
+            ],
+            sort_keys=True,
+        ).encode()
+    )
+    return key.hexdigest()
+
+
+def _local_path(key: str, settings: Settings) -> str:
+    """Returns the path of an entry of the local tier"""
+    return os.path.join(settings.work_dir, "alcf-cache", f"{key}.json")
+
+
+def _read_local(key: str, settings: Settings) -> Optional[dict]:
+    """Reads an entry of the local tier, marking it as recently used"""
+    path = _local_path(key, settings)
+    try:
+        with open(path) as handler:
+            entry = json.load(handler)
+        os.utime(path)
+        return entry
+    except (OSError, ValueError):
+        return None
+
+
+def _write_local(key: str, entry: dict, settings: Settings):
+    """Writes an entry to the local tier, evicting the least recently used entries"""
+    path = _local_path(key, settings)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with open(f"{path}.{threading.get_ident()}", "w") as handler:
+        json.dump(entry, handler)
+    os.replace(f"{path}.{threading.get_ident()}", path)
+
+    entries = [os.path.join(directory, name) for name in os.listdir(directory)]
+    if len(entries) > settings.cache_entries:
+        entries.sort(key=lambda name: os.stat(name).st_mtime if os.path.exists(name) else 0)
+        for name in entries[: len(entries) - settings.cache_entries]:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+
+def _read_remote(key: str, bucket: str, settings: Settings, client) -> Optional[dict]:
+    """Reads an entry of the object store tier"""
+    try:
+        response = client.get_object(Bucket=bucket, Key=f"{settings.cache_prefix}{key}.json")
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(response["Body"].read())
+
+
+def lookup(key: str, bucket: str, settings: Settings, client=None) -> Optional[dict]:
+    """Looks up an entry in the local tier, then in the object store.
+
+    Args:
+        key (str): The cache key, see :func:`cache_key`.
+        bucket (str): The bucket of the object store tier.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use.
+
+    Returns:
+        dict: The entry, ``{"outputs": {filename: [bucket, key, etag]}, "profiles": n}``, or
+        None on a miss.
+    """
+    entry = _read_local(key, settings)
+    if entry is None:
+        entry = _read_remote(key, bucket, settings, client or storage.get_client())
+        if entry is not None:
+            _write_local(key, entry, settings)
+    return entry
+
+
+def store(
+    key: str, outputs: List[tuple], profiles: int, bucket: str, settings: Settings, client=None
+):
+    """Records the processed files of an input in both tiers.
+
+    The ETags of the processed files are read back, so that they are only copied as long as
+    they are not overwritten.
+
+    Args:
+        key (str): The cache key, see :func:`cache_key`.
+        outputs (list): The processed files, as ``(filename, bucket, key)`` tuples.
+        profiles (int): The number of profiles read from the input.
+        bucket (str): The bucket of the object store tier.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use.
+    """
+    client = client or storage.get_client()
+    entry = {
+        "outputs": {
+            filename: [
+                bucket_,
+                key_,
+                client.head_object(Bucket=bucket_, Key=key_)["ETag"],
+            ]
+            for filename, bucket_, key_ in outputs
+        },
+        "profiles": profiles,
+    }
+    client.put_object(
+        Bucket=bucket,
+        Key=f"{settings.cache_prefix}{key}.json",
+        Body=json.dumps(entry).encode(),
+        ContentType="application/json",
+    )
+    _write_local(key, entry, settings)
+
+
+def copy_outputs(entry: dict, targets: dict, client=None) -> bool:
+    """Copies the processed files of a cache entry to new keys, server side.
+
+    Args:
+        entry (dict): The cache entry, see :func:`lookup`.
+        targets (dict): The destination ``(bucket, key)`` of every processed file, by name.
+        client (optional): The S3 client to use.
+
+    Returns:
+        bool: False if a processed file of the entry no longer exists or was overwritten, in
+        which case the entry is stale and the input must be processed again.
+    """
+    client = client or storage.get_client()
+    for filename, (bucket, key, etag) in entry["outputs"].items():
+        target_bucket, target_key = targets[filename]
+        try:
+            if (bucket, key) == (target_bucket, target_key):
+                if client.head_object(Bucket=bucket, Key=key)["ETag"] != etag:
+                    return False
+                continue
+            client.copy_object(
+                Bucket=target_bucket,
+                Key=target_key,
+                CopySource={"Bucket": bucket, "Key": key},
+                CopySourceIfMatch=etag,
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404", "PreconditionFailed"):
+                return False
+            raise
+    return True
+
+
+def count(hit: bool):
+    """Counts a hit or a miss.
+
+    Args:
+        hit (bool): True for a hit, i.e. processed files copied from a cache entry.
+    """
+    with _COUNTS_LOCK:
+        _COUNTS["hits" if hit else "misses"] += 1
+
+
+def log_counts():
+    """Logs the hits and misses of the container since it started"""
+    with _COUNTS_LOCK:
+        counts = dict(_COUNTS)
+    LOGGER.info(
+        "Result cache: %d hit(s), %d miss(es)",
+        counts["hits"],
+        counts["misses"],
+        extra={"cache_hits": counts["hits"], "cache_misses": counts["misses"]},
+    )
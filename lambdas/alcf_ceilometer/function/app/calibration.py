@@ -0,0 +1,290 @@
+"""Vectorized noise removal and calibration, with calibration tables per station
+
+ALCF's default noise removal estimates the background noise of a period from the farthest
+range gate, then corrects the profiles one at a time in a Python loop. Here, the whole
+period is corrected at once (:func:`noise_removal`), with the same result. The noise can
+also be estimated from several far-range gates (``noise_removal_gates``) and over a window
+sliding with every profile (``noise_removal_window``), from cumulative sums along the time.
+
+Calibration coefficients can change in time, e.g. after the instrument is serviced. The
+coefficients of a station are read from a calibration table, a JSON object in the output
+bucket (:func:`periods`), and applied profile by profile (:func:`calibration`). Tables are
+kept by the container for :data:`TABLE_TTL` seconds: warm invocations do not read them
+again.
+"""
+
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import aquarius_time as aq
+import pst
+from alcf import misc
+from alcf.lidars import LIDARS
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
+
+from . import storage
+
+LOGGER = Logger(child=True)
+
+#: Time a calibration table is kept by the container before being read again (s).
+TABLE_TTL = 900.0
+
+# Calibration files already read by the container, per path
+_CALIBRATION_FILES = {}
+
+# Calibration tables read by the container, per bucket and key: time read and periods
+_TABLES: Dict[Tuple[str, str], Tuple[float, List[Tuple[float, float]]]] = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def relative_coeff(lidar_type: str, calibration_coeff: float) -> float:
+    """Returns a calibration coefficient of ``alcf calibrate`` relative to the lidar's"""
+    return calibration_coeff / LIDARS[lidar_type].CALIBRATION_COEFF
+
+
+def calibration_coeff(lidar_type: str, calibration_file: Optional[str]) -> float:
+    """Returns the calibration coefficient of a calibration file, relative to the lidar's.
+
+    Calibration files are read once per container.
+
+    Args:
+        lidar_type (str): The ALCF lidar type.
+        calibration_file (str, optional): The calibration file written by ``alcf calibrate``.
+
+    Returns:
+        float: The coefficient, 1 if there is no calibration file.
+    """
+    if calibration_file is None:
+        return 1.0
+    if calibration_file not in _CALIBRATION_FILES:
+        with open(calibration_file, "rb") as handler:
+            _CALIBRATION_FILES[calibration_file] = pst.decode(handler.read())
+    return relative_coeff(lidar_type, _CALIBRATION_FILES[calibration_file][b"calibration_coeff"])
+
+
+def table_key(prefix: str, station: str) -> str:
+    """Returns the key of the calibration table of a station"""
+    return f"{prefix}{station}.json"
+
+
+def parse_table(content: bytes) -> List[Tuple[float, float]]:
+    """Parses a calibration table.
+
+    A table lists the calibration periods of a station, each starting at ``start`` (ISO
+    8601, UTC) and lasting until the next one, with the coefficient written by
+    ``alcf calibrate``::
+
+        {"periods": [{"start": "2021-03-01T00:00:00", "calibration_coeff": 3.1e-5}, ...]}
+
+    Args:
+        content (bytes): The JSON table.
+
+    Returns:
+        list: The start (Julian date) and coefficient of the periods, sorted by start.
+    """
+    table = json.loads(content)
+    return sorted(
+        (aq.from_iso(period["start"]), float(period["calibration_coeff"]))
+        for period in table["periods"]
+    )
+
+
+def periods(bucket: str, prefix: str, station: str, client=None) -> List[Tuple[float, float]]:
+    """Returns the calibration periods of a station, from the cache of the container.
+
+    Args:
+        bucket (str): The bucket of the calibration tables.
+        prefix (str): The key prefix of the calibration tables.
+        station (str): The station, the first directory of the keys of the input files.
+        client (optional): The S3 client to use.
+
+    Returns:
+        list: The periods, see :func:`parse_table`, empty if the station has no table.
+    """
+    key = (bucket, table_key(prefix, station))
+    now = time.monotonic()
+    with _TABLES_LOCK:
+        if key in _TABLES and now - _TABLES[key][0] < TABLE_TTL:
+            return _TABLES[key][1]
+
+    client = client or storage.get_client()
+    try:
+        response = client.get_object(Bucket=bucket, Key=key[1])
+        table = parse_table(response["Body"].read())
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        table = []
+    LOGGER.debug("Read the calibration table of %s: %d period(s)", station, len(table))
+
+    with _TABLES_LOCK:
+        _TABLES[key] = (now, table)
+    return table
+
+
+def coefficients(
+    t: np.ndarray,
+    calibration_coeff: float = 1.0,
+    calibration_periods: Optional[List[Tuple[float, float]]] = None,
+) -> np.ndarray:
+    """Returns the calibration coefficient of every profile.
+
+    Args:
+        t (np.ndarray): Time of the profiles (Julian date).
+        calibration_coeff (float, optional): Coefficient of the profiles before the first
+            period.
+        calibration_periods (list, optional): Start and coefficient of the periods.
+
+    Returns:
+        np.ndarray: The coefficients, shape (time,).
+    """
+    coeff = np.full(len(t), calibration_coeff, np.float64)
+    if calibration_periods:
+        starts, values = np.array(calibration_periods, np.float64).T
+        period = np.searchsorted(starts, t, side="right") - 1
+        coeff[period >= 0] = values[period[period >= 0]]
+    return coeff
+
+
+def calibration(
+    d: dict,
+    calibration_coeff: float = 1.0,
+    calibration_periods: Optional[List[Tuple[float, float]]] = None,
+    **options,
+):
+    """Calibrates a dataset, as ALCF's default calibration with coefficients per period.
+
+    Args:
+        d (dict): The dataset.
+        calibration_coeff (float, optional): Coefficient, relative to the lidar's.
+        calibration_periods (list, optional): Start (Julian date) and coefficient, relative
+            to the lidar's, of the calibration periods of the station.
+    """
+    coeff = (
+        coefficients(d["time"], calibration_coeff, calibration_periods)
+        if calibration_periods
+        else None
+    )
+    for name in ("backscatter", "backscatter_mol", "backscatter_sd"):
+        if name in d:
+            x = d[name]
+            if coeff is None:
+                # A scalar as in ALCF, keeping its rounding on single precision data
+                x *= calibration_coeff
+            else:
+                x *= np.reshape(coeff, (-1,) + (1,) * (x.ndim - 1))
+
+
+def background(
+    b: np.ndarray,
+    t: np.ndarray,
+    w: np.ndarray,
+    gates: int = 1,
+    window: Optional[float] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Estimates the background noise from the far-range gates.
+
+    The noise is the mean and standard deviation of the last ``gates`` gates, weighted by
+    the duration of the profiles, as ``np.average`` and ``np.cov``. Without ``window``, one
+    estimate covers all the profiles, as in ALCF. Otherwise, every profile has its own,
+    over the profiles within half the window of it.
+
+    Args:
+        b (np.ndarray): Backscatter, shape (time, range).
+        t (np.ndarray): Time of the profiles (days), sorted.
+        w (np.ndarray): Duration of the profiles.
+        gates (int, optional): Number of far-range gates.
+        window (float, optional): Duration of the sliding window (days).
+
+    Returns:
+        tuple: The mean and standard deviation, scalars or of shape (time,).
+    """
+    far = b[:, -gates:]
+    if window is None:
+        samples = far.ravel()
+        weights = np.repeat(w, far.shape[1])
+        mean = np.average(samples, weights=weights)
+        sd = np.sqrt(np.cov(samples, aweights=weights)) if len(samples) > 1 else 0.0
+        return mean, sd
+
+    # Sums over the windows, from cumulative sums of deviations to the overall mean
+    offset = np.mean(far)
+    x = far - offset
+    sums = np.zeros((len(t) + 1, 4), np.float64)
+    sums[1:, 0] = w * far.shape[1]
+    sums[1:, 1] = w * x.sum(axis=1)
+    sums[1:, 2] = w * (x * x).sum(axis=1)
+    sums[1:, 3] = w * w * far.shape[1]
+    np.cumsum(sums, axis=0, out=sums)
+    first = np.searchsorted(t, t - 0.5 * window, side="left")
+    last = np.searchsorted(t, t + 0.5 * window, side="right")
+    s0, s1, s2, s3 = (sums[last] - sums[first]).T
+
+    mean = s1 / s0
+    # Unbiased weighted variance, as np.cov with aweights
+    norm = s0 - s3 / s0
+    variance = np.divide(s2 - s1 * mean, norm, out=np.zeros_like(norm), where=norm > 0)
+    return mean + offset, np.sqrt(np.maximum(variance, 0.0))
+
+
+def noise_removal(
+    d: dict,
+    noise_removal_gates: int = 1,
+    noise_removal_window: Optional[float] = None,
+    **options,
+):
+    """Removes the background noise of a dataset, as ALCF's default noise removal.
+
+    The noise estimated by :func:`background` is scaled by the square of the range and
+    subtracted from the backscatter, and its standard deviation, scaled likewise, is
+    stored as ``backscatter_sd``.
+
+    Args:
+        d (dict): The dataset, with ``backscatter``, ``zfull`` and ``time_bnds``.
+        noise_removal_gates (int, optional): Number of far-range gates of the estimate.
+        noise_removal_window (float, optional): Duration of the sliding window (s), the
+            whole dataset if unset.
+    """
+    b = d["backscatter"]
+    zfull = d["zfull"]
+    w = d["time_bnds"][:, 1] - d["time_bnds"][:, 0]
+    mean, sd = background(
+        b,
+        d["time"],
+        w,
+        gates=noise_removal_gates,
+        window=None if noise_removal_window is None else noise_removal_window / 86400.0,
+    )
+    # Range correction, of one row when the profiles share their range gates
+    if np.all(zfull[1:] == zfull[0]):
+        zfull = zfull[:1]
+    c = (1.0 * zfull / zfull[:, -1:]) ** 2
+    # Scalars as in ALCF, keeping its precision on single precision data
+    if np.ndim(mean) > 0:
+        mean, sd = mean[:, np.newaxis], sd[:, np.newaxis]
+    d["backscatter"] = np.asarray(b - mean * c, np.float64)
+    d["backscatter_sd"] = np.array(np.broadcast_to(sd * c, b.shape), np.float64)
+    d["."]["backscatter_sd"] = {
+        ".dims": ["time", "range"],
+        "long_name": "total attenuated volume backscattering coefficient standard deviation",
+        "units": "m-1 sr-1",
+    }
+
+
+def noise_removal_stream(
+    dd: list, state: dict, noise_removal_sampling: float = 300, **options
+) -> list:
+    """Streams datasets through :func:`noise_removal` by periods of ``noise_removal_sampling``
+    seconds, as ``alcf.algorithms.noise_removal.default.stream``"""
+    state["aggregate_state"] = state.get("aggregate_state", {})
+    dd = misc.aggregate(dd, state["aggregate_state"], noise_removal_sampling / 86400.0)
+    return misc.stream(dd, state, noise_removal, **options)
+
+
+def calibration_stream(dd: list, state: dict, **options) -> list:
+    """Streams datasets through :func:`calibration`"""
+    return misc.stream(dd, state, calibration, **options)
@@ -0,0 +1,132 @@
+"""Time-chunked processing of large Lufft CHM15k NetCDF files
+
+A daily CHM15k file holding full resolution ``beta_raw`` can be larger than the memory of
+the function. Instead of reading it whole, the file is read ``chunk_size`` profiles at a
+time and every chunk is streamed through the ALCF chain, whose steps keep only what they
+need across chunks (a noise removal period of raw profiles, then resampled profiles). The
+processed datasets are written as soon as their output period is complete.
+
+Peak memory thus depends on the chunk size, not on the size of the file.
+"""
+
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+from netCDF4 import Dataset
+from alcf import misc
+from alcf.lidars import META, chm15k
+from aws_lambda_powertools import Logger
+
+from . import engine, instrumentation
+
+LOGGER = Logger(child=True)
+
+#: Lidar types that can be processed in chunks.
+CHUNKED_TYPES = ("chm15k",)
+
+# CHM15k time is in seconds since 1904-01-01 00:00 UTC
+_CHM15K_EPOCH = 2416480.5
+
+
+def _read_slice(variable, start: int, end: int) -> np.ndarray:
+    """Reads a slice of a NetCDF variable as float64, NaN where masked"""
+    values = variable[start:end]
+    return np.ma.filled(np.ma.asarray(values, np.float64), np.nan)
+
+
+def read_chm15k_chunks(
+    path: str,
+    chunk_size: int,
+    altitude: Optional[float] = None,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    **kwargs,
+) -> Iterator[dict]:
+    """Reads a CHM15k file in chunks of profiles.
+
+    Every chunk is the dataset ``alcf.lidars.chm15k.read`` returns for those profiles.
+    Time bounds are computed over the whole file, so chunk edges get the same bounds as a
+    whole file read.
+
+    Args:
+        path (str): The CHM15k NetCDF file.
+        chunk_size (int): Number of profiles per chunk.
+        altitude (float, optional): Altitude of the instrument (m). Defaults to the file's.
+        lon (float, optional): Longitude of the instrument (degrees East).
+        lat (float, optional): Latitude of the instrument (degrees North).
+
+    Yields:
+        dict: The dataset of each chunk.
+    """
+    with Dataset(path) as handler:
+        variables = handler.variables
+        time = variables["time"][:].astype(np.float64) / (24.0 * 60.0 * 60.0) + _CHM15K_EPOCH
+        time_bnds = misc.time_bnds(time, time[1] - time[0])
+        if altitude is None:
+            altitude = float(np.ma.filled(variables["altitude"][:], np.nan).ravel()[0])
+        zfull1 = _read_slice(variables["range"], 0, None) + altitude
+
+        for start in range(0, len(time), chunk_size):
+            end = min(start + chunk_size, len(time))
+            n = end - start
+            yield {
+                "time": time[start:end].copy(),
+                "time_bnds": time_bnds[start:end].copy(),
+                "backscatter": _read_slice(variables["beta_raw"], start, end)
+                * 1e-11
+                * chm15k.CALIBRATION_COEFF,
+                "zfull": np.tile(zfull1, (n, 1)),
+                "altitude": np.full(n, altitude, np.float64),
+                "lon": np.full(n, lon, np.float64),
+                "lat": np.full(n, lat, np.float64),
+                ".": {var: META[var] for var in engine.VARIABLES if var in META},
+            }
+
+
+def run(
+    lidar_type: str, input_path: str, work_dir: str, options: dict, chunk_size: int
+) -> engine.Output:
+    """Runs the ALCF chain on a file, ``chunk_size`` profiles at a time.
+
+    Same contract as :func:`app.engine.run`.
+
+    Args:
+        lidar_type (str): The ALCF lidar type of the file, one of :data:`CHUNKED_TYPES`.
+        input_path (str): The file to process.
+        work_dir (str): An empty directory for the output files.
+        options (dict): The options of ``alcf lidar``.
+        chunk_size (int): Number of profiles per chunk.
+
+    Returns:
+        engine.Output: The paths of the processed files and the number of profiles read.
+    """
+    if lidar_type not in CHUNKED_TYPES:
+        raise ValueError(f"Chunked processing is not supported for {lidar_type}")
+
+    read_options, options = engine.split_options(options)
+
+    output_dir = os.path.join(work_dir, "lidar")
+    os.makedirs(output_dir, exist_ok=True)
+
+    state = {}
+    paths = []
+    chunks = 0
+    profiles = 0
+    reader = read_chm15k_chunks(input_path, chunk_size, **read_options)
+    while True:
+        with instrumentation.stage("decode"):
+            d = next(reader, None)
+        if d is not None:
+            chunks += 1
+            profiles += len(d["time"])
+        # The last call, with None, flushes the datasets still held by the chain
+        with instrumentation.stage("lidar"):
+            dd = engine.stream([d], state, lidar_type, **options)
+        with instrumentation.stage("write"):
+            paths += [engine.write(x, output_dir) for x in dd]
+        if d is None:
+            break
+
+    LOGGER.debug("Processed %s in %d chunk(s)", input_path, chunks)
+    return engine.Output(paths, profiles)
@@ -0,0 +1,211 @@
+"""Vectorized cloud detection and cloud base detection
+
+The default ``cloud_detection`` and ``cloud_base_detection`` steps of ``alcf lidar``,
+computed on whole time × range arrays: ALCF finds the cloud base of every profile in a
+Python loop. Here, the cloud layers of all the profiles are found at once, as runs of
+cloudy gates along the range, from which the bases and tops of the first
+:data:`CLOUD_LAYERS` layers are taken.
+
+Besides the variables of ALCF, ``cloud_mask`` and ``cbh`` (the first cloud base), the
+processed files hold the base and top of each layer, ``cloud_layer_base`` and
+``cloud_layer_top``. Runs shorter than ``cloud_min_gates`` gates can be removed from the
+cloud mask as noise; with the default of 1, the cloud mask is ALCF's.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+from alcf import misc
+
+#: Number of cloud layers whose base and top are kept.
+CLOUD_LAYERS = 3
+
+
+def cloud_mask(
+    b: np.ndarray,
+    bsd: Optional[np.ndarray] = None,
+    bmol: Optional[np.ndarray] = None,
+    cloud_threshold: float = 2e-6,
+    cloud_nsd: float = 5,
+) -> np.ndarray:
+    """Thresholds backscatter into a cloud mask, as ALCF's default cloud detection.
+
+    A sample is cloudy when its backscatter, less ``cloud_nsd`` standard deviations of its
+    noise and the molecular backscatter, reaches ``cloud_threshold``.
+
+    Args:
+        b (np.ndarray): Backscatter, shape (time, range[, column]) (m-1.sr-1).
+        bsd (np.ndarray, optional): Standard deviation of the noise, same shape.
+        bmol (np.ndarray, optional): Molecular backscatter, shape (time, range).
+        cloud_threshold (float, optional): Threshold (m-1.sr-1).
+        cloud_nsd (float, optional): Number of standard deviations of the noise.
+
+    Returns:
+        np.ndarray: The cloud mask, of ``np.byte``.
+    """
+    if bsd is not None:
+        x = cloud_nsd * np.asarray(bsd, np.float64)
+        np.subtract(b, x, out=x)
+    else:
+        x = np.array(b, np.float64)
+    if bmol is not None:
+        bmol = np.asarray(bmol)
+        x -= bmol[..., np.newaxis] if x.ndim == 3 else bmol
+    return np.greater_equal(x, cloud_threshold).view(np.byte)
+
+
+def _profiles(x: np.ndarray) -> np.ndarray:
+    """Returns a (time, range[, column]) array as (profiles, range)"""
+    return np.moveaxis(x, 1, -1).reshape(-1, x.shape[1])
+
+
+def runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Finds the runs of cloudy gates of profiles.
+
+    Args:
+        mask (np.ndarray): Cloud mask, shape (profiles, range).
+
+    Returns:
+        tuple: The profile, first gate and gate after the last of every run, by profile and
+        by range.
+    """
+    n, m = mask.shape
+    padded = np.zeros((n, m + 2), bool)
+    padded[:, 1:-1] = mask
+    # Every profile starts and ends clear: its changes alternate between starts and ends
+    changes = np.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    rows, starts = np.divmod(changes[0::2], m + 1)
+    ends = changes[1::2] % (m + 1)
+    return rows, starts, ends
+
+
+def filter_noise(mask: np.ndarray, min_gates: int) -> np.ndarray:
+    """Removes the runs of cloudy gates shorter than ``min_gates`` from a cloud mask.
+
+    Args:
+        mask (np.ndarray): Cloud mask, shape (time, range[, column]).
+        min_gates (int): Minimum number of consecutive cloudy gates of a layer.
+
+    Returns:
+        np.ndarray: The filtered cloud mask.
+    """
+    if min_gates <= 1:
+        return mask
+    profiles = _profiles(mask)
+    rows, starts, ends = runs(profiles)
+    short = ends - starts < min_gates
+
+    # +1 at the start and -1 after the end of every short run, summed along the range
+    delta = np.zeros((profiles.shape[0], profiles.shape[1] + 1), np.int32)
+    np.add.at(delta, (rows[short], starts[short]), 1)
+    np.add.at(delta, (rows[short], ends[short]), -1)
+    noise = np.cumsum(delta, axis=1)[:, :-1] > 0
+
+    filtered = np.where(noise, 0, profiles).astype(mask.dtype)
+    shape = np.moveaxis(mask, 1, -1).shape
+    return np.moveaxis(filtered.reshape(shape), -1, 1)
+
+
+def find_layers(
+    mask: np.ndarray, zfull: np.ndarray, layers: int = CLOUD_LAYERS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the base and top heights of the lowest cloud layers of profiles.
+
+    Args:
+        mask (np.ndarray): Cloud mask, shape (time, range[, column]).
+        zfull (np.ndarray): Height of the range gates (m), shape (range,).
+        layers (int, optional): Number of layers.
+
+    Returns:
+        tuple: The bases and tops (m), shape (time[, column], layers), ``inf`` where a
+        profile has fewer layers.
+    """
+    profiles = _profiles(mask)
+    rows, starts, ends = runs(profiles)
+    # Rank of each run in its profile: runs are sorted by profile, then by range
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < layers
+
+    base = np.full((profiles.shape[0], layers), np.inf)
+    top = np.full((profiles.shape[0], layers), np.inf)
+    base[rows[keep], rank[keep]] = zfull[starts[keep]]
+    top[rows[keep], rank[keep]] = zfull[ends[keep] - 1]
+
+    shape = np.moveaxis(mask, 1, -1).shape[:-1] + (layers,)
+    return base.reshape(shape), top.reshape(shape)
+
+
+def cloud_detection(
+    d: dict,
+    cloud_threshold: float = 2e-6,
+    cloud_nsd: float = 5,
+    cloud_min_gates: int = 1,
+    **options,
+):
+    """Adds the cloud mask to a dataset, as ALCF's default cloud detection.
+
+    Args:
+        d (dict): The dataset, with ``backscatter`` and optionally ``backscatter_sd`` and
+            ``backscatter_mol``.
+        cloud_threshold (float, optional): Threshold (m-1.sr-1).
+        cloud_nsd (float, optional): Number of standard deviations of the noise.
+        cloud_min_gates (int, optional): Minimum number of consecutive cloudy gates, the
+            shorter runs being noise.
+    """
+    mask = cloud_mask(
+        d["backscatter"],
+        d.get("backscatter_sd"),
+        d.get("backscatter_mol"),
+        cloud_threshold=cloud_threshold,
+        cloud_nsd=cloud_nsd,
+    )
+    d["cloud_mask"] = filter_noise(mask, cloud_min_gates)
+    d["."]["cloud_mask"] = {
+        ".dims": d["."]["backscatter"][".dims"],
+        "long_name": "cloud mask",
+        "units": "1",
+    }
+
+
+def cloud_base_detection(d: dict, cloud_layers: int = CLOUD_LAYERS, **options):
+    """Adds the cloud base height and cloud layers to a dataset.
+
+    ``cbh`` is the first cloud base, as ALCF's default cloud base detection.
+
+    Args:
+        d (dict): The dataset, with ``cloud_mask`` and ``zfull`` (levels).
+        cloud_layers (int, optional): Number of cloud layers.
+    """
+    mask = d["cloud_mask"]
+    zfull = np.asarray(d["zfull"], np.float64)
+    base, top = find_layers(mask, zfull, cloud_layers)
+
+    dims = ["time", "column"] if mask.ndim == 3 else ["time"]
+    d["cbh"] = base[..., 0]
+    d["."]["cbh"] = {
+        ".dims": dims,
+        "long_name": "cloud base height",
+        "units": "m",
+    }
+    d["cloud_layer_base"] = base
+    d["."]["cloud_layer_base"] = {
+        ".dims": dims + ["cloud_layer"],
+        "long_name": "cloud layer base height",
+        "units": "m",
+    }
+    d["cloud_layer_top"] = top
+    d["."]["cloud_layer_top"] = {
+        ".dims": dims + ["cloud_layer"],
+        "long_name": "cloud layer top height",
+        "units": "m",
+    }
+
+
+def detection_stream(dd: list, state: dict, **options) -> list:
+    """Streams datasets through :func:`cloud_detection`"""
+    return misc.stream(dd, state, cloud_detection, **options)
+
+
+def base_detection_stream(dd: list, state: dict, **options) -> list:
+    """Streams datasets through :func:`cloud_base_detection`"""
+    return misc.stream(dd, state, cloud_base_detection, **options)
@@ -0,0 +1,315 @@
+"""Coalescing of the small files of a station into one time series
+
+Some stations push a file every minute or two. Processed one by one, the fixed cost of each
+file, setting up the ALCF chain, writing its outputs and uploading them, dominates. In
+coalescing mode (``COALESCE``), the queue buffers the notifications until its batching
+window closes, on ``batch_size`` messages or ``max_batching_window`` seconds, and the files
+of each station in the batch, a window, are processed as one series: read, sorted and
+concatenated in time, run through a single chain, as ``alcf lidar`` does for a directory,
+and written once.
+
+The processed files of a window are stored under
+``<output_prefix><path>/<first name>--<last name>/``. Coalescing requires the ``inprocess``
+engine, and windows bypass the result cache.
+"""
+
+import os
+import posixpath
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+import ds_format as ds
+from aws_lambda_powertools import Logger
+
+from . import compressed, engine, instrumentation, storage
+from .config import Settings
+from .ingest import (
+    Result,
+    S3Object,
+    alcf_options,
+    input_stem,
+    process_objects,
+    station_of,
+    upload_outputs,
+)
+from .processing import LOCK, RAW_TYPES
+
+LOGGER = Logger(child=True)
+
+
+def windows(sources: List[S3Object]) -> Dict[tuple, List[S3Object]]:
+    """Groups objects by station.
+
+    Args:
+        sources (list): The objects of a batch, possibly repeated.
+
+    Returns:
+        dict: The distinct objects of every ``(bucket, station)``, sorted by key.
+    """
+    groups = OrderedDict()
+    for source in sources:
+        station = (source.bucket, station_of(source.key))
+        group = groups.setdefault(station, {})
+        group.setdefault(source.key, source)
+    return OrderedDict(
+        (station, [group[key] for key in sorted(group)]) for station, group in groups.items()
+    )
+
+
+def window_key(sources: List[S3Object], filename: str, settings: Settings) -> str:
+    """Builds the key of a processed file of a window.
+
+    Args:
+        sources (list): The objects of the window, sorted by key.
+        filename (str): The name of the processed file.
+        settings (Settings): The settings of the engine.
+
+    Returns:
+        str: The key, ``<output_prefix><path>/<first name>--<last name>/<filename>``.
+    """
+    first, last = (input_stem(source.key) for source in (sources[0], sources[-1]))
+    return settings.output_prefix + posixpath.join(
+        posixpath.dirname(sources[0].key), f"{first}--{last}", filename
+    )
+
+
+def concatenate(dd: List[dict]) -> List[dict]:
+    """Concatenates datasets in time.
+
+    Steps of the chain such as the output sampling have a cost per dataset, whatever its
+    length: the datasets are merged into as few as possible. Consecutive datasets with the
+    same range gates are merged, in time order.
+
+    Args:
+        dd (list): The datasets, as returned by :func:`app.engine.read`.
+
+    Returns:
+        list: The merged datasets, in time order.
+    """
+    runs = []
+    for d in sorted(dd, key=lambda d: d["time"][0]):
+        if runs and runs[-1][-1]["backscatter"].shape[1:] == d["backscatter"].shape[1:]:
+            runs[-1].append(d)
+        else:
+            runs.append([d])
+
+    merged = []
+    for run in runs:
+        d = ds.merge(run, "time") if len(run) > 1 else run[0]
+        if np.any(np.diff(d["time"]) < 0):
+            ds.select(d, {"time": np.argsort(d["time"], kind="stable")})
+        merged.append(d)
+    return merged
+
+
+def process_series(dd: List[dict], lidar_type: str, output_dir: str, options: dict) -> List[str]:
+    """Processes datasets as one time series.
+
+    Args:
+        dd (list): The datasets, as returned by :func:`app.engine.read`.
+        lidar_type (str): The ALCF lidar type.
+        output_dir (str): The output directory.
+        options (dict): The processing options of :func:`app.engine.stream`.
+
+    Returns:
+        list: The paths of the processed files.
+    """
+    with LOCK:
+        with instrumentation.stage("lidar"):
+            outputs = engine.stream(concatenate(dd) + [None], {}, lidar_type, **options)
+        with instrumentation.stage("write"):
+            return [engine.write(x, output_dir) for x in outputs]
+
+
+def run(lidar_type: str, input_paths: List[str], work_dir: str, options: dict) -> engine.Output:
+    """Runs the ALCF chain on files as one time series.
+
+    Args:
+        lidar_type (str): The ALCF lidar type of the files.
+        input_paths (list): The files to process.
+        work_dir (str): An empty directory for the output files.
+        options (dict): The options of ``alcf lidar``.
+
+    Returns:
+        Output: The paths of the processed files and the number of profiles read.
+    """
+    read_options, options = engine.split_options(options)
+    with LOCK, instrumentation.stage("decode"):
+        dd = [engine.read(lidar_type, path, **read_options) for path in input_paths]
+
+    output_dir = os.path.join(work_dir, "lidar")
+    os.makedirs(output_dir, exist_ok=True)
+    return engine.Output(
+        process_series(dd, lidar_type, output_dir, options), sum(len(d["time"]) for d in dd)
+    )
+
+
+def _read_source(
+    source: S3Object, path: str, settings: Settings, read_options: dict, client
+) -> dict:
+    """Reads an input of a window.
+
+    Raw Vaisala files are decoded straight from memory, decompressed first when they are
+    compressed; the other files are downloaded to ``path`` for the ALCF driver of their
+    lidar type.
+    """
+    recorder = instrumentation.current()
+    if settings.lidar_type in RAW_TYPES and not source.key.lower().endswith(".nc"):
+        with instrumentation.stage("download"):
+            data = storage.read(source.bucket, source.key, client=client)
+            recorder.bytes_in += len(data)
+        with LOCK, instrumentation.stage("decode"):
+            name = source.key
+            if compressed.compression(source.key):
+                # The files of a window are small: each is decompressed whole
+                pieces = list(compressed.decompress([bytes(data)], source.key))
+                name = pieces[0][0] if pieces else compressed.uncompressed_name(source.key)
+                data = b"".join(piece for _, piece in pieces)
+            return engine.decode_raw(settings.lidar_type, data, name, **read_options)
+
+    with instrumentation.stage("download"):
+        recorder.bytes_in += storage.download(source.bucket, source.key, path, client=client)
+    with LOCK, instrumentation.stage("decode"):
+        return engine.read(settings.lidar_type, path, **read_options)
+
+
+def process_window(sources: List[S3Object], settings: Settings, client=None) -> List[Result]:
+    """Downloads, processes and uploads the files of a station as one time series.
+
+    A file that cannot be downloaded or read fails alone, the others are processed without
+    it.
+
+    Args:
+        sources (list): The objects of the window, of one station, sorted by key.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use.
+
+    Returns:
+        list: The results, in the order of ``sources``. The files of the window share
+        their outputs.
+    """
+    output_bucket = settings.output_bucket or sources[0].bucket
+    read_options, options = engine.split_options(
+        alcf_options(station_of(sources[0].key), output_bucket, settings, client=client)
+    )
+    recorder = instrumentation.current()
+
+    failures = {}
+    dd = []
+    profiles = {}
+    with tempfile.TemporaryDirectory(dir=settings.work_dir) as work_dir:
+        for i, source in enumerate(sources):
+            input_path = os.path.join(work_dir, f"{i}-{posixpath.basename(source.key)}")
+            try:
+                d = _read_source(source, input_path, settings, read_options, client)
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.exception("Failed to read s3://%s/%s", source.bucket, source.key)
+                failures[source] = Result(source, [], error=str(error))
+                continue
+            finally:
+                if os.path.exists(input_path):
+                    os.remove(input_path)
+            dd.append(d)
+            profiles[source] = len(d["time"])
+
+        outputs = []
+        read_sources = [source for source in sources if source in profiles]
+        if read_sources:
+            output_dir = os.path.join(work_dir, "lidar")
+            os.makedirs(output_dir)
+            paths = process_series(dd, settings.lidar_type, output_dir, options)
+            del dd
+
+            outputs = [
+                window_key(read_sources, os.path.basename(path), settings) for path in paths
+            ]
+            upload_outputs(
+                paths,
+                outputs,
+                station_of(read_sources[0].key),
+                output_bucket,
+                settings,
+                client=client,
+            )
+
+    recorder.profiles += sum(profiles.values())
+    return [
+        failures.get(source) or Result(source, outputs, profiles=profiles[source])
+        for source in sources
+    ]
+
+
+def _process_window_safely(sources: List[S3Object], settings: Settings, client) -> List[Result]:
+    """Processes a window, turning any failure into failed results of all its files"""
+    with instrumentation.record() as recorder:
+        try:
+            results = process_window(sources, settings, client=client)
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.exception(
+                "Failed to process the window of %d file(s) of s3://%s/%s",
+                len(sources),
+                sources[0].bucket,
+                posixpath.dirname(sources[0].key),
+            )
+            results = [Result(source, [], error=str(error)) for source in sources]
+        instrumentation.publish(recorder)
+
+    processed = [result for result in results if result.error is None]
+    if len(processed) < len(results):
+        LOGGER.error(
+            "Failed to process %d of the %d file(s) of the window of s3://%s/%s",
+            len(results) - len(processed),
+            len(results),
+            sources[0].bucket,
+            posixpath.dirname(sources[0].key),
+        )
+    if processed:
+        LOGGER.info(
+            "Processed a window of %d file(s) of s3://%s/%s into %d file(s)",
+            len(processed),
+            sources[0].bucket,
+            posixpath.dirname(sources[0].key),
+            len(processed[0].outputs),
+        )
+    return results
+
+
+def process_windows(sources: List[S3Object], settings: Settings, client=None) -> List[Result]:
+    """Processes the objects of a batch, the files of each station as one window.
+
+    Same contract as :func:`app.ingest.process_objects`, which processes the files instead
+    when the engine is not ``inprocess``. The windows of the stations are processed by a
+    bounded pool of workers, overlapping their S3 transfers only: their decoding, ALCF
+    processing and NetCDF reads and writes hold :data:`app.processing.LOCK`.
+
+    Args:
+        sources (list): The objects to process.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use. Defaults to the shared client.
+
+    Returns:
+        list: The results, in the order of ``sources``.
+    """
+    if settings.engine != "inprocess":
+        LOGGER.warning("Coalescing requires the inprocess engine, processing files one by one")
+        return process_objects(sources, settings, client=client)
+    if not sources:
+        return []
+
+    client = client or storage.get_client()
+    groups = list(windows(sources).values())
+    workers = max(1, min(settings.max_workers, len(groups)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        window_results = list(
+            executor.map(lambda group: _process_window_safely(group, settings, client), groups)
+        )
+
+    results = {
+        (result.source.bucket, result.source.key): result
+        for group_results in window_results
+        for result in group_results
+    }
+    return [results[(source.bucket, source.key)] for source in sources]
@@ -0,0 +1,409 @@
+"""Streaming decompression of compressed raw Vaisala CL31/CL51 files
+
+Stations often deliver their raw files gzip, bzip2 or zip compressed, and a daily archive
+can be larger than the ephemeral storage of the function once uncompressed. Such a file is
+never staged: its object is read from S3 in chunks (:func:`app.storage.stream`),
+decompressed on the fly (:func:`decompress`), cut into blocks of whole messages
+(:func:`message_blocks`), and every block is decoded into a dataset streamed through the
+ALCF chain (:func:`run`). Memory depends on :data:`BLOCK_SIZE`, not on the size of the
+file, and only the processed files are written to the work directory.
+
+Zip archives are read member by member from their local headers, as the bytes arrive:
+their members must be deflated, or stored with their sizes in the local header.
+"""
+
+import bz2
+import os
+import posixpath
+import re
+import struct
+import zlib
+from typing import Iterable, Iterator, Optional, Tuple
+
+from aws_lambda_powertools import Logger
+
+from . import instrumentation, storage
+from .processing import LOCK
+
+LOGGER = Logger(child=True)
+
+#: Compressions of the raw files, by suffix.
+COMPRESSIONS = {".gz": "gzip", ".bz2": "bzip2", ".zip": "zip"}
+
+#: Size of the blocks of uncompressed data decoded at a time (bytes).
+BLOCK_SIZE = 8 * 1024 * 1024
+
+# Start of a data message: its time line, followed by the header line
+_DAT_MESSAGE_START = re.compile(
+    rb"^-?(?:\d{4}-\d\d-\d\d \d\d:\d\d:\d\d|\d+\.?\d*)[ \t]*\r?\n(?:\x01|\xef\xbf\xbd)?CL",
+    re.MULTILINE,
+)
+
+# Message starts are looked for in the end of a block first (bytes)
+_TAIL_SIZE = 256 * 1024
+
+_ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+_ZIP_LOCAL_SIGNATURE = b"PK\x03\x04"
+_ZIP_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+_ZIP_ZIP64_EXTRA = 0x0001
+
+
+def compression(key: str) -> Optional[str]:
+    """Returns the compression of a file from its suffix, None if it is not compressed"""
+    return COMPRESSIONS.get(posixpath.splitext(key)[1].lower())
+
+
+def uncompressed_name(key: str) -> str:
+    """Returns the name of a file without its compression suffix"""
+    name = posixpath.basename(key)
+    return posixpath.splitext(name)[0] if compression(name) else name
+
+
+class _Stream:
+    """Exact size reads from an iterator of chunks of bytes"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size: int) -> bytes:
+        """Reads ``size`` bytes, fewer at the end of the stream"""
+        parts = [self._buffer]
+        available = len(self._buffer)
+        while available < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            available += len(chunk)
+        data = b"".join(parts)
+        self._buffer = data[size:]
+        return data[:size]
+
+    def chunks(self) -> Iterator[bytes]:
+        """Iterates over the rest of the stream, as it comes"""
+        while True:
+            if self._buffer:
+                data, self._buffer = self._buffer, b""
+            else:
+                data = next(self._chunks, None)
+                if data is None:
+                    return
+            yield data
+
+    def unread(self, data: bytes):
+        """Puts bytes back at the start of the stream"""
+        self._buffer = data + self._buffer
+
+
+def _inflate(decompressor, data: bytes) -> Iterator[bytes]:
+    """Feeds data to a zlib decompressor, yielding pieces of at most :data:`BLOCK_SIZE`"""
+    while not decompressor.eof:
+        piece = decompressor.decompress(data, BLOCK_SIZE)
+        if piece:
+            yield piece
+        data = decompressor.unconsumed_tail
+        # A full piece may leave output pending in the decompressor
+        if not data and len(piece) < BLOCK_SIZE:
+            return
+
+
+def _gunzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompresses a gzip stream, of one or more members"""
+    decompressor = None
+    for data in chunks:
+        while data:
+            if decompressor is None:
+                if not data.startswith(b"\x1f\x8b"[: len(data)]):
+                    # Padding after the last member
+                    return
+                decompressor = zlib.decompressobj(wbits=31)
+            yield from _inflate(decompressor, data)
+            data = b""
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = None
+    if decompressor is not None:
+        raise ValueError("Truncated gzip stream")
+
+
+def _bunzip2(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompresses a bzip2 stream, of one or more streams"""
+    decompressor = None
+    for data in chunks:
+        while data or (decompressor is not None and not decompressor.needs_input):
+            if decompressor is None:
+                if not data.startswith(b"BZh"[: len(data)]):
+                    # Padding after the last stream
+                    return
+                decompressor = bz2.BZ2Decompressor()
+            piece = decompressor.decompress(data, BLOCK_SIZE)
+            data = b""
+            if piece:
+                yield piece
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = None
+    if decompressor is not None:
+        raise ValueError("Truncated bzip2 stream")
+
+
+def _zip64_sizes(extra: bytes, usize: int, csize: int) -> Tuple[int, int, bool]:
+    """Reads the sizes of a member from its zip64 extra field, when there is one"""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack_from("<HH", extra, offset)
+        if header_id == _ZIP_ZIP64_EXTRA:
+            values = list(struct.unpack_from(f"<{length // 8}Q", extra, offset + 4))
+            if usize == 0xFFFFFFFF and values:
+                usize = values.pop(0)
+            if csize == 0xFFFFFFFF and values:
+                csize = values.pop(0)
+            return usize, csize, True
+        offset += 4 + length
+    return usize, csize, False
+
+
+def _unzip(chunks: Iterable[bytes]) -> Iterator[Tuple[str, bytes]]:
+    """Decompresses the members of a zip stream from their local headers"""
+    stream = _Stream(chunks)
+    while True:
+        header = stream.read(_ZIP_LOCAL_HEADER.size)
+        if header[:4] != _ZIP_LOCAL_SIGNATURE:
+            # Central directory, after the last member
+            return
+        if len(header) < _ZIP_LOCAL_HEADER.size:
+            raise ValueError("Truncated zip stream")
+        _, _, flags, method, _, _, crc, csize, usize, nlen, xlen = _ZIP_LOCAL_HEADER.unpack(
+            header
+        )
+        name = stream.read(nlen).decode("utf-8" if flags & 0x800 else "cp437")
+        usize, csize, zip64 = _zip64_sizes(stream.read(xlen), usize, csize)
+        if flags & 0x1:
+            raise ValueError(f"Encrypted zip member: {name}")
+
+        checksum = 0
+        if method == zlib.DEFLATED:
+            decompressor = zlib.decompressobj(wbits=-15)
+            for data in stream.chunks():
+                for piece in _inflate(decompressor, data):
+                    checksum = zlib.crc32(piece, checksum)
+                    yield name, piece
+                if decompressor.eof:
+                    stream.unread(decompressor.unused_data)
+                    break
+            if not decompressor.eof:
+                raise ValueError(f"Truncated zip member: {name}")
+        elif method == 0 and not flags & 0x8:
+            remaining = csize
+            while remaining > 0:
+                piece = stream.read(min(remaining, BLOCK_SIZE))
+                if not piece:
+                    raise ValueError(f"Truncated zip member: {name}")
+                remaining -= len(piece)
+                checksum = zlib.crc32(piece, checksum)
+                yield name, piece
+        else:
+            raise ValueError(f"Zip member {name} cannot be streamed (method {method})")
+
+        if flags & 0x8:
+            # Data descriptor, with or without its signature
+            descriptor = stream.read(4)
+            if descriptor == _ZIP_DESCRIPTOR_SIGNATURE:
+                descriptor = stream.read(4)
+            crc = struct.unpack("<I", descriptor)[0]
+            stream.read(16 if zip64 else 8)
+        if checksum != crc:
+            raise ValueError(f"Bad CRC of zip member {name}")
+
+
+def decompress(chunks: Iterable[bytes], key: str) -> Iterator[Tuple[str, bytes]]:
+    """Decompresses a compressed file on the fly.
+
+    Args:
+        chunks (iterable): The content of the file, in chunks.
+        key (str): The key of the file, whose suffix gives the compression.
+
+    Yields:
+        tuple: The name of the uncompressed file (the zip member) and the next piece of its
+        content, of at most :data:`BLOCK_SIZE` bytes.
+
+    Raises:
+        ValueError: If the file is truncated or corrupt.
+    """
+    kind = compression(key)
+    if kind == "zip":
+        yield from _unzip(chunks)
+        return
+    if kind not in ("gzip", "bzip2"):
+        raise ValueError(f"Not a compressed file: {key}")
+    name = uncompressed_name(key)
+    for piece in (_gunzip if kind == "gzip" else _bunzip2)(chunks):
+        yield name, piece
+
+
+def _cut(buffer: bytearray, name: str) -> int:
+    """Returns the end of the whole messages or lines of a block, 0 if there is none"""
+    if name.lower().endswith(".his"):
+        return buffer.rfind(b"\n") + 1
+    for start in (max(0, len(buffer) - _TAIL_SIZE), 0):
+        cut = 0
+        for match in _DAT_MESSAGE_START.finditer(buffer, start):
+            cut = match.start()
+        if cut > 0:
+            return cut
+    return 0
+
+
+def message_blocks(pieces: Iterable[Tuple[str, bytes]]) -> Iterator[Tuple[str, bytes]]:
+    """Groups pieces of uncompressed files into blocks of whole messages.
+
+    A block ends before the time line of a data message (``.dat``), or after a line
+    (``.his``); the blocks of a history file after the first start with its header line.
+
+    Args:
+        pieces (iterable): The names of the files and pieces of their content.
+
+    Yields:
+        tuple: The name of the file and a block, of about :data:`BLOCK_SIZE` bytes.
+    """
+    buffer = bytearray()
+    current = None
+    header = b""
+    for name, piece in pieces:
+        if name != current:
+            if buffer.strip():
+                yield current, bytes(buffer)
+            buffer = bytearray()
+            current = name
+            header = b""
+        buffer += piece
+        if len(buffer) < BLOCK_SIZE:
+            continue
+        cut = _cut(buffer, name)
+        if cut == 0:
+            continue
+        block = bytes(buffer[:cut])
+        del buffer[:cut]
+        if name.lower().endswith(".his"):
+            if not header:
+                header = next(
+                    (
+                        line + b"\n"
+                        for line in block.split(b"\n")
+                        if b"CREATEDATE" in line and b"BS_PROFILE" in line
+                    ),
+                    b"",
+                )
+            else:
+                block = header + block
+        yield name, block
+    if buffer.strip():
+        if header:
+            buffer[:0] = header
+        yield current, bytes(buffer)
+
+
+def datasets(lidar_type: str, blocks: Iterable[Tuple[str, bytes]], **options) -> Iterator[dict]:
+    """Decodes blocks of messages into datasets.
+
+    The time bounds of the profiles are those of a whole file read: the time step of the
+    first block is kept, and every block starts where the previous one ended.
+
+    Args:
+        lidar_type (str): cl31 or cl51.
+        blocks (iterable): The names of the files and the blocks of their messages.
+        **options: The reading options of :func:`app.engine.cl_dataset` (``altitude``,
+            ``lon``, ``lat``...).
+
+    Yields:
+        dict: The dataset of each block holding profiles.
+    """
+    # pylint: disable=import-outside-toplevel
+    from . import engine, vaisala
+
+    time_step = None
+    time_end = None
+    for name, block in blocks:
+        with LOCK:
+            profiles = vaisala.decode(block, name)
+            if len(profiles.time) == 0:
+                continue
+            time = profiles.time / 86400.0 + 2440587.5
+            if time_step is None:
+                if len(time) < 2:
+                    raise ValueError(f"Too few profiles in the first block of {name}")
+                time_step = time[1] - time[0]
+            d = engine.cl_dataset(
+                lidar_type,
+                time=profiles.time,
+                backscatter=profiles.backscatter,
+                vertical_resolution=profiles.vertical_resolution[0],
+                detection_status=profiles.detection_status,
+                time_step=time_step,
+                time_start=None if time_end is None else max(time_end, time[0] - 0.5 * time_step),
+                **options,
+            )
+        yield d
+        time_end = time[-1] + 0.5 * time_step
+
+
+def run(lidar_type: str, bucket: str, key: str, work_dir: str, options: dict, client=None):
+    """Runs the ALCF chain on a compressed raw file streamed from S3.
+
+    Same contract as :func:`app.engine.run`, without staging the input.
+
+    Args:
+        lidar_type (str): cl31 or cl51.
+        bucket (str): The bucket of the file.
+        key (str): The key of the file, ending with a suffix of :data:`COMPRESSIONS`.
+        work_dir (str): An empty directory for the output files.
+        options (dict): The options of ``alcf lidar``.
+        client (optional): The S3 client to use.
+
+    Returns:
+        engine.Output: The paths of the processed files and the number of profiles read.
+    """
+    from . import engine  # pylint: disable=import-outside-toplevel
+
+    read_options, options = engine.split_options(options)
+
+    output_dir = os.path.join(work_dir, "lidar")
+    os.makedirs(output_dir, exist_ok=True)
+
+    recorder = instrumentation.current()
+
+    def counted(chunks):
+        for chunk in chunks:
+            recorder.bytes_in += len(chunk)
+            yield chunk
+
+    state = {}
+    paths = []
+    blocks = 0
+    profiles = 0
+    reader = datasets(
+        lidar_type,
+        message_blocks(decompress(counted(storage.stream(bucket, key, client=client)), key)),
+        **read_options,
+    )
+    while True:
+        # Reading includes the download and the decompression of the block
+        with instrumentation.stage("decode"):
+            d = next(reader, None)
+        if d is not None:
+            blocks += 1
+            profiles += len(d["time"])
+        # The last call, with None, flushes the datasets still held by the chain
+        with LOCK:
+            with instrumentation.stage("lidar"):
+                dd = engine.stream([d], state, lidar_type, **options)
+            with instrumentation.stage("write"):
+                paths += [engine.write(x, output_dir) for x in dd]
+        if d is None:
+            break
+
+    if profiles == 0:
+        raise ValueError(f"No backscatter profile in {key}")
+    LOGGER.debug("Processed %s in %d block(s)", key, blocks)
+    return engine.Output(paths, profiles)
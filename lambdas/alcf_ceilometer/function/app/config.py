@@ -0,0 +1,91 @@
+"""Runtime settings of the alcf_ceilometer function"""
+
+import json
+import os
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Settings:
+    """Settings of the ingestion engine.
+
+    All values can be overridden through environment variables, see :meth:`from_env`.
+    """
+
+    #: Bucket receiving the processed files. Defaults to the bucket of the input file.
+    output_bucket: str = ""
+    #: Key prefix of the processed files.
+    output_prefix: str = "processed/"
+    #: Size of the worker pool processing the files of one invocation.
+    max_workers: int = 4
+    #: ALCF lidar type of the input files (cl31, cl51, chm15k, minimpl...).
+    lidar_type: str = "cl51"
+    #: Options passed to ``alcf lidar``, e.g. ``{"tres": 300, "zlim": [0, 15000]}``.
+    alcf_options: dict = field(default_factory=dict)
+    #: ALCF engine: ``inprocess`` or ``cli``, see :mod:`app.processing`.
+    engine: str = "inprocess"
+    #: Number of profiles read at a time from large files (CHM15k), 0 to read whole files.
+    chunk_size: int = 1000
+    #: Scratch directory used to stage input and output files.
+    work_dir: str = "/tmp"
+    #: Key prefix of the incremental statistics (see :mod:`app.stats`), empty to disable them.
+    stats_prefix: str = ""
+    #: Key prefix of the time series stores of the stations (see :mod:`app.store`), empty to
+    #: disable them.
+    store_prefix: str = ""
+    #: Key prefix of the result cache (see :mod:`app.cache`), empty to disable it.
+    cache_prefix: str = ""
+    #: Number of result cache entries kept in the work directory.
+    cache_entries: int = 1024
+    #: Key prefix of the calibration tables of the stations in the output bucket (see
+    #: :mod:`app.calibration`), empty to disable them.
+    calibration_prefix: str = ""
+    #: Key prefix of the archive of the processed profiles, indexed for window queries (see
+    #: :mod:`app.archive`), empty to disable it.
+    query_prefix: str = ""
+    #: Key prefix of the quicklooks of the processed files and the tile pyramids of the
+    #: stations (see :mod:`app.quicklook`), empty to disable them.
+    quicklook_prefix: str = ""
+    #: Buckets whose archive can be queried besides the output bucket (see :mod:`app.query`).
+    query_buckets: list = field(default_factory=list)
+    #: Fraction of the invocations logging their event, between 0 and 1.
+    event_sample_rate: float = 0.0
+    #: Process the files of each station in a batch as one time series (see
+    #: :mod:`app.coalesce`).
+    coalesce: bool = False
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Builds the settings from the environment of the function.
+
+        Returns:
+            Settings: The settings, falling back to the defaults for unset variables.
+        """
+        defaults = cls()
+        return cls(
+            output_bucket=os.environ.get("OUTPUT_BUCKET", defaults.output_bucket),
+            output_prefix=os.environ.get("OUTPUT_PREFIX", defaults.output_prefix),
+            max_workers=int(os.environ.get("MAX_WORKERS", defaults.max_workers)),
+            lidar_type=os.environ.get("LIDAR_TYPE", defaults.lidar_type),
+            alcf_options=json.loads(os.environ.get("ALCF_OPTIONS", "{}")),
+            engine=os.environ.get("ALCF_ENGINE", defaults.engine),
+            chunk_size=int(os.environ.get("CHUNK_SIZE", defaults.chunk_size)),
+            work_dir=os.environ.get("WORK_DIR", defaults.work_dir),
+            stats_prefix=os.environ.get("STATS_PREFIX", defaults.stats_prefix),
+            store_prefix=os.environ.get("STORE_PREFIX", defaults.store_prefix),
+            cache_prefix=os.environ.get("CACHE_PREFIX", defaults.cache_prefix),
+            cache_entries=int(os.environ.get("CACHE_ENTRIES", defaults.cache_entries)),
+            calibration_prefix=os.environ.get(
+                "CALIBRATION_PREFIX", defaults.calibration_prefix
+            ),
+            query_prefix=os.environ.get("QUERY_PREFIX", defaults.query_prefix),
+            quicklook_prefix=os.environ.get("QUICKLOOK_PREFIX", defaults.quicklook_prefix),
+            query_buckets=[
+                name for name in os.environ.get("QUERY_BUCKETS", "").split(",") if name
+            ],
+            event_sample_rate=float(
+                os.environ.get("EVENT_SAMPLE_RATE", defaults.event_sample_rate)
+            ),
+            coalesce=os.environ.get("COALESCE", str(defaults.coalesce)).lower()
+            in ("1", "true"),
+        )
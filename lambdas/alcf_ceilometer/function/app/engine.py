@@ -0,0 +1,423 @@
+"""In-process ALCF engine
+
+The ALCF instrument drivers and lidar processing algorithms are imported once, when the
+container initialises, and called directly on arrays. This avoids starting an interpreter,
+importing ALCF and initialising the NetCDF library for every file, as the ``alcf`` command
+line tool does.
+
+The processing chain is the one of ``alcf lidar``: noise removal, calibration, height and
+time resampling, output sampling, cloud detection and cloud base detection. The height
+resampling is ALCF's, vectorized with weights cached per instrument geometry, see
+:mod:`app.resample`. The default noise removal and calibration, see :mod:`app.calibration`,
+and cloud detection and cloud base detection, see :mod:`app.clouds`, work on whole arrays.
+"""
+
+import os
+from types import SimpleNamespace
+from typing import List, Optional
+
+import numpy as np
+import ds_format as ds
+import aquarius_time as aq
+from alcf import misc
+from alcf.lidars import LIDARS, META
+from alcf.algorithms.calibration import CALIBRATION
+from alcf.algorithms.noise_removal import NOISE_REMOVAL
+from alcf.algorithms.cloud_detection import CLOUD_DETECTION
+from alcf.algorithms.cloud_base_detection import CLOUD_BASE_DETECTION
+from alcf.algorithms import tsample, output_sample, lidar_ratio
+from aws_lambda_powertools import Logger
+
+from . import clouds, instrumentation, resample, vaisala
+from .calibration import (
+    calibration_coeff,
+    calibration_stream,
+    noise_removal_stream,
+    relative_coeff,
+)
+from .processing import RAW_TYPES, Output
+
+LOGGER = Logger(child=True)
+
+#: Variables read from the lidar data, as in ``alcf lidar``.
+VARIABLES = [
+    "backscatter",
+    "backscatter_mol",
+    "backscatter_sd",
+    "time",
+    "time_bnds",
+    "zfull",
+    "altitude",
+    "lon",
+    "lat",
+]
+
+# The default noise removal, calibration, cloud detection and cloud base detection are
+# vectorized, see app.calibration and app.clouds
+_NOISE_REMOVAL = {**NOISE_REMOVAL, "default": SimpleNamespace(stream=noise_removal_stream)}
+_CALIBRATION = {**CALIBRATION, "default": SimpleNamespace(stream=calibration_stream)}
+_CLOUD_DETECTION = {**CLOUD_DETECTION, "default": SimpleNamespace(stream=clouds.detection_stream)}
+_CLOUD_BASE_DETECTION = {
+    **CLOUD_BASE_DETECTION,
+    "default": SimpleNamespace(stream=clouds.base_detection_stream),
+}
+
+
+def read_raw(
+    lidar_type: str,
+    path: str,
+    altitude: Optional[float] = None,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    fix_cl_range: bool = False,
+    cl_crit_range: float = 6000,
+    **kwargs,
+) -> dict:
+    """Reads a raw Vaisala CL31/CL51 file (``.dat`` or ``.his``).
+
+    The messages are decoded by :mod:`app.vaisala` and turned into the dataset ALCF's
+    driver would read from the NetCDF written by ``alcf convert``.
+
+    Args:
+        lidar_type (str): cl31 or cl51.
+        path (str): The raw file.
+        altitude (float, optional): Altitude of the instrument (m).
+        lon (float, optional): Longitude of the instrument (degrees East).
+        lat (float, optional): Latitude of the instrument (degrees North).
+        fix_cl_range (bool, optional): Apply ALCF's range correction fix.
+        cl_crit_range (float, optional): Critical range of the range correction fix (m).
+
+    Returns:
+        dict: The dataset, in the format of ALCF's instrument drivers.
+    """
+    with open(path, "rb") as handler:
+        return decode_raw(
+            lidar_type,
+            handler.read(),
+            path,
+            altitude=altitude,
+            lon=lon,
+            lat=lat,
+            fix_cl_range=fix_cl_range,
+            cl_crit_range=cl_crit_range,
+        )
+
+
+def decode_raw(
+    lidar_type: str,
+    data: bytes,
+    filename: str,
+    altitude: Optional[float] = None,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    fix_cl_range: bool = False,
+    cl_crit_range: float = 6000,
+    **kwargs,
+) -> dict:
+    """Decodes the content of a raw Vaisala CL31/CL51 file held in memory, see
+    :func:`read_raw`.
+
+    Args:
+        lidar_type (str): cl31 or cl51.
+        data (bytes): The content of the file.
+        filename (str): The name of the file, ``.his`` files being history files.
+        altitude (float, optional): Altitude of the instrument (m).
+        lon (float, optional): Longitude of the instrument (degrees East).
+        lat (float, optional): Latitude of the instrument (degrees North).
+        fix_cl_range (bool, optional): Apply ALCF's range correction fix.
+        cl_crit_range (float, optional): Critical range of the range correction fix (m).
+
+    Returns:
+        dict: The dataset, in the format of ALCF's instrument drivers.
+    """
+    profiles = vaisala.decode(data, filename)
+    if len(profiles.time) == 0:
+        raise ValueError(f"No backscatter profile in {filename}")
+
+    return cl_dataset(
+        lidar_type,
+        time=profiles.time,
+        backscatter=profiles.backscatter,
+        vertical_resolution=profiles.vertical_resolution[0],
+        detection_status=profiles.detection_status,
+        altitude=altitude,
+        lon=lon,
+        lat=lat,
+        fix_cl_range=fix_cl_range,
+        cl_crit_range=cl_crit_range,
+    )
+
+
+def cl_dataset(
+    lidar_type: str,
+    time: np.ndarray,
+    backscatter: np.ndarray,
+    vertical_resolution: float,
+    detection_status: np.ndarray,
+    altitude: Optional[float] = None,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    fix_cl_range: bool = False,
+    cl_crit_range: float = 6000,
+    time_step: Optional[float] = None,
+    time_start: Optional[float] = None,
+) -> dict:
+    """Builds the ALCF dataset of decoded Vaisala CL31/CL51 profiles.
+
+    Mirrors ``alcf.lidars.cl51.read``, without the NetCDF round trip.
+
+    Args:
+        lidar_type (str): cl31 or cl51.
+        time (np.ndarray): Time of the profiles (seconds since 1970-01-01).
+        backscatter (np.ndarray): Backscatter (time × level), see :mod:`app.vaisala`.
+        vertical_resolution (float): Range resolution (m).
+        detection_status (np.ndarray): Detection status of the profiles.
+        altitude (float, optional): Altitude of the instrument (m).
+        lon (float, optional): Longitude of the instrument (degrees East).
+        lat (float, optional): Latitude of the instrument (degrees North).
+        fix_cl_range (bool, optional): Apply ALCF's range correction fix.
+        cl_crit_range (float, optional): Critical range of the range correction fix (m).
+        time_step (float, optional): Time between profiles (days), by default between the
+            first two.
+        time_start (float, optional): Lower time bound of the first profile (Julian date),
+            for a dataset continuing an earlier one.
+
+    Returns:
+        dict: The dataset.
+    """
+    lidar = LIDARS[lidar_type]
+    n, m = backscatter.shape
+
+    d = {}
+    d["time"] = time / (24.0 * 60.0 * 60.0) + 2440587.5
+    if time_step is None:
+        time_step = d["time"][1] - d["time"][0]
+    d["time_bnds"] = misc.time_bnds(d["time"], time_step, start=time_start)
+
+    range_ = vertical_resolution * np.arange(m)
+    d["zfull"] = np.tile(range_, (n, 1))
+    if altitude is not None:
+        d["zfull"] += altitude
+
+    d["backscatter"] = backscatter * lidar.CALIBRATION_COEFF
+    if fix_cl_range:
+        mask = range_ > cl_crit_range
+        factor = (range_[mask] / cl_crit_range) ** 2
+        rows = np.asarray(detection_status) == b"0"
+        d["backscatter"][np.ix_(rows, mask)] *= factor
+
+    d["altitude"] = np.full(n, altitude, np.float64)
+    d["lon"] = np.full(n, lon, np.float64)
+    d["lat"] = np.full(n, lat, np.float64)
+    d["."] = {var: META[var] for var in VARIABLES if var in META and var in d}
+    return d
+
+
+def read(lidar_type: str, path: str, **options) -> dict:
+    """Reads an input file with the ALCF driver of its lidar type.
+
+    Args:
+        lidar_type (str): The ALCF lidar type.
+        path (str): The file to read.
+        **options: The reading options of ``alcf lidar`` (altitude, lon, lat...).
+
+    Returns:
+        dict: The dataset.
+    """
+    if lidar_type not in LIDARS:
+        raise ValueError(f"Invalid type: {lidar_type}")
+
+    if lidar_type in RAW_TYPES and not path.lower().endswith(".nc"):
+        return read_raw(lidar_type, path, **options)
+
+    return LIDARS[lidar_type].read(
+        path,
+        VARIABLES,
+        altitude=options.get("altitude"),
+        lon=options.get("lon"),
+        lat=options.get("lat"),
+        fix_cl_range=options.get("fix_cl_range", False),
+        cl_crit_range=options.get("cl_crit_range", 6000),
+    )
+
+
+def _algorithm(registry: dict, name: Optional[str], kind: str):
+    """Looks an algorithm up by name, None disabling the step"""
+    if name is None:
+        return None
+    if name not in registry:
+        raise ValueError(f"Invalid {kind} algorithm: {name}")
+    return registry[name]
+
+
+def stream(
+    dd: list,
+    state: dict,
+    lidar_type: str,
+    tres: float = 300,
+    tlim: Optional[list] = None,
+    tshift: float = 0.0,
+    zres: float = 50,
+    zlim: list = (0.0, 15000.0),
+    cloud_detection: Optional[str] = "default",
+    cloud_base_detection: Optional[str] = "default",
+    noise_removal: Optional[str] = "default",
+    calibration: Optional[str] = "default",
+    output_sampling: float = 86400,
+    calibration_file: Optional[str] = None,
+    calibration_periods: Optional[list] = None,
+    **options,
+) -> List[dict]:
+    """Streams datasets through the ``alcf lidar`` chain.
+
+    As in ALCF, a dataset can be split into consecutive parts, fed one call at a time with
+    the same ``state``. Each step buffers what it needs across calls, and ``None`` flushes
+    the chain.
+
+    Args:
+        dd (list): The next datasets, as returned by :func:`read`, ``None`` ending the stream.
+        state (dict): The state of the chain, an empty dict for a new stream.
+        lidar_type (str): The ALCF lidar type.
+        tres (float, optional): Time resolution (s).
+        tlim (list, optional): Time limits (ISO 8601).
+        tshift (float, optional): Time shift (s).
+        zres (float, optional): Height resolution (m).
+        zlim (list, optional): Height limits (m).
+        cloud_detection (str, optional): Cloud detection algorithm.
+        cloud_base_detection (str, optional): Cloud base detection algorithm.
+        noise_removal (str, optional): Noise removal algorithm.
+        calibration (str, optional): Calibration algorithm.
+        output_sampling (float, optional): Output sampling period (s).
+        calibration_file (str, optional): Calibration file.
+        calibration_periods (list, optional): Start (Julian date) and coefficient of the
+            calibration periods of the station, see :func:`app.calibration.periods`.
+        **options: The algorithm options (``cloud_threshold``, ``cloud_nsd``...).
+
+    Returns:
+        list: The processed datasets completed by this call, one per output sampling period.
+    """
+    noise_removal_mod = (
+        _algorithm(_NOISE_REMOVAL, noise_removal, "noise removal")
+        if lidar_type not in ("default", "cosp")
+        else None
+    )
+    calibration_mod = _algorithm(_CALIBRATION, calibration, "calibration")
+    cloud_detection_mod = _algorithm(_CLOUD_DETECTION, cloud_detection, "cloud detection")
+    cloud_base_detection_mod = _algorithm(
+        _CLOUD_BASE_DETECTION, cloud_base_detection, "cloud base detection"
+    )
+    if tlim is not None:
+        tlim = misc.parse_time(tlim)
+
+    options["calibration_coeff"] = calibration_coeff(lidar_type, calibration_file)
+    if calibration_periods:
+        options["calibration_periods"] = [
+            (start, relative_coeff(lidar_type, coeff)) for start, coeff in calibration_periods
+        ]
+
+    if tshift:
+        for d in dd:
+            if d is not None:
+                d["time"] += tshift / 86400.0
+                d["time_bnds"] += tshift / 86400.0
+
+    if noise_removal_mod is not None:
+        dd = noise_removal_mod.stream(dd, state.setdefault("noise_removal", {}), **options)
+    if calibration_mod is not None:
+        dd = calibration_mod.stream(dd, state.setdefault("calibration", {}), **options)
+    if zres is not None or zlim is not None:
+        dd = resample.stream(dd, state.setdefault("zsample", {}), zres=zres, zlim=zlim)
+    if tres is not None or tlim is not None:
+        dd = tsample.stream(dd, state.setdefault("tsample", {}), tres=tres / 86400.0, tlim=tlim)
+    if output_sampling is not None:
+        dd = output_sample.stream(
+            dd,
+            state.setdefault("output_sample", {}),
+            tres=tres / 86400.0,
+            output_sampling=output_sampling / 86400.0,
+        )
+        dd = misc.aggregate(dd, state.setdefault("aggregate", {}), output_sampling / 86400.0)
+    if cloud_detection_mod is not None:
+        dd = cloud_detection_mod.stream(dd, state.setdefault("cloud_detection", {}), **options)
+    if cloud_base_detection_mod is not None:
+        dd = cloud_base_detection_mod.stream(
+            dd, state.setdefault("cloud_base_detection", {}), **options
+        )
+    dd = lidar_ratio.stream(dd, state.setdefault("lidar_ratio", {}))
+
+    return [x for x in dd if x is not None and len(x["time"]) > 0]
+
+
+def process(d: dict, lidar_type: str, **options) -> List[dict]:
+    """Processes a whole dataset with the ``alcf lidar`` chain.
+
+    Args:
+        d (dict): The dataset, as returned by :func:`read`.
+        lidar_type (str): The ALCF lidar type.
+        **options: The options of :func:`stream`.
+
+    Returns:
+        list: The processed datasets, one per output sampling period.
+    """
+    return stream([d, None], {}, lidar_type, **options)
+
+
+def split_options(options: dict) -> tuple:
+    """Splits ``alcf lidar`` options into reading and processing options.
+
+    Args:
+        options (dict): The options of ``alcf lidar``.
+
+    Returns:
+        tuple: The options of :func:`read`, and those of :func:`stream`.
+    """
+    options = dict(options)
+    read_options = {
+        name: options.pop(name)
+        for name in ("altitude", "lon", "lat", "fix_cl_range", "cl_crit_range")
+        if name in options
+    }
+    return read_options, options
+
+
+def write(d: dict, output_dir: str) -> str:
+    """Writes a processed dataset, named after the start of its period as ``alcf lidar`` does.
+
+    Args:
+        d (dict): The processed dataset.
+        output_dir (str): The output directory.
+
+    Returns:
+        str: The path of the written file.
+    """
+    t1 = np.round(d["time_bnds"][0, 0] * 86400.0) / 86400.0
+    path = os.path.join(output_dir, "%s.nc" % aq.to_iso(t1).replace(":", ""))
+    ds.write(path, d)
+    return path
+
+
+def run(lidar_type: str, input_path: str, work_dir: str, options: dict) -> Output:
+    """Runs the ALCF chain on a file in-process.
+
+    Same contract as :func:`app.processing.run_alcf`.
+
+    Args:
+        lidar_type (str): The ALCF lidar type of the file.
+        input_path (str): The file to process.
+        work_dir (str): An empty directory for the output files.
+        options (dict): The options of ``alcf lidar``.
+
+    Returns:
+        Output: The paths of the processed files and the number of profiles read.
+    """
+    read_options, options = split_options(options)
+
+    with instrumentation.stage("decode"):
+        d = read(lidar_type, input_path, **read_options)
+    with instrumentation.stage("lidar"):
+        dd = process(d, lidar_type, **options)
+
+    output_dir = os.path.join(work_dir, "lidar")
+    os.makedirs(output_dir, exist_ok=True)
+    with instrumentation.stage("write"):
+        return Output([write(x, output_dir) for x in dd], len(d["time"]))
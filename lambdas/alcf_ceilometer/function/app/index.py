@@ -2,13 +2,48 @@
 
 from aws_lambda_powertools import Logger
 
+from .batch import is_sqs_event, process_sqs_batch
+from .config import Settings
+from .ingest import process_objects, s3_objects
+from .instrumentation import METRICS, log_event
+
 LOGGER = Logger(child=True)
-@LOGGER.inject_lambda_context(log_event=True)
+
+
+class IngestError(Exception):
+    """Raised when some files of an invocation could not be processed"""
+
+
+@METRICS.log_metrics
+@LOGGER.inject_lambda_context
 def main(event, context):
     """Main handler
 
+    Processes every ceilometer file referenced by an S3 event notification, or by the S3
+    notifications carried by a batch of SQS messages.
+
     Args:
         event (dict): contains information from the invoking service
         context (dict): not used
-    """    
-    pass
+
+    Returns:
+        dict: For SQS, the messages to redeliver in ``batchItemFailures``. Otherwise, the
+        keys of the processed files, per input key.
+
+    Raises:
+        IngestError: If any of the files of an S3 event failed, once all of them have
+            been attempted.
+    """
+    settings = Settings.from_env()
+    log_event(event, settings.event_sample_rate)
+
+    if is_sqs_event(event):
+        return process_sqs_batch(event, settings)
+
+    results = process_objects(s3_objects(event), settings)
+
+    failed = [result.source.key for result in results if result.error is not None]
+    if failed:
+        raise IngestError(f"Failed to process {len(failed)} file(s): {', '.join(failed)}")
+
+    return {"processed": {result.source.key: result.outputs for result in results}}
@@ -0,0 +1,454 @@
+"""Ingestion engine: download, ALCF processing and upload of ceilometer files"""
+
+import os
+import posixpath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+from urllib.parse import unquote_plus
+
+from aws_lambda_powertools import Logger
+
+from . import cache, compressed, instrumentation, processing, storage
+from .config import Settings
+from .processing import RAW_TYPES
+
+LOGGER = Logger(child=True)
+
+
+class S3Object(NamedTuple):
+    """An object referenced by an S3 event notification"""
+
+    bucket: str
+    key: str
+    size: int = 0
+
+
+class Result(NamedTuple):
+    """Outcome of the processing of one object"""
+
+    source: S3Object
+    outputs: List[str]
+    error: Optional[str] = None
+    profiles: int = 0
+
+
+def s3_objects(event: dict) -> List[S3Object]:
+    """Lists the objects referenced by an S3 event notification.
+
+    Args:
+        event (dict): The S3 event, holding any number of records.
+
+    Returns:
+        list: The created objects, in the order of the records.
+    """
+    objects = []
+    for record in event.get("Records", []):
+        if "s3" not in record:
+            continue
+        objects.append(
+            S3Object(
+                bucket=record["s3"]["bucket"]["name"],
+                # Keys are URL encoded in event notifications
+                key=unquote_plus(record["s3"]["object"]["key"]),
+                size=record["s3"]["object"].get("size", 0),
+            )
+        )
+    return objects
+
+
+def input_stem(key: str) -> str:
+    """Returns the name of an input file without its extension and compression suffix.
+
+    Args:
+        key (str): The key of the input file, e.g. ``<path>/<name>.dat.gz``.
+
+    Returns:
+        str: The stem of the file, e.g. ``<name>``.
+    """
+    return posixpath.splitext(compressed.uncompressed_name(key))[0]
+
+
+def station_of(key: str) -> str:
+    """Returns the station of an input file, the first directory of its key.
+
+    The files of a station may be stored flat, ``<station>/<name>``, or in directories of
+    their day, ``<station>/%Y/%m/%d/<name>`` as listed by :mod:`app.backfill`: both belong to
+    the same station, whose statistics, store, calibration and archive are shared.
+
+    Args:
+        key (str): The key of the input file.
+
+    Returns:
+        str: The station, empty for a key without directory.
+    """
+    return key.split("/", 1)[0] if "/" in key else ""
+
+
+def output_key(source: S3Object, filename: str, settings: Settings) -> str:
+    """Builds the key of a processed file.
+
+    The processed files of ``<path>/<name>.<ext>`` (or ``<path>/<name>.<ext>.gz``...) are
+    stored under ``<output_prefix><path>/<name>/``.
+
+    Args:
+        source (S3Object): The input object.
+        filename (str): The name of the processed file.
+        settings (Settings): The settings of the engine.
+
+    Returns:
+        str: The key of the processed file.
+    """
+    return settings.output_prefix + posixpath.join(
+        posixpath.dirname(source.key), input_stem(source.key), filename
+    )
+
+
+def process_object(source: S3Object, settings: Settings, client=None) -> Result:
+    """Downloads, processes and uploads one object.
+
+    When the result cache is enabled, an input already processed with the same ALCF version
+    and options is not processed again: its earlier processed files are copied instead.
+
+    When statistics are enabled, the processed profiles are merged into the hourly, daily
+    and monthly aggregates of the station (see :func:`station_of`). When the station
+    store is enabled, they are also written to the time series store of the station.
+
+    Compressed raw Vaisala files are streamed instead, see :func:`_process_compressed`.
+
+    Args:
+        source (S3Object): The object to process.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use.
+
+    Returns:
+        Result: The keys of the uploaded files.
+    """
+    output_bucket = settings.output_bucket or source.bucket
+    station = station_of(source.key)
+    options = alcf_options(station, output_bucket, settings, client=client)
+    if settings.lidar_type in RAW_TYPES and compressed.compression(source.key):
+        return _process_compressed(source, station, output_bucket, options, settings, client)
+    recorder = instrumentation.current()
+
+    with tempfile.TemporaryDirectory(dir=settings.work_dir) as work_dir:
+        input_path = os.path.join(work_dir, posixpath.basename(source.key))
+        with instrumentation.stage("download"):
+            recorder.bytes_in += storage.download(
+                source.bucket, source.key, input_path, client=client
+            )
+
+        if settings.cache_prefix:
+            with instrumentation.stage("cache"):
+                cache_key = cache.cache_key(input_path, settings, options)
+                result = _copy_cached(source, cache_key, output_bucket, settings, client)
+            cache.count(result is not None)
+            if result is not None:
+                _derive_copied(result.outputs, station, output_bucket, work_dir, settings, client)
+                return result
+
+        output = processing.run(
+            settings.lidar_type,
+            input_path,
+            work_dir,
+            options,
+            engine_name=settings.engine,
+            chunk_size=settings.chunk_size,
+        )
+
+        outputs = [
+            output_key(source, os.path.basename(path), settings) for path in output.paths
+        ]
+        upload_outputs(
+            output.paths,
+            outputs,
+            station,
+            output_bucket,
+            settings,
+            client=client,
+        )
+
+        if settings.cache_prefix:
+            with instrumentation.stage("cache"):
+                cache.store(
+                    cache_key,
+                    [
+                        (os.path.basename(path), output_bucket, key)
+                        for path, key in zip(output.paths, outputs)
+                    ],
+                    output.profiles,
+                    output_bucket,
+                    settings,
+                    client=client,
+                )
+
+    return Result(source, outputs, profiles=output.profiles)
+
+
+def _process_compressed(
+    source: S3Object,
+    station: str,
+    output_bucket: str,
+    options: dict,
+    settings: Settings,
+    client,
+) -> Result:
+    """Processes a compressed raw Vaisala file streamed from S3, see :mod:`app.compressed`.
+
+    The input is never staged in the work directory, so it bypasses the result cache, whose
+    keys hash its content.
+    """
+    if settings.engine != "inprocess":
+        raise ValueError(f"Compressed inputs require the inprocess engine: {source.key}")
+
+    with tempfile.TemporaryDirectory(dir=settings.work_dir) as work_dir:
+        output = compressed.run(
+            settings.lidar_type, source.bucket, source.key, work_dir, options, client=client
+        )
+        outputs = [
+            output_key(source, os.path.basename(path), settings) for path in output.paths
+        ]
+        upload_outputs(output.paths, outputs, station, output_bucket, settings, client=client)
+
+    return Result(source, outputs, profiles=output.profiles)
+
+
+def alcf_options(station: str, output_bucket: str, settings: Settings, client=None) -> dict:
+    """Returns the ALCF options of the files of a station.
+
+    When calibration tables are enabled, the options include the calibration periods of the
+    station, kept by the container (see :func:`app.calibration.periods`). They are only
+    used by the ``inprocess`` engine.
+
+    Args:
+        station (str): The station of the input files, see :func:`station_of`.
+        output_bucket (str): The bucket holding the calibration tables.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use.
+
+    Returns:
+        dict: The options, those of the settings without calibration tables.
+    """
+    if not settings.calibration_prefix or settings.engine != "inprocess":
+        return settings.alcf_options
+    from . import calibration  # pylint: disable=import-outside-toplevel
+
+    calibration_periods = calibration.periods(
+        output_bucket, settings.calibration_prefix, station, client=client
+    )
+    if not calibration_periods:
+        return settings.alcf_options
+    return {**settings.alcf_options, "calibration_periods": calibration_periods}
+
+
+def upload_outputs(
+    paths: List[str],
+    keys: List[str],
+    station: str,
+    output_bucket: str,
+    settings: Settings,
+    client=None,
+):
+    """Uploads processed files, adding them to the statistics, the store and the archive of
+    the station and rendering their quicklooks, see :func:`derive_outputs`.
+
+    Args:
+        paths (list): The processed files.
+        keys (list): The keys of the files, in the order of ``paths``.
+        station (str): The station of the input files, see :func:`station_of`.
+        output_bucket (str): The bucket receiving the files.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use.
+    """
+    recorder = instrumentation.current()
+    for path, key in zip(paths, keys):
+        with instrumentation.stage("upload"):
+            recorder.bytes_out += storage.upload(path, output_bucket, key, client=client)
+    derive_outputs(paths, keys, station, output_bucket, settings, client=client)
+
+
+def derive_outputs(
+    paths: List[str],
+    keys: List[str],
+    station: str,
+    output_bucket: str,
+    settings: Settings,
+    client=None,
+):
+    """Adds processed files to the statistics, the store and the archive of the station and
+    renders their quicklooks, those enabled by the settings.
+
+    The statistics, the store, the archive and the quicklooks, and NumPy, Zarr and
+    Matplotlib with them, are only imported when enabled.
+
+    Args:
+        paths (list): The processed files.
+        keys (list): The keys of the files, in the order of ``paths``.
+        station (str): The station of the input files, see :func:`station_of`.
+        output_bucket (str): The bucket receiving the files.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use.
+    """
+    # pylint: disable=import-outside-toplevel
+    if settings.stats_prefix:
+        from . import stats
+    if settings.store_prefix:
+        from . import store
+    if settings.query_prefix:
+        from . import archive
+    if settings.quicklook_prefix:
+        from . import quicklook
+
+    recorder = instrumentation.current()
+    for path, key in zip(paths, keys):
+        if settings.stats_prefix:
+            with instrumentation.stage("stats"):
+                stats.update(
+                    stats.read(path),
+                    source=key,
+                    station=station,
+                    bucket=output_bucket,
+                    prefix=settings.stats_prefix,
+                    client=client,
+                )
+        if settings.store_prefix:
+            with instrumentation.stage("store"):
+                store.write_file(
+                    path,
+                    store.station_store(
+                        output_bucket, settings.store_prefix, station, client=client
+                    ),
+                )
+        if settings.query_prefix:
+            with instrumentation.stage("archive"):
+                recorder.bytes_out += archive.write_file(
+                    path,
+                    output_bucket,
+                    settings.query_prefix,
+                    station,
+                    derived_key(key, settings.query_prefix, settings) + ".pack",
+                    client=client,
+                )
+        if settings.quicklook_prefix:
+            with instrumentation.stage("quicklook"):
+                recorder.bytes_out += quicklook.publish(
+                    path,
+                    output_bucket,
+                    settings.quicklook_prefix,
+                    station,
+                    derived_key(key, settings.quicklook_prefix, settings) + ".png",
+                    client=client,
+                )
+
+
+def derived_key(key: str, prefix: str, settings: Settings) -> str:
+    """Returns the key of an object derived from a processed file, without extension.
+
+    The objects derived from ``<output_prefix><path>/<name>.nc`` are stored as
+    ``<prefix><path>/<name>``.
+    """
+    if key.startswith(settings.output_prefix):
+        key = key[len(settings.output_prefix) :]
+    return prefix + posixpath.splitext(key)[0]
+
+
+def _copy_cached(
+    source: S3Object, cache_key: str, output_bucket: str, settings: Settings, client
+) -> Optional[Result]:
+    """Copies the processed files of an input from the result cache, None on a miss"""
+    entry = cache.lookup(cache_key, output_bucket, settings, client=client)
+    if entry is None:
+        return None
+
+    targets = {
+        filename: (output_bucket, output_key(source, filename, settings))
+        for filename in entry["outputs"]
+    }
+    if not cache.copy_outputs(entry, targets, client=client):
+        LOGGER.warning("Stale cache entry for s3://%s/%s", source.bucket, source.key)
+        return None
+
+    return Result(
+        source, [key for _, key in targets.values()], profiles=entry["profiles"]
+    )
+
+
+def _derive_copied(
+    keys: List[str], station: str, output_bucket: str, work_dir: str, settings: Settings, client
+):
+    """Adds the processed files copied from the result cache to the products of the station.
+
+    The copies have new keys, possibly of another station: they are downloaded and go
+    through the same steps as freshly processed files (see :func:`derive_outputs`).
+    """
+    if not (
+        settings.stats_prefix
+        or settings.store_prefix
+        or settings.query_prefix
+        or settings.quicklook_prefix
+    ):
+        return
+
+    recorder = instrumentation.current()
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    paths = [os.path.join(output_dir, posixpath.basename(key)) for key in keys]
+    with instrumentation.stage("download"):
+        for path, key in zip(paths, keys):
+            recorder.bytes_in += storage.download(output_bucket, key, path, client=client)
+    derive_outputs(paths, keys, station, output_bucket, settings, client=client)
+
+
+def _process_safely(source: S3Object, settings: Settings, client) -> Result:
+    """Processes one object, turning any failure into a failed result.
+
+    The measurements of the processing are added to the metrics of the invocation, also
+    when it fails.
+    """
+    with instrumentation.record() as recorder:
+        try:
+            result = process_object(source, settings, client=client)
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.exception("Failed to process s3://%s/%s", source.bucket, source.key)
+            result = Result(source, [], error=str(error))
+        recorder.profiles = result.profiles
+        instrumentation.publish(recorder)
+
+    if result.error is not None:
+        return result
+
+    LOGGER.info(
+        "Processed s3://%s/%s into %d file(s)", source.bucket, source.key, len(result.outputs)
+    )
+    return result
+
+
+def process_objects(sources: List[S3Object], settings: Settings, client=None) -> List[Result]:
+    """Processes objects through a bounded pool of workers.
+
+    The threads of the pool overlap the S3 transfers of some files with the processing of
+    another: the decoding, the ALCF processing and the NetCDF reads and writes of the
+    ``inprocess`` engine are serialized by :data:`app.processing.LOCK`, the netCDF4 and HDF5
+    libraries not being thread-safe. A failure is reported in the result of its object and
+    does not stop the others.
+
+    Args:
+        sources (list): The objects to process.
+        settings (Settings): The settings of the engine.
+        client (optional): The S3 client to use. Defaults to the shared client.
+
+    Returns:
+        list: The results, in the order of ``sources``.
+    """
+    if not sources:
+        return []
+
+    client = client or storage.get_client()
+    workers = max(1, min(settings.max_workers, len(sources)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(lambda source: _process_safely(source, settings, client), sources)
+        )
+
+    if settings.cache_prefix:
+        cache.log_counts()
+    return results
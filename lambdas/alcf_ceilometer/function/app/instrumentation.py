@@ -0,0 +1,132 @@
+"""Per-stage instrumentation of the processing of a file
+
+The stages of the processing of a file run in the worker thread handling it. Each stage is
+timed with :func:`stage`, which adds its duration to the :class:`Recorder` of the thread,
+opened by :func:`record` for the file. :func:`publish` then emits the timings, the bytes
+downloaded and uploaded, the profiles processed and the peak RSS of the container as
+CloudWatch Embedded Metric Format metrics, flushed at the end of the invocation by
+``METRICS.log_metrics``.
+"""
+
+import os
+import random
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+LOGGER = Logger(child=True)
+
+#: Stages of the processing of a file, in order.
+STAGES = (
+    "download",
+    "cache",
+    "decode",
+    "lidar",
+    "write",
+    "stats",
+    "store",
+    "archive",
+    "quicklook",
+    "upload",
+)
+
+#: Metrics of the function, in the namespace set by ``POWERTOOLS_METRICS_NAMESPACE``.
+METRICS = Metrics(namespace=os.environ.get("POWERTOOLS_METRICS_NAMESPACE", "alcf_ceilometer"))
+
+_LOCAL = threading.local()
+
+
+class Recorder:
+    """Measurements of the processing of one file"""
+
+    def __init__(self):
+        #: Time spent in every stage (s).
+        self.durations: Dict[str, float] = {}
+        #: Bytes downloaded.
+        self.bytes_in = 0
+        #: Bytes uploaded.
+        self.bytes_out = 0
+        #: Profiles read from the file.
+        self.profiles = 0
+
+    def add(self, name: str, duration: float):
+        """Adds time spent in a stage.
+
+        Args:
+            name (str): The stage, one of :data:`STAGES`.
+            duration (float): The time spent (s).
+        """
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+
+@contextmanager
+def record() -> Iterator[Recorder]:
+    """Opens the recorder of the current thread for the processing of a file.
+
+    Yields:
+        Recorder: The recorder, receiving the stages timed by the thread until it closes.
+    """
+    previous = getattr(_LOCAL, "recorder", None)
+    _LOCAL.recorder = Recorder()
+    try:
+        yield _LOCAL.recorder
+    finally:
+        _LOCAL.recorder = previous
+
+
+def current() -> Recorder:
+    """Returns the recorder of the current thread, a throwaway one if none is open"""
+    return getattr(_LOCAL, "recorder", None) or Recorder()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times a stage, adding its duration to the recorder of the current thread.
+
+    Args:
+        name (str): The stage, one of :data:`STAGES`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current().add(name, time.perf_counter() - start)
+
+
+def peak_rss() -> float:
+    """Returns the peak resident set size of the container (MB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def publish(recorder: Recorder):
+    """Adds the measurements of a file to the metrics of the invocation.
+
+    Args:
+        recorder (Recorder): The measurements.
+    """
+    for name, duration in recorder.durations.items():
+        METRICS.add_metric(name=f"{name}_time", unit=MetricUnit.Seconds, value=duration)
+    METRICS.add_metric(name="bytes_in", unit=MetricUnit.Bytes, value=recorder.bytes_in)
+    METRICS.add_metric(name="bytes_out", unit=MetricUnit.Bytes, value=recorder.bytes_out)
+    METRICS.add_metric(name="profiles", unit=MetricUnit.Count, value=recorder.profiles)
+    METRICS.add_metric(name="peak_rss", unit=MetricUnit.Megabytes, value=peak_rss())
+    LOGGER.debug(
+        "Stage timings",
+        extra={f"{name}_time": duration for name, duration in recorder.durations.items()},
+    )
+
+
+def log_event(event: dict, sample_rate: float):
+    """Logs an event, for a sample of the invocations.
+
+    Args:
+        event (dict): The event of the invocation.
+        sample_rate (float): The fraction of the events to log, between 0 and 1.
+    """
+    if sample_rate > 0 and random.random() < sample_rate:
+        LOGGER.info(event)
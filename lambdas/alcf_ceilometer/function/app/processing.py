@@ -0,0 +1,145 @@
+"""ALCF processing of a single ceilometer file
+
+Two engines are available: ``inprocess`` (default) calls ALCF in the handler's own process,
+see :mod:`app.engine`, while ``cli`` runs the ``alcf`` command line tool for every file.
+
+The engines are imported by :func:`run` when first used: the ``inprocess`` engine loads
+ALCF, NumPy, SciPy and netCDF4, which the ``cli`` engine and the invocations processing
+no file do not need.
+
+The threads of an invocation (see :func:`app.ingest.process_objects`) overlap their S3
+transfers only: the netCDF4 and HDF5 libraries are not thread-safe, so the decoding, the
+ALCF processing and the NetCDF reads and writes of a file hold :data:`LOCK`.
+"""
+
+import glob
+import os
+import subprocess
+import threading
+from typing import List, NamedTuple
+
+from aws_lambda_powertools import Logger
+
+from . import instrumentation
+
+LOGGER = Logger(child=True)
+
+#: Lidar types delivered as raw Vaisala messages, converted with ``alcf convert`` first.
+RAW_TYPES = ("cl31", "cl51")
+
+#: Held while decoding, processing, reading and writing NetCDF files or drawing quicklooks.
+LOCK = threading.RLock()
+
+
+class Output(NamedTuple):
+    """Outcome of the processing of a file"""
+
+    #: The paths of the processed files.
+    paths: List[str]
+    #: Number of profiles read from the file, 0 if unknown.
+    profiles: int = 0
+
+
+def run(
+    lidar_type: str,
+    input_path: str,
+    work_dir: str,
+    options: dict,
+    engine_name: str = "inprocess",
+    chunk_size: int = 0,
+) -> Output:
+    """Runs the ALCF chain on a file with the given engine.
+
+    Args:
+        lidar_type (str): The ALCF lidar type of the file.
+        input_path (str): The file to process.
+        work_dir (str): An empty directory for intermediate and output files.
+        options (dict): The options of ``alcf lidar``.
+        engine_name (str, optional): ``inprocess`` or ``cli``.
+        chunk_size (int, optional): Number of profiles read at a time by the ``inprocess``
+            engine, for the lidar types supporting it (see :mod:`app.chunked`). 0 reads
+            whole files.
+
+    Returns:
+        Output: The paths of the processed files and the number of profiles read.
+    """
+    if engine_name == "inprocess":
+        from . import chunked, engine  # pylint: disable=import-outside-toplevel
+
+        with LOCK:
+            if chunk_size > 0 and lidar_type in chunked.CHUNKED_TYPES:
+                return chunked.run(lidar_type, input_path, work_dir, options, chunk_size)
+            return engine.run(lidar_type, input_path, work_dir, options)
+    if engine_name == "cli":
+        return run_alcf(lidar_type, input_path, work_dir, options)
+    raise ValueError(f"Invalid engine: {engine_name}")
+
+
+def format_options(options: dict) -> List[str]:
+    """Formats options as ``alcf`` command line arguments.
+
+    Args:
+        options (dict): The options, e.g. ``{"tres": 300, "zlim": [0, 15000]}``.
+
+    Returns:
+        list: The arguments, e.g. ``["tres:", "300", "zlim:", "{", "0", "15000", "}"]``.
+    """
+    args = []
+    for name, value in options.items():
+        args.append(f"{name}:")
+        if isinstance(value, (list, tuple)):
+            args += ["{", *[str(item) for item in value], "}"]
+        elif isinstance(value, bool):
+            args.append("true" if value else "false")
+        else:
+            args.append(str(value))
+    return args
+
+
+def run_alcf(lidar_type: str, input_path: str, work_dir: str, options: dict) -> Output:
+    """Runs the ALCF chain on a file with the ``alcf`` command line tool.
+
+    Raw Vaisala messages are converted to NetCDF with ``alcf convert`` before ``alcf lidar``.
+
+    Args:
+        lidar_type (str): The ALCF lidar type of the file.
+        input_path (str): The file to process.
+        work_dir (str): An empty directory for intermediate and output files.
+        options (dict): The options of ``alcf lidar``.
+
+    Returns:
+        Output: The paths of the processed files, and the number of profiles read when the
+        input is NetCDF (converted raw files included).
+    """
+    if lidar_type in RAW_TYPES:
+        converted_path = os.path.join(work_dir, "converted.nc")
+        with instrumentation.stage("decode"):
+            _check_call(["alcf", "convert", "cl51", input_path, converted_path])
+        input_path = converted_path
+
+    output_dir = os.path.join(work_dir, "lidar")
+    os.makedirs(output_dir)
+    with instrumentation.stage("lidar"):
+        _check_call(
+            ["alcf", "lidar", lidar_type, input_path, output_dir, *format_options(options)]
+        )
+
+    profiles = 0
+    if input_path.endswith(".nc"):
+        import ds_format as ds  # pylint: disable=import-outside-toplevel
+
+        with LOCK:
+            profiles = len(ds.read(input_path, ["time"])["time"])
+
+    return Output(sorted(glob.glob(os.path.join(output_dir, "*.nc"))), profiles)
+
+
+def _check_call(cmd: List[str]):
+    """Runs a command, raising with its output when it fails"""
+    LOGGER.debug("Running %s", " ".join(cmd))
+    completed = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"{cmd[0]} {cmd[1]} failed ({completed.returncode}): "
+            f"{completed.stdout.decode(errors='replace')[-2000:]}"
+        )
@@ -0,0 +1,172 @@
+"""Query handler: profiles of a station in a time and height window
+
+The handler answers requests such as "backscatter at station X from 03:00 to 09:00 below
+3 km" from the archive of the processed profiles (:mod:`app.archive`), reading only the
+blocks of the window. It is invoked directly, with the parameters as the event::
+
+    {"station": "X", "start": "2021-03-01T03:00:00", "end": "2021-03-01T09:00:00",
+     "zmax": 3000}
+
+or through a function URL or API Gateway, with the same parameters in the query string.
+"""
+
+import json
+import math
+import time
+
+import numpy as np
+import aquarius_time as aq
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.metrics import MetricUnit
+
+from . import archive
+from .config import Settings
+from .instrumentation import METRICS
+
+LOGGER = Logger(child=True)
+
+#: Variables returned by a query.
+VARIABLES = ("backscatter", "cloud_mask", "cbh")
+
+
+class QueryError(ValueError):
+    """Raised when the parameters of a query are invalid"""
+
+
+def parse(parameters: dict, settings: Settings) -> dict:
+    """Parses the parameters of a query.
+
+    Args:
+        parameters (dict): ``station``, ``start`` and ``end`` (ISO 8601, UTC), and
+            optionally ``zmin`` and ``zmax`` (m), ``variables`` (a list, or comma
+            separated) and ``bucket``, the bucket of the archive: the output bucket or one
+            of the query buckets of the settings, by default the only one of them.
+        settings (Settings): The settings of the function.
+
+    Returns:
+        dict: The arguments of :func:`app.archive.read` and the variables.
+
+    Raises:
+        QueryError: If a parameter is missing or invalid.
+    """
+    missing = [name for name in ("station", "start", "end") if not parameters.get(name)]
+    if missing:
+        raise QueryError(f"Missing parameter(s): {', '.join(missing)}")
+    buckets = ([settings.output_bucket] if settings.output_bucket else []) + [
+        name for name in settings.query_buckets if name != settings.output_bucket
+    ]
+    bucket = parameters.get("bucket") or (buckets[0] if len(buckets) == 1 else "")
+    if not bucket:
+        raise QueryError(f"No bucket: pass bucket, one of {', '.join(buckets) or 'none'}")
+    if bucket not in buckets:
+        raise QueryError(f"Unknown bucket: {bucket}")
+
+    try:
+        start = aq.from_iso(parameters["start"])
+        end = aq.from_iso(parameters["end"])
+        zmin = float(parameters.get("zmin", -math.inf))
+        zmax = float(parameters.get("zmax", math.inf))
+    except (TypeError, ValueError) as error:
+        raise QueryError(f"Invalid parameter: {error}") from error
+    if start is None or end is None or not start < end or not zmin <= zmax:
+        raise QueryError("Empty or invalid window")
+
+    variables = parameters.get("variables", VARIABLES)
+    if isinstance(variables, str):
+        variables = variables.split(",")
+    unknown = set(variables) - set(VARIABLES)
+    if unknown:
+        raise QueryError(f"Unknown variable(s): {', '.join(sorted(unknown))}")
+
+    return dict(
+        bucket=bucket,
+        prefix=settings.query_prefix,
+        station=parameters["station"].strip("/"),
+        start=start,
+        end=end,
+        zmin=zmin,
+        zmax=zmax,
+        variables=list(variables),
+    )
+
+
+def _jsonable(x: np.ndarray) -> list:
+    """Returns an array as nested lists, missing values as None"""
+    if x.dtype.kind == "f":
+        return np.where(np.isfinite(x), x, None).tolist()
+    return x.tolist()
+
+
+def query(parameters: dict, settings: Settings, client=None) -> dict:
+    """Answers a query.
+
+    Args:
+        parameters (dict): The parameters of the query, see :func:`parse`.
+        settings (Settings): The settings of the function.
+        client (optional): The S3 client to use.
+
+    Returns:
+        dict: ``time`` (ISO 8601) and ``zfull`` (m) of the window, the variables, of shape
+        (time, level) or (time,), and ``bytes_read``.
+    """
+    options = parse(parameters, settings)
+    variables = options.pop("variables")
+    start = time.perf_counter()
+    d = archive.read(**options, client=client)
+    METRICS.add_metric(
+        name="query_time", unit=MetricUnit.Seconds, value=time.perf_counter() - start
+    )
+    METRICS.add_metric(name="query_bytes", unit=MetricUnit.Bytes, value=d["bytes_read"])
+    LOGGER.debug(
+        "Query of %s: %d profile(s), %d level(s), %d bytes read",
+        options["station"],
+        len(d["time"]),
+        len(d["zfull"]),
+        d["bytes_read"],
+    )
+
+    result = {
+        "station": options["station"],
+        "time": [aq.to_iso(t) for t in d["time"]],
+        "zfull": _jsonable(d["zfull"]),
+        "bytes_read": d["bytes_read"],
+    }
+    for name in variables:
+        result[name] = _jsonable(d[name].astype(np.int8) if name == "cloud_mask" else d[name])
+    return result
+
+
+@METRICS.log_metrics
+@LOGGER.inject_lambda_context
+def main(event, context):
+    """Query handler
+
+    Args:
+        event (dict): The parameters of the query, or a function URL or API Gateway request
+            carrying them in its query string.
+        context (dict): not used
+
+    Returns:
+        dict: The result of :func:`query`, or for HTTP requests, a response with the result
+        as JSON body, or the error with status 400.
+
+    Raises:
+        QueryError: If the parameters of a direct invocation are invalid.
+    """
+    settings = Settings.from_env()
+    if "queryStringParameters" not in event:
+        return query(event, settings)
+
+    try:
+        result = query(event["queryStringParameters"] or {}, settings)
+    except QueryError as error:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": str(error)}),
+        }
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(result),
+    }
@@ -0,0 +1,450 @@
+"""Decimated backscatter quicklooks and their tile pyramid
+
+``alcf plot backscatter`` draws every sample of a processed file, hundreds of thousands of
+cells per day, most of them smaller than a pixel. Here, the time × height array is first
+reduced onto the pixel grid of the image (:func:`decimate`): every pixel takes the maximum
+(or minimum, or mean) of the samples it covers, so that a thin cloud layer still shows at
+plot scale, and a pixel narrower than a sample takes the value of that sample. Only the
+reduced array is drawn.
+
+The same decimation renders the tile pyramid of every day of a station (:func:`tiles`): at
+zoom level ``z``, the day is split into ``2**z`` × ``2**z`` tiles of :data:`TILE_SIZE`
+pixels, ready to be served to a web viewer as ``<z>/<x>/<y>.png``, ``y`` counted from the
+top. A processed file only renders the tiles its profiles fall in, and merges them into
+the stored tiles of the day (:func:`publish`): a pixel keeps the maximum of the two, read
+back from the colour scale. Tile updates are read-modify-write, with a conditional write
+retried when another invocation updated the tile in the meantime, as the indexes of
+:mod:`app.archive`.
+"""
+
+import functools
+import io
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from typing import Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import ds_format as ds
+import aquarius_time as aq
+import matplotlib
+import matplotlib.image
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import LogNorm
+from matplotlib.figure import Figure
+from matplotlib.gridspec import GridSpec
+from matplotlib.ticker import FuncFormatter
+
+from . import storage
+from .processing import LOCK
+from .resample import half
+
+LOGGER = Logger(child=True)
+
+#: Colour scale of the backscatter, as ``alcf plot backscatter`` (1e-6 m-1 sr-1).
+VLIM = (0.1, 200.0)
+#: Size of the tiles (pixels).
+TILE_SIZE = 256
+#: Number of zoom levels of the tile pyramid.
+ZOOM_LEVELS = 4
+#: Reductions of the samples of a pixel.
+REDUCTIONS = {"max": np.fmax, "min": np.fmin, "mean": np.add}
+#: Variables of the processed files used by the quicklooks.
+VARIABLES = ["time", "time_bnds", "zfull", "backscatter", "backscatter_sd", "backscatter_mol"]
+
+# Threads uploading the tiles of a file
+_UPLOAD_WORKERS = 8
+
+# Attempts of a tile update racing other updates
+_UPDATE_ATTEMPTS = 10
+
+
+def read(path: str) -> dict:
+    """Reads the variables of the quicklooks from a processed file"""
+    with LOCK:
+        return ds.read(path, VARIABLES)
+
+
+def values(
+    d: dict, sigma: float = 5, remove_bmol: bool = True, vlim: Sequence[float] = VLIM
+) -> np.ndarray:
+    """Returns the backscatter drawn by ``alcf plot backscatter``.
+
+    Args:
+        d (dict): The processed dataset.
+        sigma (float, optional): Number of standard deviations of the noise subtracted.
+        remove_bmol (bool, optional): Subtract the molecular backscatter.
+        vlim (list, optional): Colour scale, the values below set under it.
+
+    Returns:
+        np.ndarray: The backscatter (1e-6 m-1 sr-1), shape (time, level), of the first
+        column of simulated data.
+    """
+    b = np.array(np.ma.filled(d["backscatter"], np.nan), np.float64)
+    if b.ndim == 3:
+        b = b[:, :, 0]
+    if sigma > 0 and "backscatter_sd" in d:
+        bsd = np.ma.filled(d["backscatter_sd"], np.nan)
+        b -= sigma * (bsd[:, :, 0] if bsd.ndim == 3 else bsd)
+    if remove_bmol and "backscatter_mol" in d:
+        bmol = np.ma.filled(d["backscatter_mol"], np.nan)
+        b -= np.where(np.isnan(bmol), 0.0, bmol)
+    x = b * 1e6
+    x[x <= 0.0] = 0.5 * vlim[0]
+    return x
+
+
+def cells(d: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the bounds of the samples of a processed dataset.
+
+    Returns:
+        tuple: The lower and upper bounds of the profiles (Julian date) and of the levels
+        (m).
+    """
+    if "time_bnds" in d:
+        time_bnds = np.asarray(d["time_bnds"], np.float64)
+        t_lower, t_upper = time_bnds[:, 0], time_bnds[:, 1]
+    else:
+        thalf = half(np.asarray(d["time"], np.float64))
+        t_lower, t_upper = thalf[:-1], thalf[1:]
+    zfull = np.asarray(d["zfull"], np.float64)
+    zhalf = half(zfull[0] if zfull.ndim == 2 else zfull)
+    return t_lower, t_upper, zhalf[:-1], zhalf[1:]
+
+
+def _reduce_axis(
+    x: np.ndarray,
+    lower: np.ndarray,
+    upper: np.ndarray,
+    edges: np.ndarray,
+    ufunc: np.ufunc,
+) -> np.ndarray:
+    """Reduces the first axis of an array onto pixels.
+
+    The samples whose centre falls in a pixel are reduced by ``ufunc``; a pixel without
+    any takes the sample whose cell holds its centre, and is NaN in a gap.
+    """
+    centres = 0.5 * (lower + upper)
+    first = np.searchsorted(centres, edges[:-1], side="left")
+    last = np.searchsorted(centres, edges[1:], side="left")
+    covered = last > first
+
+    y = np.full((len(edges) - 1,) + x.shape[1:], np.nan)
+    if np.any(covered):
+        # Consecutive covered pixels hold consecutive samples: one reduceat for all
+        start, end = first[covered][0], last[covered][-1]
+        y[covered] = ufunc.reduceat(x[start:end], first[covered] - start, axis=0)
+
+    middle = 0.5 * (edges[:-1] + edges[1:])
+    sample = np.maximum(np.searchsorted(lower, middle, side="right") - 1, 0)
+    inside = ~covered & (lower[sample] <= middle) & (middle < upper[sample])
+    y[inside] = x[sample[inside]]
+    return y
+
+
+def decimate(
+    x: np.ndarray,
+    bounds: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+    t_edges: np.ndarray,
+    z_edges: np.ndarray,
+    how: str = "max",
+) -> np.ndarray:
+    """Reduces a time × height array onto a pixel grid.
+
+    Args:
+        x (np.ndarray): The array, shape (time, level).
+        bounds (tuple): The bounds of the samples, see :func:`cells`.
+        t_edges (np.ndarray): The edges of the pixels along the time (Julian date).
+        z_edges (np.ndarray): The edges of the pixels along the height (m).
+        how (str, optional): Reduction of the samples of a pixel, one of
+            :data:`REDUCTIONS`. Missing samples are ignored.
+
+    Returns:
+        np.ndarray: The pixels, shape (len(t_edges) - 1, len(z_edges) - 1), NaN where no
+        sample falls.
+    """
+    t_lower, t_upper, z_lower, z_upper = bounds
+    ufunc = REDUCTIONS[how]
+
+    def reduce(y):
+        y = _reduce_axis(y, t_lower, t_upper, t_edges, ufunc)
+        return _reduce_axis(y.T, z_lower, z_upper, z_edges, ufunc).T
+
+    if how != "mean":
+        return reduce(x)
+    finite = np.isfinite(x)
+    total = reduce(np.where(finite, x, 0.0))
+    count = reduce(finite.astype(np.float64))
+    return np.divide(total, count, out=np.full_like(total, np.nan), where=count > 0)
+
+
+def extent(d: dict, zlim: Optional[Sequence[float]] = None) -> Tuple[float, float, float, float]:
+    """Returns the extent of the quicklooks of a dataset: the whole days it covers and the
+    height limits, by default those of the levels"""
+    t_lower, t_upper, z_lower, z_upper = cells(d)
+    # Days start at midnight, at half Julian dates
+    t1 = np.floor(t_lower[0] - 0.5) + 0.5
+    t2 = max(np.ceil(t_upper[-1] - 0.5) + 0.5, t1 + 1.0)
+    z1, z2 = zlim if zlim is not None else (z_lower[0], z_upper[-1])
+    return t1, t2, float(z1), float(z2)
+
+
+def _colormap():
+    """Returns the colour map of ``alcf plot backscatter``, missing pixels transparent"""
+    cmap = matplotlib.colormaps["viridis"]  # A copy, set without changing the registry
+    cmap.set_under("#222222")
+    cmap.set_bad(alpha=0.0)
+    return cmap
+
+
+@functools.lru_cache(maxsize=None)
+def _palette() -> np.ndarray:
+    """Returns the colours of the tiles, in increasing order of backscatter: missing, under
+    the colour scale, then the colours of the scale"""
+    cmap = _colormap()
+    return np.concatenate(
+        [
+            cmap(np.array([np.nan, -1.0]), bytes=True),
+            cmap(np.arange(cmap.N), bytes=True),
+        ]
+    )
+
+
+def _levels(rgba: np.ndarray) -> np.ndarray:
+    """Returns the positions in :func:`_palette` of the colours of an RGBA image"""
+    palette = _palette().view(np.uint32)[:, 0]
+    order = np.argsort(palette, kind="stable")
+    colours = np.ascontiguousarray(rgba, np.uint8).view(np.uint32)[..., 0]
+    found = np.minimum(np.searchsorted(palette[order], colours), len(palette) - 1)
+    if np.any(palette[order][found] != colours):
+        raise ValueError("The image has colours outside of the colour scale")
+    return order[found]
+
+
+def png(rgba: np.ndarray) -> bytes:
+    """Encodes an RGBA image as PNG"""
+    buffer = io.BytesIO()
+    matplotlib.image.imsave(buffer, np.ascontiguousarray(rgba), format="png")
+    return buffer.getvalue()
+
+
+def read_png(content: bytes) -> np.ndarray:
+    """Decodes a PNG image as RGBA bytes"""
+    rgba = matplotlib.image.imread(io.BytesIO(content), format="png")
+    return np.round(rgba * 255).astype(np.uint8)
+
+
+def merge(rgba: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Merges two tiles: each pixel takes the colour of the higher backscatter"""
+    return _palette()[np.maximum(_levels(rgba), _levels(other))]
+
+
+def tile_key(prefix: str, station: str, day: float, zoom: int, column: int, row: int) -> str:
+    """Returns the key of a tile of the pyramid of a station for a day (Julian date of its
+    start)"""
+    date = aq.to_datetime(day + 0.5 / 86400).strftime("%Y-%m-%d")
+    return f"{prefix}{station.strip('/')}.tiles/{date}/{zoom}/{column}/{row}.png"
+
+
+def render(
+    d: dict,
+    output,
+    width: float = 10.0,
+    height: float = 4.0,
+    dpi: int = 150,
+    how: str = "max",
+    zlim: Optional[Sequence[float]] = None,
+    vlim: Sequence[float] = VLIM,
+    sigma: float = 5,
+    title: Optional[str] = None,
+):
+    """Plots the backscatter of a dataset, as ``alcf plot backscatter``, decimated to the
+    pixels of the plot.
+
+    Args:
+        d (dict): The processed dataset.
+        output: The image file (PNG), a path or a file object.
+        width (float, optional): Width of the figure (in).
+        height (float, optional): Height of the figure (in).
+        dpi (int, optional): Resolution (pixels per inch).
+        how (str, optional): Reduction of the samples of a pixel.
+        zlim (list, optional): Height limits (m).
+        vlim (list, optional): Colour scale (1e-6 m-1 sr-1).
+        sigma (float, optional): Number of standard deviations of the noise subtracted.
+        title (str, optional): Title of the plot.
+    """
+    t1, t2, z1, z2 = extent(d, zlim)
+    # Not a pyplot figure, whose global state is not thread-safe. Matplotlib still shares
+    # its text and font caches between figures: the figures of the threads are drawn one
+    # at a time
+    with LOCK:
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvasAgg(fig)
+        gs = GridSpec(1, 2, width_ratios=[0.985, 0.015], wspace=0.05, figure=fig)
+        ax = fig.add_subplot(gs[0])
+        cax = fig.add_subplot(gs[1])
+
+        # One array element per pixel of the axes
+        box = ax.get_window_extent()
+        pixels = decimate(
+            values(d, sigma=sigma, vlim=vlim),
+            cells(d),
+            np.linspace(t1, t2, max(int(round(box.width)), 1) + 1),
+            np.linspace(z1, z2, max(int(round(box.height)), 1) + 1),
+            how=how,
+        )
+        image = ax.imshow(
+            pixels.T,
+            extent=(t1, t2, z1 * 1e-3, z2 * 1e-3),
+            aspect="auto",
+            origin="lower",
+            interpolation="nearest",
+            norm=LogNorm(*vlim),
+            cmap=_colormap(),
+        )
+        fig.colorbar(
+            image,
+            cax=cax,
+            label="Att. vol. backscattering coef. (×10$^{-6}$ m$^{-1}$sr$^{-1}$)",
+            extend="both",
+        )
+        ax.set_xlabel("Time (UTC)")
+        ax.set_ylabel("Height (km)")
+        ax.set_xticks(np.linspace(t1, t2, 9))
+        ax.xaxis.set_major_formatter(
+            FuncFormatter(lambda t, _: aq.to_datetime(t).strftime("%d/%m\n%H:%M"))
+        )
+        if title is not None:
+            ax.set_title(title)
+        fig.savefig(output, bbox_inches="tight", dpi=dpi)
+
+
+def tiles(
+    d: dict,
+    zoom_levels: int = ZOOM_LEVELS,
+    tile_size: int = TILE_SIZE,
+    how: str = "max",
+    zlim: Optional[Sequence[float]] = None,
+    vlim: Sequence[float] = VLIM,
+    sigma: float = 5,
+) -> Iterator[Tuple[float, int, int, int, np.ndarray]]:
+    """Renders the tiles of a dataset in the tile pyramids of the days it covers.
+
+    Only the tiles of the columns the profiles fall in are rendered, and those holding at
+    least a sample are returned. The tiles of a day span the heights of the levels, or
+    ``zlim``, which should not change between the files of a station.
+
+    Args:
+        d (dict): The processed dataset.
+        zoom_levels (int, optional): Number of zoom levels.
+        tile_size (int, optional): Size of the tiles (pixels).
+        how (str, optional): Reduction of the samples of a pixel.
+        zlim (list, optional): Height limits (m).
+        vlim (list, optional): Colour scale (1e-6 m-1 sr-1).
+        sigma (float, optional): Number of standard deviations of the noise subtracted.
+
+    Yields:
+        tuple: The day (Julian date of its start), zoom level, column, row (from the top)
+        and RGBA pixels of every tile, shape (tile_size, tile_size, 4), transparent where no
+        sample falls.
+    """
+    t1, t2, z1, z2 = extent(d, zlim)
+    x = values(d, sigma=sigma, vlim=vlim)
+    bounds = cells(d)
+    start, end = bounds[0][0], bounds[1][-1]
+    cmap = _colormap()
+    norm = LogNorm(*vlim)
+    for day in t1 + np.arange(int(round(t2 - t1))):
+        for zoom in range(zoom_levels):
+            count = 2**zoom
+            size = count * tile_size
+            # Columns of the tiles overlapping the profiles
+            first = max(int(np.floor((start - day) * count)), 0)
+            last = min(int(np.ceil((end - day) * count)), count)
+            if first >= last:
+                continue
+            t_edges = day + np.arange(first * tile_size, last * tile_size + 1) / size
+            pixels = decimate(x, bounds, t_edges, np.linspace(z1, z2, size + 1), how=how)
+            # Rows of the image from the top
+            rgba = cmap(norm(np.ma.masked_invalid(pixels.T[::-1])), bytes=True)
+            found = np.isfinite(pixels.T[::-1])
+            for column in range(first, last):
+                columns = slice((column - first) * tile_size, (column - first + 1) * tile_size)
+                for row in range(count):
+                    rows = slice(row * tile_size, (row + 1) * tile_size)
+                    if np.any(found[rows, columns]):
+                        yield day, zoom, column, row, rgba[rows, columns]
+
+
+def _update_tile(bucket: str, key: str, rgba: np.ndarray, client) -> int:
+    """Merges the pixels of a tile into the stored tile and returns the size of the tile
+    (bytes).
+
+    The tile is updated with a conditional write, retried when another invocation updated
+    it in the meantime.
+    """
+    for attempt in range(_UPDATE_ATTEMPTS):
+        try:
+            response = client.get_object(Bucket=bucket, Key=key)
+            merged = merge(rgba, read_png(response["Body"].read()))
+            condition = dict(IfMatch=response["ETag"])
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            merged = rgba
+            condition = dict(IfNoneMatch="*")
+
+        body = png(merged)
+        try:
+            client.put_object(
+                Bucket=bucket, Key=key, Body=body, ContentType="image/png", **condition
+            )
+            return len(body)
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in (
+                "PreconditionFailed",
+                "ConditionalRequestConflict",
+            ):
+                raise
+            LOGGER.debug("Concurrent update of %s, retrying", key)
+            sleep(0.05 * 2**attempt)
+
+    raise RuntimeError(f"Could not update {key} after {_UPDATE_ATTEMPTS} attempts")
+
+
+def publish(
+    path: str, bucket: str, prefix: str, station: str, quicklook_key: str, client=None
+) -> int:
+    """Uploads the quicklook of a processed file and merges it into the tile pyramids of
+    the days of its station.
+
+    The tiles are stored as ``<prefix><station>.tiles/<YYYY-MM-DD>/<z>/<x>/<y>.png``, see
+    :func:`tile_key`.
+
+    Args:
+        path (str): The processed file.
+        bucket (str): The bucket receiving the images.
+        prefix (str): The key prefix of the tile pyramids.
+        station (str): The station, the first directory of the keys of its input files.
+        quicklook_key (str): The key of the quicklook.
+        client (optional): The S3 client to use.
+
+    Returns:
+        int: The number of bytes uploaded.
+    """
+    client = client or storage.get_client()
+    d = read(path)
+    buffer = io.BytesIO()
+    render(d, buffer)
+    client.put_object(
+        Bucket=bucket, Key=quicklook_key, Body=buffer.getvalue(), ContentType="image/png"
+    )
+
+    def update(item):
+        day, zoom, column, row, rgba = item
+        key = tile_key(prefix, station, day, zoom, column, row)
+        return _update_tile(bucket, key, rgba, client)
+
+    with ThreadPoolExecutor(max_workers=_UPLOAD_WORKERS) as executor:
+        return len(buffer.getvalue()) + sum(executor.map(update, tiles(d)))
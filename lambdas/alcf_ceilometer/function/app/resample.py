@@ -0,0 +1,156 @@
+"""Vectorized height resampling of lidar profiles
+
+ALCF's ``zsample`` averages every profile onto the output levels with
+``alcf.algorithms.interp``, a Python loop over the range gates of each profile, each time
+working out again which gates overlap which levels. The gates of an instrument do not
+change, so the overlaps are computed once per geometry, as a sparse matrix of weights
+(:func:`weight_matrix`), kept by the container across invocations, and all the profiles are
+resampled by one sparse product.
+
+The time resampling, ``alcf.algorithms.tsample``, already averages each period in one
+vectorized call, and is kept.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+import scipy.sparse
+from alcf import misc
+
+#: Number of geometries whose weights are kept by the container.
+CACHE_SIZE = 32
+
+_MATRICES: "OrderedDict[tuple, scipy.sparse.csr_matrix]" = OrderedDict()
+_MATRICES_LOCK = threading.Lock()
+
+
+def half(zfull: np.ndarray) -> np.ndarray:
+    """Returns the half levels around full levels, as ``alcf.misc.half``"""
+    zhalf = np.empty(len(zfull) + 1, np.float64)
+    zhalf[1:-1] = 0.5 * (zfull[1:] + zfull[:-1])
+    zhalf[0] = 2.0 * zfull[0] - zfull[1]
+    zhalf[-1] = 2.0 * zfull[-1] - zfull[-2]
+    return zhalf
+
+
+def interp_matrix(zhalf: np.ndarray, zhalf2: np.ndarray) -> np.ndarray:
+    """Returns the matrix averaging levels onto other levels by overlap.
+
+    ``interp_matrix(zhalf, zhalf2) @ y`` equals ``alcf.algorithms.interp(zhalf, y, zhalf2)``:
+    every target level is the average of the source levels it overlaps, weighted by their
+    overlap. Target levels outside of the source levels are 0.
+
+    Args:
+        zhalf (np.ndarray): Half levels of the source grid.
+        zhalf2 (np.ndarray): Half levels of the target grid.
+
+    Returns:
+        np.ndarray: The matrix, shape (target levels, source levels).
+    """
+    overlap = np.maximum(
+        0.0,
+        np.minimum(zhalf[np.newaxis, 1:], zhalf2[1:, np.newaxis])
+        - np.maximum(zhalf[np.newaxis, :-1], zhalf2[:-1, np.newaxis]),
+    )
+    total = overlap.sum(axis=1, keepdims=True)
+    return np.divide(overlap, total, out=np.zeros_like(overlap), where=total > 0)
+
+
+def levels(zres: float, zlim: Sequence[float]) -> np.ndarray:
+    """Returns the half levels of the output grid, as ALCF's ``zsample``"""
+    return np.arange(zlim[0], zlim[-1] + zres, zres)
+
+
+def weight_matrix(
+    zfull: np.ndarray, zres: float, zlim: Sequence[float]
+) -> scipy.sparse.csr_matrix:
+    """Returns the sparse matrix resampling the profiles of a geometry onto the output grid.
+
+    The matrix is that of :func:`interp_matrix`, plus explicit zeros where ALCF's ``interp``
+    multiplies a gate by a zero overlap: a gate ending where a level starts. A missing value
+    in such a gate then makes the level missing, as in ALCF. Matrices are cached per
+    geometry, the least recently used dropped past :data:`CACHE_SIZE`.
+
+    Args:
+        zfull (np.ndarray): Full levels of the range gates (m).
+        zres (float): Resolution of the output grid (m).
+        zlim (list): Limits of the output grid (m).
+
+    Returns:
+        scipy.sparse.csr_matrix: The matrix, shape (output levels, range gates).
+    """
+    zfull = np.ascontiguousarray(zfull, np.float64)
+    key = (zfull.tobytes(), float(zres), tuple(float(z) for z in zlim))
+    with _MATRICES_LOCK:
+        if key in _MATRICES:
+            _MATRICES.move_to_end(key)
+            return _MATRICES[key]
+
+    zhalf = half(zfull)
+    zhalf2 = levels(zres, zlim)
+    weights = interp_matrix(zhalf, zhalf2)
+    # interp only visits the levels starting below the top of the gates
+    touching = (zhalf[np.newaxis, 1:] == zhalf2[:-1, np.newaxis]) & (
+        zhalf2[:-1, np.newaxis] < zhalf[-1]
+    )
+    rows, columns = np.nonzero((weights > 0) | touching)
+    matrix = scipy.sparse.csr_matrix(
+        (weights[rows, columns], (rows, columns)), shape=weights.shape
+    )
+
+    with _MATRICES_LOCK:
+        _MATRICES[key] = matrix
+        while len(_MATRICES) > CACHE_SIZE:
+            _MATRICES.popitem(last=False)
+    return matrix
+
+
+def _apply(x: np.ndarray, zfull: np.ndarray, zres: float, zlim: Sequence[float]) -> np.ndarray:
+    """Resamples a (time, range[, channel]) array, profiles sharing their geometry at once"""
+    m = x.shape[1]
+    # Gates along the last axis: (time[, channel], range)
+    y = np.moveaxis(np.asarray(x, np.float64), 1, -1)
+    if zfull.ndim == 1 or np.all(zfull == zfull[0]):
+        groups = [(slice(None), zfull if zfull.ndim == 1 else zfull[0])]
+    else:
+        geometries, inverse = np.unique(zfull, axis=0, return_inverse=True)
+        groups = [(inverse == i, geometry) for i, geometry in enumerate(geometries)]
+
+    m2 = len(levels(zres, zlim)) - 1
+    y2 = np.empty(y.shape[:-1] + (m2,), np.float64)
+    for select, geometry in groups:
+        part = y[select]
+        product = weight_matrix(geometry, zres, zlim) @ part.reshape(-1, m).T
+        y2[select] = product.T.reshape(part.shape[:-1] + (m2,))
+    return np.moveaxis(y2, -1, 1)
+
+
+def zsample(d: dict, zres: Optional[float] = None, zlim: Optional[Sequence[float]] = None):
+    """Resamples a dataset onto the output levels in place, as ALCF's ``zsample``.
+
+    Args:
+        d (dict): The dataset, with ``backscatter`` and ``zfull``, and optionally
+            ``backscatter_mol`` and ``backscatter_sd``.
+        zres (float, optional): Resolution of the output grid (m).
+        zlim (list, optional): Limits of the output grid (m).
+    """
+    b = d["backscatter"]
+    if b.shape[1] == 0:
+        return
+    zfull = np.asarray(d["zfull"], np.float64)
+
+    d["backscatter"] = _apply(b, zfull, zres, zlim)
+    for name in ("backscatter_mol", "backscatter_sd"):
+        if name in d:
+            d[name] = _apply(d[name], zfull, zres, zlim)
+
+    zhalf2 = levels(zres, zlim)
+    d["zfull"] = (zhalf2[1:] + zhalf2[:-1]) * 0.5
+    d["."]["zfull"][".dims"] = ["level"]
+
+
+def stream(dd: list, state: dict, zres: Optional[float] = None, zlim=None, **options) -> list:
+    """Streams datasets through :func:`zsample`, as ``alcf.algorithms.zsample.stream``"""
+    return misc.stream(dd, state, zsample, zres=zres, zlim=zlim)
@@ -0,0 +1,411 @@
+"""Parallel, resumable lidar simulation of model output at stations
+
+Usage::
+
+    python -m app.simulate <model_type> <input> <lidar_type> <output> \\
+        --stations stations.json --start 2020-01-01 --end 2020-02-01 \\
+        [--step-hours 24] [--workers N] [--ncolumns 10] [--overlap maximum-random]
+
+``alcf model`` extracts model output at a point, then ``alcf simulate`` runs the COSP lidar
+simulator on it, one file at a time. Here, the model output is split into chunks, a time
+step of one station each. Every chunk is extracted and simulated by a task on a pool of
+processes using all the local cores, and the chunks of each station are then merged along
+the time into ``<output>/<station>.nc``.
+
+The stations are read from a JSON list of ``{"name": ..., "lon": ..., "lat": ...}``.
+Every finished chunk is appended to a JSON lines manifest, ``<output>/manifest.jsonl`` by
+default. A run started again with the same manifest and options skips the chunks already
+simulated, so a killed run resumes where it stopped.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from string import Template
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import ds_format as ds
+import aquarius_time as aq
+from alcf.cmds import model, simulate
+from alcf.lidars import LIDARS
+from aws_lambda_powertools import Logger
+
+LOGGER = Logger(child=True)
+
+#: Number of model levels of the simulator configuration, as ``alcf simulate``.
+NLEVELS = 60
+
+# Seconds between two progress reports
+_REPORT_INTERVAL = 30.0
+
+
+class Station(NamedTuple):
+    """A station at which the model output is simulated"""
+
+    name: str
+    lon: float
+    lat: float
+
+
+class Chunk(NamedTuple):
+    """A time step of the model output at a station"""
+
+    station: Station
+    start: float
+    end: float
+
+    @property
+    def name(self) -> str:
+        """The identifier of the chunk, as recorded in the manifest"""
+        return f"{self.station.name}/{aq.to_iso(self.start).replace(':', '')}"
+
+
+def read_stations(path: str) -> List[Station]:
+    """Reads the stations from a JSON list of names, longitudes and latitudes.
+
+    Args:
+        path (str): The JSON file.
+
+    Returns:
+        list: The stations.
+    """
+    with open(path) as handler:
+        return [
+            Station(str(item["name"]), float(item["lon"]), float(item["lat"]))
+            for item in json.load(handler)
+        ]
+
+
+def chunks(stations: List[Station], start: float, end: float, step: float) -> List[Chunk]:
+    """Splits a period at stations into chunks.
+
+    Args:
+        stations (list): The stations.
+        start (float): Start of the period (Julian date).
+        end (float): End of the period (Julian date), excluded.
+        step (float): Duration of a chunk (days).
+
+    Returns:
+        list: The chunks, in order of time then station, the steps of every station run
+        side by side.
+    """
+    starts = np.arange(start, end, step)
+    return [
+        Chunk(station, float(t), float(min(t + step, end)))
+        for t in starts
+        for station in stations
+    ]
+
+
+def chunk_path(output_dir: str, chunk: Chunk) -> str:
+    """Returns the simulated file of a chunk"""
+    return os.path.join(output_dir, "chunks", chunk.name + ".nc")
+
+
+def cosp_config(lidar_type: str, ncolumns: int = 10, overlap: str = "maximum-random") -> str:
+    """Returns the configuration of the COSP simulator, as ``alcf simulate``.
+
+    Args:
+        lidar_type (str): The ALCF lidar type to simulate.
+        ncolumns (int, optional): Number of SCOPS subcolumns.
+        overlap (str, optional): Cloud overlap assumption (``maximum``, ``random`` or
+            ``maximum-random``).
+
+    Returns:
+        str: The Fortran namelist.
+    """
+    lidar = LIDARS.get(lidar_type)
+    if lidar is None:
+        raise ValueError(f"Invalid lidar type: {lidar_type}")
+    if overlap not in simulate.OVERLAP:
+        raise ValueError(f"Invalid overlap: {overlap}")
+    return Template(simulate.CONFIG_TEMPLATE).substitute(
+        ncolumns=ncolumns,
+        nlevels=NLEVELS,
+        overlap=simulate.OVERLAP[overlap],
+        wavelength=lidar.WAVELENGTH,
+        max_range=lidar.MAX_RANGE,
+        surface_lidar=1 if lidar.SURFACE_LIDAR else 0,
+    )
+
+
+def simulate_chunk(
+    chunk: Chunk, model_type: str, input_dir: str, output_dir: str, config: str
+) -> Optional[str]:
+    """Extracts and simulates the model output of a chunk.
+
+    The simulated file is written under a temporary name, then renamed: a chunk is done
+    when its file exists.
+
+    Args:
+        chunk (Chunk): The chunk.
+        model_type (str): The ALCF model type (``era5``, ``merra2``...).
+        input_dir (str): The model output.
+        output_dir (str): The output directory of the run.
+        config (str): The configuration of the simulator, see :func:`cosp_config`.
+
+    Returns:
+        str: The simulated file, None if the model output does not cover the chunk.
+    """
+    path = chunk_path(output_dir, chunk)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    d = model.model(
+        model_type,
+        input_dir,
+        point=(chunk.station.lon, chunk.station.lat),
+        time=(chunk.start, chunk.end),
+    )
+    if d is None:
+        return None
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(path)) as work_dir:
+        model_path = os.path.join(work_dir, "model.nc")
+        simulated_path = os.path.join(work_dir, "simulated.nc")
+        ds.write(model_path, d)
+        simulate.cosp_alcf(config, model_path, simulated_path)
+        # The simulator does not report failures but by writing nothing
+        if not os.path.exists(simulated_path):
+            raise RuntimeError(f"The simulator wrote no output for {chunk.name}")
+        os.replace(simulated_path, path)
+    return path
+
+
+def merge_station(paths: List[str], output_path: str) -> int:
+    """Merges the simulated chunks of a station along the time.
+
+    Args:
+        paths (list): The simulated files of the chunks, in time order.
+        output_path (str): The merged file.
+
+    Returns:
+        int: The number of profiles.
+    """
+    d = ds.merge([ds.read(path) for path in paths], "time")
+    tmp_path = os.path.splitext(output_path)[0] + ".tmp.nc"
+    ds.write(tmp_path, d)
+    os.replace(tmp_path, output_path)
+    return len(d["time"])
+
+
+def options_fingerprint(model_type: str, input_dir: str, config: str, step: float) -> str:
+    """Returns an identifier of the options that change the simulated chunks"""
+    relevant = [model_type, os.path.abspath(input_dir), config, step]
+    return hashlib.sha256(json.dumps(relevant).encode()).hexdigest()[:16]
+
+
+def read_manifest(path: str, fingerprint: str) -> Dict[str, Optional[str]]:
+    """Reads the chunks already simulated with the same options from a manifest.
+
+    Args:
+        path (str): The manifest, which may not exist yet.
+        fingerprint (str): The fingerprint of the options, see :func:`options_fingerprint`.
+
+    Returns:
+        dict: The simulated file of every chunk done, None if the model output does not
+        cover the chunk.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as handler:
+        for line in handler:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of a killed run may be truncated
+                continue
+            if entry.get("options") != fingerprint or entry.get("error") is not None:
+                continue
+            if entry["output"] is None or os.path.exists(entry["output"]):
+                done[entry["chunk"]] = entry["output"]
+    return done
+
+
+def _simulate(chunk: Chunk, model_type: str, input_dir: str, output_dir: str, config: str):
+    """Task of a worker process: simulates one chunk, returning its file or the error"""
+    try:
+        return simulate_chunk(chunk, model_type, input_dir, output_dir, config), None
+    except Exception as error:  # pylint: disable=broad-except
+        LOGGER.exception("Failed to simulate %s", chunk.name)
+        return None, str(error)
+
+
+def _merge(paths: List[str], output_path: str):
+    """Task of a worker process: merges a station, returning its profiles or the error"""
+    try:
+        return merge_station(paths, output_path), None
+    except Exception as error:  # pylint: disable=broad-except
+        LOGGER.exception("Failed to merge %s", output_path)
+        return 0, str(error)
+
+
+def run(
+    stations: List[Station],
+    model_type: str,
+    input_dir: str,
+    lidar_type: str,
+    output_dir: str,
+    start: float,
+    end: float,
+    step: float = 1.0,
+    workers: Optional[int] = None,
+    manifest: Optional[str] = None,
+    ncolumns: int = 10,
+    overlap: str = "maximum-random",
+) -> dict:
+    """Simulates a period at stations on a pool of processes, merging every station.
+
+    Args:
+        stations (list): The stations.
+        model_type (str): The ALCF model type.
+        input_dir (str): The model output.
+        lidar_type (str): The ALCF lidar type to simulate.
+        output_dir (str): The output directory.
+        start (float): Start of the period (Julian date).
+        end (float): End of the period (Julian date), excluded.
+        step (float, optional): Duration of a chunk (days).
+        workers (int, optional): The number of worker processes, all the cores by default.
+        manifest (str, optional): The manifest of the run, ``<output>/manifest.jsonl`` by
+            default. The chunks it records as done with the same options are skipped.
+        ncolumns (int, optional): Number of SCOPS subcolumns.
+        overlap (str, optional): Cloud overlap assumption.
+
+    Returns:
+        dict: Counts of chunks (simulated, failed, skipped, merges failing too) and
+        profiles, the merged files, elapsed time and throughput.
+    """
+    config = cosp_config(lidar_type, ncolumns, overlap)
+    manifest = manifest or os.path.join(output_dir, "manifest.jsonl")
+    fingerprint = options_fingerprint(model_type, input_dir, config, step)
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = chunks(stations, start, end, step)
+    done = read_manifest(manifest, fingerprint)
+    pending = [chunk for chunk in tasks if chunk.name not in done]
+    LOGGER.info(
+        "Simulating %d chunk(s), %d already done", len(pending), len(tasks) - len(pending)
+    )
+
+    summary = dict(simulated=0, failed=0, skipped=len(tasks) - len(pending), profiles=0)
+    failed = set()
+    start_time = last_report = time.perf_counter()
+
+    # Spawned workers do not share the NetCDF library state of the parent
+    context = multiprocessing.get_context("spawn")
+    with open(manifest, "a") as handler, ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(), mp_context=context
+    ) as executor:
+        futures = {
+            executor.submit(_simulate, chunk, model_type, input_dir, output_dir, config): chunk
+            for chunk in pending
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            path, error = future.result()
+            entry = dict(chunk=chunk.name, options=fingerprint, output=path, error=error)
+            handler.write(json.dumps(entry) + "\n")
+            handler.flush()
+            if error is None:
+                done[chunk.name] = path
+                summary["simulated"] += 1
+            else:
+                failed.add(chunk.station.name)
+                summary["failed"] += 1
+
+            now = time.perf_counter()
+            if now - last_report >= _REPORT_INTERVAL:
+                last_report = now
+                LOGGER.info("Progress", extra=_throughput(summary, now - start_time))
+
+        # A station is merged once all its chunks are done, its merges run side by side
+        merges = {}
+        for station in stations:
+            paths = [
+                done[chunk.name]
+                for chunk in tasks
+                if chunk.station == station and done.get(chunk.name) is not None
+            ]
+            if station.name in failed or not paths:
+                continue
+            output_path = os.path.join(output_dir, station.name + ".nc")
+            merges[executor.submit(_merge, paths, output_path)] = output_path
+        summary["outputs"] = []
+        for future in as_completed(merges):
+            profiles, error = future.result()
+            if error is None:
+                summary["profiles"] += profiles
+                summary["outputs"].append(merges[future])
+            else:
+                summary["failed"] += 1
+
+    summary["outputs"].sort()
+    summary.update(_throughput(summary, time.perf_counter() - start_time))
+    return summary
+
+
+def _throughput(summary: dict, elapsed: float) -> dict:
+    """Returns the number of chunks and the throughput of a run"""
+    chunks_run = summary["simulated"] + summary["failed"]
+    return dict(
+        chunks=chunks_run,
+        elapsed=round(elapsed, 3),
+        chunks_per_second=chunks_run / elapsed if elapsed > 0 else 0.0,
+    )
+
+
+def main(argv: List[str] = None) -> int:
+    """Runs a simulation from the command line.
+
+    Args:
+        argv (list, optional): The arguments. Defaults to the command line.
+
+    Returns:
+        int: The exit status, 1 if any chunk failed.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model_type", help="ALCF model type (era5, merra2...)")
+    parser.add_argument("input", help="model output directory")
+    parser.add_argument("lidar_type", help="ALCF lidar type to simulate")
+    parser.add_argument("output", help="output directory")
+    parser.add_argument("--stations", required=True, help="JSON list of name, lon and lat")
+    parser.add_argument("--start", required=True, help="start time (ISO 8601)")
+    parser.add_argument("--end", required=True, help="end time (ISO 8601), excluded")
+    parser.add_argument("--step-hours", type=float, default=24.0, help="duration of a chunk")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes")
+    parser.add_argument("--manifest", help="checkpoint manifest")
+    parser.add_argument("--ncolumns", type=int, default=10, help="SCOPS subcolumns")
+    parser.add_argument("--overlap", default="maximum-random", help="cloud overlap")
+    args = parser.parse_args(argv)
+
+    summary = run(
+        read_stations(args.stations),
+        args.model_type,
+        args.input,
+        args.lidar_type,
+        args.output,
+        aq.from_iso(args.start),
+        aq.from_iso(args.end),
+        step=args.step_hours / 24.0,
+        workers=args.workers,
+        manifest=args.manifest,
+        ncolumns=args.ncolumns,
+        overlap=args.overlap,
+    )
+
+    print(
+        f"{summary['simulated']} chunk(s) simulated, {summary['failed']} failed, "
+        f"{summary['skipped']} skipped in {summary['elapsed']:.1f} s: "
+        f"{summary['chunks_per_second']:.2f} chunks/s, "
+        f"{len(summary['outputs'])} station file(s)"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,603 @@
+"""Incremental cloud occurrence and backscatter statistics
+
+``alcf stats`` recomputes its histograms from all the processed files of a period. Here,
+each processed file yields a small :class:`StatsState` per hour it covers: sums and
+counts per height and backscatter bin, on a fixed grid. States add up, so the stored
+hourly, daily and monthly aggregates are updated by merging the new state, in a time that
+does not depend on the history of the period. :func:`reduce` turns an aggregate into the
+statistics ``alcf stats`` computes for the same profiles (without profile filters).
+
+An input is merged once per content: a marker object is written per input once all its
+aggregates are updated, holding the hourly states of the input, and every aggregate keeps
+the digests of the last :data:`RECENT_SOURCES` inputs merged into it, for an input whose
+invocation failed before its marker was written. An input processed again with other
+results, e.g. other ALCF options, replaces its earlier states in the aggregates.
+"""
+
+import datetime as dt
+import hashlib
+import io
+import posixpath
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import ds_format as ds
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
+
+from . import storage
+from .processing import LOCK
+from .resample import half, interp_matrix
+
+LOGGER = Logger(child=True)
+
+#: Aggregation periods, with the format of their identifier.
+PERIODS = {
+    "hourly": "%Y-%m-%dT%H",
+    "daily": "%Y-%m-%d",
+    "monthly": "%Y-%m",
+}
+
+#: Variables of the processed files used by the statistics.
+VARIABLES = [
+    "time",
+    "zfull",
+    "backscatter",
+    "backscatter_sd",
+    "backscatter_mol",
+    "cloud_mask",
+]
+
+# Julian date of 1970-01-01 00:00 UTC
+_UNIX_EPOCH_JD = 2440587.5
+
+# Array fields of a state, adding up when states merge
+_FIELDS = (
+    "cl",
+    "backscatter_sum",
+    "backscatter_mol_sum",
+    "backscatter_hist",
+    "backscatter_sd_hist",
+)
+
+#: Number of inputs whose digest is kept by an aggregate.
+RECENT_SOURCES = 64
+
+# Attempts at a conditional update of an aggregate before giving up
+_UPDATE_ATTEMPTS = 10
+
+
+@dataclass(frozen=True)
+class StatsConfig:
+    """Grids of the statistics, with the defaults of ``alcf stats``"""
+
+    #: Height limits (m).
+    zlim: Tuple[float, float] = (0.0, 15000.0)
+    #: Height resolution (m).
+    zres: float = 100.0
+    #: Backscatter histogram limits (m-1 sr-1).
+    blim: Tuple[float, float] = (5e-6, 200e-6)
+    #: Backscatter histogram resolution (m-1 sr-1).
+    bres: float = 5e-6
+    #: Backscatter standard deviation histogram limits (m-1 sr-1).
+    bsd_lim: Tuple[float, float] = (0.001e-6, 10e-6)
+    #: Logarithmic backscatter standard deviation histogram.
+    bsd_log: bool = True
+    #: Backscatter standard deviation histogram resolution (m-1 sr-1).
+    bsd_res: float = 0.001e-6
+    #: Height of the backscatter standard deviation histogram (m).
+    bsd_z: float = 8000.0
+
+    def zfull(self) -> np.ndarray:
+        """Returns the full levels of the height grid"""
+        return np.arange(self.zlim[0] + 0.5 * self.zres, self.zlim[1], self.zres)
+
+    def backscatter_half(self) -> np.ndarray:
+        """Returns the edges of the backscatter histogram bins"""
+        return np.arange(self.blim[0], self.blim[1] + self.bres, self.bres)
+
+    def backscatter_sd_half(self) -> np.ndarray:
+        """Returns the edges of the backscatter standard deviation histogram bins"""
+        lo, hi = self.bsd_lim
+        if self.bsd_log:
+            step = np.log(lo + self.bsd_res) - np.log(lo)
+            return np.exp(np.arange(np.log(lo), np.log(hi + self.bsd_res), step))
+        return np.arange(lo, hi + self.bsd_res, self.bsd_res)
+
+
+def _histogram_2d(x: np.ndarray, bins: np.ndarray) -> np.ndarray:
+    """Histograms every column of ``x`` at once, as ``np.histogram`` per column.
+
+    Returns:
+        np.ndarray: The counts, shape (bins - 1, columns).
+    """
+    n, m = x.shape
+    o = len(bins) - 1
+    index = np.searchsorted(bins, x, side="right") - 1
+    # The last bin is closed on the right, as in np.histogram
+    index[x == bins[-1]] = o - 1
+    valid = (index >= 0) & (index < o)
+    columns = np.broadcast_to(np.arange(m), (n, m))
+    return np.bincount(
+        index[valid] * m + columns[valid], minlength=o * m
+    ).reshape(o, m).astype(np.float64)
+
+
+@dataclass
+class StatsState:
+    """Mergeable statistics of a set of profiles, on the grids of a :class:`StatsConfig`"""
+
+    #: Number of profiles.
+    n: int
+    #: Cloud occurrence count per height, shape (zfull,).
+    cl: np.ndarray
+    #: Number of profiles with a cloud.
+    clt: float
+    #: Sum of backscatter per height, shape (zfull,).
+    backscatter_sum: np.ndarray
+    #: Sum of molecular backscatter per height, shape (zfull,).
+    backscatter_mol_sum: np.ndarray
+    #: Backscatter histogram counts, shape (backscatter bins, zfull).
+    backscatter_hist: np.ndarray
+    #: Backscatter standard deviation histogram counts, shape (backscatter_sd bins,).
+    backscatter_sd_hist: np.ndarray
+    #: Height of the backscatter standard deviation histogram (m), NaN if unknown.
+    backscatter_sd_z: float = np.nan
+    #: Digests of the last inputs merged into a stored aggregate, oldest first, at most
+    #: :data:`RECENT_SOURCES`.
+    recent: Tuple[str, ...] = ()
+
+    @classmethod
+    def empty(cls, config: StatsConfig) -> "StatsState":
+        """Returns the state of no profile.
+
+        Args:
+            config (StatsConfig): The grids of the statistics.
+
+        Returns:
+            StatsState: The empty state.
+        """
+        m2 = len(config.zfull())
+        o = len(config.backscatter_half()) - 1
+        osd = len(config.backscatter_sd_half()) - 1
+        return cls(
+            n=0,
+            cl=np.zeros(m2),
+            clt=0.0,
+            backscatter_sum=np.zeros(m2),
+            backscatter_mol_sum=np.zeros(m2),
+            backscatter_hist=np.zeros((o, m2)),
+            backscatter_sd_hist=np.zeros(osd),
+        )
+
+    @classmethod
+    def from_dataset(
+        cls, d: dict, config: StatsConfig, mask: Optional[np.ndarray] = None
+    ) -> "StatsState":
+        """Computes the state of the profiles of a processed dataset.
+
+        Profiles with missing backscatter are left out, as in ``alcf stats``.
+
+        Args:
+            d (dict): The processed dataset, as written by ``alcf lidar``.
+            config (StatsConfig): The grids of the statistics.
+            mask (np.ndarray, optional): The profiles to use. Defaults to all.
+
+        Returns:
+            StatsState: The state.
+        """
+        state = cls.empty(config)
+
+        b = np.asarray(d["backscatter"], np.float64)
+        select = np.all(~np.isnan(b), axis=1)
+        if mask is not None:
+            select &= mask
+        if not np.any(select):
+            return state
+
+        zfull = np.asarray(d["zfull"], np.float64)
+        if zfull.ndim == 2:
+            zfull = zfull[0]
+        weights = interp_matrix(half(zfull), half(config.zfull()))
+
+        b = b[select]
+        cloud_mask = np.asarray(d["cloud_mask"])[select]
+
+        state.n = int(np.count_nonzero(select))
+        state.cl = weights @ cloud_mask.sum(axis=0, dtype=np.float64)
+        state.clt = float(np.count_nonzero(np.any(cloud_mask, axis=1)))
+        state.backscatter_sum = weights @ b.sum(axis=0)
+        if "backscatter_mol" in d:
+            state.backscatter_mol_sum = weights @ np.asarray(d["backscatter_mol"])[select].sum(
+                axis=0
+            )
+        state.backscatter_hist = _histogram_2d(b, config.backscatter_half()) @ weights.T
+
+        jsd = int(np.argmin(np.abs(zfull - config.bsd_z)))
+        state.backscatter_sd_z = float(zfull[jsd])
+        if "backscatter_sd" in d:
+            state.backscatter_sd_hist = np.histogram(
+                np.asarray(d["backscatter_sd"])[select][:, jsd],
+                bins=config.backscatter_sd_half(),
+            )[0].astype(np.float64)
+        return state
+
+    def copy(self) -> "StatsState":
+        """Returns a copy of the state, not sharing any array"""
+        return StatsState(
+            **{
+                name: np.copy(value) if isinstance(value, np.ndarray) else value
+                for name, value in self.__dict__.items()
+            }
+        )
+
+    def negative(self) -> "StatsState":
+        """Returns the state removing this one from the aggregates it is merged into"""
+        state = self.copy()
+        state.n = -state.n
+        state.clt = -state.clt
+        for name in _FIELDS:
+            setattr(state, name, -getattr(state, name))
+        return state
+
+    def merge(self, other: "StatsState") -> "StatsState":
+        """Merges another state into this one.
+
+        Args:
+            other (StatsState): The state to merge, on the same grids.
+
+        Returns:
+            StatsState: This state.
+
+        Raises:
+            ValueError: If the states are on different grids.
+        """
+        if self.backscatter_hist.shape != other.backscatter_hist.shape or len(
+            self.backscatter_sd_hist
+        ) != len(other.backscatter_sd_hist):
+            raise ValueError("Cannot merge statistics on different grids")
+
+        self.n += other.n
+        self.cl += other.cl
+        self.clt += other.clt
+        self.backscatter_sum += other.backscatter_sum
+        self.backscatter_mol_sum += other.backscatter_mol_sum
+        self.backscatter_hist += other.backscatter_hist
+        self.backscatter_sd_hist += other.backscatter_sd_hist
+        if np.isnan(self.backscatter_sd_z):
+            self.backscatter_sd_z = other.backscatter_sd_z
+        return self
+
+    def to_bytes(self) -> bytes:
+        """Serializes the state.
+
+        Returns:
+            bytes: The state, as a compressed NumPy archive.
+        """
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            n=self.n,
+            cl=self.cl,
+            clt=self.clt,
+            backscatter_sum=self.backscatter_sum,
+            backscatter_mol_sum=self.backscatter_mol_sum,
+            backscatter_hist=self.backscatter_hist,
+            backscatter_sd_hist=self.backscatter_sd_hist,
+            backscatter_sd_z=self.backscatter_sd_z,
+            recent=np.array(self.recent, dtype=np.str_),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "StatsState":
+        """Deserializes a state written by :meth:`to_bytes`.
+
+        Args:
+            data (bytes): The serialized state.
+
+        Returns:
+            StatsState: The state.
+        """
+        with np.load(io.BytesIO(data)) as archive:
+            if "recent" in archive.files:
+                recent = archive["recent"].tolist()
+            else:
+                # Aggregates written with the list of all their inputs
+                recent = [source_digest(x) for x in archive["sources"].tolist()]
+            return cls(
+                n=int(archive["n"]),
+                cl=archive["cl"],
+                clt=float(archive["clt"]),
+                backscatter_sum=archive["backscatter_sum"],
+                backscatter_mol_sum=archive["backscatter_mol_sum"],
+                backscatter_hist=archive["backscatter_hist"],
+                backscatter_sd_hist=archive["backscatter_sd_hist"],
+                backscatter_sd_z=float(archive["backscatter_sd_z"]),
+                recent=tuple(recent[-RECENT_SOURCES:]),
+            )
+
+
+def reduce(state: StatsState, config: StatsConfig) -> dict:
+    """Computes the statistics of a state, as ``alcf stats`` does.
+
+    Args:
+        state (StatsState): The state.
+        config (StatsConfig): The grids of the statistics.
+
+    Returns:
+        dict: The statistics (``cl``, ``clt``, ``backscatter_avg``, ``backscatter_hist``...),
+        in the units of ``alcf stats``.
+    """
+    n = state.n if state.n != 0 else np.nan
+    backscatter_half = config.backscatter_half()
+    backscatter_sd_half = config.backscatter_sd_half()
+    return {
+        "cl": 100.0 * state.cl / n,
+        "clt": 100.0 * state.clt / n,
+        "zfull": config.zfull(),
+        "n": state.n,
+        "backscatter_avg": state.backscatter_sum / n,
+        "backscatter_mol_avg": state.backscatter_mol_sum / n,
+        "backscatter_full": 0.5 * (backscatter_half[1:] + backscatter_half[:-1]),
+        "backscatter_hist": state.backscatter_hist / n,
+        "backscatter_sd_hist": state.backscatter_sd_hist / n,
+        "backscatter_sd_full": 0.5 * (backscatter_sd_half[1:] + backscatter_sd_half[:-1]),
+        "backscatter_sd_z": state.backscatter_sd_z,
+    }
+
+
+def read(path: str) -> dict:
+    """Reads the variables of a processed file used by the statistics.
+
+    Args:
+        path (str): The processed file.
+
+    Returns:
+        dict: The dataset.
+    """
+    with LOCK:
+        return ds.read(path, VARIABLES)
+
+
+def split_by_period(time: np.ndarray, period: str) -> Dict[str, np.ndarray]:
+    """Groups profiles by the period they fall in.
+
+    Args:
+        time (np.ndarray): Time of the profiles (Julian date, as in ALCF).
+        period (str): One of :data:`PERIODS`.
+
+    Returns:
+        dict: The mask of the profiles of each period, by period identifier.
+    """
+    seconds = np.round((np.asarray(time) - _UNIX_EPOCH_JD) * 86400.0).astype(np.int64)
+    unit = {"hourly": "h", "daily": "D", "monthly": "M"}[period]
+    periods = seconds.astype("M8[s]").astype(f"M8[{unit}]")
+    return {
+        dt.datetime.utcfromtimestamp(
+            int(value.astype("M8[s]").astype(np.int64))
+        ).strftime(PERIODS[period]): periods == value
+        for value in np.unique(periods)
+    }
+
+
+def stats_key(prefix: str, station: str, period: str, identifier: str) -> str:
+    """Returns the key of an aggregate.
+
+    Args:
+        prefix (str): The key prefix of the statistics.
+        station (str): The station, the first directory of the keys of its input files.
+        period (str): One of :data:`PERIODS`.
+        identifier (str): The identifier of the period, e.g. ``2020-01-01``.
+
+    Returns:
+        str: The key, ``<prefix><station>/<period>/<identifier>.npz``.
+    """
+    return prefix + posixpath.join(station, period, f"{identifier}.npz")
+
+
+def source_digest(source: str) -> str:
+    """Returns the digest identifying an input in the aggregates and its marker"""
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+
+
+def marker_key(prefix: str, station: str, source: str) -> str:
+    """Returns the key of the marker of an input merged into the aggregates.
+
+    Args:
+        prefix (str): The key prefix of the statistics.
+        station (str): The station, the first directory of the keys of its input files.
+        source (str): Identifier of the input.
+
+    Returns:
+        str: The key, ``<prefix><station>/sources/<digest>``.
+    """
+    return prefix + posixpath.join(station, "sources", source_digest(source))
+
+
+def update_aggregate(
+    bucket: str, key: str, state: StatsState, source: str, client=None
+) -> bool:
+    """Merges a state into a stored aggregate.
+
+    The aggregate is updated with a conditional write, retried when another invocation
+    updated it in the meantime. A state whose input is one of the last inputs merged is
+    skipped, so a file redelivered after a failed invocation is counted once.
+
+    Args:
+        bucket (str): The bucket of the aggregate.
+        key (str): The key of the aggregate.
+        state (StatsState): The state to merge.
+        source (str): Identifier of the input of the state.
+        client (optional): The S3 client to use.
+
+    Returns:
+        bool: True if the aggregate was updated, False if the state was already merged.
+    """
+    digest = source_digest(source)
+    client = client or storage.get_client()
+
+    for attempt in range(_UPDATE_ATTEMPTS):
+        try:
+            response = client.get_object(Bucket=bucket, Key=key)
+            aggregate = StatsState.from_bytes(response["Body"].read())
+            condition = dict(IfMatch=response["ETag"])
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            aggregate = None
+            condition = dict(IfNoneMatch="*")
+
+        if aggregate is None:
+            aggregate = state.copy()
+        elif digest in aggregate.recent:
+            return False
+        else:
+            aggregate.merge(state)
+        aggregate.recent = (aggregate.recent + (digest,))[-RECENT_SOURCES:]
+
+        try:
+            client.put_object(Bucket=bucket, Key=key, Body=aggregate.to_bytes(), **condition)
+            return True
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in (
+                "PreconditionFailed",
+                "ConditionalRequestConflict",
+            ):
+                raise
+            LOGGER.debug("Concurrent update of %s, retrying", key)
+            time.sleep(0.05 * 2**attempt)
+
+    raise RuntimeError(f"Could not update {key} after {_UPDATE_ATTEMPTS} attempts")
+
+
+def _fingerprint(hours: Dict[str, StatsState]) -> str:
+    """Returns the digest of the hourly states of an input"""
+    digest = hashlib.sha256()
+    for identifier in sorted(hours):
+        state = hours[identifier]
+        digest.update(identifier.encode("utf-8"))
+        digest.update(np.array([state.n, state.clt, state.backscatter_sd_z]).tobytes())
+        for name in _FIELDS:
+            digest.update(np.ascontiguousarray(getattr(state, name)).tobytes())
+    return digest.hexdigest()[:32]
+
+
+def _periods(hours: Dict[str, StatsState]) -> Dict[Tuple[str, str], StatsState]:
+    """Returns the states of the hours, days and months of the hourly states of an input"""
+    states = {}
+    for identifier, state in hours.items():
+        hour = dt.datetime.strptime(identifier, PERIODS["hourly"])
+        states[("hourly", identifier)] = state.copy()
+        for period in ("daily", "monthly"):
+            key = (period, hour.strftime(PERIODS[period]))
+            if key in states:
+                states[key].merge(state)
+            else:
+                states[key] = state.copy()
+    return states
+
+
+def _marker_bytes(hours: Dict[str, StatsState], fingerprint: str) -> bytes:
+    """Serializes the hourly states of an input into its marker"""
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        fingerprint=np.str_(fingerprint),
+        **{
+            identifier: np.frombuffer(state.to_bytes(), np.uint8)
+            for identifier, state in hours.items()
+        },
+    )
+    return buffer.getvalue()
+
+
+def _read_marker(
+    bucket: str, key: str, client
+) -> Optional[Tuple[Optional[str], Dict[str, StatsState]]]:
+    """Reads the marker of an input.
+
+    Returns:
+        tuple: The fingerprint and the hourly states of the input, ``(None, {})`` for a
+        marker of an earlier version holding no state, None if there is no marker.
+    """
+    try:
+        data = client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return None
+    if not data:
+        return None, {}
+    with np.load(io.BytesIO(data)) as archive:
+        return str(archive["fingerprint"]), {
+            name: StatsState.from_bytes(archive[name].tobytes())
+            for name in archive.files
+            if name != "fingerprint"
+        }
+
+
+def update(
+    d: dict,
+    source: str,
+    station: str,
+    bucket: str,
+    prefix: str,
+    config: StatsConfig = StatsConfig(),
+    client=None,
+) -> int:
+    """Merges the profiles of a processed dataset into the hourly, daily and monthly aggregates.
+
+    Nothing is merged when the marker of the input holds the same states: the input was
+    merged before. When its states differ, the input was processed again with other results,
+    and its earlier states are replaced. A marker of an earlier version, holding no state,
+    leaves the aggregates unchanged.
+
+    Args:
+        d (dict): The processed dataset.
+        source (str): Identifier of the input of the dataset.
+        station (str): The station, the first directory of the keys of its input files.
+        bucket (str): The bucket of the aggregates.
+        prefix (str): The key prefix of the aggregates.
+        config (StatsConfig, optional): The grids of the statistics.
+        client (optional): The S3 client to use.
+
+    Returns:
+        int: The number of aggregates updated.
+    """
+    client = client or storage.get_client()
+
+    # Compute the state of each hour once: days and months merge the states of their hours
+    hours = {
+        identifier: StatsState.from_dataset(d, config, mask=mask)
+        for identifier, mask in split_by_period(d["time"], "hourly").items()
+    }
+    hours = {identifier: state for identifier, state in hours.items() if state.n > 0}
+    fingerprint = _fingerprint(hours)
+
+    marker = marker_key(prefix, station, source)
+    merged = _read_marker(bucket, marker, client)
+    if merged is not None and merged[0] in (None, fingerprint):
+        return 0
+
+    updates = _periods(hours)
+    if merged is not None:
+        for key, state in _periods(merged[1]).items():
+            if key in updates:
+                updates[key].merge(state.negative())
+            else:
+                updates[key] = state.negative()
+
+    updated = 0
+    for (period, identifier), state in updates.items():
+        updated += update_aggregate(
+            bucket,
+            stats_key(prefix, station, period, identifier),
+            state,
+            f"{source}#{fingerprint}",
+            client=client,
+        )
+    client.put_object(Bucket=bucket, Key=marker, Body=_marker_bytes(hours, fingerprint))
+    return updated
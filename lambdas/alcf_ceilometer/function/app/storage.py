@@ -0,0 +1,207 @@
+"""Object store access of the alcf_ceilometer function
+
+One S3 client is shared by all the workers of the container and kept for warm
+invocations, its connection pool sized for their parallel transfers. Objects larger than
+:data:`PART_SIZE` are transferred in parts run in parallel: ranged GETs for downloads and
+multipart uploads for uploads, from and to local files or memory buffers.
+"""
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Union
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+#: Size of the parts of a transfer (bytes). Smaller objects take a single request.
+PART_SIZE = 8 * 1024 * 1024
+
+#: Number of parts of an object transferred in parallel.
+TRANSFER_THREADS = 8
+
+#: Connections kept open by the client, for the parallel parts of the files of all the
+#: workers of the container.
+POOL_CONNECTIONS = 64
+
+#: Transfer settings of the files.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=PART_SIZE,
+    multipart_chunksize=PART_SIZE,
+    max_concurrency=TRANSFER_THREADS,
+)
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+# Total size in the Content-Range header of a ranged GET
+_CONTENT_RANGE = re.compile(r"bytes \d+-\d+/(\d+)")
+
+
+def get_client():
+    """Returns the S3 client shared by all the workers of the container.
+
+    The client is created once and kept for warm invocations. Setting ``S3_ENDPOINT_URL``
+    points it to a local S3 stand-in (moto server, minio...).
+
+    Returns:
+        botocore.client.S3: The S3 client.
+    """
+    global _CLIENT  # pylint: disable=global-statement
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = boto3.client(
+                "s3",
+                endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+                config=Config(
+                    max_pool_connections=POOL_CONNECTIONS,
+                    retries={"mode": "standard"},
+                    tcp_keepalive=True,
+                ),
+            )
+        return _CLIENT
+
+
+def download(bucket: str, key: str, path: str, client=None) -> int:
+    """Downloads an object to a local file, in parallel ranged GETs if it is large.
+
+    Args:
+        bucket (str): The bucket of the object.
+        key (str): The key of the object.
+        path (str): The destination file.
+        client (optional): The S3 client to use. Defaults to :func:`get_client`.
+
+    Returns:
+        int: The number of bytes downloaded.
+    """
+    (client or get_client()).download_file(bucket, key, path, Config=TRANSFER_CONFIG)
+    return os.path.getsize(path)
+
+
+def upload(path: str, bucket: str, key: str, client=None) -> int:
+    """Uploads a local file, in a parallel multipart upload if it is large.
+
+    Args:
+        path (str): The file to upload.
+        bucket (str): The destination bucket.
+        key (str): The destination key.
+        client (optional): The S3 client to use. Defaults to :func:`get_client`.
+
+    Returns:
+        int: The number of bytes uploaded.
+    """
+    (client or get_client()).upload_file(path, bucket, key, Config=TRANSFER_CONFIG)
+    return os.path.getsize(path)
+
+
+def read(bucket: str, key: str, client=None) -> bytearray:
+    """Reads an object into memory, in parallel ranged GETs if it is large.
+
+    The first part also gives the size of the object; the other parts are read in
+    parallel, from the same version of the object, straight into the buffer.
+
+    Args:
+        bucket (str): The bucket of the object.
+        key (str): The key of the object.
+        client (optional): The S3 client to use. Defaults to :func:`get_client`.
+
+    Returns:
+        bytearray: The content of the object.
+    """
+    client = client or get_client()
+    try:
+        first = client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{PART_SIZE - 1}")
+    except ClientError as error:
+        # An empty object has no range
+        if error.response["Error"]["Code"] != "InvalidRange":
+            raise
+        return bytearray()
+    match = _CONTENT_RANGE.match(first.get("ContentRange", ""))
+    size = int(match.group(1)) if match else first["ContentLength"]
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    view[: first["ContentLength"]] = first["Body"].read()
+
+    def fetch(start: int):
+        end = min(start + PART_SIZE, size)
+        response = client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}", IfMatch=first["ETag"]
+        )
+        view[start:end] = response["Body"].read()
+
+    starts = range(first["ContentLength"], size, PART_SIZE)
+    if len(starts) > 0:
+        with ThreadPoolExecutor(max_workers=TRANSFER_THREADS) as executor:
+            list(executor.map(fetch, starts))
+    return buffer
+
+
+def stream(
+    bucket: str, key: str, client=None, chunk_size: int = 1024 * 1024
+) -> Iterator[bytes]:
+    """Reads an object as it is downloaded, in chunks.
+
+    Args:
+        bucket (str): The bucket of the object.
+        key (str): The key of the object.
+        client (optional): The S3 client to use. Defaults to :func:`get_client`.
+        chunk_size (int, optional): Size of the chunks (bytes).
+
+    Yields:
+        bytes: The next chunk of the object.
+    """
+    body = (client or get_client()).get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def write(
+    body: Union[bytes, bytearray, memoryview], bucket: str, key: str, client=None, **extra
+) -> int:
+    """Writes an object from memory, in a parallel multipart upload if it is large.
+
+    Args:
+        body (bytes): The content of the object.
+        bucket (str): The destination bucket.
+        key (str): The destination key.
+        client (optional): The S3 client to use. Defaults to :func:`get_client`.
+        **extra: Other arguments of the upload, e.g. ``ContentType``.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    client = client or get_client()
+    view = memoryview(body).cast("B")
+    if len(view) <= PART_SIZE:
+        client.put_object(Bucket=bucket, Key=key, Body=bytes(view), **extra)
+        return len(view)
+
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, **extra)["UploadId"]
+
+    def put(number: int) -> dict:
+        start = (number - 1) * PART_SIZE
+        response = client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=bytes(view[start : start + PART_SIZE]),
+        )
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    try:
+        with ThreadPoolExecutor(max_workers=TRANSFER_THREADS) as executor:
+            parts = list(executor.map(put, range(1, -(-len(view) // PART_SIZE) + 1)))
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return len(view)
@@ -0,0 +1,340 @@
+"""Chunked, compressed time series store of the processed profiles of a station
+
+Besides the processed NetCDF files, the profiles of every station are written to one Zarr
+group, ``<store_prefix><station>.zarr`` in the output bucket. Its arrays share a regular
+time axis starting on 1970-01-01, with one row per output time step, and are chunked in
+time (a day by default, so that a file rewrites a small chunk) and compressed. A processed
+file fills the rows of its profiles: the store grows at its end as new files arrive, late or
+reprocessed files overwrite their own rows, and chunks never written are not stored.
+
+The metadata of all the arrays is consolidated into a single object, so reading a month
+takes a metadata read and the chunks of the month, read in parallel (:func:`read`), instead
+of opening every processed file.
+
+Any number of invocations can write to the store of a station. Every object of an S3 store
+is written with a condition on the version read (:class:`S3Store`): a write racing another
+fails instead of losing its rows, and :func:`write` starts over.
+"""
+
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+import ds_format as ds
+import zarr
+from aws_lambda_powertools import Logger
+from botocore.exceptions import ClientError
+from numcodecs import Blosc
+from zarr.storage import BaseStore
+
+from . import storage
+from .processing import LOCK
+
+LOGGER = Logger(child=True)
+
+#: Variables of the processed files written to the store.
+VARIABLES = ["time", "time_bnds", "zfull", "backscatter", "cloud_mask", "cbh"]
+
+#: Number of days of profiles per chunk.
+CHUNK_DAYS = 1
+
+#: Number of chunks read at a time.
+READ_THREADS = 16
+
+# Attempts of a write racing other writes
+_WRITE_ATTEMPTS = 10
+
+# Julian date of the origin of the time axis, 1970-01-01 00:00 UTC
+_ORIGIN_JD = 2440587.5
+
+_COMPRESSOR = Blosc(cname="zstd", clevel=3, shuffle=Blosc.SHUFFLE)
+
+# Time × range arrays, with their type and fill value
+_PROFILE_ARRAYS = {
+    "backscatter": ("f4", np.nan),
+    "cloud_mask": ("i1", 0),
+}
+
+# Time series arrays, with their type and fill value
+_SERIES_ARRAYS = {
+    "time": ("f8", np.nan),
+    "cbh": ("f8", np.nan),
+}
+
+
+
+class ConcurrentWriteError(Exception):
+    """An object of a store was changed by another writer since it was read"""
+
+
+class S3Store(BaseStore):
+    """Zarr store of the objects under a key prefix of a bucket
+
+    The store remembers the version (ETag) of every object it reads, or finds missing, and
+    only overwrites an object in that version, or creates it if it was missing: S3 rejects
+    the write otherwise and :class:`ConcurrentWriteError` is raised. :meth:`forget` starts
+    a new sequence of reads and writes.
+    """
+
+    def __init__(self, bucket: str, prefix: str, client=None):
+        """Constructor
+
+        Args:
+            bucket (str): The bucket.
+            prefix (str): The key prefix of the store, ending with a slash.
+            client (optional): The S3 client to use.
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or storage.get_client()
+        # ETag of the objects read, None for those found missing
+        self._etags: Dict[str, Optional[str]] = {}
+
+    @property
+    def path(self) -> str:
+        """The URL of the store"""
+        return f"s3://{self.bucket}/{self.prefix}"
+
+    def forget(self):
+        """Forgets the versions of the objects read"""
+        self._etags = {}
+
+    def __getitem__(self, key: str) -> bytes:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                self._etags[key] = None
+                raise KeyError(key) from error
+            raise
+        self._etags[key] = response["ETag"]
+        return response["Body"].read()
+
+    def getitems(self, keys, **kwargs) -> dict:  # pylint: disable=unused-argument
+        """Reads objects in parallel, skipping the missing ones"""
+
+        def get(key):
+            try:
+                return key, self[key]
+            except KeyError:
+                return key, None
+
+        with ThreadPoolExecutor(max_workers=READ_THREADS) as executor:
+            return {key: value for key, value in executor.map(get, keys) if value is not None}
+
+    def __setitem__(self, key: str, value: bytes):
+        # Objects written without being read, e.g. new chunks, are looked up first
+        if key not in self._etags and key not in self:
+            self._etags[key] = None
+        etag = self._etags[key]
+        condition = dict(IfNoneMatch="*") if etag is None else dict(IfMatch=etag)
+        try:
+            response = self.client.put_object(
+                Bucket=self.bucket, Key=self.prefix + key, Body=bytes(value), **condition
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] in (
+                "PreconditionFailed",
+                "ConditionalRequestConflict",
+            ):
+                raise ConcurrentWriteError(f"{self.path}{key}") from error
+            raise
+        self._etags[key] = response["ETag"]
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def __contains__(self, key) -> bool:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                self._etags[key] = None
+                return False
+            raise
+        self._etags[key] = response["ETag"]
+        return True
+
+    def __iter__(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(self.prefix) :]
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+def station_store(bucket: str, prefix: str, station: str, client=None) -> S3Store:
+    """Returns the store of a station.
+
+    Args:
+        bucket (str): The bucket of the stores.
+        prefix (str): The key prefix of the stores.
+        station (str): The station, the first directory of the keys of its input files.
+        client (optional): The S3 client to use.
+
+    Returns:
+        S3Store: The store, ``<prefix><station>.zarr/``.
+    """
+    return S3Store(bucket, f"{prefix}{station.strip('/')}.zarr/", client=client)
+
+
+def _time_step(d: dict) -> float:
+    """Returns the output time step of a processed dataset (s)"""
+    time_bnds = np.asarray(d["time_bnds"], np.float64)
+    return float(np.round(np.median(time_bnds[:, 1] - time_bnds[:, 0]) * 86400.0))
+
+
+def _create(group: zarr.Group, time_step: float, zfull: np.ndarray):
+    """Creates the arrays of a group, those missing after an interrupted creation.
+
+    ``time`` is created last: a group holding it is complete.
+    """
+    rows = int(round(CHUNK_DAYS * 86400.0 / time_step))
+    group.attrs.update(time_origin=_ORIGIN_JD, time_step=time_step)
+    if "zfull" not in group:
+        group.array("zfull", zfull, compressor=None)
+    arrays = {}
+    for name, (dtype, fill_value) in _PROFILE_ARRAYS.items():
+        arrays[name] = ((rows, len(zfull)), dtype, fill_value)
+    for name, (dtype, fill_value) in _SERIES_ARRAYS.items():
+        arrays[name] = ((rows,), dtype, fill_value)
+    for name in sorted(arrays, key=lambda name: name == "time"):
+        chunks, dtype, fill_value = arrays[name]
+        if name not in group:
+            group.create(
+                name,
+                shape=(0,) + chunks[1:],
+                chunks=chunks,
+                dtype=dtype,
+                fill_value=fill_value,
+                compressor=_COMPRESSOR,
+                write_empty_chunks=False,
+            )
+
+
+def write(d: dict, store: MutableMapping) -> int:
+    """Writes the profiles of a processed dataset to a store.
+
+    Only the profiles holding data are written; the other rows keep their content. Writing
+    rows is idempotent: a write racing another write to an S3 store is started over, up to
+    a number of attempts.
+
+    Args:
+        d (dict): The processed dataset, with the variables of :data:`VARIABLES`.
+        store (MutableMapping): The store, e.g. :func:`station_store`.
+
+    Returns:
+        int: The number of profiles written.
+
+    Raises:
+        ValueError: If the time step or the levels of the dataset differ from the store's.
+        RuntimeError: If the store kept changing during every attempt.
+    """
+    backscatter = np.asarray(d["backscatter"], np.float64)
+    valid = ~np.all(np.isnan(backscatter), axis=1)
+    if not np.any(valid):
+        return 0
+
+    for attempt in range(_WRITE_ATTEMPTS):
+        if isinstance(store, S3Store):
+            store.forget()
+        try:
+            _write_rows(d, valid, store)
+            return int(np.count_nonzero(valid))
+        except ConcurrentWriteError as error:
+            LOGGER.debug("Concurrent write of %s, retrying", error)
+            time.sleep(0.05 * 2**attempt)
+
+    raise RuntimeError(f"Could not write to the store after {_WRITE_ATTEMPTS} attempts")
+
+
+def _write_rows(d: dict, valid: np.ndarray, store: MutableMapping):
+    """Writes the valid profiles of a processed dataset to a store, see :func:`write`"""
+    time_step = _time_step(d)
+    zfull = np.asarray(d["zfull"], np.float64)
+    if zfull.ndim == 2:
+        zfull = zfull[0]
+
+    # The version of the consolidated metadata is read before the arrays, so that
+    # consolidating arrays read before another writer's changes fails
+    _ = ".zmetadata" in store
+    group = zarr.open_group(store, mode="a")
+    if "time" not in group:
+        _create(group, time_step, zfull)
+    if group.attrs["time_step"] != time_step:
+        raise ValueError(
+            f"Time step of {time_step} s, the store has {group.attrs['time_step']} s"
+        )
+    if not np.array_equal(group["zfull"][:], zfull):
+        raise ValueError("Levels differ from the levels of the store")
+
+    # Row of the time step starting at the lower bound of each profile
+    start = np.asarray(d["time_bnds"], np.float64)[valid, 0]
+    rows = np.round((start - _ORIGIN_JD) * 86400.0 / time_step).astype(np.int64)
+    if rows.min() < 0:
+        raise ValueError("Profiles before 1970 cannot be stored")
+
+    end = int(rows.max()) + 1
+    if end > group["time"].shape[0]:
+        for array_name in _SERIES_ARRAYS:
+            group[array_name].resize(end)
+        for array_name in _PROFILE_ARRAYS:
+            group[array_name].resize(end, len(zfull))
+
+    group["time"].oindex[rows] = np.asarray(d["time"], np.float64)[valid]
+    group["cbh"].oindex[rows] = np.asarray(d["cbh"], np.float64)[valid]
+    group["backscatter"].oindex[rows, :] = np.asarray(d["backscatter"], np.float64)[valid]
+    group["cloud_mask"].oindex[rows, :] = np.asarray(d["cloud_mask"], np.int8)[valid]
+
+    zarr.consolidate_metadata(store)
+
+
+def write_file(path: str, store: MutableMapping) -> int:
+    """Writes the profiles of a processed file to a store.
+
+    Args:
+        path (str): The processed file.
+        store (MutableMapping): The store.
+
+    Returns:
+        int: The number of profiles written.
+    """
+    with LOCK:
+        d = ds.read(path, VARIABLES)
+    return write(d, store)
+
+
+def read(store: MutableMapping, start: float, end: float) -> dict:
+    """Reads the profiles of a time window from a store.
+
+    Args:
+        store (MutableMapping): The store.
+        start (float): Start of the window (Julian date), included.
+        end (float): End of the window (Julian date), excluded.
+
+    Returns:
+        dict: ``time``, ``zfull``, ``backscatter``, ``cloud_mask`` and ``cbh`` of the
+        profiles of the window.
+    """
+    group = zarr.open_consolidated(store, mode="r")
+    time_step = group.attrs["time_step"]
+    size = group["time"].shape[0]
+    first = int(np.floor((start - _ORIGIN_JD) * 86400.0 / time_step))
+    last = int(np.ceil((end - _ORIGIN_JD) * 86400.0 / time_step)) + 1
+    first, last = min(size, max(0, first)), min(size, max(0, last))
+
+    time = group["time"][first:last]
+    valid = ~np.isnan(time) & (time >= start) & (time < end)
+    return {
+        "time": time[valid],
+        "zfull": group["zfull"][:],
+        "backscatter": group["backscatter"][first:last][valid],
+        "cloud_mask": group["cloud_mask"][first:last][valid].astype(bool),
+        "cbh": group["cbh"][first:last][valid],
+    }
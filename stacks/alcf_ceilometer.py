@@ -3,16 +3,64 @@
 from pkg_resources import resource_filename
 
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 from aws_cdk import (
-    core as cdk
+    core as cdk,
+    aws_lambda as lambda_,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_s3 as s3,
+    aws_s3_notifications as s3_notifications,
+    aws_sqs as sqs,
 )
 
-from .utils import consolidate_config, resolve_tags
+from .lanes import LANES_SCHEMA, Lane, plan_lanes
+from .utils import Field, consolidate_config, resolve_tags
+
+# The Dockerfile building the function image is at the root of the repository
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
 
 
 class Alcf_ceilometerStack(cdk.Stack):
     """Stack to deploy resources for alcf_ceilometer"""
 
+    #: Schema of the consolidated configuration, checked when it is loaded.
+    CONFIG_SCHEMA = dict(
+        app_name=Field(str),
+        stack_name=Field(str),
+        allow_multiple=Field(bool),
+        input_buckets=Field(list, required=False),
+        output_bucket=Field(str, required=False),
+        function=Field(
+            dict(
+                memory_size=Field(int),
+                timeout=Field(int),
+                max_workers=Field(int),
+                lidar_type=Field(str),
+                output_prefix=Field(str),
+                stats_prefix=Field(str, required=False),
+                store_prefix=Field(str, required=False),
+                cache_prefix=Field(str, required=False),
+                calibration_prefix=Field(str, required=False),
+                query_prefix=Field(str, required=False),
+                quicklook_prefix=Field(str, required=False),
+                event_sample_rate=Field((int, float), required=False),
+            )
+        ),
+        query=Field(dict(memory_size=Field(int), timeout=Field(int)), required=False),
+        queue=Field(
+            dict(
+                batch_size=Field(int),
+                max_batching_window=Field(int),
+                max_receive_count=Field(int),
+                coalesce=Field(bool, required=False),
+            )
+        ),
+        stations=Field(dict, required=False),
+        lanes=Field(LANES_SCHEMA, required=False),
+        tags=Field(dict),
+        git=Field(dict, required=False),
+    )
+
     @classmethod
     def load_config(cls, target_env: str, use_git_info: bool) -> dict:
         """Loads the configuration for the given stack.
@@ -30,6 +78,7 @@ class Alcf_ceilometerStack(cdk.Stack):
             resource_filename(__name__, f"configurations/{cls.__name__}.yaml"),
             target_env,
             use_git_info=use_git_info,
+            schema=cls.CONFIG_SCHEMA,
         )
 
     def __init__(
@@ -61,8 +110,260 @@ class Alcf_ceilometerStack(cdk.Stack):
         # Call the super constructor
         super().__init__(app, id, **kwargs)
 
-        # Add code here
+        # Without a station registry, a single queue and function process every file
+        self.lanes = plan_lanes(self.config)
+        self.lane_resources: Dict[str, Tuple[sqs.Queue, lambda_.DockerImageFunction]] = {}
+        if self.lanes:
+            self.queue = self.function = None
+            for lane in self.lanes:
+                self.lane_resources[lane.name] = self.create_lane(lane)
+            self.route_stations()
+        else:
+            self.queue = self.create_queue()
+            self.function = self.create_function()
+            self.add_queue_source(self.function, self.queue)
+            self.route_inputs()
+
+        self.query_function = (
+            self.create_query_function()
+            if self.config["function"].get("query_prefix")
+            else None
+        )
+
+    def add_queue_source(
+        self,
+        function: lambda_.DockerImageFunction,
+        queue: sqs.Queue,
+        batch_size: Optional[int] = None,
+    ):
+        """Feeds a function with the notifications of a queue.
+
+        Args:
+            function (lambda_.DockerImageFunction): The function.
+            queue (sqs.Queue): The queue.
+            batch_size (int, optional): The messages per invocation. Defaults to the
+                configured batch size.
+        """
+        # Report partial batch failures so that only the failed files are redelivered
+        function.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                queue,
+                batch_size=batch_size or self.config["queue"]["batch_size"],
+                max_batching_window=cdk.Duration.seconds(
+                    self.config["queue"]["max_batching_window"]
+                ),
+                report_batch_item_failures=True,
+            )
+        )
+
+    def create_lane(self, lane: Lane) -> Tuple[sqs.Queue, lambda_.DockerImageFunction]:
+        """Creates the processing lane of a shard of stations: its queue and function.
+
+        Args:
+            lane (Lane): The lane, see :func:`stacks.lanes.plan_lanes`.
+
+        Returns:
+            tuple: The queue and the function of the lane.
+        """
+        scope = cdk.Construct(self, f"Lane-{lane.name}")
+        queue = self.create_queue(scope, timeout=lane.timeout)
+        function = self.create_function(
+            scope,
+            lidar_type=lane.lidar_type,
+            memory_size=lane.memory_size,
+            timeout=lane.timeout,
+            reserved_concurrency=lane.reserved_concurrency,
+        )
+        self.add_queue_source(function, queue, batch_size=lane.batch_size)
+        return queue, function
+
+    def route_inputs(self):
+        """Sends the S3 notifications of the files of the input buckets to the queue.
+
+        Without an output bucket, the processed files and the derived products are written
+        to the input buckets, whose notifications would send them back to the function:
+        those notifications are left to be wired outside the stack, filtered on the keys of
+        the raw files.
+        """
+        if not self.config.get("output_bucket"):
+            if self.config.get("input_buckets"):
+                cdk.Annotations.of(self).add_warning(
+                    "No output bucket: the S3 notifications of the input buckets must be sent "
+                    "to the queue outside the stack, filtered on the keys of the raw files"
+                )
+            return
+        destination = s3_notifications.SqsDestination(self.queue)
+        for bucket_name in self.config.get("input_buckets", []):
+            bucket = s3.Bucket.from_bucket_name(self, f"Notifications{bucket_name}", bucket_name)
+            bucket.add_event_notification(s3.EventType.OBJECT_CREATED, destination)
+
+    def route_stations(self):
+        """Sends the S3 notifications of the files of each station to the queue of its lane"""
+        for bucket_name in self.config.get("input_buckets", []):
+            bucket = s3.Bucket.from_bucket_name(self, f"Notifications{bucket_name}", bucket_name)
+            for lane in self.lanes:
+                destination = s3_notifications.SqsDestination(self.lane_resources[lane.name][0])
+                for station in lane.stations:
+                    bucket.add_event_notification(
+                        s3.EventType.OBJECT_CREATED,
+                        destination,
+                        s3.NotificationKeyFilter(prefix=station.prefix),
+                    )
+
+    def create_queue(
+        self, scope: Optional[cdk.Construct] = None, timeout: Optional[int] = None
+    ) -> sqs.Queue:
+        """Creates the queue of S3 notifications feeding the function.
+
+        Args:
+            scope (cdk.Construct, optional): The scope of the queue, the stack by default.
+            timeout (int, optional): The timeout of the function it feeds (s). Defaults to
+                the configured timeout.
+
+        Returns:
+            sqs.Queue: The queue, with its dead letter queue.
+        """
+        scope = scope or self
+        timeout = timeout or self.config["function"]["timeout"]
+        dead_letter_queue = sqs.Queue(
+            scope,
+            "DeadLetterQueue",
+            retention_period=cdk.Duration.days(14),
+        )
+
+        return sqs.Queue(
+            scope,
+            "Queue",
+            # AWS recommends six times the timeout of the function for SQS event sources
+            visibility_timeout=cdk.Duration.seconds(6 * timeout),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=self.config["queue"]["max_receive_count"],
+                queue=dead_letter_queue,
+            ),
+        )
+
+    def create_function(
+        self,
+        scope: Optional[cdk.Construct] = None,
+        lidar_type: Optional[str] = None,
+        memory_size: Optional[int] = None,
+        timeout: Optional[int] = None,
+        reserved_concurrency: Optional[int] = None,
+    ) -> lambda_.DockerImageFunction:
+        """Creates the function processing the ceilometer files.
+
+        The arguments of a lane override the configured function.
+
+        Args:
+            scope (cdk.Construct, optional): The scope of the function, the stack by default.
+            lidar_type (str, optional): The lidar type of the files.
+            memory_size (int, optional): The memory of the function (MB).
+            timeout (int, optional): The timeout of the function (s).
+            reserved_concurrency (int, optional): The reserved concurrency of the function,
+                none by default.
+
+        Returns:
+            lambda_.DockerImageFunction: The function, granted access to the configured buckets:
+            read and write on the input buckets when there is no output bucket.
+        """
+        scope = scope or self
+        function_config = self.config["function"]
+
+        environment = dict(
+            POWERTOOLS_SERVICE_NAME=self.config["app_name"],
+            POWERTOOLS_METRICS_NAMESPACE=self.config["app_name"],
+            MAX_WORKERS=str(function_config["max_workers"]),
+            LIDAR_TYPE=lidar_type or function_config["lidar_type"],
+            OUTPUT_PREFIX=function_config["output_prefix"],
+        )
+        if self.config.get("output_bucket"):
+            environment["OUTPUT_BUCKET"] = self.config["output_bucket"]
+        if function_config.get("stats_prefix"):
+            environment["STATS_PREFIX"] = function_config["stats_prefix"]
+        if function_config.get("store_prefix"):
+            environment["STORE_PREFIX"] = function_config["store_prefix"]
+        if function_config.get("cache_prefix"):
+            environment["CACHE_PREFIX"] = function_config["cache_prefix"]
+        if function_config.get("calibration_prefix"):
+            environment["CALIBRATION_PREFIX"] = function_config["calibration_prefix"]
+        if function_config.get("query_prefix"):
+            environment["QUERY_PREFIX"] = function_config["query_prefix"]
+        if function_config.get("quicklook_prefix"):
+            environment["QUICKLOOK_PREFIX"] = function_config["quicklook_prefix"]
+        if self.config["queue"].get("coalesce"):
+            environment["COALESCE"] = "true"
+        if function_config.get("event_sample_rate"):
+            environment["EVENT_SAMPLE_RATE"] = str(function_config["event_sample_rate"])
+
+        function = lambda_.DockerImageFunction(
+            scope,
+            "Function",
+            code=lambda_.DockerImageCode.from_image_asset(
+                str(REPOSITORY_ROOT),
+                cmd=["app.index.main"],
+                exclude=["apps/*/cdk.out", "docs", ".git"],
+            ),
+            memory_size=memory_size or function_config["memory_size"],
+            timeout=cdk.Duration.seconds(timeout or function_config["timeout"]),
+            reserved_concurrent_executions=reserved_concurrency,
+            environment=environment,
+        )
+
+        # Without an output bucket, the processed files are written next to their input
+        for bucket_name in self.config.get("input_buckets", []):
+            bucket = s3.Bucket.from_bucket_name(scope, f"InputBucket{bucket_name}", bucket_name)
+            if self.config.get("output_bucket"):
+                bucket.grant_read(function)
+            else:
+                bucket.grant_read_write(function)
+        if self.config.get("output_bucket"):
+            s3.Bucket.from_bucket_name(
+                scope, "OutputBucket", self.config["output_bucket"]
+            ).grant_read_write(function)
+
+        return function
+
+    def create_query_function(self) -> lambda_.DockerImageFunction:
+        """Creates the function answering time and height window queries (app.query).
+
+        Returns:
+            lambda_.DockerImageFunction: The function, with read access to the output bucket,
+            or to the input buckets without output bucket.
+        """
+        query_config = self.config["query"]
+
+        environment = dict(
+            POWERTOOLS_SERVICE_NAME=f"{self.config['app_name']}_query",
+            POWERTOOLS_METRICS_NAMESPACE=self.config["app_name"],
+            QUERY_PREFIX=self.config["function"]["query_prefix"],
+        )
+        # Without an output bucket, the archives are written to the input buckets
+        if self.config.get("output_bucket"):
+            environment["OUTPUT_BUCKET"] = self.config["output_bucket"]
+            bucket_names = [self.config["output_bucket"]]
+        else:
+            bucket_names = self.config.get("input_buckets", [])
+            environment["QUERY_BUCKETS"] = ",".join(bucket_names)
+
+        function = lambda_.DockerImageFunction(
+            self,
+            "QueryFunction",
+            code=lambda_.DockerImageCode.from_image_asset(
+                str(REPOSITORY_ROOT),
+                cmd=["app.query.main"],
+                exclude=["apps/*/cdk.out", "docs", ".git"],
+            ),
+            memory_size=query_config["memory_size"],
+            timeout=cdk.Duration.seconds(query_config["timeout"]),
+            environment=environment,
+        )
+
+        for bucket_name in bucket_names:
+            s3.Bucket.from_bucket_name(self, f"QueryBucket{bucket_name}", bucket_name).grant_read(
+                function
+            )
 
+        return function
 
     def resolve_stack_names(self, suffix: str = ""):
         """Resolves the stack name and updates the config object.
@@ -0,0 +1,263 @@
+"""Module stacks.lanes
+
+The stations of the registry are split into shards, each processed by its own lane: a
+queue, its dead letter queue and a function with reserved concurrency. A station only
+feeds the queue of its lane and a lane only takes its own share of the concurrency, so a
+noisy station delays the stations of its lane at most.
+
+Stations are grouped by instrument type, a function processing a single lidar type, and
+packed, largest first, into lanes of at most ``max_stations`` stations and
+``max_bytes_per_day`` of expected input. A station above that is alone in its lane.
+Stations sharing a ``shard`` name are kept together instead. The memory, timeout and
+reserved concurrency of each lane are then sized from the expected input of its stations,
+and its batches cut so that a batch of its largest files fits in the timeout.
+"""
+
+import math
+from typing import Dict, List, NamedTuple, Tuple
+
+from .utils import Field, validate_config
+
+#: Memory of a function (MB): its bounds and step.
+MIN_MEMORY, MAX_MEMORY, MEMORY_STEP = 128, 10240, 64
+
+#: Longest timeout of a function (s).
+MAX_TIMEOUT = 900
+
+#: Schema of a station of the registry.
+STATION_SCHEMA = dict(
+    lidar_type=Field(str),
+    cadence=Field((int, float)),
+    bytes_per_day=Field(int),
+    prefix=Field(str, required=False),
+    shard=Field(str, required=False),
+)
+
+#: Schema of the sizing of the lanes.
+LANES_SCHEMA = dict(
+    max_stations=Field(int),
+    max_bytes_per_day=Field(int),
+    throughput=Field((int, float)),
+    memory_base=Field(int),
+    memory_per_mb=Field((int, float)),
+    min_timeout=Field(int),
+    timeout_factor=Field((int, float)),
+    headroom=Field((int, float)),
+    min_concurrency=Field(int),
+    max_concurrency=Field(int),
+    max_total_concurrency=Field(int),
+)
+
+
+class Station(NamedTuple):
+    """A station of the registry"""
+
+    name: str
+    #: ALCF lidar type of its files.
+    lidar_type: str
+    #: Time between two of its files (s).
+    cadence: float
+    #: Expected size of its files per day (bytes).
+    bytes_per_day: int
+    #: Key prefix of its files in the input buckets.
+    prefix: str
+    #: Name of the lane it is pinned to, empty to let it be packed.
+    shard: str = ""
+
+    @property
+    def file_bytes(self) -> float:
+        """Expected size of one of its files (bytes)"""
+        return self.bytes_per_day * min(self.cadence, 86400) / 86400
+
+
+class Lane(NamedTuple):
+    """A processing lane: the stations of a shard and the sizing of their function"""
+
+    name: str
+    lidar_type: str
+    stations: Tuple[Station, ...]
+    #: Memory of the function (MB).
+    memory_size: int
+    #: Timeout of the function (s).
+    timeout: int
+    #: Reserved concurrency of the function.
+    reserved_concurrency: int
+    #: Messages per invocation.
+    batch_size: int
+
+    @property
+    def bytes_per_day(self) -> int:
+        """Expected input of the lane per day (bytes)"""
+        return sum(station.bytes_per_day for station in self.stations)
+
+
+def load_stations(registry: Dict[str, dict]) -> List[Station]:
+    """Reads the station registry of a configuration.
+
+    Args:
+        registry (dict): The stations by name, see :data:`STATION_SCHEMA`. ``cadence`` is
+            the time between two files of the station (s), ``prefix`` defaults to
+            ``<name>/``. The function takes the first directory of the key of a file for its
+            station, so a prefix is ``<name>/`` or a directory of it.
+
+    Returns:
+        list: The stations, by name.
+
+    Raises:
+        ValueError: If a station does not follow the schema, or its prefix is not in the
+            directory of its name.
+    """
+    errors = []
+    stations = []
+    for name, entry in sorted(registry.items()):
+        if not isinstance(entry, dict):
+            errors.append(f"stations.{name}: expected a mapping, got {entry!r}")
+            continue
+        station_errors = validate_config(entry, STATION_SCHEMA, f"stations.{name}.")
+        if not station_errors and (entry["cadence"] <= 0 or entry["bytes_per_day"] <= 0):
+            station_errors.append(f"stations.{name}: cadence and bytes_per_day must be > 0")
+        if "/" in name:
+            station_errors.append(f"stations.{name}: a station name is a single directory")
+        elif not station_errors and not entry.get("prefix", f"{name}/").startswith(f"{name}/"):
+            station_errors.append(
+                f"stations.{name}: prefix {entry['prefix']!r} is not in the directory "
+                f"{name + '/'!r} of the station"
+            )
+        errors += station_errors
+        if not station_errors:
+            stations.append(
+                Station(
+                    name=name,
+                    lidar_type=entry["lidar_type"],
+                    cadence=entry["cadence"],
+                    bytes_per_day=entry["bytes_per_day"],
+                    prefix=entry.get("prefix", f"{name}/"),
+                    shard=entry.get("shard", ""),
+                )
+            )
+
+    # The prefixes are in distinct directories: they do not overlap, which S3 rejects
+    if errors:
+        raise ValueError("Invalid station registry:\n  " + "\n  ".join(errors))
+    return stations
+
+
+def _shards(stations: List[Station], sizing: dict) -> Dict[str, List[Station]]:
+    """Splits the stations into shards, by lane name"""
+    shards: Dict[str, List[Station]] = {}
+    for station in stations:
+        if station.shard:
+            shards.setdefault(station.shard, []).append(station)
+
+    by_type: Dict[str, List[Station]] = {}
+    for station in stations:
+        if not station.shard:
+            by_type.setdefault(station.lidar_type, []).append(station)
+    for lidar_type, group in sorted(by_type.items()):
+        bins: List[List[Station]] = []
+        for station in sorted(group, key=lambda x: (-x.bytes_per_day, x.name)):
+            for shard in bins:
+                if len(shard) < sizing["max_stations"] and sum(
+                    x.bytes_per_day for x in shard
+                ) + station.bytes_per_day <= sizing["max_bytes_per_day"]:
+                    shard.append(station)
+                    break
+            else:
+                bins.append([station])
+        for number, shard in enumerate(bins, 1):
+            name = f"{lidar_type}-{number}"
+            if name in shards:
+                raise ValueError(f"Invalid station registry: shard {name} is a generated name")
+            shards[name] = shard
+    return shards
+
+
+def _size(
+    name: str, stations: List[Station], sizing: dict, function: dict, queue: dict
+) -> Lane:
+    """Sizes the function of a lane from the expected input of its stations"""
+    # The largest batch of the largest files of the lane processed within the longest timeout
+    largest_mb = max(station.file_bytes for station in stations) / 2**20
+    fitting = MAX_TIMEOUT * sizing["throughput"] / (sizing["timeout_factor"] * largest_mb)
+    batch_size = max(1, min(queue["batch_size"], math.floor(fitting)))
+
+    # Files of a station held by an invocation: one, or a window when coalescing
+    def held_mb(station: Station) -> float:
+        files = 1
+        if queue.get("coalesce"):
+            files = min(batch_size, math.ceil(queue["max_batching_window"] / station.cadence) + 1)
+        return station.file_bytes * files / 2**20
+
+    workers = min(function["max_workers"], batch_size)
+    memory = sizing["memory_base"] + sizing["memory_per_mb"] * workers * max(
+        held_mb(station) for station in stations
+    )
+    memory = max(MIN_MEMORY, MEMORY_STEP * math.ceil(memory / MEMORY_STEP))
+
+    timeout = max(
+        sizing["min_timeout"],
+        math.ceil(sizing["timeout_factor"] * batch_size * largest_mb / sizing["throughput"]),
+    )
+
+    # Invocations busy on average with the expected input, with headroom for bursts
+    busy = sum(station.bytes_per_day for station in stations) / 86400 / 2**20
+    busy /= sizing["throughput"]
+    concurrency = min(
+        sizing["max_concurrency"],
+        max(sizing["min_concurrency"], math.ceil(sizing["headroom"] * busy)),
+    )
+
+    lidar_types = {station.lidar_type for station in stations}
+    errors = []
+    if len(lidar_types) > 1:
+        errors.append(f"stations of several lidar types: {', '.join(sorted(lidar_types))}")
+    if memory > MAX_MEMORY:
+        errors.append(f"needs {memory} MB, more than the {MAX_MEMORY} MB of a function")
+    if timeout > MAX_TIMEOUT:
+        errors.append(f"needs {timeout} s, more than the {MAX_TIMEOUT} s of a function")
+    if errors:
+        raise ValueError(f"Invalid lane {name}: " + "; ".join(errors))
+
+    return Lane(
+        name=name,
+        lidar_type=stations[0].lidar_type,
+        stations=tuple(sorted(stations)),
+        memory_size=memory,
+        timeout=timeout,
+        reserved_concurrency=concurrency,
+        batch_size=batch_size,
+    )
+
+
+def plan_lanes(config: dict) -> List[Lane]:
+    """Plans the processing lanes of the station registry of a configuration.
+
+    Args:
+        config (dict): The consolidated configuration of the stack, with its ``stations``,
+            the sizing of the lanes as ``lanes``, and its ``function`` and ``queue``.
+
+    Returns:
+        list: The lanes, by name. Empty without stations.
+
+    Raises:
+        ValueError: If the registry is invalid, a lane cannot fit in a function, or the
+            lanes reserve more than ``max_total_concurrency``.
+    """
+    stations = load_stations(config.get("stations") or {})
+    if not stations:
+        return []
+    if "lanes" not in config:
+        raise ValueError("Invalid configuration: stations are registered without lanes")
+    sizing = config["lanes"]
+
+    lanes = [
+        _size(name, shard, sizing, config["function"], config["queue"])
+        for name, shard in sorted(_shards(stations, sizing).items())
+    ]
+    reserved = sum(lane.reserved_concurrency for lane in lanes)
+    if reserved > sizing["max_total_concurrency"]:
+        raise ValueError(
+            f"Invalid lanes: {reserved} reserved executions, more than "
+            f"max_total_concurrency ({sizing['max_total_concurrency']})"
+        )
+    return lanes
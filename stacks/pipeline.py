@@ -21,7 +21,7 @@ from aws_cdk.pipelines import (
 
 from . import SUBDIRECTORY_APPS_PIPELINE
 from .alcf_ceilometer import Alcf_ceilometerStack
-from .utils import consolidate_config, resolve_tags
+from .utils import Field, consolidate_config, resolve_tags
 
 
 class Alcf_ceilometerApplicationStage(core.Stage):
@@ -43,6 +43,18 @@ class Alcf_ceilometerApplicationStage(core.Stage):
 class Alcf_ceilometerPipelineStack(core.Stack):
     """Stack to deploy workflow resources for alcf_ceilometer"""
 
+    #: Schema of the consolidated configuration, checked when it is loaded.
+    CONFIG_SCHEMA = dict(
+        stack_name=Field(str),
+        codestar_connection_parameter=Field(str),
+        approvers_emails=Field(list),
+        exec_buckets=Field(dict),
+        target_regions=Field(list),
+        target_stack_info=Field(dict),
+        tags=Field(dict),
+        git=Field(dict, required=False),
+    )
+
     @classmethod
     def load_config(cls, target_env: str) -> dict:
         """Loads the configuration for the given stack.
@@ -58,6 +70,7 @@ class Alcf_ceilometerPipelineStack(core.Stack):
         return consolidate_config(
             resource_filename(__name__, f"configurations/{cls.__name__}.yaml"),
             target_env,
+            schema=cls.CONFIG_SCHEMA,
         )
 
     def __init__(
@@ -1,57 +1,223 @@
-"""Module stacks.utils"""
+"""Module stacks.utils
 
+The configuration files are parsed once per process: the parsed files are cached and only
+read again when their modification time or size changes, and the git information is read
+by a single ``git`` call. Every stack and stage of an app loading the same configuration
+then gets its own copy of the cached result.
+"""
+
+import copy
+import functools
+import os
 import subprocess
 from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
 
 from ruamel.yaml import YAML
 from fr_helpers.common.utils import merge_dicts_v2
 
 yaml = YAML()
 
+# Parsed files and consolidated configurations, with the signatures of their files
+_PARSED: Dict[str, Tuple[tuple, Any]] = {}
+_CONSOLIDATED: Dict[tuple, Tuple[tuple, dict]] = {}
+
+
+class Field(NamedTuple):
+    """A field of a configuration schema, see :func:`validate_config`"""
+
+    #: Type(s) of the value, or the schema of its fields when it is a mapping.
+    type: Union[type, Tuple[type, ...], dict]
+    #: Whether the field must be present.
+    required: bool = True
+
+
+def _signature(path: str) -> tuple:
+    """Returns what identifies a version of a file: its modification time and size"""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _plain(value: Any) -> Any:
+    """Converts the mappings and sequences of a parsed YAML document to dicts and lists"""
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+def load_yaml(path: str) -> Any:
+    """Loads a YAML file, parsing it again only when it changed.
+
+    Args:
+        path (str): The file to load.
+
+    Returns:
+        The content of the file, as dicts and lists. It is shared by all the callers and must
+        not be modified.
+    """
+    path = os.path.abspath(path)
+    signature = _signature(path)
+    cached = _PARSED.get(path)
+    if cached is None or cached[0] != signature:
+        with open(path) as handler:
+            cached = _PARSED[path] = (signature, _plain(yaml.load(handler)))
+    return cached[1]
+
+
+def clear_config_cache():
+    """Forgets the parsed files and the git information, e.g. between benchmark runs"""
+    _PARSED.clear()
+    _CONSOLIDATED.clear()
+    git_info.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def git_info() -> dict:
+    """Returns the closest tag, the branch and the commit of the working copy.
+
+    All three come from a single ``git log`` call, read up to the first tagged commit, and
+    are kept for the life of the process.
+
+    Returns:
+        dict: ``tag`` (empty without tag), ``branch`` (empty on a detached HEAD) and
+        ``commit`` (short hash).
+    """
+    info = dict(tag="", branch="", commit="")
+    with subprocess.Popen(
+        [
+            "git",
+            "log",
+            "--simplify-by-decoration",
+            "--decorate-refs=HEAD",
+            "--decorate-refs=refs/heads/",
+            "--decorate-refs=refs/tags/",
+            "--format=%h%x09%D",
+            "HEAD",
+        ],
+        stdout=subprocess.PIPE,
+    ) as process:
+        try:
+            for number, line in enumerate(process.stdout):
+                commit, _, refs = line.decode("utf-8").strip().partition("\t")
+                refs = refs.split(", ")
+                if number == 0:
+                    # HEAD, always decorated, comes first
+                    info["commit"] = commit
+                    info["branch"] = next(
+                        (ref[len("HEAD -> ") :] for ref in refs if ref.startswith("HEAD -> ")),
+                        "",
+                    )
+                tag = next((ref[len("tag: ") :] for ref in refs if ref.startswith("tag: ")), "")
+                if tag:
+                    info["tag"] = tag
+                    break
+        finally:
+            process.kill()
+    if process.returncode not in (0, -9) or not info["commit"]:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    return info
+
+
+def validate_config(config: dict, schema: Dict[str, Field], path: str = "") -> List[str]:
+    """Checks a configuration against a schema.
+
+    Args:
+        config (dict): The configuration.
+        schema (dict): The fields of the configuration, by name. The fields of a field
+            whose type is a dict are checked in turn; fields missing from the schema are
+            errors.
+        path (str, optional): The path of the configuration in the errors.
+
+    Returns:
+        list: The errors, empty when the configuration is valid.
+    """
+    errors = []
+    for name in config.keys() - schema.keys():
+        errors.append(f"{path}{name}: unknown field")
+    for name, field in schema.items():
+        if name not in config:
+            if field.required:
+                errors.append(f"{path}{name}: missing")
+            continue
+        value = config[name]
+        if isinstance(field.type, dict):
+            if not isinstance(value, dict):
+                errors.append(f"{path}{name}: expected a mapping, got {value!r}")
+            else:
+                errors += validate_config(value, field.type, f"{path}{name}.")
+        elif not isinstance(value, field.type) or (
+            isinstance(value, bool) and bool not in _types(field.type)
+        ):
+            expected = " or ".join(x.__name__ for x in _types(field.type))
+            errors.append(f"{path}{name}: expected {expected}, got {value!r}")
+    return sorted(errors)
+
+
+def _types(types: Union[type, Tuple[type, ...]]) -> Tuple[type, ...]:
+    """Returns the types of a field as a tuple"""
+    return types if isinstance(types, tuple) else (types,)
+
 
 # TODO: this method should probably be put in a FR CDK library as it will be used quite often
 def consolidate_config(
-    config_filepath: str, environment: str, use_git_info: bool = False
+    config_filepath: str,
+    environment: str,
+    use_git_info: bool = False,
+    schema: Optional[Dict[str, Field]] = None,
 ) -> dict:
     """Consolidate the main's context based on environment as a single dict.
 
     Note: this is not the full context but just common + environment.
     The environment must exist as a key of context.
-    
+
+    The result is cached until the config file or ``tags.yaml`` change, so stacks and
+    stages loading the same configuration do not parse it again.
+
     Args:
         config_filepath (str): The full path of the config file to load config from.
         environment (str): The specific environment to load configuration from.
-    
+        use_git_info (bool, optional): Add the closest tag, branch and commit as ``git``.
+        schema (dict, optional): The schema the consolidated configuration must follow,
+            see :func:`validate_config`.
+
     Returns:
-        dict: The consolidated common+environment as a single dict.
-    """
-    with open(config_filepath) as handler:
-        loaded_config = yaml.load(handler)
+        dict: The consolidated common+environment as a single dict, a copy the caller may
+        modify.
 
+    Raises:
+        ValueError: If the consolidated configuration does not follow the schema.
+    """
     # In the same folder as the config file, load the tags.yaml file
-    with open(str(Path(config_filepath).parent / "tags.yaml")) as handler:
-        loaded_tags = yaml.load(handler)
-
-    config = loaded_config["Common"]
-    config["tags"] = loaded_tags
-
-    config = dict(merge_dicts_v2(config, loaded_config.get(environment, {})))
-
-    if use_git_info:
-        # Automatically inject the current git branch name and closest tag
-        config["git"] = dict(
-            tag=subprocess.check_output(["git", "describe", "--tags", "--abbrev=0"])
-            .decode("ascii")
-            .strip(),
-            branch=subprocess.check_output(["git", "branch", "--show-current"])
-            .decode("ascii")
-            .strip(),
-            commit=subprocess.check_output(["git", "rev-parse", "--short", "HEAD"])
-            .decode("ascii")
-            .strip(),
-        )
-
-    return config
+    tags_filepath = str(Path(config_filepath).parent / "tags.yaml")
+    signature = (_signature(config_filepath), _signature(tags_filepath))
+    key = (os.path.abspath(config_filepath), environment, use_git_info, id(schema))
+
+    cached = _CONSOLIDATED.get(key)
+    if cached is None or cached[0] != signature:
+        loaded_config = load_yaml(config_filepath)
+
+        config = copy.deepcopy(loaded_config["Common"])
+        config["tags"] = copy.deepcopy(load_yaml(tags_filepath))
+
+        config = dict(merge_dicts_v2(config, copy.deepcopy(loaded_config.get(environment, {}))))
+
+        if use_git_info:
+            # Automatically inject the current git branch name and closest tag
+            config["git"] = dict(git_info())
+
+        if schema is not None:
+            errors = validate_config(config, schema)
+            if errors:
+                raise ValueError(
+                    f"Invalid configuration {config_filepath} ({environment}):\n  "
+                    + "\n  ".join(errors)
+                )
+
+        cached = _CONSOLIDATED[key] = (signature, config)
+
+    return copy.deepcopy(cached[1])
 
 
 def resolve_tags(config: dict, environment: str) -> dict:
@@ -0,0 +1,100 @@
+"""Shared setup of the tests
+
+The tests run from the root of the repository, against the code of the Lambda package
+(``app``), the stacks (``stacks``) and the synthetic data of the benchmarks
+(``synthetic``): ``python -m pytest tests``. The S3 API is mocked by moto, which ignores
+``IfMatch`` conditions: :func:`enforce_if_match` checks them.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+from urllib.parse import quote_plus
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+ROOT = Path(__file__).resolve().parent.parent
+
+for path in (
+    ROOT,
+    ROOT / "lambdas" / "alcf_ceilometer" / "function",
+    ROOT / "benchmarks",
+):
+    sys.path.insert(0, str(path))
+
+os.environ.setdefault("POWERTOOLS_SERVICE_NAME", "alcf_ceilometer")
+os.environ.setdefault("POWERTOOLS_METRICS_NAMESPACE", "alcf_ceilometer")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Credentials of the moto mocks, never real ones
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+def enforce_if_match(client):
+    """Rejects the writes and copies of a client whose IfMatch or CopySourceIfMatch condition
+    fails, as S3 does"""
+    checker = boto3.client("s3")
+
+    def etag(bucket: str, key: str):
+        try:
+            return checker.head_object(Bucket=bucket, Key=key)["ETag"]
+        except ClientError:
+            return None
+
+    def check(params, **kwargs):  # pylint: disable=unused-argument
+        if "IfMatch" in params and etag(params["Bucket"], params["Key"]) != params["IfMatch"]:
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+
+    def check_copy(params, **kwargs):  # pylint: disable=unused-argument
+        source = params["CopySource"]
+        if "CopySourceIfMatch" in params and (
+            etag(source["Bucket"], source["Key"]) != params["CopySourceIfMatch"]
+        ):
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "CopyObject")
+
+    client.meta.events.register("provide-client-params.s3.PutObject", check)
+    client.meta.events.register("provide-client-params.s3.CopyObject", check_copy)
+    return client
+
+
+@pytest.fixture
+def netcdf_calls(monkeypatch) -> list:
+    """Records the number of NetCDF reads and writes running at the start of each, which
+    netCDF4 and HDF5 do not allow from several threads"""
+    ds = pytest.importorskip("ds_format")
+    running = []
+    calls = []
+
+    def exclusive(function):
+        def wrapper(*args, **kwargs):
+            running.append(None)
+            calls.append(len(running))
+            try:
+                time.sleep(0.01)
+                return function(*args, **kwargs)
+            finally:
+                running.pop()
+
+        return wrapper
+
+    monkeypatch.setattr(ds, "read", exclusive(ds.read))
+    monkeypatch.setattr(ds, "write", exclusive(ds.write))
+    return calls
+
+
+def s3_event(bucket: str, keys: list) -> dict:
+    """An S3 event notification of created objects"""
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "eventName": "ObjectCreated:Put",
+                "s3": {"bucket": {"name": bucket}, "object": {"key": quote_plus(key)}},
+            }
+            for key in keys
+        ]
+    }
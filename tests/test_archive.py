@@ -0,0 +1,95 @@
+"""Tests of app.archive: indexes updated by concurrent invocations"""
+
+import datetime as dt
+
+import boto3
+import numpy as np
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from app import archive
+
+import synthetic
+from conftest import enforce_if_match
+
+BUCKET = "archives"
+PREFIX = "archive/"
+STATION = "site"
+DAY = (2458849.5, 2458850.5)
+
+
+@pytest.fixture
+def client():
+    with mock_aws():
+        client = enforce_if_match(boto3.client("s3"))
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def dataset(hour: int, seed: int = 0) -> dict:
+    """A processed file of an hour of 5 minute profiles of 2020-01-01"""
+    return synthetic.processed(synthetic.START + dt.timedelta(hours=hour), 12, m=100, seed=seed)
+
+
+def write(client, hour: int, seed: int = 0) -> dict:
+    """Writes the file of an hour to the archive"""
+    d = dataset(hour, seed)
+    archive.write(d, BUCKET, PREFIX, STATION, f"{PREFIX}{STATION}/{hour}.pack", client=client)
+    return d
+
+
+def test_write_read(client):
+    d1, d2 = write(client, 0), write(client, 2, seed=1)
+    profiles = archive.read(BUCKET, PREFIX, STATION, *DAY, zmax=1000, client=client)
+
+    np.testing.assert_array_equal(profiles["time"], np.concatenate([d1["time"], d2["time"]]))
+    levels = d1["zfull"] <= 1000
+    np.testing.assert_array_equal(
+        profiles["backscatter"],
+        np.concatenate([d1["backscatter"], d2["backscatter"]])[:, levels].astype(np.float32),
+    )
+
+
+def test_reprocessed_pack_replaces_its_blocks(client):
+    write(client, 0)
+    d = write(client, 0, seed=3)
+    blocks, packs = archive.read_index(BUCKET, PREFIX, STATION, "2020-01", client=client)
+
+    assert packs == [f"{PREFIX}{STATION}/0.pack"]
+    assert len(blocks) == 2
+    profiles = archive.read(BUCKET, PREFIX, STATION, *DAY, client=client)
+    np.testing.assert_array_equal(profiles["backscatter"], d["backscatter"].astype(np.float32))
+
+
+def test_concurrent_updates_keep_every_pack(client):
+    other = enforce_if_match(boto3.client("s3"))
+    write(client, 0)
+
+    # Another invocation updates the index between the read and the write of the first
+    def interleave(params, **kwargs):  # pylint: disable=unused-argument
+        if ".index/" in params["Key"] and not interleave.done:
+            interleave.done = True
+            write(other, 5, seed=2)
+
+    interleave.done = False
+    client.meta.events.register_first("provide-client-params.s3.PutObject", interleave)
+    write(client, 3, seed=1)
+    assert interleave.done
+
+    _, packs = archive.read_index(BUCKET, PREFIX, STATION, "2020-01", client=client)
+    assert sorted(packs) == [f"{PREFIX}{STATION}/{hour}.pack" for hour in (0, 3, 5)]
+    assert len(archive.read(BUCKET, PREFIX, STATION, *DAY, client=client)["time"]) == 36
+
+
+def test_unknown_conflicts_fail_after_attempts(client, monkeypatch):
+    monkeypatch.setattr(archive, "_UPDATE_ATTEMPTS", 2)
+    monkeypatch.setattr(archive, "sleep", lambda seconds: None)
+
+    def conflict(params, **kwargs):  # pylint: disable=unused-argument
+        if ".index/" in params["Key"]:
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+
+    client.meta.events.register_first("provide-client-params.s3.PutObject", conflict)
+    with pytest.raises(RuntimeError):
+        write(client, 0)
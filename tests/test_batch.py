@@ -0,0 +1,117 @@
+"""Tests of app.batch: SQS batches reporting their failed messages"""
+
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+pytest.importorskip("alcf")
+
+# pylint: disable=wrong-import-position
+from app import batch
+from app.config import Settings
+
+import synthetic
+from conftest import s3_event
+
+BUCKET = "ceilometers"
+CORRUPT = "site/corrupt.dat"
+
+
+@pytest.fixture
+def client(tmp_path):
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        for i in range(3):
+            path = tmp_path / f"A200101{i}.dat"
+            synthetic.write_cl51(str(path), 100, m=256, seed=i)
+            client.upload_file(str(path), BUCKET, f"site/{path.name}")
+        client.put_object(Bucket=BUCKET, Key=CORRUPT, Body=b"\x01CL0\x02garbage")
+        yield client
+
+
+def message(message_id: str, *keys: str, sns: bool = False) -> dict:
+    """An SQS message carrying the S3 notification of objects, forwarded by SNS or not"""
+    body = json.dumps(s3_event(BUCKET, list(keys)))
+    if sns:
+        body = json.dumps({"Type": "Notification", "Message": body})
+    return {"messageId": message_id, "eventSource": "aws:sqs", "body": body}
+
+
+def process(client, tmp_path, *messages: dict, coalesce: bool = False) -> list:
+    """Processes a batch, returning the failed messages"""
+    settings = Settings(work_dir=str(tmp_path), coalesce=coalesce)
+    event = {"Records": list(messages)}
+    assert batch.is_sqs_event(event)
+    response = batch.process_sqs_batch(event, settings, client=client)
+    return [failure["itemIdentifier"] for failure in response["batchItemFailures"]]
+
+
+def processed(client) -> set:
+    """Returns the processed inputs, by the directory of their processed files"""
+    response = client.list_objects_v2(Bucket=BUCKET, Prefix="processed/")
+    return {item["Key"].split("/")[2] for item in response.get("Contents", [])}
+
+
+def test_sns_wrapped_notifications(client, tmp_path):
+    failures = process(
+        client,
+        tmp_path,
+        message("a", "site/A2001010.dat", sns=True),
+        message("b", "site/A2001011.dat"),
+    )
+    assert failures == []
+    assert processed(client) == {"A2001010", "A2001011"}
+
+
+def test_test_events_are_skipped(client, tmp_path):
+    test_event = {"Service": "Amazon S3", "Event": "s3:TestEvent", "Bucket": BUCKET}
+    messages = [
+        {"messageId": "a", "eventSource": "aws:sqs", "body": json.dumps(test_event)},
+        {
+            "messageId": "b",
+            "eventSource": "aws:sqs",
+            "body": json.dumps({"Type": "Notification", "Message": json.dumps(test_event)}),
+        },
+    ]
+    assert process(client, tmp_path, *messages) == []
+    assert processed(client) == set()
+
+
+def test_invalid_messages_fail(client, tmp_path):
+    messages = [
+        {"messageId": "a", "eventSource": "aws:sqs", "body": "not json"},
+        {"messageId": "b", "eventSource": "aws:sqs", "body": json.dumps({"Event": "x"})},
+        message("c", "site/A2001010.dat"),
+    ]
+    assert process(client, tmp_path, *messages) == ["a", "b"]
+    assert processed(client) == {"A2001010"}
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_message_of_several_records_with_a_failure(client, tmp_path, coalesce):
+    failures = process(
+        client,
+        tmp_path,
+        message("a", "site/A2001010.dat", "site/A2001011.dat"),
+        message("b", "site/A2001012.dat", CORRUPT),
+        coalesce=coalesce,
+    )
+    assert failures == ["b"]
+    assert processed(client)
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_duplicate_keys_across_messages(client, tmp_path, coalesce):
+    failures = process(
+        client,
+        tmp_path,
+        message("a", "site/A2001010.dat", CORRUPT),
+        message("b", "site/A2001010.dat"),
+        message("c", CORRUPT),
+        message("d", "site/A2001011.dat"),
+        coalesce=coalesce,
+    )
+    assert failures == ["a", "c"]
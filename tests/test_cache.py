@@ -0,0 +1,81 @@
+"""Tests of app.cache: keys of the inputs and copies of the processed files"""
+
+import dataclasses
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from app import cache
+from app.config import Settings
+
+from conftest import enforce_if_match
+
+BUCKET = "outputs"
+
+
+@pytest.fixture
+def client():
+    with mock_aws():
+        client = enforce_if_match(boto3.client("s3"))
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def test_key_depends_on_the_engine(tmp_path):
+    pytest.importorskip("alcf")
+    path = tmp_path / "A2001011.dat"
+    path.write_bytes(b"profiles")
+    settings = Settings(work_dir=str(tmp_path))
+
+    keys = {
+        cache.cache_key(str(path), dataclasses.replace(settings, engine=engine), {})
+        for engine in ("inprocess", "cli")
+    }
+    assert len(keys) == 2
+
+
+def test_version_of_alcf_installed_without_metadata(monkeypatch):
+    pytest.importorskip("alcf")
+
+    def version(name):
+        raise cache.importlib.metadata.PackageNotFoundError(name)
+
+    monkeypatch.setattr(cache.importlib.metadata, "version", version)
+    cache.alcf_version.cache_clear()
+    try:
+        assert cache.alcf_version().startswith("sha256:")
+    finally:
+        cache.alcf_version.cache_clear()
+
+
+def test_version_of_missing_alcf_raises(monkeypatch):
+    def version(name):
+        raise cache.importlib.metadata.PackageNotFoundError(name)
+
+    monkeypatch.setattr(cache.importlib.metadata, "version", version)
+    monkeypatch.setattr(cache.importlib.util, "find_spec", lambda name: None)
+    cache.alcf_version.cache_clear()
+    try:
+        with pytest.raises(RuntimeError, match="not installed"):
+            cache.alcf_version()
+    finally:
+        cache.alcf_version.cache_clear()
+
+
+def test_overwritten_outputs_make_the_entry_stale(tmp_path, client):
+    settings = Settings(work_dir=str(tmp_path), cache_prefix="cache/", cache_entries=8)
+    client.put_object(Bucket=BUCKET, Key="processed/site/a.nc", Body=b"first")
+    cache.store("key", [("a.nc", BUCKET, "processed/site/a.nc")], 1, BUCKET, settings, client)
+    entry = cache.lookup("key", BUCKET, settings, client)
+
+    assert cache.copy_outputs(entry, {"a.nc": (BUCKET, "processed/other/a.nc")}, client)
+    assert cache.copy_outputs(entry, {"a.nc": (BUCKET, "processed/site/a.nc")}, client)
+    copy = client.get_object(Bucket=BUCKET, Key="processed/other/a.nc")["Body"].read()
+    assert copy == b"first"
+
+    # Processed again with other options
+    client.put_object(Bucket=BUCKET, Key="processed/site/a.nc", Body=b"second")
+    assert not cache.copy_outputs(entry, {"a.nc": (BUCKET, "processed/next/a.nc")}, client)
+    assert not cache.copy_outputs(entry, {"a.nc": (BUCKET, "processed/site/a.nc")}, client)
+    assert "Contents" not in client.list_objects_v2(Bucket=BUCKET, Prefix="processed/next/")
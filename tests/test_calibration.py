@@ -0,0 +1,115 @@
+"""Tests of app.calibration: noise removal and calibration as ALCF's, sliding windows and
+calibration periods"""
+
+import copy
+
+import numpy as np
+import pytest
+
+pytest.importorskip("alcf")
+
+# pylint: disable=wrong-import-position
+from alcf.algorithms.calibration import default as alcf_calibration
+from alcf.algorithms.noise_removal import default as alcf_noise_removal
+
+from app import calibration
+
+
+def dataset(shared: bool = True, dtype=np.float64, seed: int = 0) -> dict:
+    """A noisy dataset of 60 profiles of 40 gates and uneven durations, its range gates shared
+    by all the profiles or not"""
+    rng = np.random.default_rng(seed)
+    n, m = 60, 40
+    lower = np.cumsum(rng.uniform(10.0, 30.0, n)) / 86400.0
+    time_bnds = np.stack([lower, lower + rng.uniform(5.0, 20.0, n) / 86400.0], axis=1)
+    zfull = np.tile(15.0 * (np.arange(m) + 0.5), (n, 1))
+    if not shared:
+        zfull *= rng.uniform(0.9, 1.1, (n, 1))
+    return {
+        "time": time_bnds.mean(axis=1),
+        "time_bnds": time_bnds,
+        "zfull": zfull,
+        "backscatter": (rng.normal(1e-6, 2e-7, (n, m))).astype(dtype),
+        "backscatter_mol": np.full((n, m), 1e-9, dtype),
+        ".": {"backscatter": {".dims": ["time", "range"]}},
+    }
+
+
+def run(d: dict, function, **options) -> dict:
+    """Runs a step on a copy of a dataset"""
+    d = copy.deepcopy(d)
+    function(d, **options)
+    return d
+
+
+@pytest.mark.parametrize("shared", [True, False])
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_same_as_alcf(shared, dtype):
+    d = dataset(shared, dtype)
+    reference = run(d, alcf_noise_removal.noise_removal)
+    result = run(d, calibration.noise_removal)
+    for name in ("backscatter", "backscatter_sd"):
+        np.testing.assert_array_equal(result[name], reference[name])
+        assert result[name].dtype == reference[name].dtype
+    assert result["."]["backscatter_sd"] == reference["."]["backscatter_sd"]
+
+    reference = run(reference, alcf_calibration.calibration, calibration_coeff=1.7)
+    result = run(result, calibration.calibration, calibration_coeff=1.7)
+    for name in ("backscatter", "backscatter_mol", "backscatter_sd"):
+        np.testing.assert_array_equal(result[name], reference[name])
+
+
+def test_window_of_the_whole_dataset():
+    d = dataset()
+    reference = run(d, alcf_noise_removal.noise_removal)
+    result = run(d, calibration.noise_removal, noise_removal_window=10 * 86400)
+    scale = np.max(np.abs(reference["backscatter_sd"]))
+    np.testing.assert_allclose(
+        result["backscatter_sd"], reference["backscatter_sd"], rtol=1e-6, atol=1e-9 * scale
+    )
+    np.testing.assert_allclose(result["backscatter"], reference["backscatter"], rtol=1e-9)
+
+
+@pytest.mark.parametrize("gates", [1, 3])
+def test_sliding_window(gates):
+    d = dataset(seed=1)
+    window = 120.0
+    mean, sd = calibration.background(
+        d["backscatter"],
+        d["time"],
+        d["time_bnds"][:, 1] - d["time_bnds"][:, 0],
+        gates=gates,
+        window=window / 86400.0,
+    )
+
+    w = d["time_bnds"][:, 1] - d["time_bnds"][:, 0]
+    for i, t in enumerate(d["time"]):
+        select = np.abs(d["time"] - t) <= 0.5 * window / 86400.0
+        samples = d["backscatter"][select, -gates:].ravel()
+        weights = np.repeat(w[select], gates)
+        assert mean[i] == pytest.approx(np.average(samples, weights=weights), rel=1e-9)
+        if len(samples) > 1:
+            expected = np.sqrt(np.cov(samples, aweights=weights))
+            assert sd[i] == pytest.approx(expected, rel=1e-6, abs=1e-15)
+
+
+def test_calibration_periods():
+    d = dataset()
+    t = d["time"]
+    periods = [(t[20], 2.0), (t[40] + 1e-9, 3.0)]
+    result = run(d, calibration.calibration, calibration_coeff=1.5, calibration_periods=periods)
+
+    coeff = np.array([1.5] * 20 + [2.0] * 21 + [3.0] * 19)
+    np.testing.assert_array_equal(calibration.coefficients(t, 1.5, periods), coeff)
+    np.testing.assert_array_equal(result["backscatter"], d["backscatter"] * coeff[:, np.newaxis])
+    np.testing.assert_array_equal(
+        result["backscatter_mol"], d["backscatter_mol"] * coeff[:, np.newaxis]
+    )
+
+
+def test_parse_table_sorts_the_periods():
+    table = calibration.parse_table(
+        b'{"periods": [{"start": "2020-01-02T00:00:00", "calibration_coeff": 3},'
+        b' {"start": "2020-01-01T00:00:00", "calibration_coeff": 2}]}'
+    )
+    assert table == [(2458849.5, 2.0), (2458850.5, 3.0)]
@@ -0,0 +1,50 @@
+"""Tests of app.chunked: CHM15k files processed in time chunks give the whole-file output"""
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("alcf")
+ds = pytest.importorskip("ds_format")
+
+from app import chunked, engine  # pylint: disable=wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+
+VARIABLES = ["time", "time_bnds", "backscatter", "cloud_mask", "cbh"]
+
+
+def read_outputs(output: engine.Output) -> dict:
+    """Reads processed files, by name"""
+    return {
+        os.path.basename(path): ds.read(path, VARIABLES)
+        for path in sorted(output.paths)
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [97, 250])
+def test_chunks_match_whole_file(tmp_path, chunk_size):
+    path = str(tmp_path / "chm15k.nc")
+    # 4 hours of 15 s profiles, split in hourly outputs
+    synthetic.write_chm15k(path, 960, m=256)
+    options = {"output_sampling": 3600}
+
+    os.makedirs(tmp_path / "whole")
+    os.makedirs(tmp_path / "chunked")
+    whole = read_outputs(engine.run("chm15k", path, str(tmp_path / "whole"), options))
+    chunks = read_outputs(
+        chunked.run("chm15k", path, str(tmp_path / "chunked"), options, chunk_size)
+    )
+
+    assert len(whole) >= 4
+    assert chunks.keys() == whole.keys()
+    # Sums of the noise removal and resampling run over other partitions, hence rtol
+    for name, d in whole.items():
+        for var in VARIABLES:
+            np.testing.assert_allclose(
+                np.asarray(chunks[name][var], np.float64),
+                np.asarray(d[var], np.float64),
+                rtol=1e-5,
+                err_msg=f"{name} {var}",
+            )
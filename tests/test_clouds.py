@@ -0,0 +1,95 @@
+"""Tests of app.clouds: cloud detection and cloud base detection as ALCF's"""
+
+import copy
+
+import numpy as np
+import pytest
+
+pytest.importorskip("alcf")
+
+# pylint: disable=wrong-import-position
+from alcf.algorithms.cloud_base_detection import default as alcf_cloud_base_detection
+from alcf.algorithms.cloud_detection import default as alcf_cloud_detection
+
+from app import clouds
+
+ZFULL = 30.0 * (np.arange(40) + 0.5)
+
+
+def dataset(columns: int = 0, seed: int = 0) -> dict:
+    """A noisy dataset of 50 profiles of 40 levels, with cloud layers of 1 to 6 gates, the
+    backscatter of some samples on the threshold"""
+    rng = np.random.default_rng(seed)
+    shape = (50, len(ZFULL)) + ((columns,) if columns else ())
+    b = np.abs(rng.normal(0.0, 1e-7, shape))
+    bsd = np.full(shape, 2e-8)
+    for i in range(50):
+        for base, depth in [(3 + i % 5, 1 + i % 3), (15 + i % 7, 2 + i % 5), (30, i % 2)]:
+            b[i, base : base + depth] += rng.uniform(1e-6, 1e-4)
+    b[::7, 1] = 2e-6 + 5 * 2e-8 + 1e-9  # On the threshold, with the noise and bmol
+    b[::9] = 0.0  # Clear profiles
+    bmol = np.full(shape[:2], 1e-9)
+    dims = ["time", "level"] + (["column"] if columns else [])
+    return {
+        "time": np.arange(50) / 1440.0,
+        "zfull": ZFULL,
+        "backscatter": b,
+        "backscatter_sd": bsd,
+        "backscatter_mol": bmol,
+        ".": {"backscatter": {".dims": dims}},
+    }
+
+
+def detect(d: dict, detection, base_detection) -> dict:
+    """Runs detection steps on a copy of a dataset"""
+    d = copy.deepcopy(d)
+    detection(d)
+    base_detection(d)
+    return d
+
+
+@pytest.mark.parametrize("columns", [0, 3])
+def test_same_as_alcf(columns):
+    d = dataset(columns)
+    reference = detect(
+        d, alcf_cloud_detection.cloud_detection, alcf_cloud_base_detection.cloud_base_detection
+    )
+    result = detect(d, clouds.cloud_detection, clouds.cloud_base_detection)
+
+    assert 0 < np.mean(np.isfinite(reference["cbh"])) < 1
+    np.testing.assert_array_equal(result["cloud_mask"], reference["cloud_mask"])
+    assert result["cloud_mask"].dtype == reference["cloud_mask"].dtype
+    np.testing.assert_array_equal(result["cbh"], reference["cbh"])
+    assert list(result["."]["cbh"][".dims"]) == list(reference["."]["cbh"][".dims"])
+    assert result["."]["cloud_mask"] == reference["."]["cloud_mask"]
+
+
+def test_find_layers():
+    mask = np.zeros((3, 10), np.byte)
+    mask[0, [1, 2, 5, 8, 9]] = 1
+    mask[1, :] = 1
+    zfull = 100.0 * np.arange(10)
+    base, top = clouds.find_layers(mask, zfull, layers=2)
+
+    np.testing.assert_array_equal(base, [[100, 500], [0, np.inf], [np.inf, np.inf]])
+    np.testing.assert_array_equal(top, [[200, 500], [900, np.inf], [np.inf, np.inf]])
+
+
+def test_layers_are_runs_of_the_cloud_mask():
+    d = detect(dataset(), clouds.cloud_detection, clouds.cloud_base_detection)
+    mask = d["cloud_mask"].astype(bool)
+    for i in range(len(mask)):
+        _, starts, ends = clouds.runs(mask[i : i + 1])
+        layers = list(zip(ZFULL[starts], ZFULL[ends - 1]))[: clouds.CLOUD_LAYERS]
+        found = [
+            (base, top)
+            for base, top in zip(d["cloud_layer_base"][i], d["cloud_layer_top"][i])
+            if np.isfinite(base)
+        ]
+        assert found == layers
+
+
+def test_filter_noise():
+    mask = np.array([[1, 0, 1, 1, 0, 1, 1, 1, 0, 1]], np.byte)
+    np.testing.assert_array_equal(clouds.filter_noise(mask, 2), [[0, 0, 1, 1, 0, 1, 1, 1, 0, 0]])
+    np.testing.assert_array_equal(clouds.filter_noise(mask, 1), mask)
@@ -0,0 +1,117 @@
+"""Tests of app.coalesce: windows of small files processed as one time series"""
+
+import datetime as dt
+import os
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from app import coalesce
+from app.config import Settings
+from app.ingest import S3Object, process_objects
+
+import synthetic
+
+BUCKET = "ceilometers"
+
+
+@pytest.fixture
+def client():
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def logger(monkeypatch):
+    logger = mock.Mock()
+    monkeypatch.setattr(coalesce, "LOGGER", logger)
+    return logger
+
+
+def upload_files(
+    client, tmp_path, files: int, minutes: float = 2.0, station: str = "station"
+) -> list:
+    """Uploads the CL51 files of a station, one every ``minutes``"""
+    sources = []
+    for i in range(files):
+        start = synthetic.START + dt.timedelta(minutes=minutes * i)
+        path = str(tmp_path / f"{station}-{start:%Y%m%d%H%M}.dat")
+        synthetic.write_cl51(path, int(minutes * 60 / 16), m=256, seed=i, start=start)
+        key = f"{station}/{os.path.basename(path)}"
+        client.upload_file(path, BUCKET, key)
+        sources.append(S3Object(BUCKET, key, os.path.getsize(path)))
+    return sources
+
+
+def messages(logger, level: str) -> list:
+    """Returns the messages logged at a level"""
+    return [call.args[0] for call in getattr(logger, level).call_args_list]
+
+
+def test_window_reads_the_profiles_of_its_files(client, tmp_path, logger):
+    pytest.importorskip("alcf")
+    sources = upload_files(client, tmp_path, 6)
+    settings = Settings(work_dir=str(tmp_path))
+
+    files = process_objects(sources, settings, client=client)
+    window = coalesce.process_windows(sources[::-1], settings, client=client)
+
+    assert all(result.error is None for result in files + window)
+    assert sum(result.profiles for result in window) == sum(
+        result.profiles for result in files
+    )
+    (outputs,) = {tuple(result.outputs) for result in window}
+    assert outputs
+    (message,) = messages(logger, "info")
+    assert message.startswith("Processed a window")
+    assert not messages(logger, "error")
+
+
+def test_windows_of_several_stations(client, tmp_path, logger, netcdf_calls):
+    pytest.importorskip("alcf")
+    stations = [f"site-{i}" for i in range(4)]
+    sources = [
+        source
+        for station in stations
+        for source in upload_files(client, tmp_path, 3, station=station)
+    ]
+    settings = Settings(work_dir=str(tmp_path), max_workers=4)
+
+    results = coalesce.process_windows(sources[::-1], settings, client=client)
+
+    assert all(result.error is None for result in results)
+    outputs = {result.source.key.split("/")[0]: tuple(result.outputs) for result in results}
+    assert sorted(outputs) == stations
+    for station, keys in outputs.items():
+        assert keys and all(key.startswith(f"{settings.output_prefix}{station}/") for key in keys)
+    assert len(messages(logger, "info")) == len(stations)
+    assert netcdf_calls and max(netcdf_calls) == 1
+
+
+def test_unreadable_file_fails_alone(client, tmp_path, logger):
+    pytest.importorskip("alcf")
+    sources = upload_files(client, tmp_path, 3)
+    client.put_object(Bucket=BUCKET, Key="station/corrupt.dat", Body=b"\x01CL0\x02garbage")
+    sources.append(S3Object(BUCKET, "station/corrupt.dat"))
+
+    results = coalesce.process_windows(sources, Settings(work_dir=str(tmp_path)), client=client)
+
+    assert [result.error is None for result in results] == [True, True, True, False]
+    assert len(messages(logger, "error")) == 1
+    assert len(messages(logger, "info")) == 1
+
+
+def test_failed_window_is_not_logged_as_processed(client, tmp_path, logger, monkeypatch):
+    sources = [S3Object(BUCKET, f"station/{i}.dat") for i in range(3)]
+    monkeypatch.setattr(coalesce, "process_window", mock.Mock(side_effect=OSError("disk full")))
+
+    results = coalesce.process_windows(sources, Settings(work_dir=str(tmp_path)), client=client)
+
+    assert [result.error for result in results] == ["disk full"] * 3
+    assert len(messages(logger, "exception")) == 1
+    assert len(messages(logger, "error")) == 1
+    assert not messages(logger, "info")
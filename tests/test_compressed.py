@@ -0,0 +1,108 @@
+"""Tests of app.compressed: compressed raw files streamed without staging them"""
+
+import bz2
+import contextlib
+import gzip
+import io
+import os
+import signal
+import zipfile
+
+import boto3
+import numpy as np
+import pytest
+from moto import mock_aws
+
+pytest.importorskip("alcf")
+ds = pytest.importorskip("ds_format")
+resource = pytest.importorskip("resource")
+
+# pylint: disable=wrong-import-position
+from app import compressed, engine
+
+import synthetic
+
+BUCKET = "ceilometers"
+VARIABLES = ["time", "time_bnds", "backscatter", "cloud_mask", "cbh"]
+
+#: Largest file the work directory takes while processing (bytes), a fraction of the input.
+QUOTA = 1024 * 1024
+
+#: Options keeping the processed files below the quota.
+OPTIONS = {"zres": 100, "zlim": [0, 5000]}
+
+
+@contextlib.contextmanager
+def quota(size: int):
+    """Fails the writes of files larger than ``size`` bytes, as a full work directory"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_FSIZE)
+    # Writes beyond the limit then fail with EFBIG instead of killing the process
+    handler = signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    resource.setrlimit(resource.RLIMIT_FSIZE, (size, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_FSIZE, (soft, hard))
+        signal.signal(signal.SIGXFSZ, handler)
+
+
+def compress(data: bytes, suffix: str) -> bytes:
+    """Compresses the content of a raw file"""
+    if suffix == ".gz":
+        return gzip.compress(data)
+    if suffix == ".bz2":
+        return bz2.compress(data)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as handler:
+        handler.writestr("20200101.dat", data)
+    return buffer.getvalue()
+
+
+def read_outputs(output: engine.Output) -> dict:
+    """Reads processed files, by name"""
+    return {os.path.basename(path): ds.read(path, VARIABLES) for path in output.paths}
+
+
+@pytest.fixture(scope="module")
+def raw(tmp_path_factory) -> tuple:
+    """A CL51 file of 4 hours, more than 4 times the quota, and its processed files"""
+    path = str(tmp_path_factory.mktemp("raw") / "20200101.dat")
+    synthetic.write_cl51(path, 900, period=16.0)
+    assert os.path.getsize(path) > 4 * QUOTA
+    output_dir = str(tmp_path_factory.mktemp("uncompressed"))
+    with open(path, "rb") as handler:
+        return handler.read(), read_outputs(engine.run("cl51", path, output_dir, OPTIONS))
+
+
+def test_quota_rejects_a_staged_input(raw, tmp_path):
+    data, _ = raw
+    with quota(QUOTA), pytest.raises(OSError):
+        (tmp_path / "20200101.dat").write_bytes(data)
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".bz2", ".zip"])
+def test_streamed_as_uncompressed(raw, tmp_path, monkeypatch, suffix):
+    data, reference = raw
+    # Blocks of a quarter of the quota, so that the file is decoded in many blocks
+    monkeypatch.setattr(compressed, "BLOCK_SIZE", QUOTA // 4)
+    key = f"site/20200101.dat{suffix}"
+
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        client.put_object(Bucket=BUCKET, Key=key, Body=compress(data, suffix))
+        with quota(QUOTA):
+            output = compressed.run("cl51", BUCKET, key, str(tmp_path), OPTIONS, client=client)
+
+    assert output.profiles == 900
+    result = read_outputs(output)
+    assert result.keys() == reference.keys()
+    # Sums of the noise removal and resampling run over other partitions, hence rtol
+    for name, d in reference.items():
+        for var in VARIABLES:
+            np.testing.assert_allclose(
+                np.asarray(result[name][var], np.float64),
+                np.asarray(d[var], np.float64),
+                rtol=1e-5,
+                err_msg=f"{name} {var}",
+            )
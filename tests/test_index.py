@@ -0,0 +1,77 @@
+"""Tests of app.index: the handler processing the files of an S3 event"""
+
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from moto import mock_aws
+
+pytest.importorskip("alcf")
+
+# pylint: disable=wrong-import-position
+from app import index, storage
+
+import synthetic
+from conftest import s3_event
+
+BUCKET = "ceilometers"
+CONTEXT = SimpleNamespace(
+    function_name="alcf_ceilometer",
+    function_version="$LATEST",
+    memory_limit_in_mb=2048,
+    invoked_function_arn="arn:aws:lambda:us-east-1:123456789012:function:alcf_ceilometer",
+    aws_request_id="request",
+)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("WORK_DIR", str(tmp_path))
+    with mock_aws():
+        # The handler creates the shared client within the mock
+        monkeypatch.setattr(storage, "_CLIENT", None)
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def upload(client, tmp_path, keys: list) -> list:
+    """Uploads a CL51 file under every key"""
+    for i, key in enumerate(keys):
+        path = tmp_path / f"{i}.dat"
+        synthetic.write_cl51(str(path), 100, m=256, seed=i)
+        client.upload_file(str(path), BUCKET, key)
+    return keys
+
+
+def processed(client) -> set:
+    """Returns the keys of the processed files"""
+    response = client.list_objects_v2(Bucket=BUCKET, Prefix="processed/")
+    return {item["Key"] for item in response.get("Contents", [])}
+
+
+def test_processes_every_record(client, tmp_path):
+    keys = upload(client, tmp_path, ["site/A2001010.dat", "site/A2001011.dat", "other/b c.dat"])
+
+    response = index.main(s3_event(BUCKET, keys), CONTEXT)
+
+    assert list(response["processed"]) == keys
+    outputs = [key for outputs in response["processed"].values() for key in outputs]
+    assert all(response["processed"].values())
+    assert processed(client) == set(outputs)
+    assert all(key.startswith("processed/other/b c/") for key in response["processed"][keys[2]])
+
+
+def test_failed_file_raises_after_the_others(client, tmp_path):
+    keys = upload(client, tmp_path, ["site/A2001010.dat", "site/A2001012.dat"])
+    client.put_object(Bucket=BUCKET, Key="site/corrupt.dat", Body=b"\x01CL0\x02garbage")
+    keys.insert(1, "site/corrupt.dat")
+
+    with pytest.raises(index.IngestError, match=r"1 file\(s\): site/corrupt.dat$"):
+        index.main(s3_event(BUCKET, keys), CONTEXT)
+
+    # The files of the other records were processed and uploaded
+    outputs = processed(client)
+    for key in ("site/A2001010", "site/A2001012"):
+        assert any(output.startswith(f"processed/{key}/") for output in outputs)
+    assert not any(output.startswith("processed/site/corrupt/") for output in outputs)
@@ -0,0 +1,108 @@
+"""Tests of app.ingest: stations and keys of the input files, and their processing"""
+
+import datetime as dt
+
+import boto3
+import numpy as np
+import pytest
+from moto import mock_aws
+
+from app import backfill, cache, coalesce, ingest, stats
+from app.config import Settings
+
+import synthetic
+
+BUCKET = "ceilometers"
+
+
+@pytest.mark.parametrize(
+    "key, station",
+    [
+        ("site/A2001011.dat", "site"),
+        ("site/2020/01/01/A2001011.dat", "site"),
+        ("site/2020/01/01/20200101_site_CHM.nc.gz", "site"),
+        ("A2001011.dat", ""),
+    ],
+)
+def test_station_of(key, station):
+    assert ingest.station_of(key) == station
+
+
+def test_backfilled_files_belong_to_their_station():
+    prefixes = backfill.day_prefixes(["site", "other/"], dt.date(2020, 1, 1), dt.date(2020, 1, 3))
+    assert len(prefixes) == 6
+    stations = {ingest.station_of(prefix + "A2001011.dat") for prefix in prefixes}
+    assert stations == {"site", "other"}
+
+
+def test_output_key_mirrors_the_input_path():
+    settings = Settings(output_prefix="out/")
+    source = ingest.S3Object("bucket", "site/2020/01/01/A2001011.dat.gz")
+    assert ingest.output_key(source, "a.nc", settings) == "out/site/2020/01/01/A2001011/a.nc"
+
+
+def test_windows_group_the_days_of_a_station():
+    sources = [
+        ingest.S3Object("bucket", key)
+        for key in ("site/2020/01/02/b.dat", "site/2020/01/01/a.dat", "other/c.dat")
+    ]
+    windows = coalesce.windows(sources)
+    assert list(windows) == [("bucket", "site"), ("bucket", "other")]
+    assert [source.key for source in windows[("bucket", "site")]] == [
+        "site/2020/01/01/a.dat",
+        "site/2020/01/02/b.dat",
+    ]
+
+
+def test_cache_hit_of_another_station_updates_its_statistics(tmp_path):
+    pytest.importorskip("alcf")
+    path = tmp_path / "A2001011.dat"
+    synthetic.write_cl51(str(path), 100, m=256)
+    settings = Settings(
+        work_dir=str(tmp_path), cache_prefix="cache/", stats_prefix="stats/", cache_entries=8
+    )
+
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        for key in ("site/A2001011.dat", "other/A2001011.dat"):
+            client.upload_file(str(path), BUCKET, key)
+
+        hits = cache._COUNTS["hits"]  # pylint: disable=protected-access
+        first, second = (
+            ingest.process_object(ingest.S3Object(BUCKET, key), settings, client=client)
+            for key in ("site/A2001011.dat", "other/A2001011.dat")
+        )
+        assert cache._COUNTS["hits"] == hits + 1  # pylint: disable=protected-access
+
+        assert second.outputs and second.profiles == first.profiles
+        site, other = (
+            stats.StatsState.from_bytes(
+                client.get_object(
+                    Bucket=BUCKET, Key=stats.stats_key("stats/", station, "daily", "2020-01-01")
+                )["Body"].read()
+            )
+            for station in ("site", "other")
+        )
+        assert other.n == site.n > 0
+        np.testing.assert_array_equal(other.backscatter_hist, site.backscatter_hist)
+
+
+def test_files_are_processed_one_at_a_time(tmp_path, netcdf_calls):
+    pytest.importorskip("alcf")
+    settings = Settings(work_dir=str(tmp_path), stats_prefix="stats/", max_workers=4)
+
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        sources = []
+        for i in range(4):
+            path = tmp_path / f"A200101{i}.dat"
+            synthetic.write_cl51(str(path), 100, m=256, seed=i)
+            client.upload_file(str(path), BUCKET, f"site-{i}/{path.name}")
+            sources.append(ingest.S3Object(BUCKET, f"site-{i}/{path.name}"))
+
+        results = ingest.process_objects(sources, settings, client=client)
+
+    assert all(result.error is None and result.outputs for result in results)
+    assert netcdf_calls and max(netcdf_calls) == 1
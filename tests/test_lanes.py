@@ -0,0 +1,94 @@
+"""Tests of stacks.lanes: lanes planned from a station registry"""
+
+import pytest
+
+pytest.importorskip("fr_helpers")
+pytest.importorskip("ruamel.yaml")
+
+# pylint: disable=wrong-import-position
+from stacks import lanes
+
+#: The sizing of the common configuration.
+SIZING = {
+    "max_stations": 16,
+    "max_bytes_per_day": 1_000_000_000,
+    "throughput": 2,
+    "memory_base": 512,
+    "memory_per_mb": 20,
+    "min_timeout": 60,
+    "timeout_factor": 3,
+    "headroom": 3,
+    "min_concurrency": 2,
+    "max_concurrency": 50,
+    "max_total_concurrency": 400,
+}
+
+
+def config(stations: dict, **sizing) -> dict:
+    """A configuration of a registry, with fields of its sizing replaced"""
+    return {
+        "stations": stations,
+        "lanes": dict(SIZING, **sizing),
+        "function": {"max_workers": 4},
+        "queue": {"batch_size": 10, "max_batching_window": 30},
+    }
+
+
+def station(lidar_type: str = "cl51", bytes_per_day: int = 50_000_000, **fields) -> dict:
+    """A station of the registry, a file per minute"""
+    return dict(dict(lidar_type=lidar_type, cadence=60, bytes_per_day=bytes_per_day), **fields)
+
+
+def test_packs_stations_by_type():
+    stations = {f"site-{i}": station(bytes_per_day=(i + 1) * 10_000_000) for i in range(5)}
+    stations["other"] = station("chm15k")
+    stations["pinned"] = station(shard="pin")
+    planned = lanes.plan_lanes(config(stations, max_stations=2))
+
+    assert {lane.name: [s.name for s in lane.stations] for lane in planned} == {
+        "chm15k-1": ["other"],
+        "cl51-1": ["site-3", "site-4"],
+        "cl51-2": ["site-1", "site-2"],
+        "cl51-3": ["site-0"],
+        "pin": ["pinned"],
+    }
+    assert all(lane.reserved_concurrency >= 2 for lane in planned)
+
+
+def test_no_stations():
+    assert lanes.plan_lanes({}) == []
+
+
+@pytest.mark.parametrize("prefix", ["site/b/", "net/site-b/", "site-b"])
+def test_prefix_outside_the_station_directory(prefix):
+    stations = {"site": station(), "site-b": station(prefix=prefix)}
+    with pytest.raises(ValueError, match=f"prefix '{prefix}' is not in the directory 'site-b/'"):
+        lanes.plan_lanes(config(stations))
+
+
+def test_prefix_in_the_station_directory():
+    stations = {"site": station(), "site-b": station(prefix="site-b/raw/")}
+    planned = lanes.plan_lanes(config(stations))
+    assert [s.prefix for s in planned[0].stations] == ["site/", "site-b/raw/"]
+
+
+def test_station_name_of_several_directories():
+    with pytest.raises(ValueError, match="stations.net/site: a station name is a single"):
+        lanes.plan_lanes(config({"net/site": station()}))
+
+
+def test_lane_larger_than_a_function():
+    # Hourly files of 300 MB, processed by two workers at 20 MB per MB of a file
+    stations = {"site": station(bytes_per_day=300 * 2**20 * 24, cadence=3600)}
+    with pytest.raises(ValueError) as error:
+        lanes.plan_lanes(config(stations))
+    assert str(error.value) == (
+        "Invalid lane cl51-1: needs 12544 MB, more than the 10240 MB of a function"
+    )
+
+
+def test_max_total_concurrency():
+    stations = {f"site-{i}": station(shard=f"shard-{i}") for i in range(5)}
+    assert len(lanes.plan_lanes(config(stations, max_total_concurrency=10))) == 5
+    with pytest.raises(ValueError, match=r"10 reserved executions, .* max_total_concurrency \(9\)"):
+        lanes.plan_lanes(config(stations, max_total_concurrency=9))
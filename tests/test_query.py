@@ -0,0 +1,55 @@
+"""Tests of app.query: parameters of the queries"""
+
+import pytest
+
+from app import query
+from app.config import Settings
+
+WINDOW = {"station": "site", "start": "2020-01-01T00:00:00", "end": "2020-01-01T06:00:00"}
+
+
+@pytest.mark.parametrize(
+    "settings, bucket",
+    [
+        (Settings(output_bucket="processed"), "processed"),
+        (Settings(query_buckets=["raw"]), "raw"),
+        (Settings(output_bucket="processed", query_buckets=["processed"]), "processed"),
+    ],
+)
+def test_default_bucket(settings, bucket):
+    assert query.parse(WINDOW, settings)["bucket"] == bucket
+
+
+def test_bucket_among_the_query_buckets():
+    settings = Settings(output_bucket="processed", query_buckets=["raw", "other"])
+    assert query.parse({**WINDOW, "bucket": "other"}, settings)["bucket"] == "other"
+    with pytest.raises(query.QueryError, match="No bucket"):
+        query.parse(WINDOW, settings)
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [Settings(output_bucket="processed"), Settings(query_buckets=["raw"]), Settings()],
+)
+def test_other_buckets_are_rejected(settings):
+    with pytest.raises(query.QueryError):
+        query.parse({**WINDOW, "bucket": "secrets"}, settings)
+
+
+def test_query_buckets_from_env(monkeypatch):
+    monkeypatch.setenv("QUERY_BUCKETS", "raw,other")
+    assert Settings.from_env().query_buckets == ["raw", "other"]
+
+
+@pytest.mark.parametrize(
+    "parameters",
+    [
+        {"station": "site", "start": "2020-01-01T00:00:00"},
+        {**WINDOW, "end": "2020-01-01T00:00:00"},
+        {**WINDOW, "zmin": "1000", "zmax": "0"},
+        {**WINDOW, "variables": "backscatter,temperature"},
+    ],
+)
+def test_invalid_parameters(parameters):
+    with pytest.raises(query.QueryError):
+        query.parse(parameters, Settings(output_bucket="processed"))
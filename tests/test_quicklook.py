@@ -0,0 +1,156 @@
+"""Tests of app.quicklook: tile pyramids of the days of a station, merged file by file"""
+
+import datetime as dt
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import numpy as np
+import pytest
+from moto import mock_aws
+
+pytest.importorskip("matplotlib")
+ds = pytest.importorskip("ds_format")
+
+# pylint: disable=wrong-import-position
+from app import quicklook
+
+import synthetic
+from conftest import enforce_if_match
+
+BUCKET = "quicklooks"
+PREFIX = "quicklooks/"
+STATION = "site"
+DAY = 2458849.5
+
+
+@pytest.fixture
+def client():
+    with mock_aws():
+        client = enforce_if_match(boto3.client("s3"))
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def day(hours: float = 24) -> dict:
+    """The 5 minute profiles of the first hours of 2020-01-01"""
+    return synthetic.processed(synthetic.START, int(hours * 12), m=100)
+
+
+def select(d: dict, start: int, end: int) -> dict:
+    """The profiles of a dataset from ``start`` to ``end``, as a processed file of them"""
+    selected = {
+        name: value[start:end] if d["."][name][".dims"][0] == "time" else value
+        for name, value in d.items()
+        if name != "."
+    }
+    selected["."] = d["."]
+    return selected
+
+
+def publish(client, d: dict, tmp_path, name: str) -> int:
+    """Publishes a dataset as a processed file"""
+    path = str(tmp_path / f"{name}.nc")
+    ds.write(path, d)
+    return quicklook.publish(
+        path, BUCKET, PREFIX, STATION, f"{PREFIX}{STATION}/{name}.png", client=client
+    )
+
+
+def stored(client) -> dict:
+    """Reads the stored tiles, by key"""
+    keys = [
+        item["Key"]
+        for item in client.list_objects_v2(Bucket=BUCKET, Prefix=f"{PREFIX}{STATION}.tiles/")[
+            "Contents"
+        ]
+    ]
+    return {
+        key: quicklook.read_png(client.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+        for key in keys
+    }
+
+
+def expected(d: dict) -> dict:
+    """Renders the tiles of a dataset at once, by key"""
+    return {
+        quicklook.tile_key(PREFIX, STATION, *item[:4]): item[4] for item in quicklook.tiles(d)
+    }
+
+
+def test_a_file_renders_the_tiles_it_falls_in():
+    hour = select(day(), 12, 24)
+    found = [item[:4] for item in quicklook.tiles(hour)]
+
+    # The column of the first quarter of the day, 15 of the 85 tiles
+    assert sorted(found) == [(DAY, zoom, 0, row) for zoom in range(4) for row in range(2**zoom)]
+
+
+def test_files_merge_into_the_pyramid_of_the_day(client, tmp_path):
+    d = day()
+    for i, (start, end) in enumerate([(0, 30), (30, 100), (150, 288), (100, 150)]):
+        publish(client, select(d, start, end), tmp_path, str(i))
+
+    tiles = stored(client)
+    reference = expected(d)
+    assert tiles.keys() == reference.keys()
+    for key, rgba in reference.items():
+        np.testing.assert_array_equal(tiles[key], rgba, err_msg=key)
+    assert f"{PREFIX}{STATION}.tiles/2020-01-01/3/7/7.png" in tiles
+    assert client.head_object(Bucket=BUCKET, Key=f"{PREFIX}{STATION}/0.png")
+
+
+def test_a_file_over_midnight_merges_into_two_days(client, tmp_path):
+    d = synthetic.processed(synthetic.START - dt.timedelta(hours=1), 24, m=100)
+    publish(client, d, tmp_path, "0")
+    days = {key.split("/")[2] for key in stored(client)}
+    assert days == {"2019-12-31", "2020-01-01"}
+
+
+def test_concurrent_updates_keep_every_file(client, tmp_path):
+    other = enforce_if_match(boto3.client("s3"))
+    d = day(3)
+    publish(client, select(d, 0, 12), tmp_path, "0")
+
+    # Another invocation updates the tiles between the reads and writes of the first
+    def interleave(params, **kwargs):  # pylint: disable=unused-argument
+        if ".tiles/" in params["Key"] and not interleave.done:
+            interleave.done = True
+            publish(other, select(d, 24, 36), tmp_path, "2")
+
+    interleave.done = False
+    client.meta.events.register_first("provide-client-params.s3.PutObject", interleave)
+    publish(client, select(d, 12, 24), tmp_path, "1")
+    assert interleave.done
+
+    tiles = stored(client)
+    for key, rgba in expected(d).items():
+        np.testing.assert_array_equal(tiles[key], rgba, err_msg=key)
+
+
+def test_merge_keeps_the_higher_backscatter():
+    cmap = quicklook._colormap()  # pylint: disable=protected-access
+    low, high = cmap(np.array([0.2]), bytes=True), cmap(np.array([0.8]), bytes=True)
+    under, bad = cmap(np.array([-1.0]), bytes=True), cmap(np.array([np.nan]), bytes=True)
+    tile = np.concatenate([low, high, under, bad])
+    other = np.concatenate([high, low, bad, under])
+    np.testing.assert_array_equal(
+        quicklook.merge(tile, other), np.concatenate([high, high, under, under])
+    )
+    with pytest.raises(ValueError):
+        quicklook.merge(tile, np.full_like(tile, 1))
+
+
+def test_render_from_threads():
+    plt = pytest.importorskip("matplotlib.pyplot")
+    dd = [select(day(), start, start + 36) for start in range(0, 288, 36)]
+
+    def render(d: dict) -> bytes:
+        buffer = io.BytesIO()
+        quicklook.render(d, buffer)
+        return buffer.getvalue()
+
+    with ThreadPoolExecutor(max_workers=len(dd)) as executor:
+        images = list(executor.map(render, dd))
+    assert images == [render(d) for d in dd]
+    assert not plt.get_fignums()
@@ -0,0 +1,107 @@
+"""Tests of app.resample: height resampling with cached sparse weights as ALCF's zsample"""
+
+import copy
+
+import numpy as np
+import pytest
+
+pytest.importorskip("alcf")
+
+# pylint: disable=wrong-import-position
+from alcf.algorithms import zsample as alcf_zsample
+
+from app import resample
+
+ZRES = 50.0
+ZLIM = [0.0, 3000.0]
+
+#: Range gates of the profiles: gates ending on the output levels, gates across them, and
+#: gates reaching past the top of the output grid.
+GEOMETRIES = [
+    25.0 * (np.arange(100) + 0.5),
+    30.0 * (np.arange(80) + 0.5) + 7.0,
+    40.0 * (np.arange(90) + 0.5),
+]
+
+
+def dataset(zfull: np.ndarray, columns: int = 0, missing: float = 0.05, seed: int = 0) -> dict:
+    """A dataset of 30 profiles on range gates ``zfull``, shape (range,) or (time, range), a
+    fraction ``missing`` of its backscatter samples missing"""
+    rng = np.random.default_rng(seed)
+    n, m = 30, zfull.shape[-1]
+    shape = (n, m) + ((columns,) if columns else ())
+    b = rng.normal(1e-6, 1e-6, shape)
+    b[rng.random(shape) < missing] = np.nan
+    dims = ["time", "range"] + (["column"] if columns else [])
+    return {
+        "time": np.arange(n) / 1440.0,
+        "zfull": zfull,
+        "backscatter": b,
+        "backscatter_sd": np.abs(rng.normal(1e-7, 1e-8, shape)),
+        "backscatter_mol": 1e-9 * np.exp(-np.broadcast_to(zfull, (n, m)) / 8000.0),
+        ".": {
+            "backscatter": {".dims": dims},
+            "zfull": {".dims": ["time", "range"] if zfull.ndim == 2 else ["range"]},
+        },
+    }
+
+
+def compare(d: dict):
+    """Resamples a dataset with ALCF and app.resample, cold and warm, and compares them"""
+    reference = copy.deepcopy(d)
+    alcf_zsample.zsample(reference, zres=ZRES, zlim=ZLIM)
+    for _ in range(2):
+        result = copy.deepcopy(d)
+        resample.zsample(result, zres=ZRES, zlim=ZLIM)
+
+        np.testing.assert_array_equal(result["zfull"], reference["zfull"])
+        assert result["."]["zfull"] == reference["."]["zfull"]
+        for name in ("backscatter", "backscatter_sd", "backscatter_mol"):
+            assert result[name].shape == reference[name].shape
+            np.testing.assert_array_equal(np.isnan(result[name]), np.isnan(reference[name]))
+            # Sums of opposite samples cancel to about 0: compare to the scale of the data
+            scale = np.nanmax(np.abs(reference[name]))
+            np.testing.assert_allclose(
+                result[name], reference[name], rtol=1e-9, atol=1e-12 * scale
+            )
+    return result
+
+
+@pytest.mark.parametrize("zfull", GEOMETRIES)
+def test_shared_geometry(zfull):
+    result = compare(dataset(zfull))
+    assert np.any(np.isnan(result["backscatter"]))
+
+
+def test_mixed_geometries():
+    m = max(len(z) for z in GEOMETRIES)
+    # Profiles of the same number of gates, in geometries changing along the time
+    geometries = [z[0] + (z[1] - z[0]) * np.arange(m) for z in GEOMETRIES]
+    zfull = np.array([geometries[i % 3 if i < 20 else 0] for i in range(30)])
+    compare(dataset(zfull, seed=1))
+
+
+@pytest.mark.parametrize("zfull", [GEOMETRIES[0], np.tile(GEOMETRIES[1], (30, 1))])
+def test_columns(zfull):
+    result = compare(dataset(zfull, columns=3, seed=2))
+    assert result["backscatter"].shape == (30, 60, 3)
+    assert result["backscatter_mol"].shape == (30, 60)
+
+
+def test_gates_ending_on_the_levels():
+    # A missing gate ending where a level starts makes that level missing, as in ALCF
+    d = dataset(GEOMETRIES[0], missing=0.0)
+    d["backscatter"][:, 1] = np.nan
+    result = compare(d)
+    assert np.all(np.isnan(result["backscatter"][:, :2]))
+    assert not np.any(np.isnan(result["backscatter"][:, 2:]))
+
+
+def test_weights_are_cached_per_geometry():
+    resample.weight_matrix(GEOMETRIES[0], ZRES, ZLIM)
+    assert resample.weight_matrix(GEOMETRIES[0].copy(), ZRES, ZLIM) is resample.weight_matrix(
+        GEOMETRIES[0], ZRES, ZLIM
+    )
+    assert resample.weight_matrix(GEOMETRIES[0], ZRES, [0.0, 2000.0]) is not (
+        resample.weight_matrix(GEOMETRIES[0], ZRES, ZLIM)
+    )
@@ -0,0 +1,184 @@
+"""Tests of the stack synthesized offline, with configurations of the tests"""
+
+import json
+
+import pytest
+
+cdk = pytest.importorskip("aws_cdk.core")
+pytest.importorskip("fr_helpers")
+
+# pylint: disable=wrong-import-position
+from stacks import alcf_ceilometer, utils
+from stacks.alcf_ceilometer import Alcf_ceilometerStack
+
+INPUT_BUCKET = "raw-ceilometer"
+
+
+def synth(monkeypatch, environment: str = "Prod", **overrides) -> tuple:
+    """Synthesizes the stack of an environment with fields of its configuration replaced,
+    returning the stack and its template"""
+
+    def consolidate_config(*args, **kwargs):
+        config = utils.consolidate_config(*args, **kwargs)
+        config.update(input_buckets=[INPUT_BUCKET], **overrides)
+        # Synthesis rejects the underscore of the configured name
+        config["stack_name"] = config["stack_name"].replace("_", "-")
+        return config
+
+    monkeypatch.setattr(alcf_ceilometer, "consolidate_config", consolidate_config)
+    app = cdk.App()
+    stack = Alcf_ceilometerStack(app, "Test", environment)
+    return stack, app.synth().get_stack_by_name(stack.stack_name).template
+
+
+def resources(template: dict, resource_type: str) -> dict:
+    """Returns the resources of a type, by logical ID"""
+    return {
+        name: resource
+        for name, resource in template["Resources"].items()
+        if resource["Type"] == resource_type
+    }
+
+
+def function(template: dict, handler: str) -> tuple:
+    """Returns the logical ID and the properties of the function of a handler"""
+    (found,) = [
+        (name, resource["Properties"])
+        for name, resource in resources(template, "AWS::Lambda::Function").items()
+        if resource["Properties"].get("ImageConfig", {}).get("Command") == [handler]
+    ]
+    return found
+
+
+def readable_buckets(template: dict, properties: dict) -> set:
+    """Returns the buckets a function role may read objects from"""
+    role = properties["Role"]["Fn::GetAtt"][0]
+    buckets = set()
+    for policy in resources(template, "AWS::IAM::Policy").values():
+        if {"Ref": role} not in policy["Properties"]["Roles"]:
+            continue
+        for statement in policy["Properties"]["PolicyDocument"]["Statement"]:
+            actions = statement["Action"]
+            if "s3:GetObject*" in (actions if isinstance(actions, list) else [actions]):
+                resource = json.dumps(statement["Resource"])
+                buckets.update(
+                    name for name in (INPUT_BUCKET, "processed-ceilometer") if name in resource
+                )
+    return buckets
+
+
+def test_query_function_reads_the_input_buckets_without_output_bucket(monkeypatch):
+    _, template = synth(monkeypatch)
+    _, properties = function(template, "app.query.main")
+
+    variables = properties["Environment"]["Variables"]
+    assert "OUTPUT_BUCKET" not in variables
+    assert variables["QUERY_BUCKETS"] == INPUT_BUCKET
+    assert readable_buckets(template, properties) == {INPUT_BUCKET}
+
+
+def test_query_function_reads_the_output_bucket(monkeypatch):
+    _, template = synth(monkeypatch, output_bucket="processed-ceilometer")
+    _, properties = function(template, "app.query.main")
+
+    variables = properties["Environment"]["Variables"]
+    assert variables["OUTPUT_BUCKET"] == "processed-ceilometer"
+    assert "QUERY_BUCKETS" not in variables
+    assert readable_buckets(template, properties) == {"processed-ceilometer"}
+
+
+#: A small station registry: two CL51 stations sharing a lane, one pinned to its own shard,
+#: and a CHM15k station whose files are in a directory of its own.
+STATIONS = {
+    "site-a": {"lidar_type": "cl51", "cadence": 60, "bytes_per_day": 50_000_000},
+    "site-b": {"lidar_type": "cl51", "cadence": 300, "bytes_per_day": 40_000_000},
+    "site-c": {"lidar_type": "cl51", "cadence": 60, "bytes_per_day": 10_000_000, "shard": "pin"},
+    "site-d": {
+        "lidar_type": "chm15k",
+        "cadence": 3600,
+        "bytes_per_day": 100_000_000,
+        "prefix": "site-d/raw/",
+    },
+}
+
+
+def resolve(value: dict) -> str:
+    """Returns the logical ID referenced by ``Ref`` or ``Fn::GetAtt``"""
+    if "Ref" in value:
+        return value["Ref"]
+    return value["Fn::GetAtt"][0]
+
+
+def test_lanes(monkeypatch):
+    stack, template = synth(monkeypatch, stations=STATIONS)
+    assert {lane.name: [s.name for s in lane.stations] for lane in stack.lanes} == {
+        "chm15k-1": ["site-d"],
+        "cl51-1": ["site-a", "site-b"],
+        "pin": ["site-c"],
+    }
+
+    def properties(construct) -> tuple:
+        name = stack.get_logical_id(construct.node.default_child)
+        return name, template["Resources"][name]["Properties"]
+
+    mappings = resources(template, "AWS::Lambda::EventSourceMapping").values()
+    (notifications,) = resources(template, "Custom::S3BucketNotifications").values()
+    routes = {}
+    for route in notifications["Properties"]["NotificationConfiguration"]["QueueConfigurations"]:
+        assert route["Events"] == ["s3:ObjectCreated:*"]
+        (rule,) = route["Filter"]["Key"]["FilterRules"]
+        assert rule["Name"] == "prefix"
+        assert rule["Value"] not in routes
+        routes[rule["Value"]] = resolve(route["QueueArn"])
+
+    dead_letter_queues = set()
+    for lane in stack.lanes:
+        queue, lane_function = stack.lane_resources[lane.name]
+        queue_id, queue_properties = properties(queue)
+        assert queue_properties["VisibilityTimeout"] == 6 * lane.timeout
+        dead_letter_queue, _ = properties(queue.dead_letter_queue.queue)
+        assert resolve(queue_properties["RedrivePolicy"]["deadLetterTargetArn"]) == (
+            dead_letter_queue
+        )
+        dead_letter_queues.add(dead_letter_queue)
+
+        function_id, function_properties = properties(lane_function)
+        assert function_properties["MemorySize"] == lane.memory_size
+        assert function_properties["Timeout"] == lane.timeout
+        assert function_properties["ReservedConcurrentExecutions"] == lane.reserved_concurrency
+        assert function_properties["Environment"]["Variables"]["LIDAR_TYPE"] == lane.lidar_type
+
+        sources = [
+            (resolve(mapping["Properties"]["EventSourceArn"]), mapping["Properties"]["BatchSize"])
+            for mapping in mappings
+            if resolve(mapping["Properties"]["FunctionName"]) == function_id
+        ]
+        assert sources == [(queue_id, lane.batch_size)]
+
+        for station in lane.stations:
+            assert routes.pop(station.prefix) == queue_id
+    assert not routes
+    assert len(dead_letter_queues) == len(stack.lanes)
+
+
+def test_input_buckets_notify_the_queue(monkeypatch):
+    stack, template = synth(monkeypatch, output_bucket="processed-ceilometer")
+
+    (notifications,) = resources(template, "Custom::S3BucketNotifications").values()
+    assert INPUT_BUCKET in json.dumps(notifications["Properties"]["BucketName"])
+    (route,) = notifications["Properties"]["NotificationConfiguration"]["QueueConfigurations"]
+    assert route["Events"] == ["s3:ObjectCreated:*"]
+    assert "Filter" not in route
+    assert resolve(route["QueueArn"]) == stack.get_logical_id(stack.queue.node.default_child)
+
+
+def test_input_buckets_receiving_the_outputs_are_not_notified(monkeypatch):
+    stack, template = synth(monkeypatch)
+
+    assert not resources(template, "Custom::S3BucketNotifications")
+    (warning,) = [
+        entry.data
+        for entry in stack.node.metadata_entry
+        if entry.type == "aws:cdk:warning"
+    ]
+    assert warning.startswith("No output bucket")
@@ -0,0 +1,145 @@
+"""Tests of app.stats: aggregates merging an input once per content, in constant size"""
+
+import datetime as dt
+import io
+
+import boto3
+import numpy as np
+import pytest
+from moto import mock_aws
+
+from app import stats
+
+import synthetic
+
+BUCKET = "stats"
+PREFIX = "stats/"
+STATION = "station"
+
+
+@pytest.fixture
+def client():
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def dataset(i: int) -> dict:
+    """A processed file of an hour, the ``i``-th of the station"""
+    return synthetic.processed(synthetic.START + dt.timedelta(hours=i), 12, seed=i)
+
+
+def aggregate(client, period: str, identifier: str) -> stats.StatsState:
+    """Reads a stored aggregate"""
+    key = stats.stats_key(PREFIX, STATION, period, identifier)
+    return stats.StatsState.from_bytes(client.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+
+
+def update(client, i: int) -> int:
+    """Merges the ``i``-th file of the station"""
+    source = f"processed/{STATION}/{i}.nc"
+    return stats.update(dataset(i), source, STATION, BUCKET, PREFIX, client=client)
+
+
+def test_update_merges_every_period(client):
+    assert update(client, 0) == 3
+    assert update(client, 1) == 3
+
+    monthly = aggregate(client, "monthly", "2020-01")
+    assert monthly.n == 24
+    assert aggregate(client, "daily", "2020-01-01").n == 24
+    assert aggregate(client, "hourly", "2020-01-01T01").n == 12
+
+    config = stats.StatsConfig()
+    expected = stats.StatsState.from_dataset(dataset(0), config).merge(
+        stats.StatsState.from_dataset(dataset(1), config)
+    )
+    np.testing.assert_allclose(monthly.backscatter_hist, expected.backscatter_hist)
+    np.testing.assert_allclose(monthly.cl, expected.cl)
+
+
+def test_update_merges_an_input_once(client):
+    update(client, 0)
+    assert update(client, 0) == 0
+    assert aggregate(client, "monthly", "2020-01").n == 12
+
+
+def test_input_merged_before_its_marker_is_merged_once(client):
+    update(client, 0)
+    # An invocation failing after its aggregates were updated
+    client.delete_object(
+        Bucket=BUCKET, Key=stats.marker_key(PREFIX, STATION, f"processed/{STATION}/0.nc")
+    )
+    assert update(client, 0) == 0
+    assert aggregate(client, "monthly", "2020-01").n == 12
+
+
+def test_input_processed_again_replaces_its_states(client):
+    update(client, 0)
+    update(client, 1)
+    source = f"processed/{STATION}/0.nc"
+    # Processed again with other options: other profiles, in the next hour too
+    again = synthetic.processed(synthetic.START + dt.timedelta(minutes=30), 12, seed=5)
+    assert stats.update(again, source, STATION, BUCKET, PREFIX, client=client) == 4
+    assert stats.update(again, source, STATION, BUCKET, PREFIX, client=client) == 0
+
+    config = stats.StatsConfig()
+    expected = stats.StatsState.from_dataset(again, config).merge(
+        stats.StatsState.from_dataset(dataset(1), config)
+    )
+    monthly = aggregate(client, "monthly", "2020-01")
+    assert monthly.n == expected.n == 24
+    np.testing.assert_allclose(monthly.backscatter_hist, expected.backscatter_hist, atol=1e-9)
+    np.testing.assert_allclose(monthly.cl, expected.cl, atol=1e-9)
+    assert aggregate(client, "hourly", "2020-01-01T00").n == 6
+    assert aggregate(client, "hourly", "2020-01-01T01").n == 18
+
+
+def test_input_processed_again_before_its_marker_is_replaced_once(client):
+    update(client, 0)
+    source = f"processed/{STATION}/0.nc"
+    marker = client.get_object(
+        Bucket=BUCKET, Key=stats.marker_key(PREFIX, STATION, source)
+    )["Body"].read()
+    again = synthetic.processed(synthetic.START, 6, seed=5)
+    stats.update(again, source, STATION, BUCKET, PREFIX, client=client)
+    # An invocation failing after its aggregates were updated
+    client.put_object(Bucket=BUCKET, Key=stats.marker_key(PREFIX, STATION, source), Body=marker)
+
+    assert stats.update(again, source, STATION, BUCKET, PREFIX, client=client) == 0
+    assert aggregate(client, "monthly", "2020-01").n == 6
+
+
+def test_input_marked_without_states_is_not_merged_again(client):
+    source = f"processed/{STATION}/0.nc"
+    client.put_object(Bucket=BUCKET, Key=stats.marker_key(PREFIX, STATION, source), Body=b"")
+    assert update(client, 0) == 0
+
+
+def test_aggregate_size_does_not_grow_with_inputs(client):
+    sizes = []
+    for i in range(stats.RECENT_SOURCES + 20):
+        update(client, i % 24)
+        # Files of the same hours, under other keys
+        stats.update(dataset(i % 24), f"other/{i}.nc", STATION, BUCKET, PREFIX, client=client)
+        key = stats.stats_key(PREFIX, STATION, "monthly", "2020-01")
+        sizes.append(client.head_object(Bucket=BUCKET, Key=key)["ContentLength"])
+
+    monthly = aggregate(client, "monthly", "2020-01")
+    assert len(monthly.recent) == stats.RECENT_SOURCES
+    assert monthly.n == 12 * (24 + stats.RECENT_SOURCES + 20)
+    assert sizes[-1] - sizes[stats.RECENT_SOURCES] < 0.05 * sizes[-1]
+
+
+def test_reads_aggregates_listing_their_sources():
+    data = stats.StatsState.empty(stats.StatsConfig()).to_bytes()
+    legacy = dict(np.load(io.BytesIO(data)))
+    del legacy["recent"]
+    legacy["sources"] = np.array([f"{i}.nc" for i in range(100)])
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **legacy)
+
+    recent = stats.StatsState.from_bytes(buffer.getvalue()).recent
+    assert len(recent) == stats.RECENT_SOURCES
+    assert recent[-1] == stats.source_digest("99.nc")
@@ -0,0 +1,111 @@
+"""Tests of app.storage: objects read in parallel ranged GETs and written in multipart uploads"""
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from app import storage
+
+BUCKET = "objects"
+
+#: Smallest part of a multipart upload S3 accepts, a smaller PART_SIZE for the tests.
+PART_SIZE = 5 * 1024 * 1024
+
+#: Sizes of the objects: empty, a single request, and several parts.
+SIZES = [0, 1, PART_SIZE - 1, PART_SIZE, PART_SIZE + 1, 3 * PART_SIZE + 5]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(storage, "PART_SIZE", PART_SIZE)
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def calls(client, operation: str) -> list:
+    """Records the parameters of the calls of an operation of a client"""
+    recorded = []
+    client.meta.events.register(
+        f"provide-client-params.s3.{operation}",
+        lambda params, **kwargs: recorded.append(dict(params)),
+    )
+    return recorded
+
+
+def content(size: int) -> bytes:
+    """An object of ``size`` bytes, different in every part"""
+    return bytes(i * 7 % 251 for i in range(size))
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_read(client, size):
+    body = content(size)
+    client.put_object(Bucket=BUCKET, Key="object", Body=body)
+    gets = calls(client, "GetObject")
+
+    assert storage.read(BUCKET, "object", client=client) == body
+    parts = max(1, -(-size // PART_SIZE))
+    assert len(gets) == parts
+    assert gets[0]["Range"] == f"bytes=0-{PART_SIZE - 1}" and "IfMatch" not in gets[0]
+    etag = client.head_object(Bucket=BUCKET, Key="object")["ETag"]
+    assert all(get["IfMatch"] == etag for get in gets[1:])
+    ranges = sorted(get["Range"] for get in gets[1:])
+    assert ranges == sorted(
+        f"bytes={start}-{min(start + PART_SIZE, size) - 1}"
+        for start in range(PART_SIZE, size, PART_SIZE)
+    )
+
+
+def test_read_of_an_object_overwritten_between_parts(client):
+    client.put_object(Bucket=BUCKET, Key="object", Body=content(2 * PART_SIZE))
+
+    def overwrite(params, **kwargs):  # pylint: disable=unused-argument
+        if "IfMatch" in params:
+            boto3.client("s3").put_object(Bucket=BUCKET, Key="object", Body=b"other")
+
+    client.meta.events.register("provide-client-params.s3.GetObject", overwrite)
+    with pytest.raises(ClientError, match="PreconditionFailed"):
+        storage.read(BUCKET, "object", client=client)
+
+
+def test_read_of_a_missing_object(client):
+    with pytest.raises(ClientError, match="NoSuchKey"):
+        storage.read(BUCKET, "missing", client=client)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_write(client, size):
+    body = content(size)
+    puts = calls(client, "PutObject")
+    uploads = calls(client, "CreateMultipartUpload")
+
+    assert storage.write(body, BUCKET, "object", client=client, ContentType="x") == size
+    response = client.get_object(Bucket=BUCKET, Key="object")
+    assert response["Body"].read() == body
+    assert response["ContentType"] == "x"
+    multipart = size > PART_SIZE
+    assert (len(puts), len(uploads)) == ((0, 1) if multipart else (1, 0))
+
+
+def test_write_of_a_memoryview(client):
+    body = bytearray(content(PART_SIZE + 1))
+    storage.write(memoryview(body), BUCKET, "object", client=client)
+    assert client.get_object(Bucket=BUCKET, Key="object")["Body"].read() == body
+
+
+def test_failed_write_aborts_its_upload(client):
+    def fail(params, **kwargs):  # pylint: disable=unused-argument
+        if params["PartNumber"] == 2:
+            raise ClientError({"Error": {"Code": "InternalError"}}, "UploadPart")
+
+    client.meta.events.register("provide-client-params.s3.UploadPart", fail)
+    aborts = calls(client, "AbortMultipartUpload")
+    with pytest.raises(ClientError, match="InternalError"):
+        storage.write(content(3 * PART_SIZE), BUCKET, "object", client=client)
+
+    assert len(aborts) == 1
+    assert "Uploads" not in client.list_multipart_uploads(Bucket=BUCKET)
+    assert "Contents" not in client.list_objects_v2(Bucket=BUCKET)
@@ -0,0 +1,100 @@
+"""Tests of app.store: station stores written by concurrent invocations"""
+
+import datetime as dt
+
+import boto3
+import numpy as np
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+pytest.importorskip("zarr")
+
+from app import store  # pylint: disable=wrong-import-position
+
+import synthetic  # pylint: disable=wrong-import-position
+from conftest import enforce_if_match  # pylint: disable=wrong-import-position
+
+BUCKET = "stores"
+
+
+@pytest.fixture
+def client():
+    with mock_aws():
+        client = enforce_if_match(boto3.client("s3"))
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def dataset(hour: int, minutes: int = 60, seed: int = 0) -> dict:
+    """A processed file of 5 minute profiles, starting at an hour of 2020-01-01"""
+    return synthetic.processed(
+        synthetic.START + dt.timedelta(hours=hour), minutes // 5, m=50, seed=seed
+    )
+
+
+def station_store(client) -> store.S3Store:
+    """The store of the station"""
+    return store.station_store(BUCKET, "stores/", "site", client=client)
+
+
+def read_day(client) -> dict:
+    """Reads the profiles of 2020-01-01"""
+    return store.read(station_store(client), 2458849.5, 2458850.5)
+
+
+def test_write_read(client):
+    d1, d2 = dataset(0), dataset(5, seed=1)
+    assert store.write(d1, station_store(client)) == 12
+    assert store.write(d2, station_store(client)) == 12
+
+    profiles = read_day(client)
+    np.testing.assert_array_equal(profiles["time"], np.concatenate([d1["time"], d2["time"]]))
+    np.testing.assert_array_equal(
+        profiles["backscatter"],
+        np.concatenate([d1["backscatter"], d2["backscatter"]]).astype(np.float32),
+    )
+    np.testing.assert_array_equal(profiles["cbh"], np.concatenate([d1["cbh"], d2["cbh"]]))
+
+
+def test_a_file_rewrites_a_day(client):
+    store.write(dataset(0, minutes=5), station_store(client))
+    group = store.zarr.open_consolidated(station_store(client), mode="r")
+    assert group["backscatter"].chunks[0] == 288
+
+
+def test_concurrent_writes_keep_every_row(client):
+    other = enforce_if_match(boto3.client("s3"))
+    late = dataset(6, seed=2)
+    store.write(dataset(0), station_store(client))
+
+    # Another invocation writes the same chunks between the reads and writes of the first
+    def interleave(params, **kwargs):  # pylint: disable=unused-argument
+        if "/backscatter/" in params["Key"] and not interleave.done:
+            interleave.done = True
+            store.write(late, station_store(other))
+
+    interleave.done = False
+    client.meta.events.register_first("provide-client-params.s3.PutObject", interleave)
+    early = dataset(3, seed=1)
+    store.write(early, station_store(client))
+    assert interleave.done
+
+    profiles = read_day(client)
+    assert len(profiles["time"]) == 36
+    np.testing.assert_array_equal(
+        profiles["time"][12:], np.concatenate([early["time"], late["time"]])
+    )
+
+
+def test_unknown_conflicts_fail_after_attempts(client, monkeypatch):
+    monkeypatch.setattr(store, "_WRITE_ATTEMPTS", 2)
+    monkeypatch.setattr(store.time, "sleep", lambda seconds: None)
+
+    def conflict(params, **kwargs):  # pylint: disable=unused-argument
+        if "/backscatter/" in params["Key"]:
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+
+    client.meta.events.register_first("provide-client-params.s3.PutObject", conflict)
+    with pytest.raises(RuntimeError):
+        store.write(dataset(0), station_store(client))
@@ -0,0 +1,150 @@
+"""Tests of app.vaisala on synthetic CL31/CL51 messages"""
+
+import datetime as dt
+
+import numpy as np
+import pytest
+
+from app import vaisala
+
+import synthetic
+
+TIME = dt.datetime(2020, 1, 1, 12, 0, 0)
+EPOCH = (TIME - dt.datetime(1970, 1, 1)).total_seconds()
+
+
+def message(
+    samples: np.ndarray,
+    scale: bytes = b"00100",
+    header: bytes = b"CL010212",
+    sky_condition: bool = False,
+    time: dt.datetime = TIME,
+) -> bytes:
+    """Formats a data message, preceded by its time line"""
+    encoded = np.where(samples < 0, samples + (1 << 20), samples)
+    return b"".join(
+        [
+            b"-" + time.strftime("%Y-%m-%d %H:%M:%S").encode("ascii") + b"\r\n",
+            b"\x01" + header + b"\x02\r\n",
+            b"30 01230 ///// ///// 000000000000\r\n",
+            b"  1 01230  0 /////  0 /////  0 /////  0 /////\r\n" if sky_condition else b"",
+            scale + b" 10 %04d 098 +34 099 12 0621 L0016HN15 191\r\n" % len(samples),
+            b"".join(b"%05x" % value for value in encoded) + b"\r\n",
+            b"\x03abcd\x04\r\n",
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        (b"00000", 0),
+        (b"00001", 1),
+        (b"7ffff", (1 << 19) - 1),
+        (b"80000", -(1 << 19)),
+        (b"fffff", -1),
+        (b"FFFFE", -2),
+        (b"0a0b0", 0x0A0B0),
+    ],
+)
+def test_decode_samples_twos_complement(line, expected):
+    assert vaisala.decode_samples([line]).tolist() == [[expected]]
+
+
+def test_decode_samples_pads_shorter_lines():
+    samples = vaisala.decode_samples([b"00001fffff", b"00002"])
+    np.testing.assert_array_equal(samples, [[1, -1], [2, np.nan]])
+
+
+@pytest.mark.parametrize("line", [b"0000", b"0000g"])
+def test_decode_samples_rejects_invalid_lines(line):
+    with pytest.raises(ValueError):
+        vaisala.decode_samples([line])
+
+
+def test_decode_cl51():
+    samples = synthetic.cl51_profiles(3, 1540, seed=1)
+    data = b"".join(
+        message(row, time=TIME + dt.timedelta(seconds=16 * i)) for i, row in enumerate(samples)
+    )
+    profiles = vaisala.decode(data, "A2001011.dat")
+
+    np.testing.assert_array_equal(profiles.time, EPOCH + 16 * np.arange(3))
+    np.testing.assert_array_equal(profiles.backscatter, samples / 100000)
+    np.testing.assert_array_equal(profiles.vertical_resolution, [10, 10, 10])
+    assert profiles.detection_status.tolist() == [b"3"] * 3
+
+
+def test_decode_cl31_with_sky_condition():
+    samples = synthetic.cl51_profiles(2, 770, seed=2)
+    data = b"".join(message(row, header=b"CL020222", sky_condition=True) for row in samples)
+    profiles = vaisala.decode(data)
+
+    assert profiles.backscatter.shape == (2, 770)
+    np.testing.assert_array_equal(profiles.backscatter, samples / 100000)
+
+
+def test_decode_negative_samples():
+    samples = np.array([-(1 << 19), -1, 0, 1, (1 << 19) - 1])
+    profiles = vaisala.decode(message(samples))
+    np.testing.assert_array_equal(profiles.backscatter, [samples / 100000])
+
+
+@pytest.mark.parametrize("scale, factor", [(b"00100", 1.0), (b"00050", 0.5), (b"  200", 2.0)])
+def test_decode_scale(scale, factor):
+    samples = synthetic.cl51_profiles(1, 100)
+    profiles = vaisala.decode(message(samples[0], scale=scale))
+    np.testing.assert_allclose(profiles.backscatter, samples / 100000 * factor)
+
+
+def test_decode_missing_scale_is_nan():
+    samples = synthetic.cl51_profiles(2, 100)
+    data = message(samples[0], scale=b"/////") + message(samples[1])
+    profiles = vaisala.decode(data)
+
+    assert np.isnan(profiles.backscatter[0]).all()
+    np.testing.assert_array_equal(profiles.backscatter[1], samples[1] / 100000)
+
+
+def test_decode_skips_corrupt_profiles():
+    samples = synthetic.cl51_profiles(2, 100)
+    corrupt = message(samples[0])
+    # A non-hexadecimal character ending the backscatter line
+    corrupt = corrupt[: corrupt.rindex(b"\r\n\x03") - 5] + b"0000z\r\n\x03abcd\x04\r\n"
+    profiles = vaisala.decode(corrupt + message(samples[1]))
+
+    np.testing.assert_array_equal(profiles.backscatter, samples[1:] / 100000)
+
+
+def test_decode_his():
+    samples = synthetic.cl51_profiles(2, 100)
+    lines = [b"History file", b"CEILOMETER, CREATEDATE, PERIOD, BS_PROFILE"]
+    for i, row in enumerate(samples):
+        encoded = np.where(row < 0, row + (1 << 20), row)
+        profile = b"".join(b"%05x" % value for value in encoded)
+        lines.append(b"X, 2020-01-01 12:0%d:00, 30, %s" % (i, profile))
+    profiles = vaisala.decode(b"\r\n".join(lines) + b"\r\n", "A2001.his")
+
+    np.testing.assert_array_equal(profiles.time, EPOCH + 60 * np.arange(2))
+    np.testing.assert_allclose(
+        profiles.backscatter, samples / 100000 * vaisala.DEFAULT_SCALE / 100, rtol=1e-12
+    )
+    np.testing.assert_array_equal(profiles.vertical_resolution, [10, 10])
+
+
+def test_decode_as_cl2nc(tmp_path):
+    cl2nc = pytest.importorskip("cl2nc")
+    samples = synthetic.cl51_profiles(4, 200, seed=3)
+    path = tmp_path / "A2001011.dat"
+    scales = [b"00100", b"00050", b"/////", b"00100"]
+    path.write_bytes(
+        b"".join(
+            message(row, scale=scale, time=TIME + dt.timedelta(seconds=16 * i))
+            for i, (row, scale) in enumerate(zip(samples, scales))
+        )
+    )
+    reference = cl2nc.read(bytes(path), {"check": False, "time": None, "sampling_rate": None})
+
+    profiles = vaisala.read(str(path))
+    np.testing.assert_array_equal(profiles.time, [d["time"] for d in reference])
+    np.testing.assert_array_equal(profiles.backscatter, [d["backscatter"] for d in reference])